@@ -0,0 +1,19 @@
+"""
+Reads Gitlite repositories directly from their .gitlite store, without running the
+Gitlite binary: HEAD, branches, commits and their history, trees, blobs (including
+compressed, packed and chunked ones) and the staging area.
+"""
+from ._msgpack import MessagePackError
+from .objects import ObjectDirectory, ObjectNotFoundError
+from .repository import Commit, NotARepositoryError, Repository, StagingArea, TreeEntry
+
+__all__ = [
+    "Commit",
+    "MessagePackError",
+    "NotARepositoryError",
+    "ObjectDirectory",
+    "ObjectNotFoundError",
+    "Repository",
+    "StagingArea",
+    "TreeEntry",
+]
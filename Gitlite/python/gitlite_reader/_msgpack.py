@@ -0,0 +1,133 @@
+"""
+Decoder for the subset of MessagePack the Gitlite objects are written with: nil, booleans,
+integers, floats, strings, binaries, arrays, maps and timestamps (ext type -1). It keeps
+the package free of dependencies.
+"""
+import datetime
+import struct
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_FIXED = {
+    0xc0: None,
+    0xc2: False,
+    0xc3: True,
+}
+
+# Type byte -> (struct format of the value, or of the length for str/bin/array/map/ext).
+_SIZED = {
+    0xca: ">f", 0xcb: ">d",
+    0xcc: ">B", 0xcd: ">H", 0xce: ">I", 0xcf: ">Q",
+    0xd0: ">b", 0xd1: ">h", 0xd2: ">i", 0xd3: ">q",
+}
+_STR = {0xd9: ">B", 0xda: ">H", 0xdb: ">I"}
+_BIN = {0xc4: ">B", 0xc5: ">H", 0xc6: ">I"}
+_ARRAY = {0xdc: ">H", 0xdd: ">I"}
+_MAP = {0xde: ">H", 0xdf: ">I"}
+_FIXEXT = {0xd4: 1, 0xd5: 2, 0xd6: 4, 0xd7: 8, 0xd8: 16}
+_EXT = {0xc7: ">B", 0xc8: ">H", 0xc9: ">I"}
+
+
+class MessagePackError(ValueError):
+    """
+    Raised for bytes that are not valid MessagePack.
+    """
+
+
+def unpackb(data):
+    """
+    Decodes one MessagePack value.
+    :param data: Encoded bytes (bytes, bytearray or memoryview).
+    :return: The value: maps become dicts, arrays lists and timestamps aware datetimes (UTC).
+    """
+    value, position = _read(memoryview(data), 0)
+    if position != len(data):
+        raise MessagePackError(f"{len(data) - position} trailing bytes")
+    return value
+
+
+def _read(data, position):
+    try:
+        code = data[position]
+    except IndexError:
+        raise MessagePackError("unexpected end of data") from None
+    position += 1
+
+    if code <= 0x7f:
+        return code, position
+    if code >= 0xe0:
+        return code - 0x100, position
+    if code & 0xe0 == 0xa0:
+        return _read_str(data, position, code & 0x1f)
+    if code & 0xf0 == 0x90:
+        return _read_array(data, position, code & 0x0f)
+    if code & 0xf0 == 0x80:
+        return _read_map(data, position, code & 0x0f)
+    if code in _FIXED:
+        return _FIXED[code], position
+    if code in _SIZED:
+        return _unpack(_SIZED[code], data, position)
+    if code in _STR:
+        length, position = _unpack(_STR[code], data, position)
+        return _read_str(data, position, length)
+    if code in _BIN:
+        length, position = _unpack(_BIN[code], data, position)
+        return bytes(data[position:position + length]), position + length
+    if code in _ARRAY:
+        length, position = _unpack(_ARRAY[code], data, position)
+        return _read_array(data, position, length)
+    if code in _MAP:
+        length, position = _unpack(_MAP[code], data, position)
+        return _read_map(data, position, length)
+    if code in _FIXEXT:
+        return _read_ext(data, position, _FIXEXT[code])
+    if code in _EXT:
+        length, position = _unpack(_EXT[code], data, position)
+        return _read_ext(data, position, length)
+    raise MessagePackError(f"unsupported type byte 0x{code:02x}")
+
+
+def _unpack(fmt, data, position):
+    size = struct.calcsize(fmt)
+    if position + size > len(data):
+        raise MessagePackError("unexpected end of data")
+    return struct.unpack_from(fmt, data, position)[0], position + size
+
+
+def _read_str(data, position, length):
+    return bytes(data[position:position + length]).decode("utf-8"), position + length
+
+
+def _read_array(data, position, length):
+    values = []
+    for _ in range(length):
+        value, position = _read(data, position)
+        values.append(value)
+    return values, position
+
+
+def _read_map(data, position, length):
+    values = {}
+    for _ in range(length):
+        key, position = _read(data, position)
+        values[key], position = _read(data, position)
+    return values, position
+
+
+def _read_ext(data, position, length):
+    ext_type, position = _unpack(">b", data, position)
+    payload = bytes(data[position:position + length])
+    if ext_type != -1:
+        raise MessagePackError(f"unsupported extension type {ext_type}")
+
+    if length == 4:
+        seconds, nanoseconds = struct.unpack(">I", payload)[0], 0
+    elif length == 8:
+        packed = struct.unpack(">Q", payload)[0]
+        seconds, nanoseconds = packed & 0x3ffffffff, packed >> 34
+    elif length == 12:
+        nanoseconds, seconds = struct.unpack(">Iq", payload)
+    else:
+        raise MessagePackError(f"invalid timestamp length {length}")
+    timestamp = EPOCH + datetime.timedelta(seconds=seconds, microseconds=nanoseconds // 1000)
+    return timestamp, position + length
@@ -0,0 +1,243 @@
+"""
+Reads the content-addressed objects of an object directory (blobs/, trees/, commits/ or
+chunks/ of a .gitlite store). An object is either loose, in its own file under xx/rest,
+or packed into the directory's pack, and its stored bytes may be compressed or, for a
+large blob, be a manifest of chunks. Packs are memory-mapped, so reading many packed
+objects costs no system call per object.
+"""
+import mmap
+import os
+import struct
+import zlib
+
+COMPRESSION_MAGIC = b"\0GLZ"
+COMPRESSION_HEADER_SIZE = 13
+MANIFEST_MAGIC = b"\0GLM"
+MANIFEST_HEADER_SIZE = 20
+MANIFEST_ENTRY_SIZE = 24
+PACK_DATA_FILE = "pack"
+PACK_INDEX_FILE = "pack.idx"
+PACK_INDEX_MAGIC = b"GLPI"
+PACK_HEADER_SIZE = 8
+PACK_FANOUT_SIZE = 256 * 4
+HASH_SIZE = 20
+LOCATION_SIZE = 16
+
+CODEC_NONE = 0
+CODEC_DEFLATE = 1
+CODEC_BROTLI = 2
+
+
+class ObjectNotFoundError(KeyError):
+    """
+    Raised when an object is neither loose nor packed.
+    """
+
+
+class Pack:
+    """
+    Pack of an object directory: a sorted index with a fanout table into an append-only
+    data file. Both are memory-mapped for the lifetime of the pack.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: Object directory holding pack and pack.idx.
+        """
+        self._files = []
+        self._index = self._map(os.path.join(directory, PACK_INDEX_FILE))
+        self._data = self._map(os.path.join(directory, PACK_DATA_FILE))
+        if self._index[:4] != PACK_INDEX_MAGIC:
+            raise ValueError(f"Invalid pack index in {directory}")
+        self.count = self._fanout(255)
+        self._locations = PACK_HEADER_SIZE + PACK_FANOUT_SIZE + self.count * HASH_SIZE
+
+    def _map(self, path):
+        file = open(path, "rb")
+        self._files.append(file)
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _fanout(self, i):
+        return struct.unpack_from(">I", self._index, PACK_HEADER_SIZE + i * 4)[0]
+
+    def _hash_at(self, i):
+        start = PACK_HEADER_SIZE + PACK_FANOUT_SIZE + i * HASH_SIZE
+        return self._index[start:start + HASH_SIZE]
+
+    def find(self, hash):
+        """
+        Looks up an object.
+        :param hash: Full hash of the object (hex str).
+        :return: (offset, length) of its stored bytes in the data file, or None.
+        """
+        key = bytes.fromhex(hash)
+        low = self._fanout(key[0] - 1) if key[0] > 0 else 0
+        high = self._fanout(key[0])
+        while low < high:
+            middle = (low + high) // 2
+            candidate = self._hash_at(middle)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return struct.unpack_from(">QQ", self._index, self._locations + middle * LOCATION_SIZE)
+        return None
+
+    def read(self, offset, length):
+        """
+        :return: The stored bytes at a location of the data file.
+        """
+        return self._data[offset:offset + length]
+
+    def hashes(self):
+        """
+        :return: Iterator over the hashes of the packed objects, in order.
+        """
+        return (self._hash_at(i).hex() for i in range(self.count))
+
+    def close(self):
+        self._index.close()
+        self._data.close()
+        for file in self._files:
+            file.close()
+
+
+class ObjectDirectory:
+    """
+    One object directory of a .gitlite store.
+    """
+
+    def __init__(self, path, chunks=None):
+        """
+        :param path: Path of the object directory.
+        :param chunks: ObjectDirectory of the chunks, for the blobs directory.
+        """
+        self.path = path
+        self.chunks = chunks
+        self._pack = None
+        self._pack_loaded = False
+
+    @property
+    def pack(self):
+        """
+        The pack of the directory, mapped on first use, or None if it has none.
+        """
+        if not self._pack_loaded:
+            index = os.path.join(self.path, PACK_INDEX_FILE)
+            if os.path.isfile(index) and os.path.getsize(index) > 0:
+                self._pack = Pack(self.path)
+            self._pack_loaded = True
+        return self._pack
+
+    def loose_path(self, hash):
+        return os.path.join(self.path, hash[:2], hash[2:])
+
+    def __contains__(self, hash):
+        return os.path.isfile(self.loose_path(hash)) or (self.pack is not None and self.pack.find(hash) is not None)
+
+    def read_stored(self, hash):
+        """
+        Reads the bytes of an object as they are stored, i.e. still compressed.
+        :param hash: Full hash of the object.
+        :return: bytes
+        """
+        try:
+            with open(self.loose_path(hash), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            pass
+
+        location = self.pack.find(hash) if self.pack is not None else None
+        if location is None:
+            raise ObjectNotFoundError(hash)
+        return self.pack.read(*location)
+
+    def read(self, hash):
+        """
+        Reads the raw content of an object.
+        :param hash: Full hash of the object.
+        :return: bytes
+        """
+        return self.decode(self.read_stored(hash))
+
+    def read_many(self, hashes):
+        """
+        Reads the raw content of many objects, the packed ones in pack order, so the
+        mapped data file is read front to back.
+        :param hashes: Iterable of full hashes.
+        :return: Iterator over (hash, bytes), in no particular order.
+        """
+        packed = []
+        for hash in hashes:
+            if os.path.isfile(self.loose_path(hash)):
+                yield hash, self.read(hash)
+                continue
+            location = self.pack.find(hash) if self.pack is not None else None
+            if location is None:
+                raise ObjectNotFoundError(hash)
+            packed.append((location, hash))
+
+        for location, hash in sorted(packed):
+            yield hash, self.decode(self.pack.read(*location))
+
+    def decode(self, stored):
+        """
+        Turns stored object bytes into the raw content.
+        """
+        if stored[:4] == MANIFEST_MAGIC:
+            return b"".join(self.chunks.read(chunk) for chunk in read_manifest(stored))
+        if stored[:4] != COMPRESSION_MAGIC:
+            # Written before compression existed.
+            return bytes(stored)
+
+        codec = stored[4]
+        payload = stored[COMPRESSION_HEADER_SIZE:]
+        if codec == CODEC_NONE:
+            return bytes(payload)
+        if codec == CODEC_DEFLATE:
+            return zlib.decompress(payload)
+        if codec == CODEC_BROTLI:
+            try:
+                import brotli
+            except ImportError:
+                raise RuntimeError("Reading brotli-compressed objects needs the brotli package.") from None
+            return brotli.decompress(bytes(payload))
+        raise ValueError(f"Unknown compression codec: {codec}")
+
+    def hashes(self):
+        """
+        :return: Iterator over the hashes of all objects, loose and packed.
+        """
+        seen = set()
+        if os.path.isdir(self.path):
+            for prefix in sorted(os.listdir(self.path)):
+                subdir = os.path.join(self.path, prefix)
+                if len(prefix) != 2 or not os.path.isdir(subdir):
+                    continue
+                for rest in sorted(os.listdir(subdir)):
+                    hash = prefix + rest
+                    if len(hash) == 40 and not rest.endswith(".tmp"):
+                        seen.add(hash)
+                        yield hash
+        if self.pack is not None:
+            yield from (hash for hash in self.pack.hashes() if hash not in seen)
+
+    def close(self):
+        if self._pack is not None:
+            self._pack.close()
+        self._pack = None
+        self._pack_loaded = False
+
+
+def read_manifest(stored):
+    """
+    Lists the chunks of a chunked blob.
+    :param stored: Stored bytes of the blob, a manifest.
+    :return: List of chunk hashes, in order.
+    """
+    version, _, count = struct.unpack_from(">IqI", stored, 4)
+    if version != 1:
+        raise ValueError(f"Unsupported chunk manifest version: {version}")
+    return [bytes(stored[start:start + HASH_SIZE]).hex()
+            for start in range(MANIFEST_HEADER_SIZE, MANIFEST_HEADER_SIZE + count * MANIFEST_ENTRY_SIZE, MANIFEST_ENTRY_SIZE)]
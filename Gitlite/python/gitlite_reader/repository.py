@@ -0,0 +1,259 @@
+"""
+Read-only access to a Gitlite repository: HEAD, branches, commits, trees, blobs and the
+staging area, read straight from the .gitlite store.
+"""
+import dataclasses
+import datetime
+import heapq
+import os
+
+from . import _msgpack
+from .objects import ObjectDirectory
+
+GITLITE_DIR = ".gitlite"
+
+
+class NotARepositoryError(FileNotFoundError):
+    """
+    Raised when a directory holds no .gitlite store.
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class Commit:
+    """
+    A commit. Commits made before trees existed have no root tree and list their files
+    in stored_file_mapping instead.
+    """
+    hash: str
+    message: str
+    timestamp: datetime.datetime
+    parent: str | None
+    second_parent: str | None
+    root_tree: str | None
+    stored_file_mapping: dict | None
+
+    @property
+    def parents(self):
+        """
+        Parent hashes, the first parent first.
+        """
+        return tuple(parent for parent in (self.parent, self.second_parent) if parent is not None)
+
+
+@dataclasses.dataclass(frozen=True)
+class TreeEntry:
+    """
+    A file with its blob hash, or a subdirectory with its tree hash.
+    """
+    name: str
+    hash: str
+    is_tree: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class StagingArea:
+    """
+    Files staged for addition (name -> blob hash) and for removal.
+    """
+    additions: dict
+    removals: list
+
+
+class Repository:
+    """
+    A Gitlite repository, read directly from its .gitlite store. Commits and trees are
+    immutable, so they are cached once read; HEAD, branches and the staging area are read
+    afresh on every call.
+
+    Usage:
+        with Repository("path/to/repo") as repo:
+            for commit in repo.log():
+                print(commit.hash, commit.message)
+    """
+
+    def __init__(self, path="."):
+        """
+        :param path: Working directory of the repository.
+        """
+        self.path = os.path.abspath(path)
+        self.gitlite_dir = os.path.join(self.path, GITLITE_DIR)
+        if not os.path.isdir(self.gitlite_dir):
+            raise NotARepositoryError(f"Not a GitLite repository: {path}")
+
+        chunks = ObjectDirectory(os.path.join(self.gitlite_dir, "chunks"))
+        self.chunks = chunks
+        self.blobs = ObjectDirectory(os.path.join(self.gitlite_dir, "blobs"), chunks)
+        self.trees = ObjectDirectory(os.path.join(self.gitlite_dir, "trees"))
+        self.commits = ObjectDirectory(os.path.join(self.gitlite_dir, "commits"))
+        self._commit_cache = {}
+        self._tree_cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the packs.
+        """
+        for directory in (self.blobs, self.trees, self.commits, self.chunks):
+            directory.close()
+
+    def _read_ref(self, *path):
+        with open(os.path.join(self.gitlite_dir, *path), encoding="utf-8") as file:
+            return file.read()
+
+    @property
+    def head(self):
+        """
+        Content of HEAD: "ref: [branch]", or a commit hash.
+        """
+        return self._read_ref("HEAD")
+
+    @property
+    def current_branch(self):
+        """
+        Name of the checked out branch, or None.
+        """
+        head = self.head
+        return head[len("ref: "):] if head.startswith("ref: ") else None
+
+    def branches(self):
+        """
+        :return: Dict of branch names to the hashes of their head commits.
+        """
+        directory = os.path.join(self.gitlite_dir, "branches")
+        return {name: self._read_ref("branches", name) for name in sorted(os.listdir(directory))
+                if not name.endswith(".tmp")}
+
+    def resolve(self, name=None):
+        """
+        Resolves a branch name, a full or abbreviated commit hash, or HEAD (the default) to
+        a full commit hash.
+        :return: str
+        """
+        if name is None or name == "HEAD":
+            branch = self.current_branch
+            return self._read_ref("branches", branch) if branch is not None else self.head
+        branches = self.branches()
+        if name in branches:
+            return branches[name]
+        if len(name) == 40 and name in self.commits:
+            return name
+
+        matches = [hash for hash in self.commits.hashes() if hash.startswith(name)]
+        if len(matches) != 1:
+            raise KeyError(f"No single commit matches {name}")
+        return matches[0]
+
+    def commit(self, hash):
+        """
+        Reads a commit, caching it.
+        :param hash: Full commit hash.
+        :return: Commit
+        """
+        commit = self._commit_cache.get(hash)
+        if commit is None:
+            fields = _msgpack.unpackb(self.commits.read(hash))
+            fields += [None] * (7 - len(fields))
+            message, timestamp, stored_file_mapping, parent, commit_hash, root_tree, second_parent = fields[:7]
+            commit = Commit(commit_hash or hash, message, timestamp, parent, second_parent, root_tree, stored_file_mapping)
+            self._commit_cache[hash] = commit
+        return commit
+
+    def log(self, start=None):
+        """
+        Lazily walks the first-parent history of a commit, like `Gitlite log`.
+        :param start: Branch name or commit hash; HEAD by default.
+        :return: Iterator over Commit, newest first.
+        """
+        hash = self.resolve(start)
+        while hash is not None:
+            commit = self.commit(hash)
+            yield commit
+            hash = commit.parent
+
+    def history(self, start=None):
+        """
+        Lazily walks every ancestor of a commit, following both parents of merges.
+        :param start: Branch name or commit hash; HEAD by default.
+        :return: Iterator over Commit, newest first by timestamp, each once.
+        """
+        first = self.commit(self.resolve(start))
+        seen = {first.hash}
+        queue = [(-first.timestamp.timestamp(), first.hash)]
+        while queue:
+            _, hash = heapq.heappop(queue)
+            commit = self.commit(hash)
+            yield commit
+            for parent in commit.parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(queue, (-self.commit(parent).timestamp.timestamp(), parent))
+
+    def all_commits(self):
+        """
+        :return: Iterator over every stored commit, reachable or not, in no particular order.
+        """
+        return (self.commit(hash) for hash in self.commits.hashes())
+
+    def tree(self, hash):
+        """
+        Reads a tree, caching it.
+        :param hash: Tree hash.
+        :return: List of TreeEntry, sorted by name.
+        """
+        entries = self._tree_cache.get(hash)
+        if entries is None:
+            entries = [TreeEntry(*entry) for entry in _msgpack.unpackb(self.trees.read(hash))[0]]
+            self._tree_cache[hash] = entries
+        return entries
+
+    def files(self, commit=None):
+        """
+        Lists the files of a commit.
+        :param commit: Commit, branch name or commit hash; HEAD by default.
+        :return: Dict of file names ('/' separated) to blob hashes.
+        """
+        if not isinstance(commit, Commit):
+            commit = self.commit(self.resolve(commit))
+        if commit.root_tree is None:
+            return dict(commit.stored_file_mapping or {})
+
+        files = {}
+        stack = [(commit.root_tree, "")]
+        while stack:
+            tree, prefix = stack.pop()
+            for entry in self.tree(tree):
+                if entry.is_tree:
+                    stack.append((entry.hash, prefix + entry.name + "/"))
+                else:
+                    files[prefix + entry.name] = entry.hash
+        return files
+
+    def blob(self, hash):
+        """
+        Reads the content of a blob.
+        :return: bytes
+        """
+        return self.blobs.read(hash)
+
+    def read_blobs(self, hashes):
+        """
+        Reads many blobs, the packed ones in pack order through the mapped pack.
+        :param hashes: Iterable of blob hashes.
+        :return: Iterator over (hash, bytes), in no particular order.
+        """
+        return self.blobs.read_many(hashes)
+
+    def staging_area(self):
+        """
+        Reads the staging area.
+        :return: StagingArea
+        """
+        with open(os.path.join(self.gitlite_dir, "staging"), "rb") as file:
+            additions, removals = _msgpack.unpackb(file.read())[:2]
+        return StagingArea(additions or {}, removals or [])
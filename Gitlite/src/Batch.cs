@@ -0,0 +1,212 @@
+using System.Text;
+using System.Text.Json;
+
+namespace Gitlite;
+
+/// <summary>
+/// Runs a stream of commands read from stdin in one process. Repository state is loaded
+/// once (see WarmState), and writes of the staging area, HEAD and branches are deferred
+/// until a checkpoint or the end of the batch. They are then written in the order they
+/// were first deferred.
+///
+/// Input is one command per line, with arguments split on whitespace and grouped with
+/// double or single quotes (e.g. commit "first commit"). With -z, arguments are separated
+/// by NUL and a command ends with an empty argument (two NULs in a row), so arguments may
+/// hold any character. The command "checkpoint" writes all deferred state.
+///
+/// Every command produces one JSON line on stdout:
+///     {"command": [...], "exit_code": 0, "stdout": "...", "stderr": "..."}
+/// </summary>
+public static class Batch
+{
+    public const string CHECKPOINT = "checkpoint";
+
+    private static readonly JsonSerializerOptions JsonOptions = new JsonSerializerOptions
+    {
+        PropertyNamingPolicy = JsonNamingPolicy.SnakeCaseLower
+    };
+
+    private record Result(string[] Command, int ExitCode, string Stdout, string Stderr);
+
+    /// <summary>
+    /// Runs the commands read from stdin.
+    /// </summary>
+    /// <param name="nulDelimited">Whether input is NUL delimited (-z).</param>
+    /// <param name="keepGoing">Whether to run the remaining commands after one fails.</param>
+    /// <returns>True if every command that ran succeeded.</returns>
+    public static bool Run(bool nulDelimited, bool keepGoing)
+    {
+        TextWriter stdout = Console.Out, stderr = Console.Error;
+        TextReader input = Console.In;
+        bool succeeded = true;
+
+        Utils.InProcess = true;
+        WarmState.DeferWrites = true;
+        try
+        {
+            foreach (string[] command in nulDelimited ? ReadNulDelimited(input) : ReadLines(input))
+            {
+                int exitCode = RunCommand(command, out string output, out string error);
+                stdout.WriteLine(JsonSerializer.Serialize(new Result(command, exitCode, output, error), JsonOptions));
+                stdout.Flush();
+
+                if (exitCode != 0)
+                {
+                    succeeded = false;
+                    if (!keepGoing) break;
+                }
+            }
+        }
+        finally
+        {
+            WarmState.Flush();
+            WarmState.DeferWrites = false;
+            Utils.InProcess = false;
+        }
+
+        return succeeded;
+    }
+
+    /// <summary>
+    /// Runs one command of the batch with its output captured.
+    /// </summary>
+    /// <returns>The exit code of the command, as a process would report it.</returns>
+    private static int RunCommand(string[] command, out string output, out string error)
+    {
+        TextWriter stdout = Console.Out, stderr = Console.Error;
+        StringWriter outWriter = new StringWriter(), errWriter = new StringWriter();
+        Console.SetOut(outWriter);
+        Console.SetError(errWriter);
+        int exitCode;
+        try
+        {
+            if (command.Length == 1 && command[0] == CHECKPOINT)
+            {
+                WarmState.Flush();
+                exitCode = 0;
+            }
+            else if (command.Length > 0 && command[0] is "init" or "batch" or "daemon" or "fsmonitor")
+            {
+                Console.WriteLine($"Cannot run {command[0]} in a batch.");
+                exitCode = -1;
+            }
+            else
+            {
+                exitCode = Program.RunInProcess(command);
+            }
+        }
+        catch (Exception e)
+        {
+            // E.g. a corrupt object: the command fails, not the batch.
+            Console.Error.WriteLine(e);
+            exitCode = 1;
+        }
+        finally
+        {
+            Console.SetOut(stdout);
+            Console.SetError(stderr);
+        }
+
+        output = outWriter.ToString();
+        error = errWriter.ToString();
+        return exitCode & 0xFF;
+    }
+
+    private static IEnumerable<string[]> ReadLines(TextReader input)
+    {
+        string? line;
+        while ((line = input.ReadLine()) != null)
+        {
+            string[] command = SplitArguments(line);
+            if (command.Length > 0)
+            {
+                yield return command;
+            }
+        }
+    }
+
+    private static IEnumerable<string[]> ReadNulDelimited(TextReader input)
+    {
+        List<string> command = new List<string>();
+        StringBuilder argument = new StringBuilder();
+        int c;
+        while ((c = input.Read()) != -1)
+        {
+            if (c != '\0')
+            {
+                argument.Append((char)c);
+            }
+            else if (argument.Length > 0)
+            {
+                command.Add(argument.ToString());
+                argument.Clear();
+            }
+            else if (command.Count > 0)
+            {
+                yield return command.ToArray();
+                command.Clear();
+            }
+        }
+
+        if (argument.Length > 0)
+        {
+            command.Add(argument.ToString());
+        }
+        if (command.Count > 0)
+        {
+            yield return command.ToArray();
+        }
+    }
+
+    /// <summary>
+    /// Splits a command line on whitespace, keeping quoted text together. A backslash
+    /// escapes the next character.
+    /// </summary>
+    private static string[] SplitArguments(string line)
+    {
+        List<string> arguments = new List<string>();
+        StringBuilder argument = new StringBuilder();
+        bool inArgument = false;
+        char? quote = null;
+
+        for (int i = 0; i < line.Length; i++)
+        {
+            char c = line[i];
+            if (c == '\\' && i + 1 < line.Length)
+            {
+                argument.Append(line[++i]);
+                inArgument = true;
+            }
+            else if (quote != null)
+            {
+                if (c == quote) quote = null;
+                else argument.Append(c);
+            }
+            else if (c is '"' or '\'')
+            {
+                quote = c;
+                inArgument = true;
+            }
+            else if (char.IsWhiteSpace(c))
+            {
+                if (inArgument)
+                {
+                    arguments.Add(argument.ToString());
+                    argument.Clear();
+                    inArgument = false;
+                }
+            }
+            else
+            {
+                argument.Append(c);
+                inArgument = true;
+            }
+        }
+
+        if (inArgument)
+        {
+            arguments.Add(argument.ToString());
+        }
+        return arguments.ToArray();
+    }
+}
@@ -1,3 +1,5 @@
+using System.Security.Cryptography;
+
 namespace Gitlite;
 
 public static class Blob
@@ -15,14 +17,68 @@ public static class Blob
             hash = Utils.HashBytes(contents);
         }
         
-        var (firstTwoDigits, rest) = Utils.SplitHashPath(hash);
-        string path = Path.Combine(Repository.BLOBS_DIR.ToString(), firstTwoDigits);
-        Directory.CreateDirectory(path);
-        path = Path.Combine(path, rest);
-        if (!File.Exists(path))
+        ObjectStore.Write(Repository.BLOBS_DIR, hash, contents);
+    }
+
+    /// <summary>
+    /// Saves the content of a FILE as a blob without loading it into memory. The file is
+    /// hashed while it is compressed into a temporary file, which is then flushed to disk
+    /// and renamed to the blob. Files of at least GITLITE_CHUNK_THRESHOLD bytes are stored
+    /// as chunks instead (see ChunkedBlob).
+    /// </summary>
+    /// <param name="file">Path of the file to save.</param>
+    /// <returns>Hash of the file content.</returns>
+    public static string SaveBlobFromFile(string file)
+    {
+        long? chunkThreshold = ChunkedBlob.GetThreshold();
+        if (chunkThreshold != null && new FileInfo(file).Length >= chunkThreshold)
+        {
+            return ChunkedBlob.Save(file);
+        }
+        
+        using Trace.TraceSpan? span = Trace.Span("Blob.SaveBlobFromFile", "objects");
+        string tmpPath = Path.Combine(Repository.BLOBS_DIR.ToString(), $"tmp_{Guid.NewGuid():N}");
+        string hash;
+        Trace.FileOpened();
+        
+        using (IncrementalHash sha1 = IncrementalHash.CreateHash(HashAlgorithmName.SHA1))
+        using (FileStream source = new FileStream(file, FileMode.Open, FileAccess.Read, FileShare.Read, Utils.BUFFER_SIZE))
+        using (FileStream tmp = new FileStream(tmpPath, FileMode.CreateNew, FileAccess.ReadWrite, FileShare.None, Utils.BUFFER_SIZE))
         {
-            Utils.WriteContent(path, contents);
+            using (Stream encoder = Compression.OpenWrite(tmp))
+            {
+                byte[] buffer = new byte[Utils.BUFFER_SIZE];
+                int read;
+                while ((read = source.Read(buffer, 0, buffer.Length)) > 0)
+                {
+                    sha1.AppendData(buffer, 0, read);
+                    Trace.BytesHashed(read);
+                    encoder.Write(buffer, 0, read);
+                }
+                hash = Convert.ToHexString(sha1.GetHashAndReset()).ToLower();
+            }
+            
+            // On disk before it is renamed to the blob.
+            tmp.Flush(true);
         }
+        
+        ObjectStore.MoveIn(Repository.BLOBS_DIR, hash, tmpPath);
+        return hash;
+    }
+
+    /// <summary>
+    /// Writes the content of a blob to a file, byte for byte, without loading the blob into
+    /// memory. The file is created or overwritten.
+    /// </summary>
+    /// <param name="blobRef">Hash reference of the blob.</param>
+    /// <param name="file">Path of the file to write.</param>
+    public static void WriteBlobToFile(string blobRef, string file)
+    {
+        using Trace.TraceSpan? span = Trace.Span("Blob.WriteBlobToFile", "io");
+        using Stream blob = ObjectStore.OpenRead(Repository.BLOBS_DIR, blobRef);
+        Trace.FileOpened();
+        using FileStream destination = new FileStream(file, FileMode.Create, FileAccess.Write, FileShare.None, Utils.BUFFER_SIZE);
+        blob.CopyTo(destination, Utils.BUFFER_SIZE);
     }
 
     /// <summary>
@@ -30,11 +86,16 @@ public static class Blob
     /// </summary>
     /// <param name="blobRef">Hash reference of the blob</param>
     /// <param name="otherFile">File path of the file to compare to</param>
+    /// <param name="statCache">Optional stat cache used to skip rehashing unchanged files.</param>
     /// <returns>A boolean value if the blob and the file has the same content</returns>
-    public static bool IsEqualToOtherFile(string blobRef, string otherFile)
+    public static bool IsEqualToOtherFile(string blobRef, string otherFile, StatCache? statCache = null)
     {
-        byte[] otherFileContent = Utils.ReadContentsAsBytes(otherFile);
-        return Utils.HashBytes(otherFileContent) == blobRef;
+        if (statCache != null)
+        {
+            return statCache.GetFileHash(Path.GetRelativePath(Repository.CWD.ToString(), otherFile)) == blobRef;
+        }
+        
+        return Utils.HashFile(otherFile) == blobRef;
     }
 
     /// <summary>
@@ -44,9 +105,7 @@ public static class Blob
     /// <returns>Content of the BLOB in string.</returns>
     public static string ReadBlobContentAsString(string blobRef)
     {
-        var (firstTwoDigits, rest) = Utils.SplitHashPath(blobRef);
-        string path = Path.Combine(Repository.BLOBS_DIR.ToString(), firstTwoDigits, rest);
-        byte[] bytes = Utils.ReadContentsAsBytes(path);
+        byte[] bytes = ObjectStore.Read(Repository.BLOBS_DIR, blobRef);
         return System.Text.Encoding.UTF8.GetString(bytes);
     }
 }
\ No newline at end of file
@@ -7,11 +7,19 @@ public static class Branch
     /// Helper function that gets all existing branches and marks the active
     /// branch with '*'
     /// </summary>
+    /// <param name="branchesDir">Branches directory of another repository, if not this one.</param>
     /// <returns>A string[] of all branches</returns>
-    public static string[] GetExistingBranches()
+    public static string[] GetExistingBranches(DirectoryInfo? branchesDir = null)
     {
-        string[] branches = Utils.GetFilesSorted(Repository.BRANCHES.ToString());
-        return branches;
+        // Temporary files of branches being written (or left behind by a crash) are not
+        // branches, but branches whose write is deferred in a batch are.
+        IEnumerable<string> branches = Utils.GetFilesSorted((branchesDir ?? Repository.BRANCHES).ToString())
+            .Where(branch => !branch.EndsWith(Utils.TMP_SUFFIX));
+        if (branchesDir == null)
+        {
+            branches = branches.Concat(WarmState.ListPending(Repository.BRANCHES.ToString())).Order();
+        }
+        return branches.ToArray();
     }
     
     /// <summary>
@@ -22,7 +30,57 @@ public static class Branch
     public static void CreateBranch(string name, string commitHashRef)
     {
         string branch = Path.Combine(Repository.BRANCHES.ToString(), name);
-        Utils.WriteContent(branch, commitHashRef);
+        UpdateRef(branch, commitHashRef);
+    }
+    
+    /// <summary>
+    /// Writes a ref file (HEAD or a branch), keeping the cached refs up to date. In a
+    /// batch, the write is deferred along with the staging area (see WarmState.Write).
+    /// </summary>
+    /// <param name="refPath">Path of the ref file.</param>
+    /// <param name="content">Commit hash, or "ref: [branch]" for HEAD.</param>
+    public static void UpdateRef(string refPath, string content)
+    {
+        WarmState.Write(refPath, content, () => Utils.WriteContent(refPath, content));
+    }
+
+    /// <summary>
+    /// Deletes a ref file, including a write of it deferred in a batch.
+    /// </summary>
+    /// <param name="refPath">Path of the ref file.</param>
+    public static void DeleteRef(string refPath)
+    {
+        WarmState.Delete(refPath);
+    }
+    
+    /// <summary>
+    /// Moves a ref only if it still points where the caller last saw it, so an update
+    /// never silently overwrites one made by another command.
+    /// </summary>
+    /// <param name="refPath">Path of the ref file.</param>
+    /// <param name="expected">Content the ref must have.</param>
+    /// <param name="content">New content of the ref.</param>
+    /// <returns>True if the ref was updated.</returns>
+    public static bool CompareAndSwapRef(string refPath, string expected, string content)
+    {
+        // Writers hold the repository lock, so the ref can't change between the check and
+        // the rename.
+        if (ReadRef(refPath) != expected)
+        {
+            return false;
+        }
+
+        UpdateRef(refPath, content);
+        return true;
+    }
+    
+    /// <summary>
+    /// Reads a ref file (HEAD or a branch), from the cache if it did not change.
+    /// </summary>
+    /// <param name="refPath">Path of the ref file.</param>
+    public static string ReadRef(string refPath)
+    {
+        return WarmState.ReadFile(refPath, () => Utils.ReadContentsAsString(refPath));
     }
     
     /// <summary>
@@ -32,9 +90,7 @@ public static class Branch
     /// <returns>A boolean value if BRANCH is active</returns>
     public static bool IsCurrentBranch(string branchName)
     {
-        string head = Utils.ReadContentsAsString(Path.Combine(Repository.GITLITE_DIR.ToString(), "HEAD"));
-
-        return head.Split("ref: ")[1] == branchName;
+        return GetActiveBranch() == branchName;
     }
 
     /// <summary>
@@ -43,7 +99,8 @@ public static class Branch
     /// <returns>String name of the current active branch.</returns>
     public static string? GetActiveBranch()
     {
-        string head = Utils.ReadContentsAsString(Repository.GITLITE_DIR.ToString(), "HEAD");
+        string headPath = Path.Combine(Repository.GITLITE_DIR.ToString(), "HEAD");
+        string head = ReadRef(headPath);
 
         if (head.StartsWith("ref: "))
         {
@@ -57,9 +114,9 @@ public static class Branch
     {
         if (branchName.StartsWith(Repository.BRANCHES.ToString()))
         {
-            return File.Exists(branchName);
+            return WarmState.Exists(branchName);
         }
         
-        return File.Exists(Path.Combine(Repository.BRANCHES.ToString(), branchName));
+        return WarmState.Exists(Path.Combine(Repository.BRANCHES.ToString(), branchName));
     }
 }
\ No newline at end of file
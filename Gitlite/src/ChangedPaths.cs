@@ -0,0 +1,297 @@
+using System.Buffers.Binary;
+using System.Text;
+
+namespace Gitlite;
+
+/// <summary>
+/// Side file with a Bloom filter of the paths each commit changed relative to its first
+/// parent, so `log -- [path]` only opens and diffs the commits whose filter may contain
+/// the path. A filter holds every changed file and each directory above it, so a
+/// directory can be looked up as well.
+///
+/// Layout (all integers big-endian):
+///     "GLCP" | version (uint32)
+///     records: commit hash (20 bytes) | filter length in bytes (uint16) | filter |
+///         offset of the record (uint32)
+///
+/// The trailing offset lets a commit check that the last record is whole and append its
+/// own without reading the file. A hash may have several records; the last one wins.
+///
+/// Filters get BITS_PER_PATH bits per path. A commit that changed more than MAX_PATHS
+/// paths gets a single byte with every bit set, which matches any path. Records are
+/// appended, and only dropped when gc deletes their commit; commits without one (e.g.
+/// fetched ones) are diffed instead, until `write-changed-paths` fills them in. A file of
+/// another version is read as empty and rewritten from scratch.
+/// </summary>
+public static class ChangedPaths
+{
+    public static string CHANGED_PATHS = Path.Combine(Repository.GITLITE_DIR.ToString(), "changed-paths");
+
+    private static readonly byte[] MAGIC = "GLCP"u8.ToArray();
+    private const uint VERSION = 2;
+    private const int HEADER_SIZE = 8;
+    private const int HASH_SIZE = 20;
+    private const int FOOTER_SIZE = 4;
+    private const int BITS_PER_PATH = 10;
+    private const int HASH_COUNT = 7;
+    private const int MAX_PATHS = 512;
+    private const int MIN_FILTER_SIZE = 8;
+
+    /// <summary>
+    /// Appends the filter of a newly created commit. Only the end of the file is read,
+    /// unless its last record is not whole.
+    /// </summary>
+    public static void Add(Commit commit)
+    {
+        byte[] filter = Build(GetChangedFiles(commit));
+        Write(GetValidLength() ?? Read().Item2, new[] { (commit.Hash, filter) });
+    }
+
+    /// <summary>
+    /// Writes the filters of all stored commits that have none yet.
+    /// </summary>
+    /// <returns>Number of filters written.</returns>
+    public static int Backfill()
+    {
+        var (filters, length) = Read();
+        List<(string, byte[])> records = ObjectStore.EnumerateHashes(Repository.COMMITS_DIR)
+            .Where(hash => !filters.ContainsKey(hash))
+            .Select(hash => (hash, Build(GetChangedFiles(Commit.Deserialize(hash)))))
+            .ToList();
+        Write(length, records);
+        return records.Count;
+    }
+
+    /// <summary>
+    /// Rewrites the file with only the filters of commits still stored, e.g. after gc
+    /// deleted some.
+    /// </summary>
+    public static void Prune()
+    {
+        if (!File.Exists(CHANGED_PATHS))
+        {
+            return;
+        }
+
+        HashSet<string> stored = ObjectStore.EnumerateHashes(Repository.COMMITS_DIR).ToHashSet();
+        List<(string, byte[])> records = Read().Item1
+            .Where(record => stored.Contains(record.Key))
+            .Select(record => (record.Key, record.Value))
+            .ToList();
+        Utils.WriteAtomically(CHANGED_PATHS, file =>
+        {
+            WriteHeader(file);
+            WriteRecords(file, records);
+        });
+    }
+
+    /// <summary>
+    /// Loads the filters of all commits that have one.
+    /// </summary>
+    /// <returns>Filters by commit hash.</returns>
+    public static Dictionary<string, byte[]> Load()
+    {
+        return Read().Item1;
+    }
+
+    /// <summary>
+    /// Checks if a filter may contain PATH. False means the commit certainly did not
+    /// change it; true may be a false positive.
+    /// </summary>
+    /// <param name="filter">Filter of a commit.</param>
+    /// <param name="path">File or directory name, '/' separated.</param>
+    public static bool MayContain(byte[] filter, string path)
+    {
+        return GetBits(path, filter.Length * 8).All(bit => (filter[bit / 8] & (1 << (bit % 8))) != 0);
+    }
+
+    /// <summary>
+    /// Lists the files a commit changed relative to its first parent (all of its files
+    /// for the initial commit).
+    /// </summary>
+    public static IEnumerable<string> GetChangedFiles(Commit commit)
+    {
+        if (commit.ParentHashRef == null)
+        {
+            return commit.FileMapping.Keys;
+        }
+        return Commit.Deserialize(commit.ParentHashRef).DiffTo(commit).Select(change => change.Item1);
+    }
+
+    private static byte[] Build(IEnumerable<string> changedFiles)
+    {
+        HashSet<string> paths = new HashSet<string>();
+        foreach (string file in changedFiles)
+        {
+            // The file, then each directory above it until one is already in.
+            for (string path = file; paths.Add(path); )
+            {
+                int slash = path.LastIndexOf('/');
+                if (slash < 0) break;
+                path = path[..slash];
+            }
+        }
+
+        if (paths.Count > MAX_PATHS)
+        {
+            return new byte[] { 0xFF };
+        }
+
+        byte[] filter = new byte[Math.Max(MIN_FILTER_SIZE, (paths.Count * BITS_PER_PATH + 7) / 8)];
+        foreach (string path in paths)
+        {
+            foreach (int bit in GetBits(path, filter.Length * 8))
+            {
+                filter[bit / 8] |= (byte)(1 << (bit % 8));
+            }
+        }
+        return filter;
+    }
+
+    /// <summary>
+    /// Returns the HASH_COUNT bit positions of a path, by double hashing the two halves
+    /// of its 64-bit FNV-1a hash.
+    /// </summary>
+    private static IEnumerable<int> GetBits(string path, int bitCount)
+    {
+        ulong hash = 14695981039346656037;
+        foreach (byte b in Encoding.UTF8.GetBytes(path))
+        {
+            hash = (hash ^ b) * 1099511628211;
+        }
+
+        uint h1 = (uint)hash, h2 = (uint)(hash >> 32) | 1;
+        for (uint i = 0; i < HASH_COUNT; i++)
+        {
+            yield return (int)((h1 + i * h2) % (uint)bitCount);
+        }
+    }
+
+    /// <summary>
+    /// Reads all records, and the length of the file up to the last whole one.
+    /// </summary>
+    private static (Dictionary<string, byte[]>, long) Read()
+    {
+        using Trace.TraceSpan? span = Trace.Span("ChangedPaths.Read", "objects");
+        Dictionary<string, byte[]> filters = new Dictionary<string, byte[]>();
+        if (!File.Exists(CHANGED_PATHS))
+        {
+            return (filters, 0);
+        }
+
+        Trace.FileOpened();
+        byte[] content = File.ReadAllBytes(CHANGED_PATHS);
+        if (!HasValidHeader(content))
+        {
+            return (filters, 0);
+        }
+
+        int at = HEADER_SIZE;
+        while (at + HASH_SIZE + 2 <= content.Length)
+        {
+            int length = BinaryPrimitives.ReadUInt16BigEndian(content.AsSpan(at + HASH_SIZE));
+            int end = at + HASH_SIZE + 2 + length + FOOTER_SIZE;
+            if (end > content.Length || BinaryPrimitives.ReadUInt32BigEndian(content.AsSpan(end - FOOTER_SIZE)) != at)
+            {
+                break;
+            }
+
+            string hash = Convert.ToHexString(content, at, HASH_SIZE).ToLower();
+            filters[hash] = content[(at + HASH_SIZE + 2)..(end - FOOTER_SIZE)];
+            at = end;
+        }
+
+        return (filters, at);
+    }
+
+    /// <summary>
+    /// Checks the header and the last record without reading the rest of the file.
+    /// </summary>
+    /// <returns>The length of the file, 0 if it is missing, or null if its header or last
+    /// record is not valid.</returns>
+    private static long? GetValidLength()
+    {
+        if (!File.Exists(CHANGED_PATHS))
+        {
+            return 0;
+        }
+
+        Trace.FileOpened();
+        using FileStream file = new FileStream(CHANGED_PATHS, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        byte[] header = new byte[HEADER_SIZE];
+        if (file.Read(header) < HEADER_SIZE || !HasValidHeader(header))
+        {
+            return null;
+        }
+        if (file.Length == HEADER_SIZE)
+        {
+            return HEADER_SIZE;
+        }
+        if (file.Length < HEADER_SIZE + HASH_SIZE + 2 + FOOTER_SIZE)
+        {
+            return null;
+        }
+
+        byte[] footer = new byte[FOOTER_SIZE];
+        file.Seek(-FOOTER_SIZE, SeekOrigin.End);
+        file.ReadExactly(footer);
+        long start = BinaryPrimitives.ReadUInt32BigEndian(footer);
+        if (start < HEADER_SIZE || start + HASH_SIZE + 2 + FOOTER_SIZE > file.Length)
+        {
+            return null;
+        }
+
+        byte[] length = new byte[2];
+        file.Seek(start + HASH_SIZE, SeekOrigin.Begin);
+        file.ReadExactly(length);
+        long end = start + HASH_SIZE + 2 + BinaryPrimitives.ReadUInt16BigEndian(length) + FOOTER_SIZE;
+        return end == file.Length ? end : null;
+    }
+
+    private static bool HasValidHeader(byte[] content)
+    {
+        return content.Length >= HEADER_SIZE
+            && content.AsSpan(0, 4).SequenceEqual(MAGIC)
+            && BinaryPrimitives.ReadUInt32BigEndian(content.AsSpan(4)) == VERSION;
+    }
+
+    /// <summary>
+    /// Writes records at LENGTH, i.e. after the last whole record, so a record cut short
+    /// by a crash is overwritten.
+    /// </summary>
+    private static void Write(long length, IEnumerable<(string Hash, byte[] Filter)> records)
+    {
+        using FileStream file = new FileStream(CHANGED_PATHS, FileMode.OpenOrCreate, FileAccess.Write, FileShare.Read);
+        if (length < HEADER_SIZE)
+        {
+            file.SetLength(0);
+            WriteHeader(file);
+            length = HEADER_SIZE;
+        }
+
+        file.Seek(length, SeekOrigin.Begin);
+        WriteRecords(file, records);
+        file.SetLength(file.Position);
+    }
+
+    private static void WriteHeader(Stream file)
+    {
+        file.Write(MAGIC);
+        byte[] version = new byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(version, VERSION);
+        file.Write(version);
+    }
+
+    private static void WriteRecords(Stream file, IEnumerable<(string Hash, byte[] Filter)> records)
+    {
+        foreach (var (hash, filter) in records)
+        {
+            byte[] buffer = new byte[HASH_SIZE + 2 + filter.Length + FOOTER_SIZE];
+            Convert.FromHexString(hash).CopyTo(buffer, 0);
+            BinaryPrimitives.WriteUInt16BigEndian(buffer.AsSpan(HASH_SIZE), (ushort)filter.Length);
+            filter.CopyTo(buffer, HASH_SIZE + 2);
+            BinaryPrimitives.WriteUInt32BigEndian(buffer.AsSpan(buffer.Length - FOOTER_SIZE), (uint)file.Position);
+            file.Write(buffer);
+        }
+    }
+}
@@ -0,0 +1,328 @@
+using System.Buffers.Binary;
+using System.Security.Cryptography;
+
+namespace Gitlite;
+
+/// <summary>
+/// Opt-in storage of large files as chunks shared between versions. With
+/// GITLITE_CHUNK_THRESHOLD set to a size in bytes, files at least that big are cut into
+/// chunks at content-defined boundaries, so an edit only changes the chunks around it and
+/// a new version of the file only stores those. Chunks are objects of their own, in
+/// chunks/, and the blob object holds a manifest listing them in order.
+///
+/// The blob hash is still the SHA-1 of the whole content, so trees, the staging area and
+/// comparisons against working files do not know whether a blob is chunked.
+///
+/// Boundaries are found with FastCDC: a gear rolling hash over the last 64 bytes, checked
+/// against a stricter mask before the average chunk size and a looser one after it, which
+/// keeps chunk sizes close to the average. Chunks are MIN_CHUNK to MAX_CHUNK bytes.
+///
+/// Manifest layout (all integers big-endian, stored as is in place of the blob):
+///     "\0GLM" | version (uint32) | raw length (int64) | chunk count (uint32)
+///     N x chunk hash (20 bytes) | chunk length (uint32)
+/// </summary>
+public static class ChunkedBlob
+{
+    public const string CHUNK_THRESHOLD_ENV = "GITLITE_CHUNK_THRESHOLD";
+
+    public const int MIN_CHUNK = 16 * 1024;
+    public const int AVG_CHUNK = 64 * 1024;
+    public const int MAX_CHUNK = 256 * 1024;
+
+    private static readonly byte[] MAGIC = "\0GLM"u8.ToArray();
+    private const uint VERSION = 1;
+    private const int HEADER_SIZE = 4 + 4 + 8 + 4;
+    private const int HASH_SIZE = 20;
+    private const int ENTRY_SIZE = HASH_SIZE + 4;
+
+    // The gear hash shifts left, so its top bits depend on the most bytes. A cut needs
+    // 18 of them to be zero before AVG_CHUNK (2^16) and 14 after.
+    private const ulong MASK_SMALL = ~0UL << (64 - 18);
+    private const ulong MASK_LARGE = ~0UL << (64 - 14);
+
+    private static readonly ulong[] GEAR = CreateGearTable();
+
+    /// <summary>
+    /// Returns the size from which files are chunked, or null if chunking is off.
+    /// </summary>
+    public static long? GetThreshold()
+    {
+        string? value = Environment.GetEnvironmentVariable(CHUNK_THRESHOLD_ENV);
+        if (string.IsNullOrEmpty(value))
+        {
+            return null;
+        }
+
+        if (!long.TryParse(value, out long threshold) || threshold < 0)
+        {
+            Utils.ExitWithError($"Invalid {CHUNK_THRESHOLD_ENV}: {value}");
+        }
+        return threshold;
+    }
+
+    /// <summary>
+    /// Saves the content of a FILE as a chunked blob, streaming it: chunks are hashed and
+    /// stored as they are cut, skipping those already stored, and the manifest is written
+    /// last.
+    /// </summary>
+    /// <param name="file">Path of the file to save.</param>
+    /// <returns>Hash of the file content.</returns>
+    public static string Save(string file)
+    {
+        using Trace.TraceSpan? span = Trace.Span("ChunkedBlob.Save", "objects");
+        List<(byte[] Hash, int Length)> chunks = new List<(byte[], int)>();
+        long rawLength = 0;
+        string hash;
+
+        using (IncrementalHash sha1 = IncrementalHash.CreateHash(HashAlgorithmName.SHA1))
+        using (FileStream source = new FileStream(file, FileMode.Open, FileAccess.Read, FileShare.Read, Utils.BUFFER_SIZE))
+        {
+            Trace.FileOpened();
+            byte[] buffer = new byte[2 * MAX_CHUNK];
+            int filled = 0;
+            while (true)
+            {
+                filled += source.ReadAtLeast(buffer.AsSpan(filled), buffer.Length - filled, false);
+                if (filled == 0)
+                {
+                    break;
+                }
+
+                // The buffer is only partly filled at the end of the file, where the last
+                // chunk may be shorter than MIN_CHUNK.
+                int length = FindBoundary(buffer.AsSpan(0, filled));
+                byte[] chunk = buffer.AsSpan(0, length).ToArray();
+                sha1.AppendData(chunk);
+                Trace.BytesHashed(length);
+
+                byte[] chunkHash = SHA1.HashData(chunk);
+                ObjectStore.Write(Repository.CHUNKS_DIR, Convert.ToHexString(chunkHash).ToLower(), chunk);
+                chunks.Add((chunkHash, length));
+                rawLength += length;
+
+                Buffer.BlockCopy(buffer, length, buffer, 0, filled - length);
+                filled -= length;
+            }
+            hash = Convert.ToHexString(sha1.GetHashAndReset()).ToLower();
+        }
+
+        byte[] manifest = new byte[HEADER_SIZE + chunks.Count * ENTRY_SIZE];
+        MAGIC.CopyTo(manifest, 0);
+        BinaryPrimitives.WriteUInt32BigEndian(manifest.AsSpan(4), VERSION);
+        BinaryPrimitives.WriteInt64BigEndian(manifest.AsSpan(8), rawLength);
+        BinaryPrimitives.WriteUInt32BigEndian(manifest.AsSpan(16), (uint)chunks.Count);
+        for (int i = 0; i < chunks.Count; i++)
+        {
+            int at = HEADER_SIZE + i * ENTRY_SIZE;
+            chunks[i].Hash.CopyTo(manifest, at);
+            BinaryPrimitives.WriteUInt32BigEndian(manifest.AsSpan(at + HASH_SIZE), (uint)chunks[i].Length);
+        }
+
+        ObjectStore.WriteStored(Repository.BLOBS_DIR, hash, manifest);
+        return hash;
+    }
+
+    /// <summary>
+    /// Returns the length of the chunk DATA starts with. DATA holds at least MAX_CHUNK
+    /// bytes unless it is the end of the file.
+    /// </summary>
+    public static int FindBoundary(ReadOnlySpan<byte> data)
+    {
+        if (data.Length <= MIN_CHUNK)
+        {
+            return data.Length;
+        }
+
+        ulong fingerprint = 0;
+        int i = MIN_CHUNK;
+        for (int end = Math.Min(AVG_CHUNK, data.Length); i < end; i++)
+        {
+            fingerprint = (fingerprint << 1) + GEAR[data[i]];
+            if ((fingerprint & MASK_SMALL) == 0) return i + 1;
+        }
+        for (int end = Math.Min(MAX_CHUNK, data.Length); i < end; i++)
+        {
+            fingerprint = (fingerprint << 1) + GEAR[data[i]];
+            if ((fingerprint & MASK_LARGE) == 0) return i + 1;
+        }
+        return i;
+    }
+
+    /// <summary>
+    /// Checks if stored object bytes are a manifest.
+    /// </summary>
+    public static bool IsManifest(byte[] stored)
+    {
+        return stored.Length >= HEADER_SIZE && stored.AsSpan(0, MAGIC.Length).SequenceEqual(MAGIC);
+    }
+
+    /// <summary>
+    /// Checks if a stored object is a manifest, leaving the stream where it was.
+    /// </summary>
+    /// <param name="stored">Seekable stream over the stored object, positioned at its start.</param>
+    public static bool IsManifest(Stream stored)
+    {
+        long start = stored.Position;
+        byte[] magic = new byte[MAGIC.Length];
+        int read = stored.ReadAtLeast(magic, magic.Length, false);
+        stored.Seek(start, SeekOrigin.Begin);
+        return read == magic.Length && magic.AsSpan().SequenceEqual(MAGIC);
+    }
+
+    /// <summary>
+    /// Returns the content of a chunked blob.
+    /// </summary>
+    /// <param name="stored">Stored bytes of the blob, a manifest.</param>
+    public static byte[] Read(byte[] stored)
+    {
+        using MemoryStream content = new MemoryStream();
+        using (Stream chunks = OpenRead(new MemoryStream(stored)))
+        {
+            chunks.CopyTo(content);
+        }
+        return content.ToArray();
+    }
+
+    /// <summary>
+    /// Opens the content of a chunked blob as a stream that reads its chunks in order,
+    /// one at a time.
+    /// </summary>
+    /// <param name="stored">Stream over the manifest, positioned at its start. Closed by
+    /// the returned stream.</param>
+    public static Stream OpenRead(Stream stored)
+    {
+        var (rawLength, chunks) = ReadManifest(stored);
+        stored.Dispose();
+        return new ChunkStream(rawLength, chunks);
+    }
+
+    /// <summary>
+    /// Reads the raw length of a chunked blob from its manifest.
+    /// </summary>
+    /// <param name="stored">Stream over the manifest, positioned at its start.</param>
+    public static long ReadRawLength(Stream stored)
+    {
+        byte[] header = new byte[HEADER_SIZE];
+        stored.ReadExactly(header);
+        return BinaryPrimitives.ReadInt64BigEndian(header.AsSpan(8));
+    }
+
+    /// <summary>
+    /// Returns the hashes of the chunks of a chunked blob, in order.
+    /// </summary>
+    /// <param name="stored">Stream over the manifest, positioned at its start.</param>
+    public static List<string> ReadChunkHashes(Stream stored)
+    {
+        return ReadManifest(stored).Item2;
+    }
+
+    private static (long, List<string>) ReadManifest(Stream stored)
+    {
+        byte[] header = new byte[HEADER_SIZE];
+        stored.ReadExactly(header);
+        uint version = BinaryPrimitives.ReadUInt32BigEndian(header.AsSpan(4));
+        if (version != VERSION)
+        {
+            throw new InvalidDataException($"Unsupported chunk manifest version: {version}");
+        }
+
+        long rawLength = BinaryPrimitives.ReadInt64BigEndian(header.AsSpan(8));
+        int count = (int)BinaryPrimitives.ReadUInt32BigEndian(header.AsSpan(16));
+        byte[] entries = new byte[count * ENTRY_SIZE];
+        stored.ReadExactly(entries);
+
+        List<string> chunks = new List<string>(count);
+        for (int i = 0; i < count; i++)
+        {
+            chunks.Add(Convert.ToHexString(entries, i * ENTRY_SIZE, HASH_SIZE).ToLower());
+        }
+        return (rawLength, chunks);
+    }
+
+    /// <summary>
+    /// Fixed table of 256 random 64-bit values. Boundaries depend on it, so it must never
+    /// change: it is generated by SplitMix64 from a constant seed.
+    /// </summary>
+    private static ulong[] CreateGearTable()
+    {
+        ulong[] table = new ulong[256];
+        ulong state = 0x676974_6c697465UL;
+        for (int i = 0; i < table.Length; i++)
+        {
+            ulong z = state += 0x9E3779B97F4A7C15UL;
+            z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9UL;
+            z = (z ^ (z >> 27)) * 0x94D049BB133111EBUL;
+            table[i] = z ^ (z >> 31);
+        }
+        return table;
+    }
+
+    /// <summary>
+    /// Read-only stream over the content of a chunked blob.
+    /// </summary>
+    private class ChunkStream : Stream
+    {
+        private readonly long _length;
+        private readonly List<string> _chunks;
+        private int _next;
+        private Stream? _current;
+        private long _position;
+
+        public ChunkStream(long length, List<string> chunks)
+        {
+            _length = length;
+            _chunks = chunks;
+        }
+
+        public override bool CanRead => true;
+        public override bool CanSeek => false;
+        public override bool CanWrite => false;
+        public override long Length => _length;
+
+        public override long Position
+        {
+            get => _position;
+            set => throw new NotSupportedException();
+        }
+
+        public override int Read(byte[] buffer, int offset, int count)
+        {
+            while (count > 0)
+            {
+                if (_current == null)
+                {
+                    if (_next == _chunks.Count)
+                    {
+                        return 0;
+                    }
+                    _current = ObjectStore.OpenRead(Repository.CHUNKS_DIR, _chunks[_next++]);
+                }
+
+                int read = _current.Read(buffer, offset, count);
+                if (read > 0)
+                {
+                    _position += read;
+                    return read;
+                }
+
+                _current.Dispose();
+                _current = null;
+            }
+            return 0;
+        }
+
+        public override void Flush() { }
+        public override long Seek(long offset, SeekOrigin origin) => throw new NotSupportedException();
+        public override void SetLength(long value) => throw new NotSupportedException();
+        public override void Write(byte[] buffer, int offset, int count) => throw new NotSupportedException();
+
+        protected override void Dispose(bool disposing)
+        {
+            if (disposing)
+            {
+                _current?.Dispose();
+            }
+            base.Dispose(disposing);
+        }
+    }
+}
@@ -1,3 +1,4 @@
+using System.Text.Json.Serialization;
 using MessagePack;
     
 namespace Gitlite;
@@ -9,22 +10,43 @@ namespace Gitlite;
  */
 
 /// <summary>
-/// Class that represents GitLite commits.
+/// Class that represents GitLite commits. A commit stores the hash of its root tree;
+/// commits made before trees existed store a flat file mapping instead.
 /// </summary>
 [MessagePackObject]
 public class Commit
 {
     [Key(0)] public string LogMessage { get; set; }
     [Key(1)] public DateTime Timestamp { get; set; }
-    [Key(2)] public Dictionary<string, string> FileMapping { get; set; }
+    
+    /// <summary>
+    /// Flat file mapping of commits made before trees existed, null otherwise.
+    /// </summary>
+    [Key(2)] [JsonIgnore] public Dictionary<string, string>? StoredFileMapping { get; set; }
     [Key(3)] public string? ParentHashRef { get; set; }
     [Key(4)] public string Hash { get; set; }
+    [Key(5)] public string? RootTree { get; set; }
+    
+    /// <summary>
+    /// Head of the branch merged in, for merge commits.
+    /// </summary>
+    [Key(6)] public string? SecondParentHashRef { get; set; }
+
+    [IgnoreMember] private Dictionary<string, string>? _fileMapping;
 
-    public Commit(string logMessage, DateTime timestamp, Dictionary<string, string> fileMapping, string? parentHashRef)
+    /// <summary>
+    /// Mapping of file names to blob hashes, read from the root tree on first use.
+    /// Commits are shared between lookups, so it must not be modified.
+    /// </summary>
+    [IgnoreMember]
+    public Dictionary<string, string> FileMapping =>
+        _fileMapping ??= RootTree != null ? Tree.Flatten(RootTree) : StoredFileMapping ?? new Dictionary<string, string>();
+
+    public Commit(string logMessage, DateTime timestamp, Dictionary<string, string>? storedFileMapping, string? parentHashRef)
     {
         this.LogMessage = logMessage;
         this.Timestamp = timestamp;
-        this.FileMapping = fileMapping;
+        this.StoredFileMapping = storedFileMapping;
         this.ParentHashRef = parentHashRef;
     }
 
@@ -55,25 +77,99 @@ public class Commit
     
     public static string CreateCommit(string logMessage, DateTime timestamp, Dictionary<string, string> fileMapping, string? parentHashRef)
     {
-        Commit commit = new Commit(logMessage, timestamp, fileMapping, parentHashRef);
+        return CreateCommit(logMessage, timestamp, Tree.Write(fileMapping), parentHashRef);
+    }
+
+    /// <summary>
+    /// Creates a commit of the given root tree and returns its hash.
+    /// </summary>
+    /// <param name="logMessage">Commit log message.</param>
+    /// <param name="timestamp">Timestamp of when the commit was created.</param>
+    /// <param name="rootTree">Hash of the root tree of the commit.</param>
+    /// <param name="parentHashRef">Hash reference of parent commit.</param>
+    /// <param name="secondParentHashRef">Hash reference of the second parent, for a merge commit.</param>
+    /// <returns>Hash string of the created Commit object.</returns>
+    public static string CreateCommit(string logMessage, DateTime timestamp, string rootTree, string? parentHashRef,
+        string? secondParentHashRef = null)
+    {
+        Commit commit = new Commit(logMessage, timestamp, null, parentHashRef)
+        {
+            RootTree = rootTree,
+            SecondParentHashRef = secondParentHashRef
+        };
         string hash = GetHash(commit);
         commit.Hash = hash;
         byte[] serializedCommit = MessagePackSerializer.Serialize(commit);
         commit.WriteCommit(serializedCommit);
+        
+        using CommitGraph graph = CommitGraph.Load();
+        graph.Add(hash, commit.GetParentHashRefs(), timestamp);
+        CommitCatalog.Append(commit);
+        ChangedPaths.Add(commit);
         return hash;
     }
 
     private void WriteCommit(byte[] serializedCommit)
     {
-        var (firstTwoDigits, rest) = Utils.SplitHashPath(Hash);
-        string path = Path.Combine(Repository.COMMITS_DIR.ToString(), firstTwoDigits);
-        Directory.CreateDirectory(path);
-        path = Path.Combine(path, rest);
-        Utils.WriteContent(path, serializedCommit);
+        ObjectStore.Write(Repository.COMMITS_DIR, Hash, serializedCommit);
+    }
+    
+    /// <summary>
+    /// Returns the hash references of the parents of this commit.
+    /// </summary>
+    /// <returns>A list with zero (initial commit) or more parent hashes.</returns>
+    public List<string> GetParentHashRefs()
+    {
+        List<string> parents = new List<string>();
+        if (ParentHashRef != null)
+        {
+            parents.Add(ParentHashRef);
+        }
+        if (SecondParentHashRef != null)
+        {
+            parents.Add(SecondParentHashRef);
+        }
+        
+        return parents;
+    }
+    
+    /// <summary>
+    /// Returns the root tree of this commit, writing it first for a commit made before
+    /// trees existed. Writing needs the repository lock, so only commands that create
+    /// commits call this; the others compare commits with DiffTo.
+    /// </summary>
+    public string GetRootTree()
+    {
+        return RootTree ?? Tree.Write(FileMapping);
+    }
+
+    /// <summary>
+    /// Lists the files that differ between this commit and OTHER. Subtrees with the same
+    /// hash in both commits are skipped. A commit made before trees existed is compared
+    /// by its flat mapping instead, so nothing is written.
+    /// </summary>
+    /// <param name="other">Commit to compare with.</param>
+    /// <returns>Changed files with their blob hash in this commit and in OTHER (null if absent).</returns>
+    public IEnumerable<(string, string?, string?)> DiffTo(Commit other)
+    {
+        if (RootTree != null && other.RootTree != null)
+        {
+            return Tree.Diff(RootTree, other.RootTree);
+        }
+
+        return FileMapping.Keys.Union(other.FileMapping.Keys)
+            .Order(StringComparer.Ordinal)
+            .Select(file => (file, FileMapping.GetValueOrDefault(file), other.FileMapping.GetValueOrDefault(file)))
+            .Where(change => change.Item2 != change.Item3);
     }
     
     public override string ToString()
     {
+        if (SecondParentHashRef != null)
+        {
+            return $"Commit: {Hash}\nMerge: {ParentHashRef![..7]} {SecondParentHashRef[..7]}\nDate: {Timestamp}\n{LogMessage}";
+        }
+        
         return $"Commit: {Hash}\nDate: {Timestamp}\n{LogMessage}";
     }
     
@@ -90,8 +186,6 @@ public class Commit
             throw new ArgumentNullException(nameof(hash), "Hash cannot be null or empty when deserializing.");
         }
         
-        string path;
-        
         if (hash.Length < 40)
         {
             hash = FindCompleteHash(hash);
@@ -101,13 +195,12 @@ public class Commit
             }
         }
 
-        var (firstTwoDigits, rest) = Utils.SplitHashPath(hash);
-        path = Path.Combine(Repository.COMMITS_DIR.ToString(), firstTwoDigits, rest);
-        
-        Utils.ValidateFile(path, message:errorMessage);
-        byte[] commitAsByte = Utils.ReadContentsAsBytes(path);
-        
-        return MessagePackSerializer.Deserialize<Commit>(commitAsByte);
+        string completeHash = hash!;
+        return WarmState.ReadCommit(completeHash, () =>
+        {
+            using Trace.TraceSpan? span = Trace.Span("Commit.Deserialize", "objects");
+            return MessagePackSerializer.Deserialize<Commit>(ObjectStore.Read(Repository.COMMITS_DIR, completeHash, errorMessage));
+        });
     }
 
     public static string? FindCompleteHash(string shortHash)
@@ -120,20 +213,12 @@ public class Commit
             return shortHash;
         }
         
-        var (firstTwoDigits, rest) = Utils.SplitHashPath(shortHash);
-        string dirPath = Path.Combine(Repository.COMMITS_DIR.ToString(), firstTwoDigits);
-
-        if (!Directory.Exists(dirPath)) return null;
-        
-        var files = Directory.GetFiles(dirPath).Select(Path.GetFileName);
-        List<string> matchingHashes = new List<string>();
-        
-        foreach (var file in files)
+        // The catalog may miss commits, e.g. ones whose record was lost to a crash, so
+        // anything short of an ambiguous match is checked against the objects as well.
+        List<string> matchingHashes = CommitCatalog.FindByPrefix(shortHash);
+        if (matchingHashes.Count < 2)
         {
-            if (file.StartsWith(rest))
-            {
-                matchingHashes.Add(file);
-            }
+            matchingHashes = matchingHashes.Union(ObjectStore.FindByPrefix(Repository.COMMITS_DIR, shortHash)).ToList();
         }
 
         if (matchingHashes.Count == 0)
@@ -146,7 +231,7 @@ public class Commit
             Utils.ExitWithError("Hash provided is not unique enough. Please provide a longer one.");
         }
         
-        return firstTwoDigits + matchingHashes[0];
+        return matchingHashes[0];
     } 
 
     public static Commit GetHeadCommit()
@@ -158,7 +243,7 @@ public class Commit
 
     public static Commit GetBranchHeadCommit(string branchName)
     {
-        string hashRef = Utils.ReadContentsAsString(Path.Combine(Repository.BRANCHES.ToString(), branchName));
+        string hashRef = Branch.ReadRef(Path.Combine(Repository.BRANCHES.ToString(), branchName));
         return Deserialize(hashRef);
     }
 
@@ -176,10 +261,10 @@ public class Commit
 
         if (branch != null)
         {
-            return Utils.ReadContentsAsString(Path.Combine(Repository.BRANCHES.ToString(), branch));
+            return Branch.ReadRef(Path.Combine(Repository.BRANCHES.ToString(), branch));
         }
         
-        return Utils.ReadContentsAsString(Path.Combine(Repository.GITLITE_DIR.ToString(), "HEAD"));
+        return Branch.ReadRef(Path.Combine(Repository.GITLITE_DIR.ToString(), "HEAD"));
     }
 
 }
\ No newline at end of file
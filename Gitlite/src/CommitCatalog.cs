@@ -0,0 +1,461 @@
+using System.Buffers.Binary;
+using System.IO.MemoryMappedFiles;
+using System.Text.RegularExpressions;
+using MessagePack;
+
+namespace Gitlite;
+
+/// <summary>
+/// An entry of the commit catalog: the metadata of a commit, without its file mapping.
+/// </summary>
+[MessagePackObject]
+public class CatalogEntry
+{
+    [Key(0)] public string Hash { get; set; }
+    [Key(1)] public List<string> Parents { get; set; }
+    [Key(2)] public DateTime Timestamp { get; set; }
+    [Key(3)] public string LogMessage { get; set; }
+
+    public CatalogEntry(string hash, List<string> parents, DateTime timestamp, string logMessage)
+    {
+        Hash = hash;
+        Parents = parents;
+        Timestamp = timestamp;
+        LogMessage = logMessage;
+    }
+
+    /// <summary>
+    /// Same format as Commit.ToString, so commands can print entries instead of commits.
+    /// </summary>
+    public override string ToString()
+    {
+        if (Parents.Count > 1)
+        {
+            return $"Commit: {Hash}\nMerge: {Parents[0][..7]} {Parents[1][..7]}\nDate: {Timestamp}\n{LogMessage}";
+        }
+        
+        return $"Commit: {Hash}\nDate: {Timestamp}\n{LogMessage}";
+    }
+}
+
+/// <summary>
+/// Lowercase token index of the commit messages in the first COVERED bytes of the catalog.
+/// </summary>
+[MessagePackObject]
+public class CatalogTokenIndex
+{
+    [Key(0)] public long Covered { get; set; }
+    
+    /// <summary>
+    /// Offsets of the catalog records whose message has each token.
+    /// </summary>
+    [Key(1)] public Dictionary<string, List<long>> Postings { get; set; }
+
+    public CatalogTokenIndex(long covered, Dictionary<string, List<long>> postings)
+    {
+        Covered = covered;
+        Postings = postings;
+    }
+}
+
+/// <summary>
+/// Append-only catalog of every commit's metadata, so find, global-log and short hash
+/// lookups never need to list or open commit objects.
+///
+/// The catalog file is a sequence of records: length (uint32, big-endian) followed by a
+/// MessagePack serialized CatalogEntry. The catalog index holds the sorted hashes of the
+/// first COVERED bytes of the catalog for binary search; records appended after that are
+/// scanned directly until the index is rebuilt.
+///
+/// Index layout: "GLCI" | version (uint32) | covered catalog length (int64) | N x 20 byte
+/// sorted hashes.
+///
+/// The token index (a MessagePack serialized CatalogTokenIndex) is rebuilt along with
+/// the index, and likewise only covers the records written before.
+/// </summary>
+public static class CommitCatalog
+{
+    public static string CATALOG = Path.Combine(Repository.GITLITE_DIR.ToString(), "catalog");
+    public static string CATALOG_INDEX = Path.Combine(Repository.GITLITE_DIR.ToString(), "catalog.idx");
+    public static string CATALOG_TOKENS = Path.Combine(Repository.GITLITE_DIR.ToString(), "catalog.tokens");
+
+    private static readonly byte[] INDEX_MAGIC = "GLCI"u8.ToArray();
+    private const uint VERSION = 1;
+    private const int INDEX_HEADER_SIZE = 16;
+    private const int HASH_SIZE = 20;
+
+    // The index is rebuilt once this many bytes of records are not covered by it.
+    private const long MAX_UNINDEXED_BYTES = 64 * 1024;
+
+    /// <summary>
+    /// Appends a newly created commit to the catalog.
+    /// </summary>
+    public static void Append(Commit commit)
+    {
+        if (!File.Exists(CATALOG))
+        {
+            // The commit object is already written, so the rebuilt catalog includes it.
+            Rebuild();
+            return;
+        }
+        
+        CatalogEntry entry = new CatalogEntry(commit.Hash, commit.GetParentHashRefs(), commit.Timestamp, commit.LogMessage);
+
+        long length, covered = ReadCoveredLength(CATALOG_INDEX);
+        using (FileStream catalog = new FileStream(CATALOG, FileMode.Open, FileAccess.ReadWrite, FileShare.Read))
+        {
+            SeekToEnd(catalog, covered);
+            WriteRecord(catalog, entry);
+            catalog.SetLength(catalog.Position);
+            length = catalog.Length;
+        }
+
+        if (length - covered > MAX_UNINDEXED_BYTES)
+        {
+            RebuildIndex();
+        }
+    }
+
+    /// <summary>
+    /// Appends commits pushed into another repository to its catalog. Its index is left
+    /// alone, since entries past the part it covers are scanned anyway, and a missing
+    /// catalog is rebuilt there when it is next needed.
+    /// </summary>
+    /// <param name="gitliteDir">.gitlite directory of the other repository.</param>
+    /// <param name="commits">Commits in the order they were created.</param>
+    public static void AppendTo(DirectoryInfo gitliteDir, IEnumerable<Commit> commits)
+    {
+        string path = Path.Combine(gitliteDir.FullName, Path.GetFileName(CATALOG));
+        if (!File.Exists(path))
+        {
+            return;
+        }
+
+        using FileStream catalog = new FileStream(path, FileMode.Open, FileAccess.ReadWrite, FileShare.Read);
+        SeekToEnd(catalog, ReadCoveredLength(Path.Combine(gitliteDir.FullName, Path.GetFileName(CATALOG_INDEX))));
+        foreach (Commit commit in commits)
+        {
+            WriteRecord(catalog, new CatalogEntry(commit.Hash, commit.GetParentHashRefs(), commit.Timestamp, commit.LogMessage));
+        }
+        catalog.SetLength(catalog.Position);
+    }
+
+    /// <summary>
+    /// Streams all catalog entries in the order their commits were created. The catalog
+    /// is rebuilt from the commit objects first if it does not exist.
+    /// </summary>
+    public static IEnumerable<CatalogEntry> ReadEntries()
+    {
+        EnsureExists();
+        return ReadEntries(0);
+    }
+
+    /// <summary>
+    /// Returns the full hashes of all cataloged commits that start with PREFIX.
+    /// </summary>
+    /// <param name="prefix">Hexadecimal hash prefix.</param>
+    public static List<string> FindByPrefix(string prefix)
+    {
+        EnsureExists();
+        prefix = prefix.ToLower();
+        List<string> matches = new List<string>();
+        if (!prefix.All(Uri.IsHexDigit))
+        {
+            return matches;
+        }
+
+        long covered = 0;
+        FileInfo index = new FileInfo(CATALOG_INDEX);
+        if (index.Exists && index.Length >= INDEX_HEADER_SIZE)
+        {
+            using MemoryMappedFile file = MemoryMappedFile.CreateFromFile(CATALOG_INDEX, FileMode.Open, null, 0, MemoryMappedFileAccess.Read);
+            using MemoryMappedViewAccessor view = file.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+            covered = ReadInt64(view, 8);
+            matches.AddRange(SearchIndex(view, (int)((index.Length - INDEX_HEADER_SIZE) / HASH_SIZE), prefix));
+        }
+
+        // Records appended since the index was last rebuilt.
+        foreach (CatalogEntry entry in ReadEntries(covered))
+        {
+            if (entry.Hash.StartsWith(prefix) && !matches.Contains(entry.Hash))
+            {
+                matches.Add(entry.Hash);
+            }
+        }
+
+        return matches;
+    }
+
+    /// <summary>
+    /// Returns the entries whose log message contains QUERY, ignoring case. The query
+    /// tokens are looked up in the token index, and only the records having all of them
+    /// are read and checked against the whole query, along with the records the token
+    /// index does not cover yet.
+    /// </summary>
+    /// <param name="query">Text to look for in commit messages.</param>
+    public static List<CatalogEntry> FindByMessage(string query)
+    {
+        EnsureExists();
+        List<string> queryTokens = Tokenize(query).ToList();
+        CatalogTokenIndex? tokenIndex = File.Exists(CATALOG_TOKENS)
+            ? MessagePackSerializer.Deserialize<CatalogTokenIndex>(File.ReadAllBytes(CATALOG_TOKENS))
+            : null;
+
+        long covered = 0;
+        IEnumerable<CatalogEntry> candidates = Enumerable.Empty<CatalogEntry>();
+        if (tokenIndex != null && queryTokens.Count > 0)
+        {
+            covered = tokenIndex.Covered;
+            candidates = ReadEntriesAt(LookUpTokens(tokenIndex, queryTokens));
+        }
+
+        string lowerQuery = query.ToLower();
+        HashSet<string> seen = new HashSet<string>();
+        return candidates
+            .Concat(ReadEntries(covered))
+            .Where(entry => seen.Add(entry.Hash) && entry.LogMessage.ToLower().Contains(lowerQuery))
+            .ToList();
+    }
+
+    /// <summary>
+    /// Streams catalog entries, skipping duplicate records of the same commit.
+    /// </summary>
+    public static IEnumerable<CatalogEntry> DistinctEntries()
+    {
+        HashSet<string> seen = new HashSet<string>();
+        return ReadEntries().Where(entry => seen.Add(entry.Hash));
+    }
+
+    /// <summary>
+    /// Rebuilds the catalog and its index from the commit objects.
+    /// </summary>
+    /// <returns>The number of cataloged commits.</returns>
+    public static int Rebuild()
+    {
+        List<Commit> commits = ObjectStore.EnumerateHashes(Repository.COMMITS_DIR)
+            .Select(hash => Commit.Deserialize(hash))
+            .OrderBy(commit => commit.Timestamp)
+            .ToList();
+
+        Utils.WriteAtomically(CATALOG, catalog =>
+        {
+            foreach (Commit commit in commits)
+            {
+                WriteRecord(catalog, new CatalogEntry(commit.Hash, commit.GetParentHashRefs(), commit.Timestamp, commit.LogMessage));
+            }
+        });
+
+        RebuildIndex();
+        return commits.Count;
+    }
+
+    private static void EnsureExists()
+    {
+        if (!File.Exists(CATALOG))
+        {
+            Rebuild();
+        }
+    }
+
+    /// <summary>
+    /// Returns the offsets of the records whose message has every query token. Query
+    /// tokens between two others are whole words of a matching message, so they are looked
+    /// up directly. The first may be the end of a word and the last the start of one (a
+    /// single one any part of a word), so for those the tokens are scanned, but never the
+    /// records.
+    /// </summary>
+    private static SortedSet<long> LookUpTokens(CatalogTokenIndex tokenIndex, List<string> queryTokens)
+    {
+        SortedSet<long>? offsets = null;
+        for (int i = 0; i < queryTokens.Count; i++)
+        {
+            string queryToken = queryTokens[i];
+            bool first = i == 0, last = i == queryTokens.Count - 1;
+            IEnumerable<string> tokens = !first && !last
+                ? new[] { queryToken }.Where(tokenIndex.Postings.ContainsKey)
+                : tokenIndex.Postings.Keys.Where(token =>
+                    first && last ? token.Contains(queryToken, StringComparison.Ordinal)
+                    : first ? token.EndsWith(queryToken, StringComparison.Ordinal)
+                    : token.StartsWith(queryToken, StringComparison.Ordinal));
+
+            SortedSet<long> withToken = new SortedSet<long>(tokens.SelectMany(token => tokenIndex.Postings[token]));
+            if (offsets == null) offsets = withToken;
+            else offsets.IntersectWith(withToken);
+        }
+
+        return offsets ?? new SortedSet<long>();
+    }
+
+    private static IEnumerable<CatalogEntry> ReadEntries(long offset)
+    {
+        return ReadRecords(offset).Select(record => record.Item2);
+    }
+
+    /// <summary>
+    /// Streams the records from OFFSET on, with the offset of each.
+    /// </summary>
+    private static IEnumerable<(long, CatalogEntry)> ReadRecords(long offset)
+    {
+        using FileStream catalog = new FileStream(CATALOG, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        catalog.Seek(offset, SeekOrigin.Begin);
+        while (ReadRecord(catalog) is { } entry)
+        {
+            yield return (offset, entry);
+            offset = catalog.Position;
+        }
+    }
+
+    /// <summary>
+    /// Reads the records at the given offsets, in order.
+    /// </summary>
+    private static IEnumerable<CatalogEntry> ReadEntriesAt(IEnumerable<long> offsets)
+    {
+        using FileStream catalog = new FileStream(CATALOG, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        foreach (long offset in offsets)
+        {
+            catalog.Seek(offset, SeekOrigin.Begin);
+            if (ReadRecord(catalog) is { } entry)
+            {
+                yield return entry;
+            }
+        }
+    }
+
+    private static CatalogEntry? ReadRecord(FileStream catalog)
+    {
+        if (catalog.Position + 4 > catalog.Length) return null;
+
+        byte[] lengthBuffer = new byte[4];
+        catalog.ReadExactly(lengthBuffer);
+        int length = (int)BinaryPrimitives.ReadUInt32BigEndian(lengthBuffer);
+
+        // A record cut short by a crash ends the catalog.
+        if (catalog.Position + length > catalog.Length) return null;
+
+        byte[] record = new byte[length];
+        catalog.ReadExactly(record);
+        return MessagePackSerializer.Deserialize<CatalogEntry>(record);
+    }
+
+    /// <summary>
+    /// Moves to the end of the last whole record, so that a record cut short by a crash
+    /// is overwritten instead of swallowing the records appended after it. Only the
+    /// records after COVERED, which the index vouches for, are read.
+    /// </summary>
+    private static void SeekToEnd(FileStream catalog, long covered)
+    {
+        catalog.Seek(covered <= catalog.Length ? covered : 0, SeekOrigin.Begin);
+        while (true)
+        {
+            long end = catalog.Position;
+            try
+            {
+                if (ReadRecord(catalog) != null) continue;
+            }
+            catch (MessagePackSerializationException)
+            {
+                // Its length was written, but not its content.
+            }
+
+            catalog.Seek(end, SeekOrigin.Begin);
+            return;
+        }
+    }
+
+    private static void WriteRecord(Stream catalog, CatalogEntry entry)
+    {
+        byte[] record = MessagePackSerializer.Serialize(entry);
+        byte[] length = new byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(length, (uint)record.Length);
+        catalog.Write(length);
+        catalog.Write(record);
+    }
+
+    private static void RebuildIndex()
+    {
+        long covered = new FileInfo(CATALOG).Length;
+        List<byte[]> hashes = new List<byte[]>();
+        Dictionary<string, List<long>> postings = new Dictionary<string, List<long>>();
+        HashSet<string> seen = new HashSet<string>();
+        foreach (var (offset, entry) in ReadRecords(0).TakeWhile(record => record.Item1 < covered))
+        {
+            if (!seen.Add(entry.Hash)) continue;
+
+            hashes.Add(Convert.FromHexString(entry.Hash));
+            foreach (string token in Tokenize(entry.LogMessage).Distinct())
+            {
+                if (!postings.TryGetValue(token, out List<long>? offsets))
+                {
+                    postings[token] = offsets = new List<long>();
+                }
+                offsets.Add(offset);
+            }
+        }
+        hashes.Sort((a, b) => a.AsSpan().SequenceCompareTo(b));
+
+        Utils.WriteAtomically(CATALOG_INDEX, index =>
+        {
+            byte[] header = new byte[INDEX_HEADER_SIZE];
+            INDEX_MAGIC.CopyTo(header, 0);
+            BinaryPrimitives.WriteUInt32BigEndian(header.AsSpan(4), VERSION);
+            BinaryPrimitives.WriteInt64BigEndian(header.AsSpan(8), covered);
+            index.Write(header);
+            hashes.ForEach(hash => index.Write(hash));
+        });
+        Utils.WriteAtomically(CATALOG_TOKENS, tokens =>
+            MessagePackSerializer.Serialize(tokens, new CatalogTokenIndex(covered, postings)));
+    }
+
+    private static long ReadCoveredLength(string indexPath)
+    {
+        if (!File.Exists(indexPath))
+        {
+            return 0;
+        }
+
+        using FileStream index = new FileStream(indexPath, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        byte[] header = new byte[INDEX_HEADER_SIZE];
+        return index.Read(header) == INDEX_HEADER_SIZE ? BinaryPrimitives.ReadInt64BigEndian(header.AsSpan(8)) : 0;
+    }
+
+    /// <summary>
+    /// Binary searches the sorted hash table for the first hash not below PREFIX, then
+    /// collects hashes while they still start with PREFIX.
+    /// </summary>
+    private static List<string> SearchIndex(MemoryMappedViewAccessor view, int count, string prefix)
+    {
+        byte[] lowest = Convert.FromHexString(prefix.PadRight(HASH_SIZE * 2, '0'));
+        byte[] hash = new byte[HASH_SIZE];
+        int lo = 0, hi = count;
+        while (lo < hi)
+        {
+            int mid = (lo + hi) >>> 1;
+            view.ReadArray(INDEX_HEADER_SIZE + (long)mid * HASH_SIZE, hash, 0, HASH_SIZE);
+            if (hash.AsSpan().SequenceCompareTo(lowest) < 0) lo = mid + 1;
+            else hi = mid;
+        }
+
+        List<string> matches = new List<string>();
+        for (int i = lo; i < count; i++)
+        {
+            view.ReadArray(INDEX_HEADER_SIZE + (long)i * HASH_SIZE, hash, 0, HASH_SIZE);
+            string hex = Convert.ToHexString(hash).ToLower();
+            if (!hex.StartsWith(prefix)) break;
+            matches.Add(hex);
+        }
+
+        return matches;
+    }
+
+    private static long ReadInt64(MemoryMappedViewAccessor view, long at)
+    {
+        byte[] buffer = new byte[8];
+        view.ReadArray(at, buffer, 0, 8);
+        return BinaryPrimitives.ReadInt64BigEndian(buffer);
+    }
+
+    private static IEnumerable<string> Tokenize(string text)
+    {
+        return Regex.Split(text.ToLower(), @"[^\p{L}\p{N}]+").Where(token => token.Length > 0);
+    }
+}
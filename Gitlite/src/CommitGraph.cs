@@ -0,0 +1,534 @@
+using System.Buffers.Binary;
+using System.IO.MemoryMappedFiles;
+
+namespace Gitlite;
+
+/// <summary>
+/// Side file that stores the parent links and generation number of every commit, so
+/// ancestry queries (merge-base, is-ancestor) never need to open commit objects.
+///
+/// Layout (all integers big-endian):
+///     "GLCG" | version (uint32)
+///     N x fixed-width records: hash (20 bytes) | first parent (uint32) |
+///         second parent (uint32) | generation (uint32) | timestamp (int64, unix ms)
+///
+/// Parents are record positions, NO_PARENT if absent. Records are appended (gc rewrites
+/// the file when it deletes commits), and a commit is appended after its parents, so the
+/// file is in topological order.
+/// The generation of a commit is 1 + the highest generation of its parents, so a commit
+/// can only be an ancestor of commits with a strictly higher generation.
+///
+/// Commits are looked up by binary search in the graph index, which holds the positions
+/// of the first COVERED records sorted by hash; records after those are read into memory
+/// until the index is rebuilt. The index also holds the inode of the graph file and the
+/// hash of its last covered record, so it is ignored once the graph was rewritten.
+///
+/// Index layout: "GLGI" | version (uint32) | covered records (uint32) | graph inode
+///     (int64) | hash of the last covered record (20 bytes) | N x position (uint32)
+/// </summary>
+public class CommitGraph : IDisposable
+{
+    public static string COMMIT_GRAPH = Path.Combine(Repository.GITLITE_DIR.ToString(), "commit-graph");
+    public static string COMMIT_GRAPH_INDEX = Path.Combine(Repository.GITLITE_DIR.ToString(), "commit-graph.idx");
+
+    public const uint NO_PARENT = uint.MaxValue;
+
+    private static readonly byte[] MAGIC = "GLCG"u8.ToArray();
+    private const uint VERSION = 1;
+    private const int HEADER_SIZE = 8;
+    private const int HASH_SIZE = 20;
+    private const int RECORD_SIZE = HASH_SIZE + 4 + 4 + 4 + 8;
+
+    private static readonly byte[] INDEX_MAGIC = "GLGI"u8.ToArray();
+    private const int INDEX_HEADER_SIZE = 4 + 4 + 4 + 8 + HASH_SIZE;
+
+    // The index is rebuilt once this many records are not covered by it.
+    private const int MAX_UNINDEXED_RECORDS = 1024;
+
+    private readonly MemoryMappedFile? _file;
+    private readonly MemoryMappedViewAccessor? _view;
+    private readonly int _mappedCount;
+
+    private readonly MemoryMappedFile? _indexFile;
+    private readonly MemoryMappedViewAccessor? _indexView;
+    private readonly int _indexedCount;
+    private int _indexWrittenCount;
+
+    // Records appended by this process after the file was mapped.
+    private readonly List<(string Hash, uint Parent1, uint Parent2, uint Generation, long Timestamp)> _appended =
+        new List<(string, uint, uint, uint, long)>();
+
+    // Positions of the records the index does not cover.
+    private readonly Dictionary<string, int> _positions = new Dictionary<string, int>();
+
+    // Whether records are appended to the file, decided by the first one.
+    private bool? _persist;
+    private RepositoryLock? _lock;
+
+    public int Count => _mappedCount + _appended.Count;
+
+    private CommitGraph(bool empty = false)
+    {
+        FileInfo info = new FileInfo(COMMIT_GRAPH);
+        if (empty || !info.Exists || info.Length <= HEADER_SIZE)
+        {
+            return;
+        }
+
+        _file = MemoryMappedFile.CreateFromFile(COMMIT_GRAPH, FileMode.Open, null, 0, MemoryMappedFileAccess.Read);
+        _view = _file.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+
+        // A record cut short by a crash is ignored and later overwritten.
+        _mappedCount = (int)((info.Length - HEADER_SIZE) / RECORD_SIZE);
+
+        FileInfo index = new FileInfo(COMMIT_GRAPH_INDEX);
+        if (index.Exists && index.Length >= INDEX_HEADER_SIZE)
+        {
+            _indexFile = MemoryMappedFile.CreateFromFile(COMMIT_GRAPH_INDEX, FileMode.Open, null, 0, MemoryMappedFileAccess.Read);
+            _indexView = _indexFile.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+            _indexedCount = ReadIndexedCount(index.Length);
+        }
+
+        for (int i = _indexedCount; i < _mappedCount; i++)
+        {
+            _positions[GetHash(i)] = i;
+        }
+    }
+
+    /// <summary>
+    /// Loads the commit graph. A missing file is treated as an empty graph, which gets
+    /// filled in as commits are looked up.
+    /// </summary>
+    public static CommitGraph Load()
+    {
+        return new CommitGraph();
+    }
+
+    /// <summary>
+    /// Rewrites the graph with only the commits still stored, e.g. after gc deleted some.
+    /// A commit whose history is no longer complete is left out.
+    /// </summary>
+    /// <returns>The number of commits in the graph.</returns>
+    public static int Rebuild()
+    {
+        Dictionary<string, Commit> commits = ObjectStore.EnumerateHashes(Repository.COMMITS_DIR)
+            .Select(hash => Commit.Deserialize(hash))
+            .ToDictionary(commit => commit.Hash);
+
+        using CommitGraph graph = new CommitGraph(true) { _persist = false };
+        foreach (Commit start in commits.Values.OrderBy(commit => commit.Timestamp))
+        {
+            // Parents are visited first, so they are in unless they are missing.
+            foreach (Commit commit in ParentsFirst(start, graph.Contains, hash => commits.GetValueOrDefault(hash)))
+            {
+                if (commit.GetParentHashRefs().All(graph.Contains))
+                {
+                    graph.Add(commit.Hash, commit.GetParentHashRefs(), commit.Timestamp);
+                }
+            }
+        }
+
+        // The old index would point into the new graph until it is replaced.
+        File.Delete(COMMIT_GRAPH_INDEX);
+        Utils.WriteAtomically(COMMIT_GRAPH, file =>
+        {
+            WriteHeader(file);
+            graph._appended.ForEach(record => file.Write(EncodeRecord(record)));
+        });
+        graph.WriteIndex();
+        return graph.Count;
+    }
+
+    /// <summary>
+    /// Appends a newly created commit to the graph. Its parents are added first if the
+    /// graph does not know them yet (e.g. history created before the graph existed).
+    /// </summary>
+    /// <param name="hash">Hash of the new commit.</param>
+    /// <param name="parents">Hashes of its parents.</param>
+    /// <param name="timestamp">Timestamp of the commit.</param>
+    public void Add(string hash, IReadOnlyList<string> parents, DateTime timestamp)
+    {
+        if (Contains(hash))
+        {
+            return;
+        }
+
+        uint[] parentPositions = parents.Select(parent => (uint)GetPosition(parent)).ToArray();
+        uint generation = 1;
+        foreach (uint parent in parentPositions)
+        {
+            generation = Math.Max(generation, GetGeneration((int)parent) + 1);
+        }
+
+        var record = (hash,
+            parentPositions.Length > 0 ? parentPositions[0] : NO_PARENT,
+            parentPositions.Length > 1 ? parentPositions[1] : NO_PARENT,
+            generation,
+            new DateTimeOffset(timestamp.ToUniversalTime()).ToUnixTimeMilliseconds());
+        WriteRecord(record);
+        _positions[hash] = Count;
+        _appended.Add(record);
+
+        if (_persist == true && Count - Math.Max(_indexedCount, _indexWrittenCount) > MAX_UNINDEXED_RECORDS)
+        {
+            WriteIndex();
+        }
+    }
+
+    /// <summary>
+    /// Returns the first parent of a commit, without opening the commit if the graph
+    /// already knows it.
+    /// </summary>
+    /// <returns>Hash of the first parent, or null for the initial commit.</returns>
+    public string? GetFirstParent(string hash)
+    {
+        foreach (int parent in GetParents(GetPosition(hash)))
+        {
+            return GetHash(parent);
+        }
+        return null;
+    }
+
+    /// <summary>
+    /// Checks if commit ANCESTOR is reachable from commit DESCENDANT (a commit counts as
+    /// its own ancestor). Only commits with a generation at least that of ANCESTOR are
+    /// visited.
+    /// </summary>
+    public bool IsAncestor(string ancestor, string descendant)
+    {
+        int target = GetPosition(ancestor);
+        uint minGeneration = GetGeneration(target);
+        HashSet<int> visited = new HashSet<int>();
+        Stack<int> stack = new Stack<int>();
+        stack.Push(GetPosition(descendant));
+
+        while (stack.Count > 0)
+        {
+            int position = stack.Pop();
+            if (position == target) return true;
+            if (!visited.Add(position) || GetGeneration(position) <= minGeneration) continue;
+
+            foreach (int parent in GetParents(position))
+            {
+                stack.Push(parent);
+            }
+        }
+
+        return false;
+    }
+
+    /// <summary>
+    /// Finds the latest common ancestor of two commits. Commits are visited in order of
+    /// decreasing generation, marking which side they are reachable from; the first one
+    /// reachable from both sides is a common ancestor with the highest generation.
+    /// </summary>
+    /// <returns>Hash of the latest common ancestor, or null if they share no history.</returns>
+    public string? MergeBase(string first, string second)
+    {
+        const int FROM_FIRST = 1, FROM_SECOND = 2;
+        Dictionary<int, int> flags = new Dictionary<int, int>();
+        PriorityQueue<int, uint> queue = new PriorityQueue<int, uint>(Comparer<uint>.Create((a, b) => b.CompareTo(a)));
+
+        void Mark(int position, int flag)
+        {
+            int current = flags.GetValueOrDefault(position);
+            if ((current | flag) == current) return;
+            if (current == 0) queue.Enqueue(position, GetGeneration(position));
+            flags[position] = current | flag;
+        }
+
+        Mark(GetPosition(first), FROM_FIRST);
+        Mark(GetPosition(second), FROM_SECOND);
+
+        while (queue.Count > 0)
+        {
+            int position = queue.Dequeue();
+            int flag = flags[position];
+            if (flag == (FROM_FIRST | FROM_SECOND))
+            {
+                return GetHash(position);
+            }
+
+            foreach (int parent in GetParents(position))
+            {
+                Mark(parent, flag);
+            }
+        }
+
+        return null;
+    }
+
+    public void Dispose()
+    {
+        _view?.Dispose();
+        _file?.Dispose();
+        _indexView?.Dispose();
+        _indexFile?.Dispose();
+        _lock?.Dispose();
+    }
+
+    /// <summary>
+    /// Checks if records can be appended to the file, which needs the repository lock.
+    /// A reader only takes it if no writer holds it, and only appends if nothing was
+    /// appended since the file was mapped. Otherwise its records stay in memory, along
+    /// with all later ones, as those refer to them by position.
+    /// </summary>
+    private bool CanPersist()
+    {
+        if (_persist != null)
+        {
+            return _persist.Value;
+        }
+
+        if (!RepositoryLock.IsHeld)
+        {
+            _lock = RepositoryLock.TryAcquire();
+        }
+
+        FileInfo info = new FileInfo(COMMIT_GRAPH);
+        _persist = RepositoryLock.IsHeld
+                   && (!info.Exists || info.Length < HEADER_SIZE + (long)(_mappedCount + 1) * RECORD_SIZE);
+        if (!_persist.Value)
+        {
+            _lock?.Dispose();
+            _lock = null;
+        }
+        return _persist.Value;
+    }
+
+    /// <summary>
+    /// Returns the position of a commit in the graph, adding it (and any unknown
+    /// ancestors) from the commit objects if needed.
+    /// </summary>
+    private int GetPosition(string hash)
+    {
+        if (TryGetPosition(hash, out int position))
+        {
+            return position;
+        }
+
+        // Walk back to the first ancestors the graph knows, adding commits parents-first.
+        foreach (Commit commit in ParentsFirst(Commit.Deserialize(hash), Contains, parent => Commit.Deserialize(parent)))
+        {
+            Add(commit.Hash, commit.GetParentHashRefs(), commit.Timestamp);
+        }
+
+        return _positions[hash];
+    }
+
+    private bool Contains(string hash)
+    {
+        return TryGetPosition(hash, out _);
+    }
+
+    /// <summary>
+    /// Looks a commit up among the records the index does not cover, then binary searches
+    /// the index.
+    /// </summary>
+    private bool TryGetPosition(string hash, out int position)
+    {
+        if (_positions.TryGetValue(hash, out position))
+        {
+            return true;
+        }
+
+        byte[] target = Convert.FromHexString(hash);
+        byte[] candidate = new byte[HASH_SIZE];
+        int lo = 0, hi = _indexedCount;
+        while (lo < hi)
+        {
+            int mid = (lo + hi) >>> 1;
+            position = (int)ReadIndexUInt32(INDEX_HEADER_SIZE + (long)mid * 4);
+            _view!.ReadArray(HEADER_SIZE + (long)position * RECORD_SIZE, candidate, 0, HASH_SIZE);
+            int comparison = candidate.AsSpan().SequenceCompareTo(target);
+            if (comparison == 0) return true;
+            if (comparison < 0) lo = mid + 1;
+            else hi = mid;
+        }
+
+        position = -1;
+        return false;
+    }
+
+    /// <summary>
+    /// Lists START and its ancestors that KNOWN rejects, each after its parents, by a
+    /// depth-first walk that emits a commit once its parents are done. Parents that LOAD
+    /// returns null for are skipped.
+    /// </summary>
+    private static IEnumerable<Commit> ParentsFirst(Commit start, Func<string, bool> known, Func<string, Commit?> load)
+    {
+        HashSet<string> done = new HashSet<string>();
+        Stack<(Commit, bool)> stack = new Stack<(Commit, bool)>();
+        stack.Push((start, false));
+        while (stack.Count > 0)
+        {
+            var (commit, parentsDone) = stack.Pop();
+            if (done.Contains(commit.Hash) || known(commit.Hash)) continue;
+            if (parentsDone)
+            {
+                done.Add(commit.Hash);
+                yield return commit;
+                continue;
+            }
+
+            // A parent reached again from another child is pushed again, so it is still
+            // done before that child.
+            stack.Push((commit, true));
+            foreach (string parent in commit.GetParentHashRefs())
+            {
+                if (!done.Contains(parent) && !known(parent) && load(parent) is { } parentCommit)
+                {
+                    stack.Push((parentCommit, false));
+                }
+            }
+        }
+    }
+
+    /// <summary>
+    /// Returns how many records the index covers, or 0 if it does not belong to the
+    /// mapped graph.
+    /// </summary>
+    private int ReadIndexedCount(long indexLength)
+    {
+        byte[] header = new byte[INDEX_HEADER_SIZE];
+        _indexView!.ReadArray(0, header, 0, INDEX_HEADER_SIZE);
+        int covered = (int)BinaryPrimitives.ReadUInt32BigEndian(header.AsSpan(8));
+        if (!header.AsSpan(0, 4).SequenceEqual(INDEX_MAGIC)
+            || BinaryPrimitives.ReadUInt32BigEndian(header.AsSpan(4)) != VERSION
+            || covered == 0 || covered > _mappedCount
+            || indexLength < INDEX_HEADER_SIZE + (long)covered * 4
+            || BinaryPrimitives.ReadInt64BigEndian(header.AsSpan(12)) != StatEntry.FromFile(COMMIT_GRAPH, "").Inode)
+        {
+            return 0;
+        }
+
+        byte[] lastHash = new byte[HASH_SIZE];
+        _view!.ReadArray(HEADER_SIZE + (long)(covered - 1) * RECORD_SIZE, lastHash, 0, HASH_SIZE);
+        return lastHash.AsSpan().SequenceEqual(header.AsSpan(20, HASH_SIZE)) ? covered : 0;
+    }
+
+    /// <summary>
+    /// Writes the index of all records of the graph file, which must hold them all.
+    /// </summary>
+    private void WriteIndex()
+    {
+        List<(byte[] Hash, int Position)> hashes = Enumerable.Range(0, Count)
+            .Select(position => (Convert.FromHexString(GetHash(position)), position))
+            .ToList();
+        hashes.Sort((a, b) => a.Hash.AsSpan().SequenceCompareTo(b.Hash));
+
+        Utils.WriteAtomically(COMMIT_GRAPH_INDEX, index =>
+        {
+            byte[] header = new byte[INDEX_HEADER_SIZE];
+            INDEX_MAGIC.CopyTo(header, 0);
+            BinaryPrimitives.WriteUInt32BigEndian(header.AsSpan(4), VERSION);
+            BinaryPrimitives.WriteUInt32BigEndian(header.AsSpan(8), (uint)Count);
+            BinaryPrimitives.WriteInt64BigEndian(header.AsSpan(12), StatEntry.FromFile(COMMIT_GRAPH, "").Inode);
+            if (Count > 0) Convert.FromHexString(GetHash(Count - 1)).CopyTo(header, 20);
+            index.Write(header);
+
+            byte[] position = new byte[4];
+            foreach (var (_, at) in hashes)
+            {
+                BinaryPrimitives.WriteUInt32BigEndian(position, (uint)at);
+                index.Write(position);
+            }
+        });
+
+        // This process keeps using the index it mapped, and its positions for the rest.
+        _indexWrittenCount = Count;
+    }
+
+    private uint ReadIndexUInt32(long at)
+    {
+        byte[] buffer = new byte[4];
+        _indexView!.ReadArray(at, buffer, 0, 4);
+        return BinaryPrimitives.ReadUInt32BigEndian(buffer);
+    }
+
+    private string GetHash(int position)
+    {
+        if (position >= _mappedCount)
+        {
+            return _appended[position - _mappedCount].Hash;
+        }
+
+        byte[] hash = new byte[HASH_SIZE];
+        _view!.ReadArray(HEADER_SIZE + (long)position * RECORD_SIZE, hash, 0, HASH_SIZE);
+        return Convert.ToHexString(hash).ToLower();
+    }
+
+    private uint GetGeneration(int position)
+    {
+        if (position >= _mappedCount)
+        {
+            return _appended[position - _mappedCount].Generation;
+        }
+
+        return ReadUInt32(HEADER_SIZE + (long)position * RECORD_SIZE + HASH_SIZE + 8);
+    }
+
+    private IEnumerable<int> GetParents(int position)
+    {
+        uint parent1, parent2;
+        if (position >= _mappedCount)
+        {
+            (_, parent1, parent2, _, _) = _appended[position - _mappedCount];
+        }
+        else
+        {
+            long at = HEADER_SIZE + (long)position * RECORD_SIZE + HASH_SIZE;
+            parent1 = ReadUInt32(at);
+            parent2 = ReadUInt32(at + 4);
+        }
+
+        if (parent1 != NO_PARENT) yield return (int)parent1;
+        if (parent2 != NO_PARENT) yield return (int)parent2;
+    }
+
+    private uint ReadUInt32(long at)
+    {
+        byte[] buffer = new byte[4];
+        _view!.ReadArray(at, buffer, 0, 4);
+        return BinaryPrimitives.ReadUInt32BigEndian(buffer);
+    }
+
+    private void WriteRecord((string Hash, uint Parent1, uint Parent2, uint Generation, long Timestamp) record)
+    {
+        if (!CanPersist())
+        {
+            return;
+        }
+
+        using FileStream file = new FileStream(COMMIT_GRAPH, FileMode.OpenOrCreate, FileAccess.Write, FileShare.Read);
+        if (file.Length < HEADER_SIZE)
+        {
+            file.SetLength(0);
+            WriteHeader(file);
+        }
+
+        // Overwrites a torn record left behind by a crash, if there is one.
+        file.Seek(HEADER_SIZE + (long)Count * RECORD_SIZE, SeekOrigin.Begin);
+        file.Write(EncodeRecord(record));
+        file.SetLength(file.Position);
+    }
+
+    private static byte[] EncodeRecord((string Hash, uint Parent1, uint Parent2, uint Generation, long Timestamp) record)
+    {
+        byte[] buffer = new byte[RECORD_SIZE];
+        Convert.FromHexString(record.Hash).CopyTo(buffer, 0);
+        BinaryPrimitives.WriteUInt32BigEndian(buffer.AsSpan(HASH_SIZE), record.Parent1);
+        BinaryPrimitives.WriteUInt32BigEndian(buffer.AsSpan(HASH_SIZE + 4), record.Parent2);
+        BinaryPrimitives.WriteUInt32BigEndian(buffer.AsSpan(HASH_SIZE + 8), record.Generation);
+        BinaryPrimitives.WriteInt64BigEndian(buffer.AsSpan(HASH_SIZE + 12), record.Timestamp);
+        return buffer;
+    }
+
+    private static void WriteHeader(Stream file)
+    {
+        file.Write(MAGIC);
+        byte[] version = new byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(version, VERSION);
+        file.Write(version);
+    }
+}
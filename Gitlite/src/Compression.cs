@@ -0,0 +1,255 @@
+using System.Buffers.Binary;
+using System.IO.Compression;
+
+namespace Gitlite;
+
+/// <summary>
+/// A compression codec objects can be stored with. The id is what gets written in the
+/// object header, so ids must never be reused.
+/// </summary>
+/// <param name="Id">Codec id recorded in the object header.</param>
+/// <param name="Name">Name used to pick the codec in GITLITE_COMPRESSION.</param>
+/// <param name="Compress">Wraps a destination stream in a compressing stream.</param>
+/// <param name="Decompress">Wraps a source stream in a decompressing stream.</param>
+public record Codec(
+    byte Id,
+    string Name,
+    Func<Stream, CompressionLevel, Stream> Compress,
+    Func<Stream, Stream> Decompress);
+
+/// <summary>
+/// Transparent compression of stored objects. The hash of an object is always the hash of
+/// its raw content; only the bytes on disk are compressed.
+///
+/// Stored layout: "\0GLZ" | codec id (byte) | raw length (int64, big-endian) | payload.
+/// Objects without the magic were written before compression existed and are raw.
+///
+/// The codec is picked with the GITLITE_COMPRESSION environment variable: a codec name,
+/// optionally followed by "-fast" for write-heavy workloads (e.g. "deflate-fast"), or
+/// "none". The default is "deflate".
+/// </summary>
+public static class Compression
+{
+    public const string COMPRESSION_ENV = "GITLITE_COMPRESSION";
+    public const int HEADER_SIZE = 13;
+
+    private static readonly byte[] MAGIC = "\0GLZ"u8.ToArray();
+    private const string FAST_SUFFIX = "-fast";
+
+    public static readonly Codec None = new Codec(0, "none", (stream, _) => stream, stream => stream);
+
+    public static readonly Codec Deflate = new Codec(1, "deflate",
+        (stream, level) => new ZLibStream(stream, level, true),
+        stream => new ZLibStream(stream, CompressionMode.Decompress));
+
+    public static readonly Codec Brotli = new Codec(2, "brotli",
+        (stream, level) => new BrotliStream(stream, level, true),
+        stream => new BrotliStream(stream, CompressionMode.Decompress));
+
+    private static readonly Dictionary<byte, Codec> Codecs = new[] { None, Deflate, Brotli }.ToDictionary(codec => codec.Id);
+
+    // Last parsed setting, which only changes between commands of a daemon.
+    private static (string Setting, Codec Codec, CompressionLevel Level)? _configured;
+
+    /// <summary>
+    /// Returns the codec and level new objects are written with.
+    /// </summary>
+    public static (Codec, CompressionLevel) Configured()
+    {
+        string setting = (Environment.GetEnvironmentVariable(COMPRESSION_ENV) ?? Deflate.Name).Trim().ToLower();
+        var configured = _configured;
+        if (configured?.Setting == setting)
+        {
+            return (configured.Value.Codec, configured.Value.Level);
+        }
+
+        string name = setting;
+        CompressionLevel level = CompressionLevel.Optimal;
+        if (name.EndsWith(FAST_SUFFIX))
+        {
+            name = name[..^FAST_SUFFIX.Length];
+            level = CompressionLevel.Fastest;
+        }
+
+        Codec? codec = Codecs.Values.FirstOrDefault(c => c.Name == name);
+        if (codec == null)
+        {
+            Utils.ExitWithError($"Unknown compression codec: {name}");
+        }
+
+        _configured = (setting, codec!, level);
+        return (codec!, level);
+    }
+
+    /// <summary>
+    /// Encodes the raw bytes of an object for storage with the configured codec. Content
+    /// that does not get smaller is stored uncompressed.
+    /// </summary>
+    public static byte[] Encode(byte[] raw)
+    {
+        var (codec, level) = Configured();
+        using MemoryStream stored = new MemoryStream();
+        WriteHeader(stored, codec, raw.Length);
+        using (Stream compressor = codec.Compress(stored, level))
+        {
+            compressor.Write(raw);
+        }
+
+        if (codec != None && stored.Length >= HEADER_SIZE + raw.Length)
+        {
+            stored.SetLength(0);
+            WriteHeader(stored, None, raw.Length);
+            stored.Write(raw);
+        }
+
+        return stored.ToArray();
+    }
+
+    /// <summary>
+    /// Decodes the stored bytes of an object back into its raw content.
+    /// </summary>
+    public static byte[] Decode(byte[] stored)
+    {
+        if (!HasHeader(stored))
+        {
+            return stored;
+        }
+
+        Codec codec = GetCodec(stored[4]);
+        long rawLength = BinaryPrimitives.ReadInt64BigEndian(stored.AsSpan(5));
+        byte[] raw = new byte[rawLength];
+        using MemoryStream source = new MemoryStream(stored, HEADER_SIZE, stored.Length - HEADER_SIZE);
+        using Stream decompressor = codec.Decompress(source);
+        decompressor.ReadExactly(raw);
+        return raw;
+    }
+
+    /// <summary>
+    /// Opens a stream that compresses everything written to it into DESTINATION with the
+    /// configured codec. The header is completed when the stream is disposed, so the raw
+    /// length does not need to be known in advance.
+    /// </summary>
+    /// <param name="destination">Seekable stream positioned where the object starts.</param>
+    public static Stream OpenWrite(Stream destination)
+    {
+        var (codec, level) = Configured();
+        return new EncodingStream(destination, codec, level);
+    }
+
+    /// <summary>
+    /// Wraps the stored bytes of an object in a stream of its raw content.
+    /// </summary>
+    /// <param name="stored">Seekable stream over the stored object, positioned at its start.</param>
+    public static Stream OpenRead(Stream stored)
+    {
+        long start = stored.Position;
+        byte[] header = new byte[HEADER_SIZE];
+        if (stored.ReadAtLeast(header, HEADER_SIZE, false) < HEADER_SIZE || !HasHeader(header))
+        {
+            stored.Seek(start, SeekOrigin.Begin);
+            return stored;
+        }
+
+        return GetCodec(header[4]).Decompress(stored);
+    }
+
+    /// <summary>
+    /// Reads the raw length of an object from its stored bytes without decompressing it.
+    /// </summary>
+    /// <param name="stored">Seekable stream over the stored object, positioned at its start.</param>
+    public static long ReadRawLength(Stream stored)
+    {
+        byte[] header = new byte[HEADER_SIZE];
+        if (stored.ReadAtLeast(header, HEADER_SIZE, false) < HEADER_SIZE || !HasHeader(header))
+        {
+            return stored.Length;
+        }
+
+        return BinaryPrimitives.ReadInt64BigEndian(header.AsSpan(5));
+    }
+
+    private static bool HasHeader(byte[] stored)
+    {
+        return stored.Length >= HEADER_SIZE && stored.AsSpan(0, MAGIC.Length).SequenceEqual(MAGIC);
+    }
+
+    private static Codec GetCodec(byte id)
+    {
+        if (!Codecs.TryGetValue(id, out Codec? codec))
+        {
+            throw new InvalidDataException($"Unknown compression codec id: {id}");
+        }
+
+        return codec;
+    }
+
+    private static void WriteHeader(Stream stream, Codec codec, long rawLength)
+    {
+        byte[] header = new byte[HEADER_SIZE];
+        MAGIC.CopyTo(header, 0);
+        header[4] = codec.Id;
+        BinaryPrimitives.WriteInt64BigEndian(header.AsSpan(5), rawLength);
+        stream.Write(header);
+    }
+
+    /// <summary>
+    /// Write-only stream that counts the raw bytes passing through a compressor, then
+    /// patches the raw length into the header on dispose.
+    /// </summary>
+    private class EncodingStream : Stream
+    {
+        private readonly Stream _destination;
+        private readonly Stream _compressor;
+        private readonly Codec _codec;
+        private readonly long _start;
+        private long _rawLength;
+
+        public EncodingStream(Stream destination, Codec codec, CompressionLevel level)
+        {
+            _destination = destination;
+            _codec = codec;
+            _start = destination.Position;
+            WriteHeader(destination, codec, 0);
+            _compressor = codec.Compress(destination, level);
+        }
+
+        public override bool CanRead => false;
+        public override bool CanSeek => false;
+        public override bool CanWrite => true;
+        public override long Length => _rawLength;
+
+        public override long Position
+        {
+            get => _rawLength;
+            set => throw new NotSupportedException();
+        }
+
+        public override void Write(byte[] buffer, int offset, int count)
+        {
+            _compressor.Write(buffer, offset, count);
+            _rawLength += count;
+        }
+
+        public override void Flush() => _compressor.Flush();
+        public override int Read(byte[] buffer, int offset, int count) => throw new NotSupportedException();
+        public override long Seek(long offset, SeekOrigin origin) => throw new NotSupportedException();
+        public override void SetLength(long value) => throw new NotSupportedException();
+
+        protected override void Dispose(bool disposing)
+        {
+            if (disposing)
+            {
+                if (_compressor != _destination)
+                {
+                    _compressor.Dispose();
+                }
+
+                long end = _destination.Position;
+                _destination.Seek(_start, SeekOrigin.Begin);
+                WriteHeader(_destination, _codec, _rawLength);
+                _destination.Seek(end, SeekOrigin.Begin);
+            }
+            base.Dispose(disposing);
+        }
+    }
+}
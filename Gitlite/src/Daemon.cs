@@ -0,0 +1,323 @@
+using System.Buffers.Binary;
+using System.Collections;
+using System.Net.Sockets;
+using System.Text;
+
+namespace Gitlite;
+
+/// <summary>
+/// Long-lived process that serves commands over a Unix domain socket, so scripted
+/// workloads pay the runtime startup once and reuse repository state kept in WarmState.
+/// Commands are run one at a time, in the order clients connect.
+///
+/// Protocol (all integers big-endian), one command per connection:
+///     request:  cwd | args | environment, where a string is length (uint32) + UTF-8 bytes
+///               and a list is count (uint32) + strings; the environment holds the
+///               client's GITLITE_* variables as "NAME=value"
+///     response: frames of type (byte) | length (uint32) | payload, where type is
+///               STDOUT or STDERR (payload is output bytes) or EXIT (payload is the exit
+///               code as int32, and ends the response)
+/// </summary>
+public static class Daemon
+{
+    public static string SOCKET = Path.Combine(Repository.GITLITE_DIR.ToString(), "daemon.sock");
+
+    // Set to bypass a running daemon and run the command in its own process.
+    public const string NO_DAEMON_ENV = "GITLITE_NO_DAEMON";
+
+    public const byte STDOUT = 1;
+    public const byte STDERR = 2;
+    public const byte EXIT = 3;
+
+    private const string ENV_PREFIX = "GITLITE_";
+
+    private static bool _stopping;
+
+    /// <summary>
+    /// Serves commands until a client sends "daemon stop" or the process is terminated.
+    /// </summary>
+    public static void Serve()
+    {
+        if (File.Exists(SOCKET))
+        {
+            if (TryConnect(out Socket? running))
+            {
+                running!.Dispose();
+                Utils.ExitWithError("A daemon is already running.");
+            }
+
+            // Left behind by a daemon that did not shut down cleanly.
+            File.Delete(SOCKET);
+        }
+
+        using Socket listener = new Socket(AddressFamily.Unix, SocketType.Stream, ProtocolType.Unspecified);
+        listener.Bind(new UnixDomainSocketEndPoint(SOCKET));
+        listener.Listen(16);
+        AppDomain.CurrentDomain.ProcessExit += (_, _) => File.Delete(SOCKET);
+
+        Utils.InProcess = true;
+        Console.WriteLine($"Serving commands on {SOCKET}");
+
+        try
+        {
+            while (!_stopping)
+            {
+                using Socket client = listener.Accept();
+                using NetworkStream stream = new NetworkStream(client);
+                try
+                {
+                    Handle(stream);
+                }
+                catch (IOException)
+                {
+                    // The client went away; its command already ran to completion.
+                }
+            }
+        }
+        finally
+        {
+            File.Delete(SOCKET);
+        }
+    }
+
+    /// <summary>
+    /// Sends a command to the running daemon and copies its output to this process.
+    /// </summary>
+    /// <param name="args">Command line to run.</param>
+    /// <param name="exitCode">Exit code of the command.</param>
+    /// <returns>False if no daemon is running (or GITLITE_NO_DAEMON is set), in which case
+    /// the command should run in this process.</returns>
+    public static bool TryForward(string[] args, out int exitCode)
+    {
+        exitCode = 0;
+        if (Environment.GetEnvironmentVariable(NO_DAEMON_ENV) != null || !File.Exists(SOCKET) || !TryConnect(out Socket? socket))
+        {
+            return false;
+        }
+
+        using NetworkStream stream = new NetworkStream(socket!, true);
+        List<string> environment = Environment.GetEnvironmentVariables()
+            .Cast<DictionaryEntry>()
+            .Where(e => ((string)e.Key).StartsWith(ENV_PREFIX))
+            .Select(e => $"{e.Key}={e.Value}")
+            .ToList();
+        WriteString(stream, Directory.GetCurrentDirectory());
+        WriteList(stream, args);
+        WriteList(stream, environment);
+
+        using Stream stdout = Console.OpenStandardOutput();
+        using Stream stderr = Console.OpenStandardError();
+        while (true)
+        {
+            byte[] header = new byte[5];
+            if (stream.ReadAtLeast(header, header.Length, false) < header.Length)
+            {
+                Console.Error.WriteLine("Lost connection to the daemon.");
+                exitCode = 1;
+                return true;
+            }
+
+            byte[] payload = new byte[BinaryPrimitives.ReadUInt32BigEndian(header.AsSpan(1))];
+            stream.ReadExactly(payload);
+            switch (header[0])
+            {
+                case STDOUT:
+                    stdout.Write(payload);
+                    break;
+                case STDERR:
+                    stderr.Write(payload);
+                    break;
+                case EXIT:
+                    exitCode = BinaryPrimitives.ReadInt32BigEndian(payload);
+                    return true;
+            }
+        }
+    }
+
+    /// <summary>
+    /// Runs the command of one connection with its output sent back as frames.
+    /// </summary>
+    private static void Handle(Stream stream)
+    {
+        string cwd = ReadString(stream);
+        string[] args = ReadList(stream).ToArray();
+        List<string> environment = ReadList(stream);
+
+        TextWriter stdout = Console.Out, stderr = Console.Error;
+        string previousCwd = Directory.GetCurrentDirectory();
+        List<string> previousEnvironment = SetEnvironment(environment);
+        int exitCode;
+        try
+        {
+            Console.SetOut(new StreamWriter(new FrameStream(stream, STDOUT)) { AutoFlush = true });
+            Console.SetError(new StreamWriter(new FrameStream(stream, STDERR)) { AutoFlush = true });
+            Directory.SetCurrentDirectory(cwd);
+
+            // Packs may have been rewritten by another process since the last command.
+            Pack.InvalidateAll();
+
+            if (args.SequenceEqual(new[] { "daemon", "stop" }))
+            {
+                _stopping = true;
+                exitCode = 0;
+            }
+            else if (args.Length > 0 && args[0] is "daemon" or "init" or "batch" or "fsmonitor")
+            {
+                Console.WriteLine($"Cannot run {args[0]} in the daemon.");
+                exitCode = -1;
+            }
+            else
+            {
+                exitCode = Program.RunInProcess(args);
+            }
+            WarmState.ReportStats();
+        }
+        catch (Exception e) when (e is not IOException)
+        {
+            Console.Error.WriteLine(e);
+            exitCode = 1;
+        }
+        finally
+        {
+            Console.SetOut(stdout);
+            Console.SetError(stderr);
+            Directory.SetCurrentDirectory(previousCwd);
+            SetEnvironment(previousEnvironment);
+        }
+
+        byte[] code = new byte[4];
+        BinaryPrimitives.WriteInt32BigEndian(code, exitCode);
+        WriteFrame(stream, EXIT, code);
+    }
+
+    /// <summary>
+    /// Replaces the GITLITE_* environment variables of this process.
+    /// </summary>
+    /// <returns>The variables that were replaced, to restore them afterwards.</returns>
+    private static List<string> SetEnvironment(List<string> environment)
+    {
+        List<string> previous = new List<string>();
+        foreach (DictionaryEntry e in Environment.GetEnvironmentVariables())
+        {
+            string name = (string)e.Key;
+            if (name.StartsWith(ENV_PREFIX))
+            {
+                previous.Add($"{name}={e.Value}");
+                Environment.SetEnvironmentVariable(name, null);
+            }
+        }
+
+        foreach (string variable in environment)
+        {
+            int split = variable.IndexOf('=');
+            Environment.SetEnvironmentVariable(variable[..split], variable[(split + 1)..]);
+        }
+
+        return previous;
+    }
+
+    private static bool TryConnect(out Socket? socket)
+    {
+        socket = new Socket(AddressFamily.Unix, SocketType.Stream, ProtocolType.Unspecified);
+        try
+        {
+            socket.Connect(new UnixDomainSocketEndPoint(SOCKET));
+            return true;
+        }
+        catch (SocketException)
+        {
+            socket.Dispose();
+            socket = null;
+            return false;
+        }
+    }
+
+    private static void WriteFrame(Stream stream, byte type, ReadOnlySpan<byte> payload)
+    {
+        byte[] header = new byte[5];
+        header[0] = type;
+        BinaryPrimitives.WriteUInt32BigEndian(header.AsSpan(1), (uint)payload.Length);
+        stream.Write(header);
+        stream.Write(payload);
+    }
+
+    private static void WriteString(Stream stream, string value)
+    {
+        byte[] bytes = Encoding.UTF8.GetBytes(value);
+        byte[] length = new byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(length, (uint)bytes.Length);
+        stream.Write(length);
+        stream.Write(bytes);
+    }
+
+    private static void WriteList(Stream stream, IReadOnlyCollection<string> values)
+    {
+        byte[] count = new byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(count, (uint)values.Count);
+        stream.Write(count);
+        foreach (string value in values)
+        {
+            WriteString(stream, value);
+        }
+    }
+
+    private static string ReadString(Stream stream)
+    {
+        byte[] length = new byte[4];
+        stream.ReadExactly(length);
+        byte[] bytes = new byte[BinaryPrimitives.ReadUInt32BigEndian(length)];
+        stream.ReadExactly(bytes);
+        return Encoding.UTF8.GetString(bytes);
+    }
+
+    private static List<string> ReadList(Stream stream)
+    {
+        byte[] count = new byte[4];
+        stream.ReadExactly(count);
+        List<string> values = new List<string>();
+        for (uint i = BinaryPrimitives.ReadUInt32BigEndian(count); i > 0; i--)
+        {
+            values.Add(ReadString(stream));
+        }
+        return values;
+    }
+
+    /// <summary>
+    /// Write-only stream that sends everything written to it as frames of one type.
+    /// </summary>
+    private class FrameStream : Stream
+    {
+        private readonly Stream _connection;
+        private readonly byte _type;
+
+        public FrameStream(Stream connection, byte type)
+        {
+            _connection = connection;
+            _type = type;
+        }
+
+        public override bool CanRead => false;
+        public override bool CanSeek => false;
+        public override bool CanWrite => true;
+        public override long Length => throw new NotSupportedException();
+
+        public override long Position
+        {
+            get => throw new NotSupportedException();
+            set => throw new NotSupportedException();
+        }
+
+        public override void Write(byte[] buffer, int offset, int count)
+        {
+            if (count > 0)
+            {
+                WriteFrame(_connection, _type, buffer.AsSpan(offset, count));
+            }
+        }
+
+        public override void Flush() => _connection.Flush();
+        public override int Read(byte[] buffer, int offset, int count) => throw new NotSupportedException();
+        public override long Seek(long offset, SeekOrigin origin) => throw new NotSupportedException();
+        public override void SetLength(long value) => throw new NotSupportedException();
+    }
+}
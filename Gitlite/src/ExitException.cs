@@ -0,0 +1,15 @@
+namespace Gitlite;
+
+/// <summary>
+/// Thrown by Utils.ExitWithError instead of ending the process when commands run inside a
+/// long-lived process (daemon or batch), so only the current command is aborted.
+/// </summary>
+public class ExitException : Exception
+{
+    public int ExitCode { get; }
+
+    public ExitException(int exitCode) : base($"Command exited with code {exitCode}.")
+    {
+        ExitCode = exitCode;
+    }
+}
@@ -0,0 +1,241 @@
+using System.Text;
+
+namespace Gitlite;
+
+/// <summary>
+/// Opt-in file-system monitor, so that commands learn which paths changed since they last
+/// looked instead of walking the whole working directory. `Gitlite fsmonitor` watches the
+/// working directory (through inotify on Linux) and appends every path created, deleted,
+/// renamed or written to a journal. WorkingTree keeps a snapshot of the file list along
+/// with the journal position it is current to, and only re-examines the paths journaled
+/// since; files not journaled since a command last checked them are not even stat'ed.
+///
+/// A command first syncs with the monitor: it creates a cookie file and waits until the
+/// monitor journals it, so every change made before that is in the journal too. Without a
+/// running monitor, when the sync times out, or after the watch queue overflowed, the
+/// working directory is scanned in full.
+///
+/// Journal layout, one line each:
+///     "GLFM [instance id]"
+///     records: 'c' + changed path ('/' separated), 's' + cookie name, or 'o' (overflow)
+/// A new instance id, written whenever a monitor starts or its journal gets too big,
+/// invalidates every snapshot.
+/// </summary>
+public static class FsMonitor
+{
+    public static string JOURNAL = Path.Combine(Repository.GITLITE_DIR.ToString(), "fsmonitor");
+    public static string LOCK = Path.Combine(Repository.GITLITE_DIR.ToString(), "fsmonitor.lock");
+
+    private const string MAGIC = "GLFM";
+    private const string COOKIE_PREFIX = "fsmonitor-cookie.";
+    private const long MAX_JOURNAL_SIZE = 16 * 1024 * 1024;
+    private static readonly TimeSpan SYNC_TIMEOUT = TimeSpan.FromSeconds(2);
+    private static readonly TimeSpan MAX_POLL_DELAY = TimeSpan.FromMilliseconds(20);
+
+    private static FileStream? _journal;
+    private static string? _lastRecord;
+
+    /// <summary>
+    /// Watches the working directory until the process is terminated.
+    /// </summary>
+    public static void Run()
+    {
+        // Held for as long as the monitor runs, so commands know whether to trust the
+        // journal, even after a crash.
+        FileStream monitorLock;
+        try
+        {
+            monitorLock = new FileStream(LOCK, FileMode.OpenOrCreate, FileAccess.ReadWrite, FileShare.None);
+        }
+        catch (IOException)
+        {
+            Utils.ExitWithError("A file-system monitor is already running.");
+            return;
+        }
+
+        using (monitorLock)
+        using (_journal = new FileStream(JOURNAL, FileMode.Create, FileAccess.Write, FileShare.ReadWrite | FileShare.Delete))
+        using (FileSystemWatcher watcher = new FileSystemWatcher(Repository.CWD.FullName))
+        {
+            StartInstance();
+            watcher.IncludeSubdirectories = true;
+            watcher.NotifyFilter = NotifyFilters.FileName | NotifyFilters.DirectoryName | NotifyFilters.LastWrite
+                                   | NotifyFilters.Size;
+            watcher.InternalBufferSize = 64 * 1024;
+            watcher.Created += (_, e) => Record(e.FullPath);
+            watcher.Deleted += (_, e) => Record(e.FullPath);
+            // Writes to files; a directory only changes with its entries, which are
+            // journaled by name already.
+            watcher.Changed += (_, e) =>
+            {
+                if (!Directory.Exists(e.FullPath)) Record(e.FullPath);
+            };
+            watcher.Renamed += (_, e) =>
+            {
+                Record(e.OldFullPath);
+                Record(e.FullPath);
+            };
+            // Events were lost (e.g. the queue overflowed), so nothing can be trusted.
+            watcher.Error += (_, _) => Append("o");
+            watcher.EnableRaisingEvents = true;
+
+            Console.WriteLine($"Watching {Repository.CWD}");
+            Thread.Sleep(Timeout.Infinite);
+        }
+    }
+
+    /// <summary>
+    /// Checks whether a monitor is running for this repository.
+    /// </summary>
+    public static bool IsRunning()
+    {
+        try
+        {
+            // A shared lock, so commands checking at the same time don't see each other.
+            using FileStream probe = new FileStream(LOCK, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+            return false;
+        }
+        catch (FileNotFoundException)
+        {
+            return false;
+        }
+        catch (IOException)
+        {
+            return true;
+        }
+    }
+
+    /// <summary>
+    /// Syncs with the monitor and returns the paths changed since a journal position.
+    /// </summary>
+    /// <param name="instance">Instance id the position belongs to, if any.</param>
+    /// <param name="position">Journal position the caller is current to.</param>
+    /// <returns>Null if no monitor could be synced. Otherwise the instance id and the
+    /// position the journal was read to, and the changed paths, which are null if
+    /// everything must be rescanned.</returns>
+    public static (string, long, HashSet<string>?)? ReadChanges(string? instance, long position)
+    {
+        using Trace.TraceSpan? span = Trace.Span("FsMonitor.ReadChanges", "scan");
+        string cookie = COOKIE_PREFIX + Guid.NewGuid().ToString("N");
+        string cookiePath = Path.Combine(Repository.GITLITE_DIR.ToString(), cookie);
+        File.WriteAllBytes(cookiePath, Array.Empty<byte>());
+        try
+        {
+            DateTime deadline = DateTime.UtcNow + SYNC_TIMEOUT;
+            TimeSpan delay = TimeSpan.FromMilliseconds(1);
+            while (true)
+            {
+                var (changes, synced) = ReadJournal(instance, position, cookie);
+                if (synced)
+                {
+                    return changes;
+                }
+                if (DateTime.UtcNow >= deadline || !IsRunning())
+                {
+                    return null;
+                }
+
+                Thread.Sleep(delay);
+                delay = TimeSpan.FromTicks(Math.Min(delay.Ticks * 2, MAX_POLL_DELAY.Ticks));
+            }
+        }
+        finally
+        {
+            File.Delete(cookiePath);
+        }
+    }
+
+    /// <summary>
+    /// Reads the journal records after a position, and whether COOKIE is among them.
+    /// </summary>
+    private static ((string, long, HashSet<string>?), bool) ReadJournal(string? instance, long position, string cookie)
+    {
+        Trace.FileOpened();
+        using (FileStream file = new FileStream(JOURNAL, FileMode.Open, FileAccess.Read, FileShare.ReadWrite | FileShare.Delete))
+        {
+            // Only the header and the records after the position are read.
+            byte[] header = new byte[64];
+            int headerLength = Array.IndexOf(header, (byte)'\n', 0, file.ReadAtLeast(header, header.Length, false)) + 1;
+            string current = Encoding.UTF8.GetString(header, 0, Math.Max(headerLength - 1, 0));
+            if (headerLength == 0 || !current.StartsWith(MAGIC + " "))
+            {
+                return ((current, 0, null), false);
+            }
+            current = current[(MAGIC.Length + 1)..];
+
+            bool sameInstance = current == instance && position >= headerLength && position <= file.Length;
+            long start = sameInstance ? position : headerLength;
+            file.Seek(start, SeekOrigin.Begin);
+            byte[] journal = new byte[file.Length - start];
+            journal = journal[..file.ReadAtLeast(journal, journal.Length, false)];
+
+            HashSet<string>? paths = sameInstance ? new HashSet<string>() : null;
+            bool synced = false;
+            int end = 0;
+            for (int newline; (newline = Array.IndexOf(journal, (byte)'\n', end)) >= 0; end = newline + 1)
+            {
+                string record = Encoding.UTF8.GetString(journal, end, newline - end);
+                if (record.StartsWith('c'))
+                {
+                    paths?.Add(record[1..]);
+                }
+                else if (record.StartsWith('s'))
+                {
+                    synced |= record[1..] == cookie;
+                }
+                else
+                {
+                    paths = null;
+                }
+            }
+
+            return ((current, start + end, paths), synced);
+        }
+    }
+
+    private static void Record(string fullPath)
+    {
+        string name = Path.GetRelativePath(Repository.CWD.FullName, fullPath).Replace(Path.DirectorySeparatorChar, '/');
+        string gitliteDir = Repository.GITLITE_DIR.Name;
+        if (name == gitliteDir || name.StartsWith(gitliteDir + "/"))
+        {
+            // Of the repository's own files, only cookies are of interest.
+            string file = Path.GetFileName(name);
+            if (file.StartsWith(COOKIE_PREFIX))
+            {
+                Append("s" + file);
+            }
+            return;
+        }
+
+        // A name with a newline would break the journal.
+        Append(name.Contains('\n') ? "o" : "c" + name);
+    }
+
+    private static void Append(string record)
+    {
+        lock (_journal!)
+        {
+            // A file being written raises an event per write; one record is enough.
+            if (record == _lastRecord)
+            {
+                return;
+            }
+            _lastRecord = record;
+            
+            if (_journal.Length > MAX_JOURNAL_SIZE)
+            {
+                StartInstance();
+            }
+            _journal.Write(Encoding.UTF8.GetBytes(record + "\n"));
+            _journal.Flush();
+        }
+    }
+
+    private static void StartInstance()
+    {
+        _journal!.SetLength(0);
+        _journal.Write(Encoding.UTF8.GetBytes($"{MAGIC} {Guid.NewGuid():N}\n"));
+        _journal.Flush();
+    }
+}
@@ -0,0 +1,147 @@
+using System.Globalization;
+
+namespace Gitlite;
+
+/// <summary>
+/// Removes loose objects that nothing refers to anymore, e.g. blobs added and then
+/// replaced before being committed, or the commits of a removed branch.
+///
+/// Everything reachable from the branches, HEAD and the staging area is marked first,
+/// following commit parents, trees, blobs and the chunks of chunked blobs. Marks are kept in a set of 128-bit hash
+/// prefixes rather than strings, and shared subtrees are only visited once. Unmarked loose
+/// objects are then deleted if they are older than the grace period, so objects that a
+/// concurrent command just wrote but did not reference yet survive. Reachable objects and
+/// packs are never touched, so commands reading the repository can run alongside.
+/// </summary>
+public static class GarbageCollector
+{
+    public static readonly TimeSpan DEFAULT_GRACE_PERIOD = TimeSpan.FromDays(14);
+
+    /// <summary>
+    /// Marks every object reachable from the branches, HEAD and the staging area.
+    /// </summary>
+    /// <returns>The set of marked objects.</returns>
+    public static HashSet<UInt128> Mark()
+    {
+        HashSet<UInt128> marked = new HashSet<UInt128>();
+        Stack<string> commits = new Stack<string>();
+        foreach (string branch in Branch.GetExistingBranches())
+        {
+            commits.Push(Branch.ReadRef(Path.Combine(Repository.BRANCHES.ToString(), branch)));
+        }
+        commits.Push(Commit.GetHeadCommitId());
+
+        while (commits.Count > 0)
+        {
+            string hash = commits.Pop();
+            if (!marked.Add(Key(hash)))
+            {
+                continue;
+            }
+
+            Commit commit = Commit.Deserialize(hash);
+            commit.GetParentHashRefs().ForEach(commits.Push);
+            if (commit.RootTree != null)
+            {
+                MarkTree(commit.RootTree, marked);
+            }
+            else
+            {
+                // Made before trees existed.
+                foreach (string blob in commit.FileMapping.Values)
+                {
+                    MarkBlob(blob, marked);
+                }
+            }
+        }
+
+        foreach (string blob in StagingArea.GetDeserializedStagingArea().GetStagingForAddition().Values)
+        {
+            MarkBlob(blob, marked);
+        }
+
+        return marked;
+    }
+
+    /// <summary>
+    /// Deletes the loose objects of an object directory that are not marked and were last
+    /// written before the grace period, along with leftover temporary files of interrupted
+    /// writes.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="marked">Reachable objects, from Mark.</param>
+    /// <param name="gracePeriod">Minimum age of a deleted file.</param>
+    /// <returns>The number of deleted objects, the bytes freed, and the number of
+    /// unreachable objects kept because they are too recent.</returns>
+    public static (int, long, int) Prune(DirectoryInfo objectsDir, HashSet<UInt128> marked, TimeSpan gracePeriod)
+    {
+        DateTime cutoff = DateTime.UtcNow - gracePeriod;
+        int pruned = 0, kept = 0;
+        long freed = 0;
+
+        // Temporary files are deleted too, once they are old enough not to be in use.
+        List<(string, string)> files = ObjectStore.EnumerateLoose(objectsDir).ToList();
+        files.AddRange(ObjectStore.EnumerateTemporary(objectsDir).Select(path => ("", path)));
+
+        foreach (var (name, path) in files)
+        {
+            bool isObject = ObjectStore.IsHash(name);
+            if (isObject && marked.Contains(Key(name)))
+            {
+                continue;
+            }
+
+            FileInfo file = new FileInfo(path);
+            if (!file.Exists || file.LastWriteTimeUtc >= cutoff)
+            {
+                if (isObject) kept++;
+                continue;
+            }
+
+            long size = file.Length;
+            file.Delete();
+            freed += size;
+            if (isObject) pruned++;
+        }
+
+        return (pruned, freed, kept);
+    }
+
+    private static void MarkTree(string hash, HashSet<UInt128> marked)
+    {
+        if (!marked.Add(Key(hash)))
+        {
+            return;
+        }
+
+        foreach (TreeEntry entry in Tree.Read(hash).Entries)
+        {
+            if (entry.IsTree) MarkTree(entry.Hash, marked);
+            else MarkBlob(entry.Hash, marked);
+        }
+    }
+
+    private static void MarkBlob(string hash, HashSet<UInt128> marked)
+    {
+        if (!marked.Add(Key(hash)) || !Repository.CHUNKS_DIR.Exists)
+        {
+            return;
+        }
+
+        // A chunked blob keeps its chunks.
+        using Stream stored = ObjectStore.OpenStored(Repository.BLOBS_DIR, hash);
+        if (ChunkedBlob.IsManifest(stored))
+        {
+            ChunkedBlob.ReadChunkHashes(stored).ForEach(chunk => marked.Add(Key(chunk)));
+        }
+    }
+
+    /// <summary>
+    /// Returns the first 128 bits of a hash, which identify an object well enough for
+    /// marking: a collision could only keep an unreachable object, never delete one.
+    /// </summary>
+    private static UInt128 Key(string hash)
+    {
+        return UInt128.Parse(hash.AsSpan(0, 32), NumberStyles.AllowHexSpecifier);
+    }
+}
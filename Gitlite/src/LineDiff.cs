@@ -0,0 +1,340 @@
+namespace Gitlite;
+
+/// <summary>
+/// A region where two sequences of lines differ: lines [OldStart, OldEnd) of the old
+/// sequence were replaced by lines [NewStart, NewEnd) of the new one. Either range may be
+/// empty (a pure insertion or deletion).
+/// </summary>
+public record Hunk(int OldStart, int OldEnd, int NewStart, int NewEnd);
+
+/// <summary>
+/// Line-based diff and three-way merge of text.
+///
+/// The diff is Myers' O(ND) algorithm in its linear-space form: the "middle snake" of the
+/// shortest edit script is found by searching forward and backward at once, and the two
+/// halves around it are solved recursively. Lines are interned to integers first, so the
+/// search compares ints instead of strings.
+///
+/// Long ranges are first split the way histogram diff does: on the common line that occurs
+/// the fewest times, which is cheap to find and usually lines up the structure of the two
+/// versions (function headers, section titles), leaving Myers small pieces to solve.
+/// </summary>
+public static class LineDiff
+{
+    public const string OURS_MARKER = "<<<<<<<";
+    public const string SEPARATOR_MARKER = "=======";
+    public const string THEIRS_MARKER = ">>>>>>>";
+
+    // Ranges with more lines than this (both sides together) are split on rare lines.
+    private const int HISTOGRAM_THRESHOLD = 1000;
+
+    // Lines occurring more often than this are too common to split on.
+    private const int MAX_OCCURRENCES = 64;
+
+    /// <summary>
+    /// Splits text into lines, each keeping its '\n' so joining them gives back the text.
+    /// </summary>
+    public static List<string> SplitLines(string text)
+    {
+        List<string> lines = new List<string>();
+        int start = 0;
+        while (start < text.Length)
+        {
+            int end = text.IndexOf('\n', start);
+            end = end < 0 ? text.Length : end + 1;
+            lines.Add(text[start..end]);
+            start = end;
+        }
+        return lines;
+    }
+
+    /// <summary>
+    /// Computes the regions where OLDLINES and NEWLINES differ.
+    /// </summary>
+    /// <returns>Hunks in order, covering every difference. They have the fewest changed lines
+    /// possible, except where a long range was split on a rare line.</returns>
+    public static List<Hunk> Diff(IReadOnlyList<string> oldLines, IReadOnlyList<string> newLines)
+    {
+        Dictionary<string, int> ids = new Dictionary<string, int>();
+        return Diff(Intern(oldLines, ids), Intern(newLines, ids));
+    }
+
+    /// <summary>
+    /// Computes the regions where two sequences of interned lines differ.
+    /// </summary>
+    /// <param name="oldLines">Ids of the old lines; equal lines have equal ids.</param>
+    /// <param name="newLines">Ids of the new lines.</param>
+    public static List<Hunk> Diff(int[] oldLines, int[] newLines)
+    {
+        List<Hunk> hunks = new List<Hunk>();
+        int oldPos = 0, newPos = 0;
+        foreach (var (oldMatch, newMatch) in Matches(oldLines, newLines).Append((oldLines.Length, newLines.Length)))
+        {
+            if (oldMatch > oldPos || newMatch > newPos)
+            {
+                hunks.Add(new Hunk(oldPos, oldMatch, newPos, newMatch));
+            }
+            oldPos = oldMatch + 1;
+            newPos = newMatch + 1;
+        }
+        return hunks;
+    }
+
+    /// <summary>
+    /// Merges the changes OURS and THEIRS made to BASE. Regions changed on one side only
+    /// take that side; regions changed on both sides in different ways become a conflict
+    /// with both versions between markers.
+    /// </summary>
+    /// <param name="baseLines">Lines of the common ancestor.</param>
+    /// <param name="ours">Lines of the current version.</param>
+    /// <param name="theirs">Lines of the version merged in.</param>
+    /// <param name="oursLabel">Label written after the ours marker.</param>
+    /// <param name="theirsLabel">Label written after the theirs marker.</param>
+    /// <param name="conflicts">Number of conflicting regions.</param>
+    /// <returns>Merged text.</returns>
+    public static string Merge(IReadOnlyList<string> baseLines, IReadOnlyList<string> ours, IReadOnlyList<string> theirs,
+        string oursLabel, string theirsLabel, out int conflicts)
+    {
+        // For every base line, the line matched to it on each side, or -1.
+        int[] oursMatch = MatchMap(baseLines, ours);
+        int[] theirsMatch = MatchMap(baseLines, theirs);
+
+        List<string> merged = new List<string>();
+        conflicts = 0;
+        int b = 0, o = 0, t = 0;
+        while (b < baseLines.Count || o < ours.Count || t < theirs.Count)
+        {
+            // Lines unchanged on both sides are copied as they are.
+            if (b < baseLines.Count && oursMatch[b] == o && theirsMatch[b] == t)
+            {
+                merged.Add(baseLines[b]);
+                b++; o++; t++;
+                continue;
+            }
+
+            // Otherwise the changed region runs up to the next base line both sides kept.
+            int nextB = b;
+            while (nextB < baseLines.Count && (oursMatch[nextB] < 0 || theirsMatch[nextB] < 0))
+            {
+                nextB++;
+            }
+            int nextO = nextB < baseLines.Count ? oursMatch[nextB] : ours.Count;
+            int nextT = nextB < baseLines.Count ? theirsMatch[nextB] : theirs.Count;
+
+            List<string> baseRegion = Slice(baseLines, b, nextB);
+            List<string> oursRegion = Slice(ours, o, nextO);
+            List<string> theirsRegion = Slice(theirs, t, nextT);
+            if (oursRegion.SequenceEqual(baseRegion) || oursRegion.SequenceEqual(theirsRegion))
+            {
+                merged.AddRange(theirsRegion);
+            }
+            else if (theirsRegion.SequenceEqual(baseRegion))
+            {
+                merged.AddRange(oursRegion);
+            }
+            else
+            {
+                conflicts++;
+                merged.Add($"{OURS_MARKER} {oursLabel}\n");
+                AddTerminated(merged, oursRegion);
+                merged.Add($"{SEPARATOR_MARKER}\n");
+                AddTerminated(merged, theirsRegion);
+                merged.Add($"{THEIRS_MARKER} {theirsLabel}\n");
+            }
+
+            b = nextB; o = nextO; t = nextT;
+        }
+
+        return string.Concat(merged);
+    }
+
+    /// <summary>
+    /// Adds lines to a conflict, making sure the last one ends with a newline so the next
+    /// marker starts on its own line.
+    /// </summary>
+    private static void AddTerminated(List<string> merged, List<string> lines)
+    {
+        merged.AddRange(lines);
+        if (lines.Count > 0 && !lines[^1].EndsWith('\n'))
+        {
+            merged[^1] += "\n";
+        }
+    }
+
+    private static List<string> Slice(IReadOnlyList<string> lines, int start, int end)
+    {
+        List<string> slice = new List<string>(end - start);
+        for (int i = start; i < end; i++) slice.Add(lines[i]);
+        return slice;
+    }
+
+    private static int[] MatchMap(IReadOnlyList<string> baseLines, IReadOnlyList<string> other)
+    {
+        int[] map = Enumerable.Repeat(-1, baseLines.Count).ToArray();
+        foreach (var (baseLine, otherLine) in Matches(baseLines, other))
+        {
+            map[baseLine] = otherLine;
+        }
+        return map;
+    }
+
+    /// <summary>
+    /// Returns the pairs of matching lines of a common subsequence, in order. It is a longest
+    /// one unless a long range was split on a rare line.
+    /// </summary>
+    private static List<(int, int)> Matches(IReadOnlyList<string> oldLines, IReadOnlyList<string> newLines)
+    {
+        Dictionary<string, int> ids = new Dictionary<string, int>();
+        return Matches(Intern(oldLines, ids), Intern(newLines, ids));
+    }
+
+    private static List<(int, int)> Matches(int[] a, int[] b)
+    {
+        List<(int, int)> matches = new List<(int, int)>();
+        CommonSubsequence(a, 0, a.Length, b, 0, b.Length, matches);
+        return matches;
+    }
+
+    private static int[] Intern(IReadOnlyList<string> lines, Dictionary<string, int> ids)
+    {
+        return lines.Select(line => ids.TryGetValue(line, out int id) ? id : ids[line] = ids.Count).ToArray();
+    }
+
+    private static void CommonSubsequence(int[] a, int aStart, int aEnd, int[] b, int bStart, int bEnd, List<(int, int)> matches)
+    {
+        while (aStart < aEnd && bStart < bEnd && a[aStart] == b[bStart])
+        {
+            matches.Add((aStart++, bStart++));
+        }
+
+        int suffix = 0;
+        while (aStart < aEnd - suffix && bStart < bEnd - suffix && a[aEnd - 1 - suffix] == b[bEnd - 1 - suffix])
+        {
+            suffix++;
+        }
+        aEnd -= suffix;
+        bEnd -= suffix;
+
+        // With the common ends trimmed, the edit script has at least two edits and the
+        // middle snake splits it into two strictly smaller problems. So does a rare line,
+        // as its snake is at least one line long.
+        if (aStart < aEnd && bStart < bEnd)
+        {
+            bool isLong = (aEnd - aStart) + (bEnd - bStart) > HISTOGRAM_THRESHOLD;
+            var (x, y, u, v) = isLong && RareLineSnake(a, aStart, aEnd, b, bStart, bEnd) is { } rare
+                ? rare
+                : MiddleSnake(a, aStart, aEnd, b, bStart, bEnd);
+            CommonSubsequence(a, aStart, x, b, bStart, y, matches);
+            for (int i = 0; i < u - x; i++)
+            {
+                matches.Add((x + i, y + i));
+            }
+            CommonSubsequence(a, u, aEnd, b, v, bEnd, matches);
+        }
+
+        for (int i = 0; i < suffix; i++)
+        {
+            matches.Add((aEnd + i, bEnd + i));
+        }
+    }
+
+    /// <summary>
+    /// Finds the line common to both ranges that occurs the fewest times in the old one, and
+    /// extends it into the longest run of matching lines around it.
+    /// </summary>
+    /// <returns>Start (x, y) and end (u, v) of the run, or null if no line is rare enough.</returns>
+    private static (int, int, int, int)? RareLineSnake(int[] a, int aStart, int aEnd, int[] b, int bStart, int bEnd)
+    {
+        Dictionary<int, (int Count, int First)> occurrences = new Dictionary<int, (int, int)>();
+        for (int i = aStart; i < aEnd; i++)
+        {
+            occurrences[a[i]] = occurrences.TryGetValue(a[i], out var seen) ? (seen.Count + 1, seen.First) : (1, i);
+        }
+
+        int bestCount = MAX_OCCURRENCES + 1, bestA = -1, bestB = -1;
+        for (int j = bStart; j < bEnd && bestCount > 1; j++)
+        {
+            if (occurrences.TryGetValue(b[j], out var found) && found.Count < bestCount)
+            {
+                (bestCount, bestA, bestB) = (found.Count, found.First, j);
+            }
+        }
+
+        if (bestA < 0)
+        {
+            return null;
+        }
+
+        int x = bestA, y = bestB, u = bestA + 1, v = bestB + 1;
+        while (x > aStart && y > bStart && a[x - 1] == b[y - 1])
+        {
+            x--; y--;
+        }
+        while (u < aEnd && v < bEnd && a[u] == b[v])
+        {
+            u++; v++;
+        }
+        return (x, y, u, v);
+    }
+
+    /// <summary>
+    /// Finds the middle snake of the shortest edit script between two ranges.
+    /// </summary>
+    /// <returns>Start (x, y) and end (u, v) of the snake, as absolute line indexes.</returns>
+    private static (int, int, int, int) MiddleSnake(int[] a, int aStart, int aEnd, int[] b, int bStart, int bEnd)
+    {
+        int n = aEnd - aStart, m = bEnd - bStart;
+        int delta = n - m;
+        bool odd = (delta & 1) != 0;
+        int max = (n + m + 1) / 2;
+        int offset = max + 1;
+
+        // Furthest x reached on each diagonal k = x - y, forward from the start and
+        // backward from the end (in the reversed ranges).
+        int[] forward = new int[2 * max + 3];
+        int[] backward = new int[2 * max + 3];
+
+        for (int d = 0; d <= max; d++)
+        {
+            for (int k = -d; k <= d; k += 2)
+            {
+                int x = k == -d || (k != d && forward[offset + k - 1] < forward[offset + k + 1])
+                    ? forward[offset + k + 1]
+                    : forward[offset + k - 1] + 1;
+                int y = x - k;
+                int startX = x, startY = y;
+                while (x < n && y < m && a[aStart + x] == b[bStart + y])
+                {
+                    x++; y++;
+                }
+                forward[offset + k] = x;
+
+                if (odd && delta - k >= -(d - 1) && delta - k <= d - 1 && x + backward[offset + delta - k] >= n)
+                {
+                    return (aStart + startX, bStart + startY, aStart + x, bStart + y);
+                }
+            }
+
+            for (int k = -d; k <= d; k += 2)
+            {
+                int x = k == -d || (k != d && backward[offset + k - 1] < backward[offset + k + 1])
+                    ? backward[offset + k + 1]
+                    : backward[offset + k - 1] + 1;
+                int y = x - k;
+                int startX = x, startY = y;
+                while (x < n && y < m && a[aEnd - 1 - x] == b[bEnd - 1 - y])
+                {
+                    x++; y++;
+                }
+                backward[offset + k] = x;
+
+                if (!odd && delta - k >= -d && delta - k <= d && x + forward[offset + delta - k] >= n)
+                {
+                    return (aStart + n - x, bStart + m - y, aStart + n - startX, bStart + m - startY);
+                }
+            }
+        }
+
+        throw new InvalidOperationException("No middle snake found.");
+    }
+}
@@ -0,0 +1,104 @@
+namespace Gitlite;
+
+/// <summary>
+/// Thread-safe cache holding at most a fixed number of entries, evicting the least
+/// recently used one when full. Hits, misses and evictions are counted for profiling.
+/// </summary>
+/// <typeparam name="TKey">Type of the keys.</typeparam>
+/// <typeparam name="TValue">Type of the cached values.</typeparam>
+public class LruCache<TKey, TValue> where TKey : notnull
+{
+    public int Capacity { get; }
+    public long Hits { get; private set; }
+    public long Misses { get; private set; }
+    public long Evictions { get; private set; }
+
+    private readonly Dictionary<TKey, LinkedListNode<(TKey Key, TValue Value)>> _entries;
+
+    // Most recently used first.
+    private readonly LinkedList<(TKey Key, TValue Value)> _order = new LinkedList<(TKey, TValue)>();
+
+    public LruCache(int capacity)
+    {
+        Capacity = capacity;
+        _entries = new Dictionary<TKey, LinkedListNode<(TKey, TValue)>>(capacity);
+    }
+
+    public int Count
+    {
+        get
+        {
+            lock (_entries)
+            {
+                return _entries.Count;
+            }
+        }
+    }
+
+    /// <summary>
+    /// Looks up a value and marks it as the most recently used.
+    /// </summary>
+    /// <returns>True on a hit.</returns>
+    public bool TryGet(TKey key, out TValue value)
+    {
+        lock (_entries)
+        {
+            if (_entries.TryGetValue(key, out var node))
+            {
+                _order.Remove(node);
+                _order.AddFirst(node);
+                Hits++;
+                value = node.Value.Value;
+                return true;
+            }
+
+            Misses++;
+            value = default!;
+            return false;
+        }
+    }
+
+    /// <summary>
+    /// Adds or replaces a value, evicting the least recently used entry if the cache is full.
+    /// </summary>
+    public void Set(TKey key, TValue value)
+    {
+        lock (_entries)
+        {
+            if (_entries.TryGetValue(key, out var existing))
+            {
+                _order.Remove(existing);
+            }
+            else if (_entries.Count >= Capacity)
+            {
+                _entries.Remove(_order.Last!.Value.Key);
+                _order.RemoveLast();
+                Evictions++;
+            }
+
+            _entries[key] = _order.AddFirst((key, value));
+        }
+    }
+
+    /// <summary>
+    /// Removes a value, e.g. because what it was loaded from was written.
+    /// </summary>
+    public void Remove(TKey key)
+    {
+        lock (_entries)
+        {
+            if (_entries.Remove(key, out var node))
+            {
+                _order.Remove(node);
+            }
+        }
+    }
+
+    public override string ToString()
+    {
+        lock (_entries)
+        {
+            return $"{_entries.Count}/{Capacity} entries, {Hits} hits, {Misses} misses, {Evictions} evictions";
+        }
+    }
+}
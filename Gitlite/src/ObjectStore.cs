@@ -0,0 +1,304 @@
+using System.Text.RegularExpressions;
+
+namespace Gitlite;
+
+/// <summary>
+/// Reads and writes content-addressed objects (blobs and commits). An object is either
+/// loose, stored as its own file under objectsDir/xx/rest, or packed into the object
+/// directory's pack, and its bytes may be compressed (see Compression). Callers never
+/// need to know which.
+/// </summary>
+public static class ObjectStore
+{
+    private static readonly Regex HASH = new Regex("^[0-9a-f]{40}$");
+
+    /// <summary>
+    /// Returns the path where the loose copy of an object is, or would be, stored.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    public static string GetLoosePath(DirectoryInfo objectsDir, string hash)
+    {
+        var (firstTwoDigits, rest) = Utils.SplitHashPath(hash);
+        return Path.Combine(objectsDir.ToString(), firstTwoDigits, rest);
+    }
+
+    /// <summary>
+    /// Checks if a name is a full object hash, as opposed to e.g. a temporary file left
+    /// next to the loose objects.
+    /// </summary>
+    public static bool IsHash(string name)
+    {
+        return HASH.IsMatch(name);
+    }
+
+    /// <summary>
+    /// Checks if an object exists, either loose or packed.
+    /// </summary>
+    public static bool Exists(DirectoryInfo objectsDir, string hash)
+    {
+        return File.Exists(GetLoosePath(objectsDir, hash)) || (Pack.Open(objectsDir)?.Contains(hash) ?? false);
+    }
+
+    /// <summary>
+    /// Reads the raw bytes of an object, either loose or packed.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <param name="message">Error message to use if the object does not exist.</param>
+    public static byte[] Read(DirectoryInfo objectsDir, string hash, string? message = null)
+    {
+        string path = GetLoosePath(objectsDir, hash);
+        Trace.FileOpened();
+        if (File.Exists(path))
+        {
+            return Decode(File.ReadAllBytes(path));
+        }
+
+        byte[]? packed = Pack.Open(objectsDir)?.Read(hash);
+        if (packed != null)
+        {
+            return Decode(packed);
+        }
+
+        // Reports the missing object the same way a missing loose file always has.
+        Utils.ValidateFile(path, message: message);
+        return Decode(File.ReadAllBytes(path));
+    }
+
+    /// <summary>
+    /// Opens the raw content of an object for reading, either loose or packed, without
+    /// loading it into memory.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    public static Stream OpenRead(DirectoryInfo objectsDir, string hash)
+    {
+        Stream stored = OpenStored(objectsDir, hash);
+        return ChunkedBlob.IsManifest(stored) ? ChunkedBlob.OpenRead(stored) : Compression.OpenRead(stored);
+    }
+
+    /// <summary>
+    /// Reads the raw length of an object from its stored bytes, without reading its
+    /// content.
+    /// </summary>
+    /// <param name="stored">Seekable stream over the stored object, positioned at its start.</param>
+    public static long ReadRawLength(Stream stored)
+    {
+        return ChunkedBlob.IsManifest(stored) ? ChunkedBlob.ReadRawLength(stored) : Compression.ReadRawLength(stored);
+    }
+
+    /// <summary>
+    /// Opens the bytes of an object as they are stored on disk, i.e. still compressed.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    public static Stream OpenStored(DirectoryInfo objectsDir, string hash)
+    {
+        string path = GetLoosePath(objectsDir, hash);
+        Trace.FileOpened();
+        if (File.Exists(path))
+        {
+            return new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, Utils.BUFFER_SIZE);
+        }
+
+        Stream? packed = Pack.Open(objectsDir)?.OpenRead(hash);
+        if (packed != null)
+        {
+            return packed;
+        }
+        
+        Utils.ValidateFile(path);
+        return File.OpenRead(path);
+    }
+
+    /// <summary>
+    /// Moves a fully written temporary file into place as the loose copy of an object. The
+    /// temporary file is deleted instead if the object already exists.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <param name="tmpPath">Temporary file holding the object bytes.</param>
+    public static void MoveIn(DirectoryInfo objectsDir, string hash, string tmpPath)
+    {
+        if (Freshen(objectsDir, hash))
+        {
+            File.Delete(tmpPath);
+            return;
+        }
+        
+        string path = GetLoosePath(objectsDir, hash);
+        Directory.CreateDirectory(Path.GetDirectoryName(path)!);
+        File.Move(tmpPath, path, true);
+    }
+
+    /// <summary>
+    /// Writes an object as a loose file with the configured compression, unless it already
+    /// exists.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <param name="content">Raw bytes of the object.</param>
+    public static void Write(DirectoryInfo objectsDir, string hash, byte[] content)
+    {
+        if (!Freshen(objectsDir, hash))
+        {
+            WriteLoose(objectsDir, hash, Compression.Encode(content));
+        }
+    }
+
+    /// <summary>
+    /// Writes the bytes of an object exactly as they are to be stored (e.g. a chunk
+    /// manifest), unless it already exists.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <param name="stored">Stored bytes of the object.</param>
+    public static void WriteStored(DirectoryInfo objectsDir, string hash, byte[] stored)
+    {
+        if (!Freshen(objectsDir, hash))
+        {
+            WriteLoose(objectsDir, hash, stored);
+        }
+    }
+
+    private static void WriteLoose(DirectoryInfo objectsDir, string hash, byte[] stored)
+    {
+        // Written to "<hash>.<guid>.tmp" next to the object and renamed over it, so that
+        // threads storing the same object at the same time never write into the same file.
+        string path = GetLoosePath(objectsDir, hash);
+        Directory.CreateDirectory(Path.GetDirectoryName(path)!);
+        Utils.WriteContent(path, stored);
+    }
+
+    private static byte[] Decode(byte[] stored)
+    {
+        return ChunkedBlob.IsManifest(stored) ? ChunkedBlob.Read(stored) : Compression.Decode(stored);
+    }
+
+    /// <summary>
+    /// Checks if an object exists, and if it is loose, marks it as just written: gc only
+    /// prunes unreachable objects older than its grace period, and an object about to be
+    /// referenced again must not be among them.
+    /// </summary>
+    private static bool Freshen(DirectoryInfo objectsDir, string hash)
+    {
+        string path = GetLoosePath(objectsDir, hash);
+        if (File.Exists(path))
+        {
+            try
+            {
+                File.SetLastWriteTimeUtc(path, DateTime.UtcNow);
+            }
+            catch (IOException)
+            {
+                // Pruned meanwhile: the caller writes it again.
+                return false;
+            }
+            return true;
+        }
+
+        return Pack.Open(objectsDir)?.Contains(hash) ?? false;
+    }
+
+    /// <summary>
+    /// Returns the hashes of all objects in an object directory, loose and packed.
+    /// </summary>
+    public static IEnumerable<string> EnumerateHashes(DirectoryInfo objectsDir)
+    {
+        HashSet<string> seen = new HashSet<string>();
+        foreach (var (hash, _) in EnumerateLoose(objectsDir))
+        {
+            seen.Add(hash);
+            yield return hash;
+        }
+
+        Pack? pack = Pack.Open(objectsDir);
+        if (pack == null)
+        {
+            yield break;
+        }
+
+        foreach (string hash in pack.Hashes())
+        {
+            if (!seen.Contains(hash))
+            {
+                yield return hash;
+            }
+        }
+    }
+
+    /// <summary>
+    /// Returns the hash and path of every loose object in an object directory. Temporary
+    /// files next to the objects are skipped.
+    /// </summary>
+    public static IEnumerable<(string, string)> EnumerateLoose(DirectoryInfo objectsDir)
+    {
+        if (!objectsDir.Exists)
+        {
+            yield break;
+        }
+
+        foreach (string dir in Directory.GetDirectories(objectsDir.ToString()))
+        {
+            string firstTwoDigits = Path.GetFileName(dir);
+            foreach (string path in Directory.GetFiles(dir))
+            {
+                string hash = firstTwoDigits + Path.GetFileName(path);
+                if (IsHash(hash))
+                {
+                    yield return (hash, path);
+                }
+            }
+        }
+    }
+
+    /// <summary>
+    /// Returns the path of every temporary file in an object directory: blobs being
+    /// written at its top, and loose objects being written in its fanout directories.
+    /// Files left behind by a crash are among them, as well as ones still being written.
+    /// </summary>
+    public static IEnumerable<string> EnumerateTemporary(DirectoryInfo objectsDir)
+    {
+        if (!objectsDir.Exists)
+        {
+            return Enumerable.Empty<string>();
+        }
+
+        return Directory.GetFiles(objectsDir.ToString(), "tmp_*")
+            .Concat(Directory.GetDirectories(objectsDir.ToString())
+                .SelectMany(dir => Directory.GetFiles(dir, "*" + Utils.TMP_SUFFIX)));
+    }
+
+    /// <summary>
+    /// Returns the full hashes of all objects, loose or packed, that start with PREFIX.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.COMMITS_DIR).</param>
+    /// <param name="prefix">Hash prefix, at least two characters long.</param>
+    public static List<string> FindByPrefix(DirectoryInfo objectsDir, string prefix)
+    {
+        var (firstTwoDigits, rest) = Utils.SplitHashPath(prefix);
+        string dirPath = Path.Combine(objectsDir.ToString(), firstTwoDigits);
+        List<string> matches = new List<string>();
+
+        if (Directory.Exists(dirPath))
+        {
+            foreach (string path in Directory.GetFiles(dirPath))
+            {
+                string file = Path.GetFileName(path);
+                if (file.StartsWith(rest) && IsHash(firstTwoDigits + file))
+                {
+                    matches.Add(firstTwoDigits + file);
+                }
+            }
+        }
+
+        Pack? pack = Pack.Open(objectsDir);
+        if (pack != null)
+        {
+            matches.AddRange(pack.FindByPrefix(prefix).Where(hash => !matches.Contains(hash)));
+        }
+
+        return matches;
+    }
+}
@@ -0,0 +1,270 @@
+using System.Runtime.InteropServices;
+using MessagePack;
+
+namespace Gitlite;
+
+/// <summary>
+/// Copies objects from one repository to another on the same filesystem, for clone,
+/// fetch and push. Objects are immutable and named by their hash, so one the destination
+/// already has never needs to be compared or copied, and loose objects are hard-linked
+/// rather than copied where the filesystem allows it. Packed objects are copied: a pack's
+/// data file is appended to by repack, so it must not be shared.
+///
+/// Objects are copied before the objects that refer to them (blobs and chunks, then
+/// trees, then commits, oldest first), so a destination that has a commit always has its
+/// whole history. A walk can therefore stop at the first commit or tree the destination
+/// has, and an interrupted transfer leaves nothing dangling.
+/// </summary>
+public class ObjectTransfer
+{
+    private readonly DirectoryInfo _source;
+    private readonly DirectoryInfo _destination;
+
+    /// <summary>
+    /// Number of objects transferred.
+    /// </summary>
+    public int Objects { get; private set; }
+
+    /// <summary>
+    /// Number of transferred objects that were hard-linked rather than copied.
+    /// </summary>
+    public int Linked { get; private set; }
+
+    /// <summary>
+    /// Stored size of the transferred objects, in bytes.
+    /// </summary>
+    public long Bytes { get; private set; }
+
+    /// <param name="source">.gitlite directory to copy objects from.</param>
+    /// <param name="destination">.gitlite directory to copy objects to.</param>
+    public ObjectTransfer(DirectoryInfo source, DirectoryInfo destination)
+    {
+        _source = source;
+        _destination = destination;
+    }
+
+    /// <summary>
+    /// Returns the .gitlite directory of the repository at PATH, exiting with an error if
+    /// there is none.
+    /// </summary>
+    /// <param name="path">Working directory of the repository, relative to the current one.</param>
+    public static DirectoryInfo OpenRepository(string path)
+    {
+        DirectoryInfo gitliteDir = new DirectoryInfo(Path.Combine(Path.GetFullPath(path), Repository.GITLITE_DIR.Name));
+        if (!gitliteDir.Exists)
+        {
+            Utils.ExitWithError($"Not a GitLite repository: {path}");
+        }
+        return gitliteDir;
+    }
+
+    /// <summary>
+    /// Transfers every object of the source, for clone.
+    /// </summary>
+    public void CopyAll()
+    {
+        using Trace.TraceSpan? span = Trace.Span("ObjectTransfer.CopyAll", "objects");
+        foreach (DirectoryInfo objectsDir in new[] { Repository.BLOBS_DIR, Repository.CHUNKS_DIR, Repository.TREES_DIR, Repository.COMMITS_DIR })
+        {
+            DirectoryInfo from = Utils.JoinDirectory(_source, objectsDir.Name);
+            DirectoryInfo to = Utils.JoinDirectory(_destination, objectsDir.Name);
+            if (!from.Exists)
+            {
+                continue;
+            }
+
+            foreach (var (hash, _) in ObjectStore.EnumerateLoose(from))
+            {
+                CopyObject(from, to, hash);
+            }
+
+            // The data file first, as the index points into it.
+            Pack? pack = Pack.Open(from);
+            if (pack != null)
+            {
+                to.Create();
+                foreach (string file in new[] { Pack.DATA_FILE, Pack.INDEX_FILE })
+                {
+                    string target = Path.Combine(to.FullName, file);
+                    File.Copy(Path.Combine(from.FullName, file), target, true);
+                    Bytes += new FileInfo(target).Length;
+                }
+                Objects += pack.Count;
+                Pack.Invalidate(to);
+            }
+        }
+    }
+
+    /// <summary>
+    /// Transfers the commits reachable from TIP that the destination does not have, along
+    /// with the trees, blobs and chunks they need.
+    /// </summary>
+    /// <param name="tip">Hash of the commit to start from.</param>
+    /// <returns>The transferred commits, parents before children.</returns>
+    public List<Commit> CopyHistory(string tip)
+    {
+        using Trace.TraceSpan? span = Trace.Span("ObjectTransfer.CopyHistory", "objects");
+        DirectoryInfo from = Utils.JoinDirectory(_source, Repository.COMMITS_DIR.Name);
+        DirectoryInfo to = Utils.JoinDirectory(_destination, Repository.COMMITS_DIR.Name);
+
+        // Depth-first, emitting a commit once all its parents are: a parent reached
+        // through two children is only visited once, and never still on the stack when a
+        // child of it is emitted, as history has no cycles.
+        List<Commit> missing = new List<Commit>();
+        Dictionary<string, Commit> visited = new Dictionary<string, Commit>();
+        Stack<(string Hash, bool ParentsDone)> stack = new Stack<(string, bool)>();
+        stack.Push((tip, false));
+        while (stack.Count > 0)
+        {
+            var (hash, parentsDone) = stack.Pop();
+            if (parentsDone)
+            {
+                missing.Add(visited[hash]);
+                continue;
+            }
+            if (visited.ContainsKey(hash) || ObjectStore.Exists(to, hash))
+            {
+                continue;
+            }
+
+            Commit commit = MessagePackSerializer.Deserialize<Commit>(ObjectStore.Read(from, hash));
+            visited[hash] = commit;
+            stack.Push((hash, true));
+            foreach (string parent in commit.GetParentHashRefs())
+            {
+                stack.Push((parent, false));
+            }
+        }
+
+        foreach (Commit commit in missing)
+        {
+            if (commit.RootTree != null)
+            {
+                CopyTree(commit.RootTree);
+            }
+            else
+            {
+                // Commits made before trees existed list their blobs directly.
+                foreach (string blob in (commit.StoredFileMapping ?? new Dictionary<string, string>()).Values)
+                {
+                    CopyBlob(blob);
+                }
+            }
+            CopyObject(from, to, commit.Hash);
+        }
+
+        return missing;
+    }
+
+    private void CopyTree(string hash)
+    {
+        DirectoryInfo from = Utils.JoinDirectory(_source, Repository.TREES_DIR.Name);
+        DirectoryInfo to = Utils.JoinDirectory(_destination, Repository.TREES_DIR.Name);
+        if (ObjectStore.Exists(to, hash))
+        {
+            return;
+        }
+
+        Tree tree = MessagePackSerializer.Deserialize<Tree>(ObjectStore.Read(from, hash));
+        foreach (TreeEntry entry in tree.Entries)
+        {
+            if (entry.IsTree)
+            {
+                CopyTree(entry.Hash);
+            }
+            else
+            {
+                CopyBlob(entry.Hash);
+            }
+        }
+        CopyObject(from, to, hash);
+    }
+
+    private void CopyBlob(string hash)
+    {
+        DirectoryInfo from = Utils.JoinDirectory(_source, Repository.BLOBS_DIR.Name);
+        DirectoryInfo to = Utils.JoinDirectory(_destination, Repository.BLOBS_DIR.Name);
+        if (ObjectStore.Exists(to, hash))
+        {
+            return;
+        }
+
+        List<string> chunks;
+        using (Stream stored = ObjectStore.OpenStored(from, hash))
+        {
+            chunks = ChunkedBlob.IsManifest(stored) ? ChunkedBlob.ReadChunkHashes(stored) : new List<string>();
+        }
+
+        DirectoryInfo chunksFrom = Utils.JoinDirectory(_source, Repository.CHUNKS_DIR.Name);
+        DirectoryInfo chunksTo = Utils.JoinDirectory(_destination, Repository.CHUNKS_DIR.Name);
+        foreach (string chunk in chunks.Distinct())
+        {
+            if (!ObjectStore.Exists(chunksTo, chunk))
+            {
+                CopyObject(chunksFrom, chunksTo, chunk);
+            }
+        }
+        CopyObject(from, to, hash);
+    }
+
+    /// <summary>
+    /// Transfers one object as it is stored, i.e. still compressed, hard-linking its loose
+    /// file if there is one.
+    /// </summary>
+    private void CopyObject(DirectoryInfo from, DirectoryInfo to, string hash)
+    {
+        string source = ObjectStore.GetLoosePath(from, hash);
+        string target = ObjectStore.GetLoosePath(to, hash);
+        Directory.CreateDirectory(Path.GetDirectoryName(target)!);
+
+        long length;
+        if (File.Exists(source) && TryLink(source, target))
+        {
+            length = new FileInfo(target).Length;
+            Linked++;
+        }
+        else
+        {
+            string tmpPath = Path.Combine(to.FullName, $"tmp_{Guid.NewGuid():N}");
+            Trace.FileOpened();
+            using (Stream stored = ObjectStore.OpenStored(from, hash))
+            using (FileStream tmp = new FileStream(tmpPath, FileMode.CreateNew, FileAccess.Write, FileShare.None, Utils.BUFFER_SIZE))
+            {
+                stored.CopyTo(tmp, Utils.BUFFER_SIZE);
+                length = tmp.Length;
+                tmp.Flush(true);
+            }
+            ObjectStore.MoveIn(to, hash, tmpPath);
+        }
+
+        Objects++;
+        Bytes += length;
+    }
+
+    [DllImport("libc", EntryPoint = "link", SetLastError = true)]
+    private static extern int NativeLink(string oldPath, string newPath);
+
+    private static bool _linkAvailable = !OperatingSystem.IsWindows();
+
+    /// <summary>
+    /// Hard-links a file, which fails e.g. across filesystems or where link(2) does not
+    /// exist; the caller then copies it.
+    /// </summary>
+    private static bool TryLink(string source, string target)
+    {
+        if (!_linkAvailable)
+        {
+            return false;
+        }
+
+        try
+        {
+            return NativeLink(source, target) == 0;
+        }
+        catch (Exception e) when (e is DllNotFoundException or EntryPointNotFoundException)
+        {
+            _linkAvailable = false;
+            return false;
+        }
+    }
+}
@@ -0,0 +1,456 @@
+using System.Buffers.Binary;
+using System.IO.MemoryMappedFiles;
+
+namespace Gitlite;
+
+/// <summary>
+/// A pack folds the objects of one object directory (blobs or commits) into a single
+/// append-only data file, plus a sorted index that maps object hashes to their location
+/// in the data file.
+///
+/// Index layout (all integers big-endian):
+///     "GLPI" | version (uint32)
+///     fanout table: 256 x uint32, entry i = number of objects whose first byte is &lt;= i
+///     N x 20 byte object hashes, sorted
+///     N x (offset uint64, length uint64) into the data file
+///
+/// Data file layout:
+///     "GLPD" | version (uint32) | object bytes, back to back
+/// </summary>
+public class Pack : IDisposable
+{
+    public const string DATA_FILE = "pack";
+    public const string INDEX_FILE = "pack.idx";
+
+    private static readonly byte[] DATA_MAGIC = "GLPD"u8.ToArray();
+    private static readonly byte[] INDEX_MAGIC = "GLPI"u8.ToArray();
+    private const uint VERSION = 1;
+    private const int HEADER_SIZE = 8;
+    private const int FANOUT_SIZE = 256 * 4;
+    private const int HASH_SIZE = 20;
+    private const int LOCATION_SIZE = 16;
+
+    // Packs opened by this process, keyed by object directory. A null value means the
+    // directory has no pack, which saves a File.Exists on every lookup.
+    private static readonly Dictionary<string, Pack?> OpenPacks = new Dictionary<string, Pack?>();
+
+    private readonly string _dataPath;
+    private readonly MemoryMappedFile _indexFile;
+    private readonly MemoryMappedViewAccessor _index;
+
+    public int Count { get; }
+
+    private Pack(string indexPath, string dataPath)
+    {
+        _dataPath = dataPath;
+        _indexFile = MemoryMappedFile.CreateFromFile(indexPath, FileMode.Open, null, 0, MemoryMappedFileAccess.Read);
+        _index = _indexFile.CreateViewAccessor(0, 0, MemoryMappedFileAccess.Read);
+
+        byte[] header = new byte[HEADER_SIZE];
+        _index.ReadArray(0, header, 0, HEADER_SIZE);
+        if (!header.AsSpan(0, 4).SequenceEqual(INDEX_MAGIC))
+        {
+            throw new InvalidDataException($"Invalid pack index: {indexPath}");
+        }
+
+        Count = (int)ReadFanout(255);
+    }
+
+    /// <summary>
+    /// Returns the pack of an object directory, or null if the directory has not been
+    /// packed yet. The index is memory-mapped once per process.
+    /// </summary>
+    /// <param name="objectsDir">Object directory (e.g. Repository.BLOBS_DIR).</param>
+    public static Pack? Open(DirectoryInfo objectsDir)
+    {
+        string key = objectsDir.FullName;
+        lock (OpenPacks)
+        {
+            if (OpenPacks.TryGetValue(key, out Pack? pack))
+            {
+                return pack;
+            }
+
+            string indexPath = Path.Combine(key, INDEX_FILE);
+            string dataPath = Path.Combine(key, DATA_FILE);
+            pack = File.Exists(indexPath) && new FileInfo(indexPath).Length > 0
+                ? new Pack(indexPath, dataPath)
+                : null;
+            OpenPacks[key] = pack;
+            return pack;
+        }
+    }
+
+    /// <summary>
+    /// Drops the cached pack of an object directory so the next Open re-reads its index.
+    /// </summary>
+    public static void Invalidate(DirectoryInfo objectsDir)
+    {
+        lock (OpenPacks)
+        {
+            if (OpenPacks.Remove(objectsDir.FullName, out Pack? pack))
+            {
+                pack?.Dispose();
+            }
+        }
+    }
+
+    /// <summary>
+    /// Drops every cached pack, e.g. before a long-lived process runs its next command, in
+    /// case another process repacked meanwhile.
+    /// </summary>
+    public static void InvalidateAll()
+    {
+        lock (OpenPacks)
+        {
+            foreach (Pack? pack in OpenPacks.Values)
+            {
+                pack?.Dispose();
+            }
+            OpenPacks.Clear();
+        }
+    }
+
+    public bool Contains(string hash) => FindPosition(hash) >= 0;
+
+    /// <summary>
+    /// Reads the stored (possibly compressed) bytes of an object.
+    /// </summary>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <returns>The object bytes, or null if the object is not in this pack.</returns>
+    public byte[]? Read(string hash)
+    {
+        int position = FindPosition(hash);
+        if (position < 0)
+        {
+            return null;
+        }
+
+        var (offset, length) = ReadLocation(position);
+        byte[] content = new byte[length];
+        using FileStream data = new FileStream(_dataPath, FileMode.Open, FileAccess.Read, FileShare.ReadWrite);
+        data.Seek(offset, SeekOrigin.Begin);
+        data.ReadExactly(content);
+        return content;
+    }
+
+    /// <summary>
+    /// Opens the stored bytes of a packed object without loading them into memory.
+    /// </summary>
+    /// <param name="hash">Full hash of the object.</param>
+    /// <returns>A stream over the object bytes, or null if the object is not in this pack.</returns>
+    public Stream? OpenRead(string hash)
+    {
+        int position = FindPosition(hash);
+        if (position < 0)
+        {
+            return null;
+        }
+
+        var (offset, length) = ReadLocation(position);
+        FileStream data = new FileStream(_dataPath, FileMode.Open, FileAccess.Read, FileShare.ReadWrite, Utils.BUFFER_SIZE);
+        data.Seek(offset, SeekOrigin.Begin);
+        return new BoundedStream(data, length);
+    }
+
+    /// <summary>
+    /// Returns every object hash in the pack in sorted order.
+    /// </summary>
+    public IEnumerable<string> Hashes()
+    {
+        for (int i = 0; i < Count; i++)
+        {
+            yield return Convert.ToHexString(ReadHash(i)).ToLower();
+        }
+    }
+
+    /// <summary>
+    /// Returns the hashes of all packed objects that start with PREFIX.
+    /// </summary>
+    /// <param name="prefix">Hexadecimal hash prefix, at least two characters long.</param>
+    public List<string> FindByPrefix(string prefix)
+    {
+        prefix = prefix.ToLower();
+        List<string> matches = new List<string>();
+        if (!prefix.All(Uri.IsHexDigit))
+        {
+            return matches;
+        }
+
+        byte[] lowest = Convert.FromHexString(prefix.PadRight(HASH_SIZE * 2, '0'));
+
+        // Lower bound of the padded prefix, then walk forward while hashes still match.
+        var (lo, hi) = BucketRange(lowest[0]);
+        while (lo < hi)
+        {
+            int mid = (lo + hi) >>> 1;
+            if (ReadHash(mid).AsSpan().SequenceCompareTo(lowest) < 0) lo = mid + 1;
+            else hi = mid;
+        }
+
+        for (int i = lo; i < Count; i++)
+        {
+            string hash = Convert.ToHexString(ReadHash(i)).ToLower();
+            if (!hash.StartsWith(prefix))
+            {
+                break;
+            }
+            matches.Add(hash);
+        }
+
+        return matches;
+    }
+
+    /// <summary>
+    /// Folds all loose objects of an object directory into its pack. New objects are
+    /// appended to the data file, a new index is written next to the old one and renamed
+    /// over it, and only then are the loose copies deleted.
+    /// </summary>
+    /// <param name="objectsDir">Object directory to repack.</param>
+    /// <returns>The number of objects packed and their total size in bytes.</returns>
+    public static (int, long) Repack(DirectoryInfo objectsDir)
+    {
+        if (!objectsDir.Exists)
+        {
+            return (0, 0);
+        }
+        
+        string dataPath = Path.Combine(objectsDir.FullName, DATA_FILE);
+        string indexPath = Path.Combine(objectsDir.FullName, INDEX_FILE);
+
+        List<(byte[] Hash, long Offset, long Length)> entries = new List<(byte[], long, long)>();
+        Pack? existing = Open(objectsDir);
+        if (existing != null)
+        {
+            for (int i = 0; i < existing.Count; i++)
+            {
+                var (offset, length) = existing.ReadLocation(i);
+                entries.Add((existing.ReadHash(i), offset, length));
+            }
+        }
+
+        List<string> looseFiles = new List<string>();
+        int packed = 0;
+        long packedBytes = 0;
+
+        using (FileStream data = new FileStream(dataPath, FileMode.OpenOrCreate, FileAccess.Write, FileShare.Read))
+        {
+            if (data.Length == 0)
+            {
+                data.Write(DATA_MAGIC);
+                WriteUInt32(data, VERSION);
+            }
+            data.Seek(0, SeekOrigin.End);
+
+            foreach (var (hash, path) in ObjectStore.EnumerateLoose(objectsDir))
+            {
+                looseFiles.Add(path);
+                if (existing != null && existing.Contains(hash))
+                {
+                    continue;
+                }
+
+                long offset = data.Position;
+                using (FileStream loose = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, Utils.BUFFER_SIZE))
+                {
+                    loose.CopyTo(data, Utils.BUFFER_SIZE);
+                }
+                entries.Add((Convert.FromHexString(hash), offset, data.Position - offset));
+                packed++;
+                packedBytes += data.Position - offset;
+            }
+
+            data.Flush(true);
+        }
+
+        if (packed > 0)
+        {
+            entries.Sort((a, b) => a.Hash.AsSpan().SequenceCompareTo(b.Hash));
+            Invalidate(objectsDir);
+            Utils.WriteAtomically(indexPath, index => WriteIndex(index, entries));
+        }
+
+        // The pack now holds every object, so the loose copies can go.
+        foreach (string path in looseFiles)
+        {
+            File.Delete(path);
+        }
+        foreach (string dir in Directory.GetDirectories(objectsDir.FullName))
+        {
+            if (!Directory.EnumerateFileSystemEntries(dir).Any())
+            {
+                Directory.Delete(dir);
+            }
+        }
+
+        return (packed, packedBytes);
+    }
+
+    public void Dispose()
+    {
+        _index.Dispose();
+        _indexFile.Dispose();
+    }
+
+    private static void WriteIndex(Stream index, List<(byte[] Hash, long Offset, long Length)> entries)
+    {
+        index.Write(INDEX_MAGIC);
+        WriteUInt32(index, VERSION);
+
+        uint[] fanout = new uint[256];
+        foreach (var entry in entries)
+        {
+            fanout[entry.Hash[0]]++;
+        }
+        uint total = 0;
+        for (int i = 0; i < 256; i++)
+        {
+            total += fanout[i];
+            WriteUInt32(index, total);
+        }
+
+        foreach (var entry in entries)
+        {
+            index.Write(entry.Hash);
+        }
+
+        byte[] location = new byte[LOCATION_SIZE];
+        foreach (var entry in entries)
+        {
+            BinaryPrimitives.WriteUInt64BigEndian(location.AsSpan(0, 8), (ulong)entry.Offset);
+            BinaryPrimitives.WriteUInt64BigEndian(location.AsSpan(8, 8), (ulong)entry.Length);
+            index.Write(location);
+        }
+    }
+
+    private static void WriteUInt32(Stream stream, uint value)
+    {
+        Span<byte> buffer = stackalloc byte[4];
+        BinaryPrimitives.WriteUInt32BigEndian(buffer, value);
+        stream.Write(buffer);
+    }
+
+    private uint ReadFanout(int i)
+    {
+        byte[] buffer = new byte[4];
+        _index.ReadArray(HEADER_SIZE + i * 4, buffer, 0, 4);
+        return BinaryPrimitives.ReadUInt32BigEndian(buffer);
+    }
+
+    /// <summary>
+    /// Returns the [start, end) range of index positions whose hash starts with FIRST BYTE.
+    /// </summary>
+    private (int, int) BucketRange(byte firstByte)
+    {
+        int start = firstByte == 0 ? 0 : (int)ReadFanout(firstByte - 1);
+        return (start, (int)ReadFanout(firstByte));
+    }
+
+    private byte[] ReadHash(int position)
+    {
+        byte[] hash = new byte[HASH_SIZE];
+        _index.ReadArray(HEADER_SIZE + FANOUT_SIZE + (long)position * HASH_SIZE, hash, 0, HASH_SIZE);
+        return hash;
+    }
+
+    private (long, long) ReadLocation(int position)
+    {
+        long at = HEADER_SIZE + FANOUT_SIZE + (long)Count * HASH_SIZE + (long)position * LOCATION_SIZE;
+        byte[] location = new byte[LOCATION_SIZE];
+        _index.ReadArray(at, location, 0, LOCATION_SIZE);
+        return ((long)BinaryPrimitives.ReadUInt64BigEndian(location.AsSpan(0, 8)),
+            (long)BinaryPrimitives.ReadUInt64BigEndian(location.AsSpan(8, 8)));
+    }
+
+    /// <summary>
+    /// Binary searches the fanout bucket of HASH for its index position.
+    /// </summary>
+    /// <returns>The position of HASH in the index, or -1 if it is not packed.</returns>
+    private int FindPosition(string hash)
+    {
+        if (hash.Length != HASH_SIZE * 2 || !hash.All(Uri.IsHexDigit))
+        {
+            return -1;
+        }
+
+        byte[] target = Convert.FromHexString(hash);
+        var (lo, hi) = BucketRange(target[0]);
+
+        while (lo < hi)
+        {
+            int mid = (lo + hi) >>> 1;
+            int cmp = ReadHash(mid).AsSpan().SequenceCompareTo(target);
+            if (cmp == 0) return mid;
+            if (cmp < 0) lo = mid + 1;
+            else hi = mid;
+        }
+
+        return -1;
+    }
+}
+
+/// <summary>
+/// Read-only view of the next LENGTH bytes of a seekable stream. Disposing it disposes
+/// the underlying stream.
+/// </summary>
+internal class BoundedStream : Stream
+{
+    private readonly Stream _inner;
+    private readonly long _start;
+    private long _remaining;
+
+    public BoundedStream(Stream inner, long length)
+    {
+        _inner = inner;
+        _start = inner.Position;
+        _remaining = length;
+        Length = length;
+    }
+
+    public override bool CanRead => true;
+    public override bool CanSeek => true;
+    public override bool CanWrite => false;
+    public override long Length { get; }
+
+    public override long Position
+    {
+        get => Length - _remaining;
+        set => Seek(value, SeekOrigin.Begin);
+    }
+
+    public override int Read(byte[] buffer, int offset, int count)
+    {
+        if (_remaining <= 0) return 0;
+        int read = _inner.Read(buffer, offset, (int)Math.Min(count, _remaining));
+        _remaining -= read;
+        return read;
+    }
+
+    public override void Flush() { }
+    public override long Seek(long offset, SeekOrigin origin)
+    {
+        long position = origin switch
+        {
+            SeekOrigin.Begin => offset,
+            SeekOrigin.Current => Position + offset,
+            _ => Length + offset,
+        };
+        if (position < 0 || position > Length)
+        {
+            throw new ArgumentOutOfRangeException(nameof(offset));
+        }
+
+        _inner.Seek(_start + position, SeekOrigin.Begin);
+        _remaining = Length - position;
+        return position;
+    }
+
+    public override void SetLength(long value) => throw new NotSupportedException();
+    public override void Write(byte[] buffer, int offset, int count) => throw new NotSupportedException();
+
+    protected override void Dispose(bool disposing)
+    {
+        if (disposing) _inner.Dispose();
+        base.Dispose(disposing);
+    }
+}
@@ -7,12 +7,69 @@ namespace Gitlite;
 /// </summary>
 public static class Program
 {
+    private static readonly HashSet<string> WRITE_COMMANDS = new HashSet<string>
+    {
+        "add", "commit", "rm", "checkout", "branch", "rm-branch", "reset", "merge", "repack", "gc", "write-changed-paths", "fetch", "batch"
+    };
+    
     public static void Main(string[] args)
     {
+        AppDomain.CurrentDomain.ProcessExit += (_, _) =>
+        {
+            WarmState.ReportStats();
+            Trace.Flush();
+        };
+        
+        // Commands are served by a running daemon if there is one. Batches read stdin and
+        // monitors never return, so they always run in their own process.
+        bool forwardable = args.Length > 0 && args[0] is not ("init" or "batch" or "fsmonitor")
+                           && (args[0] != "daemon" || args[1..].SequenceEqual(new[] { "stop" }));
+        if (forwardable && Daemon.TryForward(args, out int exitCode))
+        {
+            Environment.Exit(exitCode);
+        }
+        
+        Run(args);
+    }
+
+    /// <summary>
+    /// Runs a command inside a long-lived process (daemon or batch).
+    /// </summary>
+    /// <param name="args">Command line of the command.</param>
+    /// <returns>The exit code the command would have exited with.</returns>
+    public static int RunInProcess(string[] args)
+    {
+        try
+        {
+            Run(args);
+            return 0;
+        }
+        catch (ExitException e)
+        {
+            return e.ExitCode;
+        }
+        catch (AggregateException e) when (e.InnerExceptions.All(inner => inner is ExitException))
+        {
+            return ((ExitException)e.InnerExceptions[0]).ExitCode;
+        }
+        finally
+        {
+            Trace.Flush();
+        }
+    }
+
+    private static void Run(string[] args)
+    {
+        // Each command scans the working directory afresh.
+        WorkingTree.Invalidate();
+        Trace.Configure();
+        
         if (args.Length == 0)
         {
             Utils.ExitWithError("Please enter a command.");   
         }
+        
+        using Trace.TraceSpan? commandSpan = Trace.Span(args[0], "command");
 
         if (args[0] == "init")
         {
@@ -21,16 +78,34 @@ public static class Program
             return;
         }
 
+        if (args[0] == "clone")
+        {
+            Utils.ValidateArguments("clone", args, 2);
+            Repository.Clone(args[1]);
+            return;
+        }
+
         if (!Repository.GitliteAlreadyInitialized())
         {
             Utils.ExitWithError("Not in an initialized GitLite directory.");
         }
+
+        // Reject a bad GITLITE_COMPRESSION or GITLITE_CHECKOUT_WORKERS before a command has
+        // changed anything.
+        Compression.Configured();
+        Repository.GetCheckoutWorkers();
+        
+        // Commands that modify the repository run one at a time; readers never wait. A
+        // batch holds the lock throughout, as its writes are only made at the end.
+        using RepositoryLock? writeLock = WRITE_COMMANDS.Contains(args[0]) ? RepositoryLock.Acquire() : null;
             
         switch (args[0])
         {
             case "add":
-                Utils.ValidateArguments("add", args, 2);
-                Repository.Add(args[1]);
+                bool verbose = args.Contains("-v") || args.Contains("--verbose");
+                string[] paths = args.Skip(1).Where(arg => arg != "-v" && arg != "--verbose").ToArray();
+                Utils.ValidateMinArguments("add", paths, 1);
+                Repository.Add(paths, verbose);
                 break;
             
             case "commit":
@@ -49,7 +124,15 @@ public static class Program
                 break;
             
             case "log":
-                Utils.ValidateArguments("log", args, 1);
+                if (args.Length == 3 && args[1] == "--")
+                {
+                    Repository.Log(args[2]);
+                    break;
+                }
+                if (args.Length != 1)
+                {
+                    Utils.ExitWithError("Usage: log [-- <path>]");
+                }
                 Repository.Log();
                 break;
             
@@ -93,9 +176,97 @@ public static class Program
                 Repository.Merge(args[1]);
                 break;
                 
+            case "repack":
+                Utils.ValidateArguments("repack", args, 1);
+                Repository.Repack();
+                break;
+                
+            case "count-objects":
+                Utils.ValidateArguments("count-objects", args, 1);
+                Repository.CountObjects();
+                break;
+                
+            case "gc":
+                Repository.Gc(ParseGracePeriod(args));
+                break;
+                
+            case "write-changed-paths":
+                Utils.ValidateArguments("write-changed-paths", args, 1);
+                Repository.WriteChangedPaths();
+                break;
+                
+            case "diff":
+                Repository.Diff(args);
+                break;
+            
+            case "merge-base":
+                Utils.ValidateArguments("merge-base", args, 3);
+                Repository.MergeBase(args[1], args[2]);
+                break;
+            
+            case "is-ancestor":
+                Utils.ValidateArguments("is-ancestor", args, 3);
+                Repository.IsAncestor(args[1], args[2]);
+                break;
+            
+            case "fetch":
+                Utils.ValidateArguments("fetch", args, 3);
+                Repository.Fetch(args[1], args[2]);
+                break;
+            
+            case "push":
+                // Takes the lock of the repository pushed to, not this one.
+                Utils.ValidateArguments("push", args, 3);
+                Repository.Push(args[1], args[2]);
+                break;
+            
+            case "batch":
+                string[] options = args.Skip(1).ToArray();
+                if (options.Any(option => option is not ("-z" or "--keep-going")))
+                {
+                    Utils.ExitWithError("Usage: batch [-z] [--keep-going]");
+                }
+                if (!Batch.Run(options.Contains("-z"), options.Contains("--keep-going")))
+                {
+                    Utils.ExitWithError(null);
+                }
+                break;
+            
+            case "fsmonitor":
+                Utils.ValidateArguments("fsmonitor", args, 1);
+                FsMonitor.Run();
+                break;
+            
+            case "daemon":
+                if (args.Length == 2 && args[1] == "stop")
+                {
+                    Utils.ExitWithError("No daemon is running.");
+                }
+                Utils.ValidateArguments("daemon", args, 1);
+                Daemon.Serve();
+                break;
+                
             default:
                 Utils.ExitWithError($"No command with such name exists: {args[0]}");
                 break;
         }
     }
-}
\ No newline at end of file
+
+    /// <summary>
+    /// Returns the grace period of a gc command: "gc" or "gc --grace [seconds]".
+    /// </summary>
+    private static TimeSpan ParseGracePeriod(string[] args)
+    {
+        if (args.Length == 1)
+        {
+            return GarbageCollector.DEFAULT_GRACE_PERIOD;
+        }
+
+        int seconds = -1;
+        if (args.Length != 3 || args[1] != "--grace" || !int.TryParse(args[2], out seconds) || seconds < 0)
+        {
+            Utils.ExitWithError("Usage: gc [--grace <seconds>]");
+        }
+        return TimeSpan.FromSeconds(seconds);
+    }
+}
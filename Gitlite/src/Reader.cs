@@ -25,6 +25,11 @@ public class Reader
                 Console.WriteLine(fileContents);
                 break;
             
+            case "tree":
+                Tree tree = Tree.Read(fileName);
+                Console.WriteLine(JsonSerializer.Serialize(tree, new JsonSerializerOptions { WriteIndented = true }));
+                break;
+            
             case "staging":
                 StagingArea staging = StagingArea.GetDeserializedStagingArea();
                 Console.WriteLine("staging");
@@ -1,3 +1,5 @@
+using System.Diagnostics;
+
 namespace Gitlite;
 
 /*
@@ -19,8 +21,16 @@ public class Repository
     public static DirectoryInfo GITLITE_DIR = Utils.JoinDirectory(CWD, ".gitlite");
     public static DirectoryInfo COMMITS_DIR = Utils.JoinDirectory(GITLITE_DIR, "commits");
     public static DirectoryInfo BLOBS_DIR = Utils.JoinDirectory(GITLITE_DIR, "blobs");
+    public static DirectoryInfo TREES_DIR = Utils.JoinDirectory(GITLITE_DIR, "trees");
+    public static DirectoryInfo CHUNKS_DIR = Utils.JoinDirectory(GITLITE_DIR, "chunks");
     public static DirectoryInfo BRANCHES = Utils.JoinDirectory(GITLITE_DIR, "branches");
     
+    // Number of checkout workers writing files in parallel; defaults to the processor count.
+    public const string CHECKOUT_WORKERS_ENV = "GITLITE_CHECKOUT_WORKERS";
+    
+    // Below this many files to write, checkout stays sequential.
+    private const int PARALLEL_CHECKOUT_THRESHOLD = 32;
+    
     
     /* GITLITE MAIN COMMANDS */
     
@@ -40,43 +50,106 @@ public class Repository
         
         string hash = Gitlite.Commit.CreateInitialCommit();
         Gitlite.Branch.CreateBranch("master", hash);
-        Utils.WriteContent(Path.Combine(GITLITE_DIR.ToString(), "HEAD"), "ref: master");
+        Gitlite.Branch.UpdateRef(Path.Combine(GITLITE_DIR.ToString(), "HEAD"), "ref: master");
         
         Console.WriteLine($"Initialized a new GitLite at {CWD}");
     }
     
-    public static void Add(string fileName)
+    /// <summary>
+    /// Stages files for addition. Each path can be a file or a directory (e.g. "."), in
+    /// which case every file under it is added. Files are hashed and their blobs written
+    /// on a bounded pool of worker threads, and the staging area is loaded and saved once.
+    /// </summary>
+    /// <param name="paths">Files and directories to add.</param>
+    /// <param name="verbose">Prints the hashing throughput if true.</param>
+    public static void Add(string[] paths, bool verbose = false)
     {
-        if (!File.Exists(fileName))
-        {
-            Utils.ExitWithError("File does not exist.");
-        }
+        List<string> fileNames = CollectFilesToAdd(paths);
+        Stopwatch stopwatch = Stopwatch.StartNew();
         
         StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
         Dictionary<string, string> forAddition = stagingArea.GetStagingForAddition();
         Commit currentCommit = Gitlite.Commit.GetHeadCommit();
-        byte[] content = File.ReadAllBytes(fileName);
-        string contentHash = Utils.HashBytes(content);
-
-        if (currentCommit.FileMapping.ContainsKey(fileName))
+        StatCache statCache = StatCache.Load();
+        
+        // Files whose stat data matches the cache don't need to be read at all if their
+        // blob is already stored.
+        string?[] contentHashes = new string?[fileNames.Count];
+        StatEntry[] stats = new StatEntry[fileNames.Count];
+        for (int i = 0; i < fileNames.Count; i++)
         {
-            string blobRef = currentCommit.FileMapping[fileName];
-
-            // Checks if content in commit and cwd are the same
-            if (blobRef == contentHash && forAddition.ContainsKey(fileName))
+            // Files the file-system monitor vouches for are not even stat'ed.
+            if (WorkingTree.IsUnchanged(fileNames[i]) && statCache.TryGetEntry(fileNames[i], out StatEntry cached)
+                && IsBlobStoredFor(fileNames[i], cached.Hash, currentCommit))
+            {
+                stats[i] = cached;
+                contentHashes[i] = cached.Hash;
+                continue;
+            }
+            
+            stats[i] = StatEntry.FromFile(Path.Combine(CWD.ToString(), fileNames[i]), "");
+            if (statCache.TryGetHash(fileNames[i], stats[i], out string hash) && IsBlobStoredFor(fileNames[i], hash, currentCommit))
             {
-                // If it is, and we see it is and is currently staged for addition,
-                // we just remove it. This can happen when file is changed, added,
-                // and then changed back to original version.
+                contentHashes[i] = hash;
+            }
+        }
+        
+        long bytesHashed = 0;
+        int filesHashed = 0;
+        ParallelOptions options = new ParallelOptions { MaxDegreeOfParallelism = Environment.ProcessorCount };
+        Parallel.For(0, fileNames.Count, options, i =>
+        {
+            if (contentHashes[i] != null) return;
+            
+            // Tracked files are most likely unchanged, so they are only hashed at first.
+            // Other files are hashed while being copied into the blob store.
+            string path = Path.Combine(CWD.ToString(), fileNames[i]);
+            string? trackedHash = currentCommit.FileMapping.GetValueOrDefault(fileNames[i]);
+            string contentHash = trackedHash != null ? Utils.HashFile(path) : Blob.SaveBlobFromFile(path);
+            if (trackedHash != null && trackedHash != contentHash)
+            {
+                contentHash = Blob.SaveBlobFromFile(path);
+            }
+            
+            contentHashes[i] = contentHash;
+            Interlocked.Add(ref bytesHashed, stats[i].Size);
+            Interlocked.Increment(ref filesHashed);
+        });
+        
+        for (int i = 0; i < fileNames.Count; i++)
+        {
+            string fileName = fileNames[i];
+            string contentHash = contentHashes[i]!;
+            
+            if (currentCommit.FileMapping.GetValueOrDefault(fileName) == contentHash)
+            {
+                // Same content as in the current commit, so there is nothing to stage. It
+                // may still be staged if it was changed, added, and then changed back
+                // to the original version.
                 forAddition.Remove(fileName);
-                stagingArea.Save();
-                return;
             }
+            else
+            {
+                forAddition[fileName] = contentHash;
+            }
+            
+            stagingArea.GetStagingForRemoval().Remove(fileName);
+            stats[i].Hash = contentHash;
+            statCache.Record(fileName, stats[i]);
+            WorkingTree.Verify(fileName);
         }
-
-        forAddition[fileName] = contentHash;
-        Blob.SaveBlob(content);
+        
         stagingArea.Save();
+        statCache.Save();
+        WorkingTree.SaveVerified();
+        
+        if (verbose)
+        {
+            double seconds = Math.Max(stopwatch.Elapsed.TotalSeconds, 1e-6);
+            double megabytes = bytesHashed / (1024.0 * 1024.0);
+            Console.WriteLine($"Added {fileNames.Count} files, hashed {filesHashed} ({megabytes:F2} MB) in {seconds:F3}s: " +
+                              $"{megabytes / seconds:F2} MB/s, {filesHashed / seconds:F0} files/s");
+        }
     }
 
     /// <summary>
@@ -95,19 +168,11 @@ public class Repository
         }
         
         Commit commitOnHEAD = Gitlite.Commit.GetHeadCommit();
-        Dictionary<string, string> fileMapping = new Dictionary<string, string>(commitOnHEAD.FileMapping);
 
-        // Invariant: COMMIT.FileMapping contains the mapping of file names to blobs.
-        
-        foreach (var keyValuePair in stagingArea.GetStagingForAddition())
-        {
-            fileMapping[keyValuePair.Key] = keyValuePair.Value;
-        }
-        
-        foreach (string file in stagingArea.GetStagingForRemoval())
-        {
-            fileMapping.Remove(file);
-        }
+        // Only the trees of directories with staged changes are rewritten; the rest are
+        // shared with the HEAD commit.
+        string rootTree = Tree.Update(commitOnHEAD.GetRootTree(), stagingArea.GetStagingForAddition(),
+            stagingArea.GetStagingForRemoval());
         
         // Clear the staging area then save
         stagingArea.Clear();
@@ -115,13 +180,13 @@ public class Repository
         
         // Create and save the new commit
         string parent = Gitlite.Commit.GetHeadCommitId();
-        string hashRef = Gitlite.Commit.CreateCommit(logMessage, DateTime.Now, fileMapping, parent);
+        string hashRef = Gitlite.Commit.CreateCommit(logMessage, DateTime.Now, rootTree, parent);
         
         // Update branch pointer, only if we are in a branch.
         string branch = Gitlite.Branch.GetActiveBranch();
-        if (branch != null)
+        if (branch != null && !Gitlite.Branch.CompareAndSwapRef(Path.Combine(BRANCHES.ToString(), branch), parent, hashRef))
         {
-            Utils.WriteContent(Path.Combine(BRANCHES.ToString(), branch), hashRef);
+            Utils.ExitWithError($"Branch {branch} was moved by another command; commit {hashRef[..7]} is not on it.");
         }
     }
 
@@ -143,6 +208,10 @@ public class Repository
         {
             stagingArea.GetStagingForRemoval().Add(fileName);
             File.Delete(Path.Combine(CWD.ToString(), fileName));
+
+            StatCache statCache = StatCache.Load();
+            statCache.Remove(fileName);
+            statCache.Save();
         }
         else
         {
@@ -154,7 +223,7 @@ public class Repository
 
     /// <summary>
     /// Displays the commit history from the HEAD commit backwards until the initial
-    /// commit.
+    /// commit, following the first parent of merge commits.
     /// </summary>
     public static void Log()
     {
@@ -162,13 +231,7 @@ public class Repository
         
         while (true)
         {
-            
-            /*
-             * TODO: Merge case
-             * I think we just need to print out the second parent after merging and
-             * this should be updated in the Commit.ToString() method.
-             */
-            
+            // Merge commits print both parents; the log follows the first one.
             Console.WriteLine("===");
             Console.WriteLine(commit?.ToString());
             Console.WriteLine();
@@ -185,23 +248,47 @@ public class Repository
     }
 
     /// <summary>
-    /// Prints out all the commit in no order.
+    /// Displays the commits of the log that changed PATH, a file or a directory, relative
+    /// to their first parent. The first-parent chain is walked through the commit graph,
+    /// and commits whose changed-path filter rules PATH out are skipped without being
+    /// opened; the others are diffed against their parent.
     /// </summary>
-    public static void GlobalLog()
+    /// <param name="path">File or directory, relative to the working directory.</param>
+    public static void Log(string path)
     {
+        path = Path.GetRelativePath(CWD.FullName, Path.GetFullPath(path, CWD.FullName)).Replace(Path.DirectorySeparatorChar, '/');
+        string prefix = path == "." ? "" : path + "/";
+        Dictionary<string, byte[]> filters = ChangedPaths.Load();
+        using CommitGraph graph = CommitGraph.Load();
 
-        string[] commitDirs = Directory.GetDirectories(COMMITS_DIR.ToString());
-        foreach (var dir in commitDirs)
+        for (string? hash = Gitlite.Commit.GetHeadCommitId(); hash != null; hash = graph.GetFirstParent(hash))
         {
-            foreach (string commitHash in Directory.GetFiles(dir).Select(Path.GetFileName))
+            if (prefix != "" && filters.TryGetValue(hash, out byte[]? filter) && !ChangedPaths.MayContain(filter, path))
+            {
+                continue;
+            }
+
+            Commit commit = Gitlite.Commit.Deserialize(hash);
+            if (ChangedPaths.GetChangedFiles(commit).Any(file => file == path || file.StartsWith(prefix)))
             {
-                Commit commit = Gitlite.Commit.Deserialize(Path.GetFileName(dir) + commitHash);
                 Console.WriteLine("===");
                 Console.WriteLine(commit);
+                Console.WriteLine();
             }
+        }
+    }
 
-            Directory.GetFiles(dir);
-               
+    /// <summary>
+    /// Prints out all the commits in the order they were created, straight from the
+    /// commit catalog.
+    /// </summary>
+    public static void GlobalLog()
+    {
+
+        foreach (CatalogEntry entry in CommitCatalog.DistinctEntries())
+        {
+            Console.WriteLine("===");
+            Console.WriteLine(entry);
         }
     }
 
@@ -211,25 +298,15 @@ public class Repository
     /// <param name="commitMessage">The commit message of the commit being looked for.</param>
     public static void Find(string commitMessage)
     {
-        string[] dirs = Directory.GetDirectories(COMMITS_DIR.ToString());
-        bool matchFound = false;
+        List<CatalogEntry> matches = CommitCatalog.FindByMessage(commitMessage);
 
-        foreach (var dir in dirs)
+        foreach (CatalogEntry entry in matches)
         {
-            foreach (var commitHashRef in Directory.GetFiles(dir).Select(Path.GetFileName))
-            {
-                Commit  commit = Gitlite.Commit.Deserialize(Path.GetFileName(dir) + commitHashRef);
-
-                if (commit.LogMessage.ToLower().Contains(commitMessage.ToLower()))
-                {
-                    Console.WriteLine("===");
-                    Console.WriteLine(commit);
-                    matchFound = true;
-                }
-            }
+            Console.WriteLine("===");
+            Console.WriteLine(entry);
         }
         
-        if (!matchFound)
+        if (matches.Count == 0)
         {
             Console.WriteLine("Found no commit with that message.");
         }
@@ -247,38 +324,26 @@ public class Repository
         StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
         Dictionary<string, string> stagedFiles = stagingArea.GetStagingForAddition();
         Commit currentCommit = Gitlite.Commit.GetHeadCommit();
+        StatCache statCache = StatCache.Load();
         
+        // If a file is not staged and not tracked in the commit, then it's untracked.
+        untrackedFiles.AddRange(GetUntrackedFiles(stagingArea, currentCommit));
         
-        foreach (var file in Directory.GetFiles(CWD.ToString()))
-        { // Checkpoint: Doing untracked and modified case 1
-            string filename = Path.GetFileName(file);
-            
-            if (filename == "Gitlite") continue;
-            
-            if (!stagedFiles.ContainsKey(filename))
+        // Tracked files are checked even if they are ignored, so they are looked up by
+        // name rather than taken from the scan.
+        foreach (var file in currentCommit.FileMapping)
+        {
+            string? hash = GetWorkingFileHash(file.Key, statCache);
+            if (hash == null)
             {
-                // If a file is not staged and not tracked in the commit,
-                // then it's untracked.
-                if (!currentCommit.FileMapping.ContainsKey(filename))
-                {
-                    untrackedFiles.Add(filename);
-                }
-                else if (currentCommit.FileMapping.ContainsKey(filename))
+                if (!stagingArea.GetStagingForRemoval().Contains(file.Key))
                 {
-                    if (!Blob.IsEqualToOtherFile(currentCommit.FileMapping[filename], file)) 
-                    {
-                        Console.WriteLine(filename);
-                        notStagedAndModified.Add(filename + " (modified)");
-                    }
+                    notStagedAndModified.Add(file.Key + " (deleted)");
                 }
             }
-        }
-
-        foreach (var file in currentCommit.FileMapping)
-        {
-            if (!File.Exists(Path.Combine(CWD.ToString(), file.Key)) && !stagingArea.GetStagingForRemoval().Contains(file.Key))
+            else if (!stagedFiles.ContainsKey(file.Key) && hash != file.Value)
             {
-                notStagedAndModified.Add(file.Key + " (deleted)");
+                notStagedAndModified.Add(file.Key + " (modified)");
             }
         }
         
@@ -296,13 +361,15 @@ public class Repository
         foreach (var file in stagedFiles.OrderBy(f => f.Key))
         {
 
+            string? hash = GetWorkingFileHash(file.Key, statCache);
+            
             // Modified: Case 3
-            if (!File.Exists(Path.Combine(CWD.ToString(), file.Key)))
+            if (hash == null)
             {
                 notStagedAndModified.Add(file.Key + " (deleted)");
             }
             // Modified: Case 2
-            else if (!stagingArea.IsStagedFileEqualToOtherFile(file.Value, file.Key))
+            else if (hash != file.Value)
             {
                 notStagedAndModified.Add(file.Key + " (modified stg)");
             }
@@ -329,6 +396,37 @@ public class Repository
         {
             Console.WriteLine(file);
         }
+        
+        // Files rehashed by this run won't be rehashed by the next one.
+        statCache.Save();
+        WorkingTree.SaveVerified();
+    }
+
+    /// <summary>
+    /// Returns the blob hash of a working file, or null if it does not exist. A file the
+    /// file-system monitor vouches for is taken from the stat cache without looking at it;
+    /// any other is stat'ed (and rehashed if its stat data changed), then verified.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    /// <param name="statCache">Stat cache of the command.</param>
+    private static string? GetWorkingFileHash(string file, StatCache statCache)
+    {
+        if (WorkingTree.IsUnchanged(file) && statCache.TryGetEntry(file, out StatEntry cached))
+        {
+            return cached.Hash;
+        }
+
+        string? hash = null;
+        if (File.Exists(Path.Combine(CWD.ToString(), file)))
+        {
+            hash = statCache.GetFileHash(file);
+        }
+        else
+        {
+            statCache.Remove(file);
+        }
+        WorkingTree.Verify(file);
+        return hash;
     }
 
     /// <summary>
@@ -389,8 +487,9 @@ public class Repository
             Utils.ExitWithError("File does not exist in that commit.");
         }
         
-        string fileContentInHeadCommit = Blob.ReadBlobContentAsString(commit.FileMapping[filename]);
-        Utils.WriteContent(filename, fileContentInHeadCommit);
+        Utils.CreateParentDirectory(filename);
+        Blob.WriteBlobToFile(commit.FileMapping[filename], filename);
+        RecordInStatCache(filename, commit.FileMapping[filename]);
     }
 
     private static void CheckoutWithBranch(string branchName)
@@ -405,35 +504,74 @@ public class Repository
         }
         
         // latest commit in the branch to checkout
-        Commit branchToCheckout = Gitlite.Commit.Deserialize(Utils.ReadContentsAsString(branchPath));
+        Commit branchToCheckout = Gitlite.Commit.Deserialize(Gitlite.Branch.ReadRef(branchPath));
         Commit currentHeadCommit = Gitlite.Commit.GetHeadCommit();
         StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
-        List<string> untrackedFiles = GetUntrackedFiles(stagingArea, currentHeadCommit);
         
         // Checking if there is an untracked that would get overwritten as a result of checkout
-        if (HasUntrackedConflict(branchToCheckout.FileMapping, untrackedFiles))
+        if (HasUntrackedConflict(branchToCheckout, currentHeadCommit, stagingArea))
         {
             Utils.ExitWithError("There is an untracked file in the way; delete it, or add and commit it first.");
         }
         
         // Checkout all files from the head of the given branch
-        CheckoutAllFilesWithCommit(branchToCheckout, untrackedFiles, stagingArea);
+        CheckoutAllFilesWithCommit(branchToCheckout, currentHeadCommit, stagingArea);
         
         // Update HEAD
-        Utils.WriteContent(Path.Combine(GITLITE_DIR.ToString(), "HEAD"), $"ref: {branchName}");
+        Gitlite.Branch.UpdateRef(Path.Combine(GITLITE_DIR.ToString(), "HEAD"), $"ref: {branchName}");
     }
 
-    private static void CheckoutAllFilesWithCommit(Commit commit, List<string> untrackedFiles, StagingArea stagingArea)
+    /// <summary>
+    /// Makes the working directory match COMMIT, starting from HEAD. Only the files whose
+    /// content differs from COMMIT are written, and only tracked or staged files missing
+    /// from COMMIT are deleted; untracked files are left alone. Large change sets are
+    /// written by a pool of workers.
+    /// </summary>
+    /// <param name="commit">Commit to check out.</param>
+    /// <param name="head">Current HEAD commit.</param>
+    /// <param name="stagingArea">Staging area, cleared afterwards.</param>
+    private static void CheckoutAllFilesWithCommit(Commit commit, Commit head, StagingArea stagingArea)
     {
-        // Writing files from the checked-out branch commit to the working directory 
-        foreach (var file in commit.FileMapping)
+        StatCache statCache = StatCache.Load();
+        var (filesToWrite, filesToDelete) = DiffForCheckout(commit, head, stagingArea, statCache);
+        
+        // Removing files not present in the checked-out commit first, in case one of them
+        // is in the way of a directory the commit needs.
+        foreach (string file in filesToDelete)
+        {
+            DeleteWorkingFile(file);
+            statCache.Remove(file);
+        }
+        
+        // Writing files that differ from the checked-out commit to the working directory 
+        int workers = GetCheckoutWorkers();
+        if (workers > 1 && filesToWrite.Count >= PARALLEL_CHECKOUT_THRESHOLD)
+        {
+            // Parent directories are created up front, so workers only ever write files.
+            foreach (string? dir in filesToWrite.Select(f => Path.GetDirectoryName(Path.Combine(CWD.ToString(), f.Item1))).Distinct())
+            {
+                if (dir != null) Directory.CreateDirectory(dir);
+            }
+            
+            ParallelOptions options = new ParallelOptions { MaxDegreeOfParallelism = workers };
+            Parallel.ForEach(filesToWrite, options, f => Blob.WriteBlobToFile(f.Item2, Path.Combine(CWD.ToString(), f.Item1)));
+        }
+        else
         {
-            string content = Blob.ReadBlobContentAsString(file.Value);
-            Utils.WriteContent(Path.Combine(CWD.ToString(), file.Key), content);
+            foreach (var (file, hash) in filesToWrite)
+            {
+                string path = Path.Combine(CWD.ToString(), file);
+                Utils.CreateParentDirectory(path);
+                Blob.WriteBlobToFile(hash, path);
+            }
         }
         
-        // Removing files not present in the checked-out branch commit
-        RemoveFilesNotInFileMappingInCwd(commit.FileMapping, untrackedFiles);
+        foreach (var (file, hash) in filesToWrite)
+        {
+            statCache.Record(file, hash);
+        }
+        statCache.Save();
+        WorkingTree.Invalidate();
         
         // Clear the staging area
         stagingArea.Clear();
@@ -445,6 +583,11 @@ public class Repository
     /// <param name="branchName">Name of the branch to be created.</param>
     public static void Branch(string branchName)
     {
+        if (branchName.EndsWith(Utils.TMP_SUFFIX))
+        {
+            Utils.ExitWithError($"A branch name cannot end with {Utils.TMP_SUFFIX}.");
+        }
+        
         if (File.Exists(Path.Combine(BRANCHES.ToString(), branchName)))
         {
             Utils.ExitWithError("A branch with that name already exists.");
@@ -470,7 +613,7 @@ public class Repository
             Utils.ExitWithError("Cannot remove the current branch.");
         }
         
-        File.Delete(path);
+        Gitlite.Branch.DeleteRef(path);
     }
     
     public static void Reset(string commitId)
@@ -479,22 +622,35 @@ public class Repository
         Commit commit = Gitlite.Commit.Deserialize(completeCommitId, "No commit with that id exists.");
         StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
         Commit currentHeadCommit = Gitlite.Commit.GetHeadCommit();
-        List<string> untrackedFiles = GetUntrackedFiles(stagingArea, currentHeadCommit);   
         
         // Check if there's an untracked overwrite conflict error
-        if (HasUntrackedConflict(commit.FileMapping, untrackedFiles))
+        if (HasUntrackedConflict(commit, currentHeadCommit, stagingArea))
         {
             Utils.ExitWithError("There is an untracked file in the way; delete it, or add and commit it first.");
         }
         
         // Checkout all files if there are no untracked files overwrite conflict.
-        CheckoutAllFilesWithCommit(commit, untrackedFiles, stagingArea);
+        CheckoutAllFilesWithCommit(commit, currentHeadCommit, stagingArea);
         
         // Update branch pointer
         string branch = Gitlite.Branch.GetActiveBranch() ?? throw new InvalidOperationException("Not in a branch.");
-        Utils.WriteContent(Path.Combine(BRANCHES.ToString(), branch), completeCommitId);
+        if (!Gitlite.Branch.CompareAndSwapRef(Path.Combine(BRANCHES.ToString(), branch), currentHeadCommit.Hash, completeCommitId))
+        {
+            Utils.ExitWithError($"Branch {branch} was moved by another command.");
+        }
     }
     
+    /// <summary>
+    /// Merges the given branch into the current one and commits the result with both
+    /// branch heads as parents.
+    ///
+    /// Every path is classified by comparing its blob hash at the split point, in the
+    /// current branch and in the given branch, from a diff of their trees; file contents
+    /// are only read for the files both branches changed in different ways, which are then
+    /// merged line by line. Regions changed on both sides become conflicts, written with
+    /// markers and committed as they are.
+    /// </summary>
+    /// <param name="branchName">Name of the branch to merge into the current one.</param>
     public static void Merge(string branchName)
     {
         StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
@@ -522,13 +678,498 @@ public class Repository
         }
         
         // Check first if an untracked file would get deleted or overwritten
-        if (HasMergeUntrackedConflict(givenBranchHead, splitPoint))
+        if (HasMergeUntrackedConflict(givenBranchHead, splitPoint, stagingArea, currBranchHead))
+        {
+            Utils.ExitWithError("There is an untracked file in the way; delete it, or add and commit it first.");
+        }
+        
+        string branch = Gitlite.Branch.GetActiveBranch()!;
+        string branchPath = Path.Combine(BRANCHES.ToString(), branch);
+        if (currBranchHead.Hash == splitPoint.Hash)
+        {
+            CheckoutAllFilesWithCommit(givenBranchHead, currBranchHead, stagingArea);
+            if (!Gitlite.Branch.CompareAndSwapRef(branchPath, currBranchHead.Hash, givenBranchHead.Hash))
+            {
+                Utils.ExitWithError($"Branch {branch} was moved by another command.");
+            }
+            Console.WriteLine("Current branch fast-forwarded.");
+            return;
+        }
+        
+        // Blob hash of every path the current branch changed since the split point (null
+        // if it was deleted).
+        Dictionary<string, string?> currentChanges = new Dictionary<string, string?>();
+        foreach (var (file, _, hash) in splitPoint.DiffTo(currBranchHead))
+        {
+            currentChanges[file] = hash;
+        }
+        
+        Dictionary<string, string> filesToWrite = new Dictionary<string, string>();
+        Dictionary<string, byte[]> mergedContents = new Dictionary<string, byte[]>();
+        List<string> filesToDelete = new List<string>();
+        int conflicts = 0;
+        foreach (var (file, splitHash, givenHash) in splitPoint.DiffTo(givenBranchHead))
+        {
+            if (!currentChanges.TryGetValue(file, out string? currentHash))
+            {
+                // Only changed in the given branch: take its version.
+                if (givenHash == null) filesToDelete.Add(file);
+                else filesToWrite[file] = givenHash;
+            }
+            else if (currentHash != givenHash)
+            {
+                // Changed differently in both branches: merge the contents.
+                byte[] merged = MergeContents(splitHash, currentHash, givenHash, branchName, out int fileConflicts);
+                conflicts += fileConflicts;
+                string hash = Utils.HashBytes(merged);
+                filesToWrite[file] = hash;
+                mergedContents[hash] = merged;
+            }
+        }
+        
+        if (filesToWrite.Count == 0 && filesToDelete.Count == 0)
+        {
+            Utils.ExitWithError("No changes added to the commit.");
+        }
+        
+        StatCache statCache = StatCache.Load();
+        foreach (string file in filesToDelete)
+        {
+            if (File.Exists(Path.Combine(CWD.ToString(), file)))
+            {
+                DeleteWorkingFile(file);
+            }
+            statCache.Remove(file);
+        }
+        
+        foreach (var (file, hash) in filesToWrite)
+        {
+            string path = Path.Combine(CWD.ToString(), file);
+            Utils.CreateParentDirectory(path);
+            if (mergedContents.TryGetValue(hash, out byte[]? merged))
+            {
+                Blob.SaveBlob(merged, hash);
+                Utils.WriteContent(path, merged);
+            }
+            else
+            {
+                Blob.WriteBlobToFile(hash, path);
+            }
+            statCache.Record(file, hash);
+        }
+        statCache.Save();
+        WorkingTree.Invalidate();
+        
+        string rootTree = Tree.Update(currBranchHead.GetRootTree(), filesToWrite, filesToDelete);
+        string hashRef = Gitlite.Commit.CreateCommit($"Merged {branchName} into {branch}.", DateTime.Now, rootTree,
+            currBranchHead.Hash, givenBranchHead.Hash);
+        if (!Gitlite.Branch.CompareAndSwapRef(branchPath, currBranchHead.Hash, hashRef))
+        {
+            Utils.ExitWithError($"Branch {branch} was moved by another command; commit {hashRef[..7]} is not on it.");
+        }
+        
+        if (conflicts > 0)
+        {
+            Console.WriteLine("Encountered a merge conflict.");
+        }
+    }
+    
+    /// <summary>
+    /// Merges the versions of a file changed differently on both sides of a merge. Text is
+    /// merged line by line; binary content (anything with a NUL byte) is treated as a
+    /// single line, so it conflicts as a whole. The bytes are split at '\n' as they are,
+    /// whatever their encoding, so merged content is byte-for-byte what both sides wrote.
+    /// </summary>
+    /// <param name="baseHash">Blob at the split point, or null if absent.</param>
+    /// <param name="oursHash">Blob in the current branch, or null if absent.</param>
+    /// <param name="theirsHash">Blob in the given branch, or null if absent.</param>
+    /// <param name="branchName">Name of the given branch, for the conflict markers.</param>
+    /// <param name="conflicts">Number of conflicting regions.</param>
+    /// <returns>The merged content.</returns>
+    private static byte[] MergeContents(string? baseHash, string? oursHash, string? theirsHash, string branchName,
+        out int conflicts)
+    {
+        // Latin-1 maps each byte to one char and back, so lines are merged as raw bytes.
+        System.Text.Encoding bytes = System.Text.Encoding.Latin1;
+        string[] versions = new[] { baseHash, oursHash, theirsHash }
+            .Select(hash => hash == null ? "" : bytes.GetString(ObjectStore.Read(BLOBS_DIR, hash)))
+            .ToArray();
+        
+        List<string>[] lines = versions.Any(content => content.Contains('\0'))
+            ? versions.Select(content => content.Length == 0 ? new List<string>() : new List<string> { content }).ToArray()
+            : versions.Select(LineDiff.SplitLines).ToArray();
+        
+        // The branch name goes into the markers as UTF-8, like any other text.
+        string theirsLabel = bytes.GetString(System.Text.Encoding.UTF8.GetBytes(branchName));
+        string merged = LineDiff.Merge(lines[0], lines[1], lines[2], "HEAD", theirsLabel, out conflicts);
+        return bytes.GetBytes(merged);
+    }
+    
+    /// <summary>
+    /// Folds all loose blobs and commits into their packs, so that a repository with many
+    /// objects is stored as a handful of files instead of one file per object.
+    /// </summary>
+    public static void Repack()
+    {
+        var (blobs, blobBytes) = Pack.Repack(BLOBS_DIR);
+        var (trees, treeBytes) = Pack.Repack(TREES_DIR);
+        var (commits, commitBytes) = Pack.Repack(COMMITS_DIR);
+        var (chunks, chunkBytes) = Pack.Repack(CHUNKS_DIR);
+        Console.WriteLine($"Packed {blobs} blobs ({blobBytes} bytes), {trees} trees ({treeBytes} bytes), " +
+                          $"{commits} commits ({commitBytes} bytes) and {chunks} chunks ({chunkBytes} bytes).");
+    }
+    
+    /// <summary>
+    /// Prints the number of blobs, trees and commits, loose and packed, along with their raw size
+    /// and the size they take on disk after compression.
+    /// </summary>
+    public static void CountObjects()
+    {
+        foreach (var (name, objectsDir) in new[] { ("blobs", BLOBS_DIR), ("trees", TREES_DIR), ("commits", COMMITS_DIR), ("chunks", CHUNKS_DIR) })
+        {
+            int loose = ObjectStore.EnumerateLoose(objectsDir).Count();
+            int count = 0;
+            long rawSize = 0, storedSize = 0;
+            foreach (string hash in ObjectStore.EnumerateHashes(objectsDir))
+            {
+                using Stream stored = ObjectStore.OpenStored(objectsDir, hash);
+                storedSize += stored.Length;
+                rawSize += ObjectStore.ReadRawLength(stored);
+                count++;
+            }
+
+            Console.WriteLine($"{name}: {count} ({loose} loose, {count - loose} packed)");
+            Console.WriteLine($"  raw size: {rawSize} bytes");
+            Console.WriteLine($"  stored size: {storedSize} bytes");
+        }
+    }
+    
+    /// <summary>
+    /// Deletes the loose objects that are not reachable from any branch, HEAD or the staging
+    /// area and are older than the grace period, then prints how many were deleted, the
+    /// bytes freed and the time taken. Packed objects are kept.
+    /// </summary>
+    /// <param name="gracePeriod">Minimum age of a deleted object.</param>
+    public static void Gc(TimeSpan gracePeriod)
+    {
+        Stopwatch stopwatch = Stopwatch.StartNew();
+        HashSet<UInt128> marked = GarbageCollector.Mark();
+
+        int pruned = 0, kept = 0;
+        long freed = 0;
+        foreach (DirectoryInfo objectsDir in new[] { BLOBS_DIR, TREES_DIR, COMMITS_DIR, CHUNKS_DIR })
+        {
+            var (dirPruned, dirFreed, dirKept) = GarbageCollector.Prune(objectsDir, marked, gracePeriod);
+            pruned += dirPruned;
+            freed += dirFreed;
+            kept += dirKept;
+
+            // The catalog and the other side files must not list deleted commits.
+            if (objectsDir == COMMITS_DIR && dirPruned > 0)
+            {
+                CommitCatalog.Rebuild();
+                CommitGraph.Rebuild();
+                ChangedPaths.Prune();
+            }
+        }
+
+        Console.WriteLine($"Marked {marked.Count} reachable objects.");
+        Console.WriteLine($"Removed {pruned} unreachable objects ({freed} bytes) in {stopwatch.ElapsedMilliseconds} ms.");
+        if (kept > 0)
+        {
+            Console.WriteLine($"Kept {kept} unreachable objects newer than the grace period.");
+        }
+    }
+
+    /// <summary>
+    /// Writes the changed-path filters of the commits that have none, e.g. those made
+    /// before filters existed or fetched from another repository.
+    /// </summary>
+    public static void WriteChangedPaths()
+    {
+        Stopwatch stopwatch = Stopwatch.StartNew();
+        int written = ChangedPaths.Backfill();
+        Console.WriteLine($"Wrote changed-path filters for {written} commits in {stopwatch.ElapsedMilliseconds} ms.");
+    }
+    
+    /// <summary>
+    /// Creates a repository in the current working directory as a copy of the one at PATH,
+    /// with all its objects and branches, and checks out its HEAD. Loose objects are
+    /// hard-linked rather than copied where possible.
+    /// </summary>
+    /// <param name="path">Working directory of the repository to clone.</param>
+    public static void Clone(string path)
+    {
+        if (GitliteAlreadyInitialized())
+        {
+            Utils.ExitWithError("A Gitlet version-control system already exists in the current directory.");
+        }
+
+        DirectoryInfo source = ObjectTransfer.OpenRepository(path);
+        CreateDirs();
+        ObjectTransfer transfer = new ObjectTransfer(source, GITLITE_DIR);
+        transfer.CopyAll();
+
+        foreach (string branch in Gitlite.Branch.GetExistingBranches(Utils.JoinDirectory(source, BRANCHES.Name)))
         {
+            Gitlite.Branch.CreateBranch(branch, Utils.ReadContentsAsString(Path.Combine(source.FullName, BRANCHES.Name, branch)));
+        }
+        Gitlite.Branch.UpdateRef(Path.Combine(GITLITE_DIR.ToString(), "HEAD"), Utils.ReadContentsAsString(Path.Combine(source.FullName, "HEAD")));
+
+        // The source's catalog and filters cover exactly the commits just transferred.
+        foreach (string file in new[] { CommitCatalog.CATALOG, CommitCatalog.CATALOG_INDEX, CommitCatalog.CATALOG_TOKENS, ChangedPaths.CHANGED_PATHS })
+        {
+            string sourceFile = Path.Combine(source.FullName, Path.GetFileName(file));
+            if (File.Exists(sourceFile))
+            {
+                File.Copy(sourceFile, file, true);
+            }
+        }
+
+        // Checked out as if from a commit without files, so every file is written.
+        Commit head = Gitlite.Commit.GetHeadCommit();
+        Commit empty = new Commit("", DateTime.UnixEpoch, null, null);
+        StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
+        if (HasUntrackedConflict(head, empty, stagingArea))
+        {
+            GITLITE_DIR.Delete(true);
             Utils.ExitWithError("There is an untracked file in the way; delete it, or add and commit it first.");
         }
+        CheckoutAllFilesWithCommit(head, empty, stagingArea);
+
+        Console.WriteLine($"Cloned {path} into {CWD}");
+        PrintTransfer(transfer);
+    }
+
+    /// <summary>
+    /// Copies BRANCH of the repository at PATH into the branch of the same name here,
+    /// creating it if needed. Only the commits this repository does not have are copied,
+    /// with the trees and blobs they need. An existing branch is only moved forward, and
+    /// the current branch is never updated, as its files would no longer match it.
+    /// </summary>
+    /// <param name="path">Working directory of the repository to fetch from.</param>
+    /// <param name="branchName">Branch to fetch.</param>
+    public static void Fetch(string path, string branchName)
+    {
+        DirectoryInfo remote = ObjectTransfer.OpenRepository(path);
+        string remoteRef = Path.Combine(remote.FullName, BRANCHES.Name, branchName);
+        if (!File.Exists(remoteRef))
+        {
+            Utils.ExitWithError("No such branch exists.");
+        }
+        if (Gitlite.Branch.IsCurrentBranch(branchName))
+        {
+            Utils.ExitWithError("Cannot fetch into the current branch.");
+        }
+
+        string tip = Utils.ReadContentsAsString(remoteRef);
+        string branchPath = Path.Combine(BRANCHES.ToString(), branchName);
+        string? old = Gitlite.Branch.Exists(branchPath) ? Gitlite.Branch.ReadRef(branchPath) : null;
+
+        ObjectTransfer transfer = new ObjectTransfer(remote, GITLITE_DIR);
+        foreach (Commit commit in transfer.CopyHistory(tip))
+        {
+            CommitCatalog.Append(commit);
+        }
+
+        if (old != null && old != tip)
+        {
+            using CommitGraph graph = CommitGraph.Load();
+            if (!graph.IsAncestor(old, tip))
+            {
+                Utils.ExitWithError($"Branch {branchName} has commits that are not in the fetched branch; not a fast-forward.");
+            }
+        }
+
+        if (old == null)
+        {
+            Gitlite.Branch.CreateBranch(branchName, tip);
+        }
+        else if (!Gitlite.Branch.CompareAndSwapRef(branchPath, old, tip))
+        {
+            Utils.ExitWithError($"Branch {branchName} was moved by another command.");
+        }
+
+        PrintTransfer(transfer);
+        PrintBranchUpdate(branchName, old, tip);
+    }
+
+    /// <summary>
+    /// Copies BRANCH into the branch of the same name of the repository at PATH, creating
+    /// it if needed. Only the commits that repository does not have are copied, with the
+    /// trees and blobs they need, under its repository lock. Its branch is only moved
+    /// forward, and never if it is checked out there.
+    /// </summary>
+    /// <param name="path">Working directory of the repository to push to.</param>
+    /// <param name="branchName">Branch to push.</param>
+    public static void Push(string path, string branchName)
+    {
+        DirectoryInfo remote = ObjectTransfer.OpenRepository(path);
+        string branchPath = Path.Combine(BRANCHES.ToString(), branchName);
+        if (!Gitlite.Branch.Exists(branchPath))
+        {
+            Utils.ExitWithError("No such branch exists.");
+        }
+        string tip = Gitlite.Branch.ReadRef(branchPath);
+
+        using IDisposable remoteLock = RepositoryLock.AcquireOther(remote);
+        if (Utils.ReadContentsAsString(Path.Combine(remote.FullName, "HEAD")) == $"ref: {branchName}")
+        {
+            Utils.ExitWithError($"Cannot push to the current branch of {path}.");
+        }
+
+        string remoteRef = Path.Combine(remote.FullName, BRANCHES.Name, branchName);
+        string? old = File.Exists(remoteRef) ? Utils.ReadContentsAsString(remoteRef) : null;
+        if (old != null && old != tip)
+        {
+            // The remote branch must be in this repository's history.
+            using CommitGraph graph = CommitGraph.Load();
+            if (!ObjectStore.Exists(COMMITS_DIR, old) || !graph.IsAncestor(old, tip))
+            {
+                Utils.ExitWithError($"Branch {branchName} of {path} has commits that are not in the local branch; not a fast-forward.");
+            }
+        }
+
+        ObjectTransfer transfer = new ObjectTransfer(GITLITE_DIR, remote);
+        CommitCatalog.AppendTo(remote, transfer.CopyHistory(tip));
+        Utils.WriteContent(remoteRef, tip);
+
+        PrintTransfer(transfer);
+        PrintBranchUpdate(branchName, old, tip);
+    }
+
+    private static void PrintTransfer(ObjectTransfer transfer)
+    {
+        Console.WriteLine($"Transferred {transfer.Objects} objects ({transfer.Bytes} bytes), {transfer.Linked} of them hard-linked.");
+    }
+
+    private static void PrintBranchUpdate(string branchName, string? old, string tip)
+    {
+        if (old == null)
+        {
+            Console.WriteLine($"Created branch {branchName} at {tip[..7]}.");
+        }
+        else if (old == tip)
+        {
+            Console.WriteLine($"Branch {branchName} is already up to date.");
+        }
+        else
+        {
+            Console.WriteLine($"Updated branch {branchName}: {old[..7]}..{tip[..7]}");
+        }
+    }
+
+    /// <summary>
+    /// Shows changes to tracked files as unified diffs. Has three use cases:
+    /// 1. diff
+    ///         - working directory against the staging area (HEAD plus staged changes)
+    /// 2. diff --staged
+    ///         - staging area against HEAD
+    /// 3. diff [commit] [commit]
+    ///         - between two commits, given as branch names or commit ids
+    /// Files are compared by blob hash first, so identical files are never read.
+    /// </summary>
+    /// <param name="args"></param>
+    public static void Diff(string[] args)
+    {
+        if (args.Length == 3)
+        {
+            Commit from = Gitlite.Commit.Deserialize(ResolveCommit(args[1]));
+            Commit to = Gitlite.Commit.Deserialize(ResolveCommit(args[2]));
+            foreach (var (file, oldHash, newHash) in from.DiffTo(to))
+            {
+                PrintBlobDiff(file, oldHash, newHash);
+            }
+            return;
+        }
         
+        StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
+        Commit head = Gitlite.Commit.GetHeadCommit();
+        Dictionary<string, string> stagedFiles = stagingArea.GetStagingForAddition();
+        
+        if (args.Length == 2 && args[1] is "--staged" or "--cached")
+        {
+            foreach (string file in stagedFiles.Keys.Union(stagingArea.GetStagingForRemoval()).Order(StringComparer.Ordinal))
+            {
+                string? oldHash = head.FileMapping.GetValueOrDefault(file);
+                string? newHash = stagedFiles.GetValueOrDefault(file);
+                if (oldHash != newHash)
+                {
+                    PrintBlobDiff(file, oldHash, newHash);
+                }
+            }
+            return;
+        }
+        
+        if (args.Length != 1)
+        {
+            Utils.ExitWithError("Usage: diff [--staged | [commit] [commit]]");
+        }
+        
+        Dictionary<string, string> stagedVersions = new Dictionary<string, string>(head.FileMapping);
+        stagingArea.GetStagingForRemoval().ForEach(file => stagedVersions.Remove(file));
+        foreach (var (file, hash) in stagedFiles)
+        {
+            stagedVersions[file] = hash;
+        }
+        
+        StatCache statCache = StatCache.Load();
+        foreach (var (file, hash) in stagedVersions.OrderBy(f => f.Key, StringComparer.Ordinal))
+        {
+            string path = Path.Combine(CWD.ToString(), file);
+            if (!File.Exists(path))
+            {
+                UnifiedDiff.Print(file, () => ObjectStore.OpenRead(BLOBS_DIR, hash), null);
+            }
+            else if (statCache.GetFileHash(file) != hash)
+            {
+                UnifiedDiff.Print(file, () => ObjectStore.OpenRead(BLOBS_DIR, hash),
+                    () => new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, Utils.BUFFER_SIZE));
+            }
+        }
+        statCache.Save();
+    }
+    
+    /// <summary>
+    /// Prints the diff between two blobs of a file, either of which may be absent.
+    /// </summary>
+    private static void PrintBlobDiff(string file, string? oldHash, string? newHash)
+    {
+        UnifiedDiff.Print(file,
+            oldHash == null ? null : () => ObjectStore.OpenRead(BLOBS_DIR, oldHash),
+            newHash == null ? null : () => ObjectStore.OpenRead(BLOBS_DIR, newHash));
+    }
+    
+    /// <summary>
+    /// Prints the latest common ancestor of two commits or branches.
+    /// </summary>
+    /// <param name="first">Branch name or commit id.</param>
+    /// <param name="second">Branch name or commit id.</param>
+    public static void MergeBase(string first, string second)
+    {
+        using CommitGraph graph = CommitGraph.Load();
+        string? mergeBase = graph.MergeBase(ResolveCommit(first), ResolveCommit(second));
+        if (mergeBase == null)
+        {
+            Utils.ExitWithError("The commits share no history.");
+        }
         
+        Console.WriteLine(mergeBase);
+    }
 
+    /// <summary>
+    /// Exits successfully if ANCESTOR is an ancestor of DESCENDANT, and with an error
+    /// otherwise. Nothing is printed, so it can be used in scripts.
+    /// </summary>
+    /// <param name="ancestor">Branch name or commit id.</param>
+    /// <param name="descendant">Branch name or commit id.</param>
+    public static void IsAncestor(string ancestor, string descendant)
+    {
+        using CommitGraph graph = CommitGraph.Load();
+        if (!graph.IsAncestor(ResolveCommit(ancestor), ResolveCommit(descendant)))
+        {
+            Utils.ExitWithError(null);
+        }
     }
     
     private static void ValidateCheckoutSeparator(string[] args, int index)
@@ -547,6 +1188,7 @@ public class Repository
         GITLITE_DIR.Create();
         COMMITS_DIR.Create();
         BLOBS_DIR.Create();
+        TREES_DIR.Create();
         BRANCHES.Create();
         StagingArea.CreateStagingArea();
     }
@@ -565,7 +1207,7 @@ public class Repository
     /// </summary>
     /// <param name="stagingArea">Staging area object.</param>
     /// <param name="head">HEAD commit object.</param>
-    /// <returns>A list of untracked files if there's any. Returns null otherwise</returns>
+    /// <returns>A list of the untracked files, from the working tree scan.</returns>
     private static List<string> GetUntrackedFiles(StagingArea? stagingArea = null, Commit? head = null)
     {
         if (stagingArea == null)
@@ -578,17 +1220,58 @@ public class Repository
             head = Gitlite.Commit.GetHeadCommit();
         }
 
-        List<string> files = new List<string>();
+        return WorkingTree.Scan().Where(file => IsFileUntracked(file, stagingArea, head)).ToList();
+    }
+
+    /// <summary>
+    /// Expands the paths given to add into file names relative to the working directory.
+    /// Directories expand to the files of the working tree scan below them, so ignored
+    /// files are only added when given explicitly.
+    /// </summary>
+    /// <param name="paths">Files and directories to add.</param>
+    /// <returns>A sorted list of distinct file names.</returns>
+    private static List<string> CollectFilesToAdd(string[] paths)
+    {
+        SortedSet<string> fileNames = new SortedSet<string>(StringComparer.Ordinal);
         
-        foreach (var file in Directory.GetFiles(CWD.ToString()).Select(Path.GetFileName))
-        {   // An untracked file exists in the current branch.
-            if (file != GITLITE && IsFileUntracked(file, stagingArea, head))
+        foreach (string path in paths)
+        {
+            string fullPath = Path.GetFullPath(path);
+            if (File.Exists(fullPath))
+            {
+                fileNames.Add(ToFileName(fullPath));
+            }
+            else if (Directory.Exists(fullPath))
             {
-                files.Add(file);
+                string dirName = ToFileName(fullPath);
+                string prefix = dirName == "." ? "" : dirName + "/";
+                fileNames.UnionWith(WorkingTree.Scan().Where(file => file.StartsWith(prefix, StringComparison.Ordinal)));
+            }
+            else
+            {
+                Utils.ExitWithError("File does not exist.");
             }
         }
+        
+        return fileNames.ToList();
+    }
+
+    /// <summary>
+    /// Converts a path to the file name Gitlite tracks it under: relative to the working
+    /// directory, with '/' as separator.
+    /// </summary>
+    private static string ToFileName(string path)
+    {
+        return Path.GetRelativePath(CWD.ToString(), path).Replace(Path.DirectorySeparatorChar, '/');
+    }
 
-        return files;
+    /// <summary>
+    /// Checks whether the blob of a file with the given content hash is already stored,
+    /// either because it is tracked by the current commit or staged with that content.
+    /// </summary>
+    private static bool IsBlobStoredFor(string fileName, string hash, Commit currentCommit)
+    {
+        return currentCommit.FileMapping.GetValueOrDefault(fileName) == hash || ObjectStore.Exists(BLOBS_DIR, hash);
     }
 
     private static bool IsFileUntracked(string file, StagingArea stagingArea, Commit currHeadCommit)
@@ -597,19 +1280,113 @@ public class Repository
     }
 
     /// <summary>
-    /// A helper method that removes all files in the CWD that are not in the given
-    /// FILE MAPPING.
+    /// Computes what checking out COMMIT has to change in the working directory, from a
+    /// diff of the trees of HEAD and COMMIT that skips identical subtrees. A file tracked
+    /// with the same blob by both is only rewritten if it is staged or its working copy
+    /// was modified, which the stat cache answers without reading it in the common case.
     /// </summary>
-    /// <param name="fileMapping">File mapping of files to not be removed in the CWD.</param>
-    private static void RemoveFilesNotInFileMappingInCwd(Dictionary<string, string> fileMapping, List<string> untrackedFiles)
+    /// <param name="commit">Commit to check out.</param>
+    /// <param name="head">Current HEAD commit.</param>
+    /// <param name="stagingArea">Staging area; staged files count as tracked.</param>
+    /// <param name="statCache">Stat cache of the working files.</param>
+    /// <returns>The files to write with their blob hash, and the files to delete.</returns>
+    private static (List<(string, string)>, List<string>) DiffForCheckout(Commit commit, Commit head,
+        StagingArea stagingArea, StatCache statCache)
     {
-        foreach (var file in Directory.GetFiles(CWD.ToString()).Select(Path.GetFileName))
+        Dictionary<string, string> stagedFiles = stagingArea.GetStagingForAddition();
+        List<(string, string)> filesToWrite = new List<(string, string)>();
+        List<string> filesToDelete = new List<string>();
+        
+        HashSet<string> changedFiles = new HashSet<string>();
+        
+        foreach (var (file, _, hash) in head.DiffTo(commit))
+        {
+            changedFiles.Add(file);
+            if (hash != null)
+            {
+                filesToWrite.Add((file, hash));
+            }
+            else if (File.Exists(Path.Combine(CWD.ToString(), file)))
+            {
+                filesToDelete.Add(file);
+            }
+        }
+        
+        foreach (var (file, hash) in commit.FileMapping)
         {
-            if (!fileMapping.ContainsKey(file) && !untrackedFiles.Contains(file) && file != GITLITE)
+            bool unchanged = changedFiles.Contains(file)
+                             || (!stagedFiles.ContainsKey(file)
+                                 && File.Exists(Path.Combine(CWD.ToString(), file))
+                                 && statCache.GetFileHash(file) == hash);
+            if (!unchanged)
             {
-                File.Delete(file);
+                filesToWrite.Add((file, hash));
             }
         }
+
+        // Files staged for addition only, which neither commit tracks.
+        foreach (string file in stagedFiles.Keys)
+        {
+            if (!commit.FileMapping.ContainsKey(file) && !head.FileMapping.ContainsKey(file)
+                && File.Exists(Path.Combine(CWD.ToString(), file)))
+            {
+                filesToDelete.Add(file);
+            }
+        }
+
+        return (filesToWrite, filesToDelete);
+    }
+
+    /// <summary>
+    /// Returns the number of workers checkout writes files with, from GITLITE_CHECKOUT_WORKERS
+    /// if set. Program checks the setting before any command runs, so a bad one never
+    /// stops a checkout halfway.
+    /// </summary>
+    public static int GetCheckoutWorkers()
+    {
+        string? setting = Environment.GetEnvironmentVariable(CHECKOUT_WORKERS_ENV);
+        if (setting == null)
+        {
+            return Environment.ProcessorCount;
+        }
+
+        if (!int.TryParse(setting, out int workers) || workers < 1)
+        {
+            Utils.ExitWithError($"{CHECKOUT_WORKERS_ENV} must be a positive number.");
+        }
+
+        return workers;
+    }
+
+    /// <summary>
+    /// Deletes a working file, then any parent directories it leaves empty.
+    /// </summary>
+    /// <param name="fileName">File name relative to the working directory.</param>
+    private static void DeleteWorkingFile(string fileName)
+    {
+        string path = Path.Combine(CWD.ToString(), fileName);
+        File.Delete(path);
+        
+        string? dir = Path.GetDirectoryName(path);
+        while (dir != null && Path.GetFullPath(dir) != CWD.FullName.TrimEnd(Path.DirectorySeparatorChar)
+               && !Directory.EnumerateFileSystemEntries(dir).Any())
+        {
+            Directory.Delete(dir);
+            dir = Path.GetDirectoryName(dir);
+        }
+    }
+    
+    /// <summary>
+    /// Records the blob hash of a working file that was just hashed or written in the
+    /// stat cache, so the next status does not need to rehash it.
+    /// </summary>
+    /// <param name="fileName">File name relative to the working directory.</param>
+    /// <param name="hash">Blob hash of the file content.</param>
+    private static void RecordInStatCache(string fileName, string hash)
+    {
+        StatCache statCache = StatCache.Load();
+        statCache.Record(fileName, hash);
+        statCache.Save();
     }
 
     /// <summary>
@@ -640,17 +1417,20 @@ public class Repository
     //     }
     // }
 
-    private static bool HasUntrackedConflict(Dictionary<string, string> fileMapping, List<string> untrackedFiles)
+    /// <summary>
+    /// Checks if checking out COMMIT would overwrite a file that is neither tracked by HEAD
+    /// nor staged. Only the files of COMMIT are looked up, never the whole working directory.
+    /// </summary>
+    private static bool HasUntrackedConflict(Commit commit, Commit head, StagingArea stagingArea)
     {
-        if (untrackedFiles.Count > 0 && FileExistsInFileMapping(fileMapping, untrackedFiles))
-        {
-            return true;
-        }
-
-        return false;
+        return commit.FileMapping.Keys.Any(file =>
+            file != GITLITE
+            && IsFileUntracked(file, stagingArea, head)
+            && File.Exists(Path.Combine(CWD.ToString(), file)));
     }
 
-    private static bool HasMergeUntrackedConflict(Commit givenBranchHead, Commit splitPoint)
+    private static bool HasMergeUntrackedConflict(Commit givenBranchHead, Commit splitPoint,
+        StagingArea stagingArea, Commit currentHeadCommit)
     {
         // A merge would cause a delete conflict with an untracked file if:
         // - the file does is absent (untracked/unstaged) in both branches but exists in the split point
@@ -659,9 +1439,6 @@ public class Repository
         
         // And an overwrite conflict if:
         // - the file exists in the given branch
-        
-        StagingArea stagingArea = StagingArea.GetDeserializedStagingArea();
-        Commit currentHeadCommit = Gitlite.Commit.GetHeadCommit();
 
         foreach (string file in GetUntrackedFiles(stagingArea, currentHeadCommit))
         {
@@ -678,45 +1455,39 @@ public class Repository
     /// <summary>
     /// Given two branches, finds the split point in the commit tree.
     /// THe split point of the two branches is their latest common ancestor in
-    /// the commit tree.
+    /// the commit tree, following both parents of merge commits. The search runs on the
+    /// commit graph, so no commit objects are opened along the way.
     /// </summary>
     /// <param name="currentBranch">Current branch head.</param>
     /// <param name="givenBranch">Given branch head.</param>
-    /// <returns></returns>
+    /// <returns>The split point commit.</returns>
     private static Commit FindSplitPoint(Commit currentBranch, Commit givenBranch) 
     {
-        // Store all the commits of one of the branches in a hashset.
-        // Doesn't matter which. Here I am choosing the given branch.
-        // Since we are mainly concerned in lookups, hashset is better
-        // than a list.
-        HashSet<string> givenBranchCommits = new HashSet<string>();
-        Commit pointer = givenBranch;
-        while (pointer.ParentHashRef != null)
+        using CommitGraph graph = CommitGraph.Load();
+        
+        // All commits share the initial commit, so there always is a split point.
+        string splitPoint = graph.MergeBase(currentBranch.Hash, givenBranch.Hash)!;
+        return Gitlite.Commit.Deserialize(splitPoint);
+    }
+    
+    /// <summary>
+    /// Resolves a branch name or a (possibly short) commit id to a full commit hash.
+    /// </summary>
+    /// <param name="branchOrCommitId">Branch name or commit id.</param>
+    /// <returns>Full hash of the commit.</returns>
+    private static string ResolveCommit(string branchOrCommitId)
+    {
+        if (Gitlite.Branch.Exists(branchOrCommitId))
         {
-            givenBranchCommits.Add(pointer.Hash);
-            pointer = Gitlite.Commit.Deserialize(pointer.ParentHashRef);
+            return Gitlite.Branch.ReadRef(Path.Combine(BRANCHES.ToString(), branchOrCommitId));
         }
-        // This is the initial commit. Remember, the initial commit is always
-        // created when we initialize a gitlite repo. (I think this is not
-        // necessary. We'll just return it anyway once we reached the end of the
-        // other branch's commit history)
-        givenBranchCommits.Add(pointer.Hash);
-        
-        // Now we can traverse the other branch from the latest commit backwards
-        // and see if there exists a (latest) common ancestor.
-        pointer = currentBranch;
-        while (pointer.ParentHashRef != null)
+
+        string? hash = Gitlite.Commit.FindCompleteHash(branchOrCommitId);
+        if (hash == null || !ObjectStore.Exists(COMMITS_DIR, hash))
         {
-            if (givenBranchCommits.Contains(pointer.Hash))
-            {
-                return pointer;
-            }
-            pointer = Gitlite.Commit.Deserialize(pointer.ParentHashRef);
+            Utils.ExitWithError("No commit with that id exists.");
         }
-        // Otherwise, we reach the initial commit here. Since we know for a fact
-        // that all commits share the initial commit. If we did not find
-        // any common ancestor before that, it means the common ancestor is the initial
-        // commit.
-        return pointer;
+
+        return hash!;
     }
-}
+}
\ No newline at end of file
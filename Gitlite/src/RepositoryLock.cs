@@ -0,0 +1,137 @@
+namespace Gitlite;
+
+/// <summary>
+/// Exclusive lock held by commands that modify the repository, so that writers run one
+/// at a time. Readers never take it: every file is replaced by an atomic rename, so they
+/// always see either the old or the new version.
+///
+/// The lock is an OS file lock on .gitlite/lock rather than the existence of the file, so
+/// it is released when its process exits, even after a crash. A process can take it more
+/// than once (e.g. a batch and the commands it runs); it is released with the last
+/// Dispose.
+/// </summary>
+public sealed class RepositoryLock : IDisposable
+{
+    public static string LOCK = Path.Combine(Repository.GITLITE_DIR.ToString(), "lock");
+    public const string TIMEOUT_ENV = "GITLITE_LOCK_TIMEOUT";
+
+    private static readonly TimeSpan DEFAULT_TIMEOUT = TimeSpan.FromSeconds(60);
+    private static readonly TimeSpan MAX_RETRY_DELAY = TimeSpan.FromMilliseconds(100);
+
+    private static FileStream? _file;
+    private static int _depth;
+
+    private bool _disposed;
+
+    private RepositoryLock()
+    {
+    }
+
+    /// <summary>
+    /// Whether this process holds the lock.
+    /// </summary>
+    public static bool IsHeld => _depth > 0;
+
+    /// <summary>
+    /// Takes the lock, waiting for the process holding it for up to GITLITE_LOCK_TIMEOUT
+    /// seconds (60 by default).
+    /// </summary>
+    public static RepositoryLock Acquire()
+    {
+        return WaitFor(TryAcquire);
+    }
+
+    /// <summary>
+    /// Takes the lock if no other process holds it, without waiting.
+    /// </summary>
+    /// <returns>The lock, or null if it is held by another process.</returns>
+    public static RepositoryLock? TryAcquire()
+    {
+        if (_depth > 0)
+        {
+            _depth++;
+            return new RepositoryLock();
+        }
+
+        _file = TryLock(LOCK);
+        if (_file == null)
+        {
+            return null;
+        }
+
+        _depth = 1;
+        return new RepositoryLock();
+    }
+
+    /// <summary>
+    /// Takes the lock of another repository, e.g. the one push writes to, waiting like
+    /// Acquire. It is not reentrant.
+    /// </summary>
+    /// <param name="gitliteDir">.gitlite directory of the other repository.</param>
+    /// <returns>The lock, released when disposed.</returns>
+    public static IDisposable AcquireOther(DirectoryInfo gitliteDir)
+    {
+        string path = Path.Combine(gitliteDir.FullName, Path.GetFileName(LOCK));
+        return WaitFor(() => TryLock(path));
+    }
+
+    private static FileStream? TryLock(string path)
+    {
+        try
+        {
+            return new FileStream(path, FileMode.OpenOrCreate, FileAccess.ReadWrite, FileShare.None);
+        }
+        catch (IOException)
+        {
+            return null;
+        }
+    }
+
+    private static T WaitFor<T>(Func<T?> tryTake) where T : class
+    {
+        DateTime deadline = DateTime.UtcNow + GetTimeout();
+        TimeSpan delay = TimeSpan.FromMilliseconds(1);
+        T? taken;
+        while ((taken = tryTake()) == null)
+        {
+            if (DateTime.UtcNow >= deadline)
+            {
+                Utils.ExitWithError("Another Gitlite command is modifying the repository; try again later.");
+            }
+
+            Thread.Sleep(delay);
+            delay = TimeSpan.FromTicks(Math.Min(delay.Ticks * 2, MAX_RETRY_DELAY.Ticks));
+        }
+        return taken;
+    }
+
+    public void Dispose()
+    {
+        if (_disposed)
+        {
+            return;
+        }
+
+        _disposed = true;
+        if (--_depth == 0)
+        {
+            _file!.Dispose();
+            _file = null;
+        }
+    }
+
+    private static TimeSpan GetTimeout()
+    {
+        string? value = Environment.GetEnvironmentVariable(TIMEOUT_ENV);
+        if (value == null)
+        {
+            return DEFAULT_TIMEOUT;
+        }
+
+        if (!double.TryParse(value, out double seconds) || seconds < 0)
+        {
+            Utils.ExitWithError($"Invalid {TIMEOUT_ENV}: {value}");
+        }
+        return TimeSpan.FromSeconds(seconds);
+    }
+}
@@ -60,14 +60,31 @@ public partial class StagingArea
     /// <returns>A StagingArea object</returns>
     public static StagingArea GetDeserializedStagingArea()
     {
-        byte[] serializedObj = Utils.ReadContentsAsBytes(STAGING_AREA);
-        return Deserialize(serializedObj);
+        return WarmState.ReadFile(STAGING_AREA, () =>
+        {
+            using Trace.TraceSpan? span = Trace.Span("StagingArea.Load", "staging");
+            return Deserialize(Utils.ReadContentsAsBytes(STAGING_AREA));
+        }, Copy);
     }
 
     public void Save()
     {
-        byte[] serialized = MessagePackSerializer.Serialize(this);
-        Utils.WriteContent(STAGING_AREA, serialized);
+        // A copy, since this instance may still be modified after saving.
+        StagingArea saved = Copy(this);
+        WarmState.Write(STAGING_AREA, saved, () =>
+        {
+            using Trace.TraceSpan? span = Trace.Span("StagingArea.Save", "staging");
+            Utils.WriteContent(STAGING_AREA, MessagePackSerializer.Serialize(saved));
+        });
+    }
+
+    private static StagingArea Copy(StagingArea stagingArea)
+    {
+        return new StagingArea
+        {
+            StagingForAddition = new Dictionary<string, string>(stagingArea.StagingForAddition),
+            StagingForRemoval = new List<string>(stagingArea.StagingForRemoval)
+        };
     }
 
     public void Clear()
@@ -123,11 +140,16 @@ public partial class StagingArea
     /// </summary>
     /// <param name="stagedFileBlobRef">Name of the staged file</param>
     /// <param name="otherFile">Path of the other File in cwd</param>
+    /// <param name="statCache">Optional stat cache used to skip rehashing unchanged files.</param>
     /// <returns>A boolean value if the staged file and the file has the same content</returns>
-    public bool IsStagedFileEqualToOtherFile(string stagedFileBlobRef, string otherFile)
+    public bool IsStagedFileEqualToOtherFile(string stagedFileBlobRef, string otherFile, StatCache? statCache = null)
     {
-        byte[] otherFileContent = Utils.ReadContentsAsBytes(Repository.CWD.ToString(), otherFile);
-        return Utils.HashBytes(otherFileContent) == stagedFileBlobRef;
+        if (statCache != null)
+        {
+            return statCache.GetFileHash(otherFile) == stagedFileBlobRef;
+        }
+        
+        return Utils.HashFile(Path.Combine(Repository.CWD.ToString(), otherFile)) == stagedFileBlobRef;
     }
     
 }
\ No newline at end of file
@@ -0,0 +1,242 @@
+using System.Runtime.InteropServices;
+using MessagePack;
+
+namespace Gitlite;
+
+/// <summary>
+/// Per-path cache of the stat data and blob hash of working files, so commands like
+/// status only rehash a file when its stat data changed since it was last hashed.
+/// </summary>
+[MessagePackObject]
+public partial class StatCache
+{
+    public static string STAT_CACHE = Path.Combine(Repository.GITLITE_DIR.ToString(), "statcache");
+
+    /// <summary>
+    /// Mapping of file names to their cached stat data and blob hash.
+    /// </summary>
+    [Key(0)]
+    private Dictionary<string, StatEntry> Entries { get; set; }
+
+    /// <summary>
+    /// Modification time of the cache file when it was loaded. An entry whose file was
+    /// modified in the same timestamp tick (or later) is "racily clean": the file could
+    /// have changed again without its stat data changing, so it must be rehashed.
+    /// </summary>
+    [IgnoreMember]
+    private long _loadedMtimeNs = long.MaxValue;
+
+    [IgnoreMember]
+    private bool _dirty;
+
+    public StatCache()
+    {
+        Entries = new Dictionary<string, StatEntry>();
+    }
+
+    /// <summary>
+    /// Loads the stat cache, or returns an empty one if it does not exist yet.
+    /// </summary>
+    public static StatCache Load()
+    {
+        using Trace.TraceSpan? span = Trace.Span("StatCache.Load", "staging");
+        if (!File.Exists(STAT_CACHE))
+        {
+            return new StatCache();
+        }
+
+        StatCache cache = MessagePackSerializer.Deserialize<StatCache>(Utils.ReadContentsAsBytes(STAT_CACHE));
+        cache._loadedMtimeNs = StatEntry.FromFile(STAT_CACHE, "").MtimeNs;
+        return cache;
+    }
+
+    /// <summary>
+    /// Returns the blob hash of a working file, only reading and hashing the file if its
+    /// stat data does not match the cached entry.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    public string GetFileHash(string file)
+    {
+        string path = Path.Combine(Repository.CWD.ToString(), file);
+        StatEntry current = StatEntry.FromFile(path, "");
+
+        if (TryGetHash(file, current, out string cachedHash))
+        {
+            return cachedHash;
+        }
+
+        string hash = Utils.HashFile(path);
+        current.Hash = hash;
+        Entries[file] = current;
+        _dirty = true;
+        return hash;
+    }
+
+    /// <summary>
+    /// Looks up the cached blob hash of a working file without touching the file.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    /// <param name="current">Current stat data of the file.</param>
+    /// <param name="hash">The cached blob hash, if the stat data still matches.</param>
+    /// <returns>True if the cached hash can be trusted.</returns>
+    public bool TryGetHash(string file, StatEntry current, out string hash)
+    {
+        if (Entries.TryGetValue(file, out StatEntry? cached)
+            && cached.HasSameStat(current)
+            && cached.MtimeNs < _loadedMtimeNs)
+        {
+            hash = cached.Hash;
+            return true;
+        }
+
+        hash = "";
+        return false;
+    }
+
+    /// <summary>
+    /// Looks up the cached entry of a working file as it is, for a file the file-system
+    /// monitor vouches has not changed since the entry was checked (see WorkingTree.Verify).
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    /// <param name="entry">The cached stat data and blob hash, if any.</param>
+    /// <returns>True if the file has an entry.</returns>
+    public bool TryGetEntry(string file, out StatEntry entry)
+    {
+        return Entries.TryGetValue(file, out entry!);
+    }
+
+    /// <summary>
+    /// Records the blob hash of a working file that was just hashed or written, e.g. by
+    /// add or checkout.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    /// <param name="hash">Blob hash of the file content.</param>
+    public void Record(string file, string hash)
+    {
+        Record(file, StatEntry.FromFile(Path.Combine(Repository.CWD.ToString(), file), hash));
+    }
+
+    /// <summary>
+    /// Records stat data taken before the file was read, along with its blob hash.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    /// <param name="entry">Stat data and blob hash of the file.</param>
+    public void Record(string file, StatEntry entry)
+    {
+        Entries[file] = entry;
+        _dirty = true;
+    }
+
+    /// <summary>
+    /// Forgets a file, e.g. after it was removed from the working directory.
+    /// </summary>
+    public void Remove(string file)
+    {
+        _dirty |= Entries.Remove(file);
+    }
+
+    /// <summary>
+    /// Saves the cache if any entry changed since it was loaded.
+    /// </summary>
+    public void Save()
+    {
+        if (!_dirty)
+        {
+            return;
+        }
+
+        using Trace.TraceSpan? span = Trace.Span("StatCache.Save", "staging");
+
+        Utils.WriteContent(STAT_CACHE, MessagePackSerializer.Serialize(this));
+
+        // Entries modified in the same tick as the cache write can't be trusted by the
+        // next reader, so drop them and write again. Their files simply get rehashed.
+        long writtenMtimeNs = StatEntry.FromFile(STAT_CACHE, "").MtimeNs;
+        List<string> racy = Entries.Where(e => e.Value.MtimeNs >= writtenMtimeNs).Select(e => e.Key).ToList();
+        if (racy.Count > 0)
+        {
+            racy.ForEach(file => Entries.Remove(file));
+            Utils.WriteContent(STAT_CACHE, MessagePackSerializer.Serialize(this));
+        }
+
+        _dirty = false;
+    }
+}
+
+/// <summary>
+/// Stat data of a working file along with the blob hash of its content.
+/// </summary>
+[MessagePackObject]
+public class StatEntry
+{
+    [Key(0)] public long Size { get; set; }
+    [Key(1)] public long MtimeNs { get; set; }
+    [Key(2)] public long Inode { get; set; }
+    [Key(3)] public long CtimeNs { get; set; }
+    [Key(4)] public string Hash { get; set; }
+
+    public StatEntry(long size, long mtimeNs, long inode, long ctimeNs, string hash)
+    {
+        Size = size;
+        MtimeNs = mtimeNs;
+        Inode = inode;
+        CtimeNs = ctimeNs;
+        Hash = hash;
+    }
+
+    public bool HasSameStat(StatEntry other)
+    {
+        return Size == other.Size && MtimeNs == other.MtimeNs && Inode == other.Inode && CtimeNs == other.CtimeNs;
+    }
+
+    // struct stat as laid out by glibc on x86_64.
+    private const int STAT_SIZE = 144;
+    private const int ST_INO = 8;
+    private const int ST_SIZE = 48;
+    private const int ST_MTIM = 88;
+    private const int ST_CTIM = 104;
+
+    [DllImport("libc", EntryPoint = "stat", SetLastError = true)]
+    private static extern int NativeStat(string path, byte[] buffer);
+
+    private static bool _nativeStatAvailable = OperatingSystem.IsLinux() && RuntimeInformation.ProcessArchitecture == Architecture.X64;
+
+    /// <summary>
+    /// Reads the stat data of a file. Inode and ctime come from stat(2) where it is
+    /// available; elsewhere only size and mtime are compared.
+    /// </summary>
+    /// <param name="path">Path of the file.</param>
+    /// <param name="hash">Blob hash to store along with the stat data.</param>
+    public static StatEntry FromFile(string path, string hash)
+    {
+        if (_nativeStatAvailable)
+        {
+            try
+            {
+                byte[] buffer = new byte[STAT_SIZE];
+                if (NativeStat(path, buffer) == 0)
+                {
+                    return new StatEntry(
+                        BitConverter.ToInt64(buffer, ST_SIZE),
+                        ToNanoseconds(buffer, ST_MTIM),
+                        BitConverter.ToInt64(buffer, ST_INO),
+                        ToNanoseconds(buffer, ST_CTIM),
+                        hash);
+                }
+            }
+            catch (Exception e) when (e is DllNotFoundException or EntryPointNotFoundException)
+            {
+                _nativeStatAvailable = false;
+            }
+        }
+
+        FileInfo info = new FileInfo(path);
+        long mtimeNs = (info.LastWriteTimeUtc - DateTime.UnixEpoch).Ticks * 100;
+        return new StatEntry(info.Length, mtimeNs, 0, 0, hash);
+    }
+
+    private static long ToNanoseconds(byte[] buffer, int offset)
+    {
+        return BitConverter.ToInt64(buffer, offset) * 1_000_000_000 + BitConverter.ToInt64(buffer, offset + 8);
+    }
+}
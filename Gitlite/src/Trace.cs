@@ -0,0 +1,148 @@
+using System.Diagnostics;
+using System.Text;
+using System.Text.Json;
+
+namespace Gitlite;
+
+/// <summary>
+/// Opt-in timing of the phases of a command. When GITLITE_TRACE names a file, every span
+/// (the command itself, directory scans, hashing, object and staging area reads and
+/// writes, ...) is appended to it as a Chrome trace event, one JSON object per line, so
+/// runs of many commands and processes can be aggregated. `jq -s . [file]` turns it into
+/// a trace that chrome://tracing or Perfetto can open.
+///
+/// Each span carries the number of files opened and bytes hashed while it was open, by
+/// any thread. Spans cost nothing when tracing is off: Span returns null, which using
+/// accepts.
+/// </summary>
+public static class Trace
+{
+    public const string TRACE_ENV = "GITLITE_TRACE";
+
+    private static readonly int ProcessId = Environment.ProcessId;
+
+    // Event timestamps are microseconds since the Unix epoch, so processes share a clock.
+    private static readonly long EpochStartUs = DateTimeOffset.UtcNow.ToUnixTimeMilliseconds() * 1000;
+    private static readonly Stopwatch Clock = Stopwatch.StartNew();
+
+    private static readonly List<string> Events = new List<string>();
+    private static string? _path;
+    private static long _filesOpened;
+    private static long _bytesHashed;
+
+    /// <summary>
+    /// Whether spans are recorded.
+    /// </summary>
+    public static bool Enabled => _path != null;
+
+    /// <summary>
+    /// Reads GITLITE_TRACE, at the start of every command since a daemon runs commands
+    /// with different environments.
+    /// </summary>
+    public static void Configure()
+    {
+        string? path = Environment.GetEnvironmentVariable(TRACE_ENV);
+        _path = string.IsNullOrEmpty(path) ? null : Path.GetFullPath(path);
+    }
+
+    /// <summary>
+    /// Starts a span, which ends when it is disposed.
+    /// </summary>
+    /// <param name="name">Name of the phase, e.g. "Commit.Deserialize".</param>
+    /// <param name="category">Category of the phase, e.g. "objects".</param>
+    /// <returns>The span, or null if tracing is off.</returns>
+    public static TraceSpan? Span(string name, string category)
+    {
+        return Enabled ? new TraceSpan(name, category) : null;
+    }
+
+    /// <summary>
+    /// Counts a file opened for reading or writing.
+    /// </summary>
+    public static void FileOpened()
+    {
+        if (Enabled) Interlocked.Increment(ref _filesOpened);
+    }
+
+    /// <summary>
+    /// Counts bytes passed to a hash function.
+    /// </summary>
+    public static void BytesHashed(long count)
+    {
+        if (Enabled) Interlocked.Add(ref _bytesHashed, count);
+    }
+
+    /// <summary>
+    /// Appends the events recorded so far to the trace file, in a single write so that
+    /// processes tracing to the same file don't interleave their lines.
+    /// </summary>
+    public static void Flush()
+    {
+        string? path = _path;
+        string lines;
+        lock (Events)
+        {
+            if (path == null || Events.Count == 0)
+            {
+                return;
+            }
+
+            lines = string.Concat(Events);
+            Events.Clear();
+        }
+
+        using FileStream file = new FileStream(path, FileMode.Append, FileAccess.Write, FileShare.ReadWrite);
+        file.Write(Encoding.UTF8.GetBytes(lines));
+    }
+
+    /// <summary>
+    /// A phase being timed. Records a complete ("X") event when disposed.
+    /// </summary>
+    public sealed class TraceSpan : IDisposable
+    {
+        private readonly string _name;
+        private readonly string _category;
+        private readonly long _startTicks;
+        private readonly long _filesOpenedAtStart;
+        private readonly long _bytesHashedAtStart;
+
+        internal TraceSpan(string name, string category)
+        {
+            _name = name;
+            _category = category;
+            _filesOpenedAtStart = Interlocked.Read(ref _filesOpened);
+            _bytesHashedAtStart = Interlocked.Read(ref _bytesHashed);
+            _startTicks = Clock.ElapsedTicks;
+        }
+
+        public void Dispose()
+        {
+            long endTicks = Clock.ElapsedTicks;
+            var traceEvent = new
+            {
+                name = _name,
+                cat = _category,
+                ph = "X",
+                ts = EpochStartUs + ToMicroseconds(_startTicks),
+                dur = ToMicroseconds(endTicks - _startTicks),
+                pid = ProcessId,
+                tid = Environment.CurrentManagedThreadId,
+                args = new
+                {
+                    files_opened = Interlocked.Read(ref _filesOpened) - _filesOpenedAtStart,
+                    bytes_hashed = Interlocked.Read(ref _bytesHashed) - _bytesHashedAtStart
+                }
+            };
+            string line = JsonSerializer.Serialize(traceEvent) + "\n";
+            lock (Events)
+            {
+                Events.Add(line);
+            }
+        }
+
+        private static long ToMicroseconds(long ticks)
+        {
+            return (long)(ticks * (1_000_000.0 / Stopwatch.Frequency));
+        }
+    }
+}
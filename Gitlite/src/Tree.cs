@@ -0,0 +1,210 @@
+using MessagePack;
+
+namespace Gitlite;
+
+/// <summary>
+/// An entry of a tree: a file with its blob hash, or a subdirectory with its tree hash.
+/// </summary>
+[MessagePackObject]
+public class TreeEntry
+{
+    [Key(0)] public string Name { get; set; }
+    [Key(1)] public string Hash { get; set; }
+    [Key(2)] public bool IsTree { get; set; }
+
+    public TreeEntry(string name, string hash, bool isTree)
+    {
+        Name = name;
+        Hash = hash;
+        IsTree = isTree;
+    }
+}
+
+/// <summary>
+/// Content-addressed snapshot of one directory. A commit only stores the hash of its root
+/// tree, and a directory that did not change between two commits is the same tree object
+/// in both, so commits cost in proportion to what changed, and diffs can skip identical
+/// subtrees by comparing their hashes.
+/// </summary>
+[MessagePackObject]
+public class Tree
+{
+    /// <summary>
+    /// Entries sorted by name (ordinal), so equal directories serialize to the same bytes.
+    /// </summary>
+    [Key(0)] public List<TreeEntry> Entries { get; set; }
+
+    public Tree(List<TreeEntry> entries)
+    {
+        Entries = entries;
+    }
+
+    /// <summary>
+    /// Reads a tree object.
+    /// </summary>
+    /// <param name="hash">Hash of the tree.</param>
+    public static Tree Read(string hash)
+    {
+        return WarmState.ReadTree(hash, () =>
+        {
+            using Trace.TraceSpan? span = Trace.Span("Tree.Read", "objects");
+            return MessagePackSerializer.Deserialize<Tree>(ObjectStore.Read(Repository.TREES_DIR, hash));
+        });
+    }
+
+    /// <summary>
+    /// Writes the trees of a flat file mapping, e.g. to convert a commit made before trees
+    /// existed.
+    /// </summary>
+    /// <param name="fileMapping">Mapping of file names ('/' separated) to blob hashes.</param>
+    /// <returns>Hash of the root tree.</returns>
+    public static string Write(Dictionary<string, string> fileMapping)
+    {
+        return Update(null, fileMapping, new List<string>());
+    }
+
+    /// <summary>
+    /// Applies changes to a tree and writes the result. Only the trees of directories that
+    /// contain a change are rewritten; all other subtrees are shared with ROOT.
+    /// </summary>
+    /// <param name="root">Hash of the tree to change, or null to start from an empty tree.</param>
+    /// <param name="additions">Files to add or replace, with their blob hashes.</param>
+    /// <param name="removals">Files to remove.</param>
+    /// <returns>Hash of the new root tree.</returns>
+    public static string Update(string? root, IReadOnlyDictionary<string, string> additions, IReadOnlyCollection<string> removals)
+    {
+        Dictionary<string, string?> changes = new Dictionary<string, string?>();
+        foreach (string file in removals) changes[file] = null;
+        foreach (var (file, hash) in additions) changes[file] = hash;
+        return Update(root, changes);
+    }
+
+    /// <summary>
+    /// Returns the flat mapping of every file in a tree to its blob hash.
+    /// </summary>
+    /// <param name="root">Hash of the root tree.</param>
+    public static Dictionary<string, string> Flatten(string root)
+    {
+        Dictionary<string, string> fileMapping = new Dictionary<string, string>();
+        Flatten(root, "", fileMapping);
+        return fileMapping;
+    }
+
+    /// <summary>
+    /// Lists the files that differ between two trees, without entering subtrees that have
+    /// the same hash on both sides.
+    /// </summary>
+    /// <param name="from">Hash of the old tree, or null for an empty tree.</param>
+    /// <param name="to">Hash of the new tree, or null for an empty tree.</param>
+    /// <returns>Changed files with their old and new blob hash (null if absent).</returns>
+    public static IEnumerable<(string, string?, string?)> Diff(string? from, string? to)
+    {
+        return Diff(from, to, "");
+    }
+
+    private static string Update(string? root, Dictionary<string, string?> changes)
+    {
+        return WriteTree(Apply(root, changes));
+    }
+
+    /// <summary>
+    /// Applies changes to a tree, writing the subtrees that changed and are not empty.
+    /// The resulting tree itself is left to the caller to write.
+    /// </summary>
+    private static Tree Apply(string? root, Dictionary<string, string?> changes)
+    {
+        SortedDictionary<string, TreeEntry> entries = new SortedDictionary<string, TreeEntry>(StringComparer.Ordinal);
+        if (root != null)
+        {
+            foreach (TreeEntry entry in Read(root).Entries)
+            {
+                entries[entry.Name] = entry;
+            }
+        }
+
+        // Changes below a subdirectory are grouped so each subtree is rewritten once.
+        Dictionary<string, Dictionary<string, string?>> subtreeChanges = new Dictionary<string, Dictionary<string, string?>>();
+        foreach (var (path, hash) in changes)
+        {
+            int slash = path.IndexOf('/');
+            if (slash < 0)
+            {
+                if (hash == null) entries.Remove(path);
+                else entries[path] = new TreeEntry(path, hash, false);
+                continue;
+            }
+
+            string dir = path[..slash];
+            if (!subtreeChanges.TryGetValue(dir, out var dirChanges))
+            {
+                subtreeChanges[dir] = dirChanges = new Dictionary<string, string?>();
+            }
+            dirChanges[path[(slash + 1)..]] = hash;
+        }
+
+        foreach (var (dir, dirChanges) in subtreeChanges)
+        {
+            string? subtree = entries.TryGetValue(dir, out TreeEntry? existing) && existing.IsTree ? existing.Hash : null;
+            Tree updated = Apply(subtree, dirChanges);
+            if (updated.Entries.Count == 0) entries.Remove(dir);
+            else entries[dir] = new TreeEntry(dir, WriteTree(updated), true);
+        }
+
+        return new Tree(entries.Values.ToList());
+    }
+
+    private static string WriteTree(Tree tree)
+    {
+        byte[] serialized = MessagePackSerializer.Serialize(tree);
+        string hash = Utils.HashBytes(serialized);
+        ObjectStore.Write(Repository.TREES_DIR, hash, serialized);
+        WarmState.RememberTree(hash, tree);
+        return hash;
+    }
+
+    private static void Flatten(string tree, string prefix, Dictionary<string, string> fileMapping)
+    {
+        foreach (TreeEntry entry in Read(tree).Entries)
+        {
+            if (entry.IsTree) Flatten(entry.Hash, prefix + entry.Name + "/", fileMapping);
+            else fileMapping[prefix + entry.Name] = entry.Hash;
+        }
+    }
+
+    private static IEnumerable<(string, string?, string?)> Diff(string? from, string? to, string prefix)
+    {
+        if (from == to)
+        {
+            yield break;
+        }
+
+        Dictionary<string, TreeEntry> fromEntries = from == null ? new() : Read(from).Entries.ToDictionary(e => e.Name);
+        Dictionary<string, TreeEntry> toEntries = to == null ? new() : Read(to).Entries.ToDictionary(e => e.Name);
+
+        foreach (string name in fromEntries.Keys.Union(toEntries.Keys).Order(StringComparer.Ordinal))
+        {
+            TreeEntry? old = fromEntries.GetValueOrDefault(name);
+            TreeEntry? current = toEntries.GetValueOrDefault(name);
+            if (old?.Hash == current?.Hash && old?.IsTree == current?.IsTree)
+            {
+                continue;
+            }
+
+            // A name can change from file to directory or back, so both sides are
+            // diffed separately: the file side directly, the tree side recursively.
+            string? oldFile = old is { IsTree: false } ? old.Hash : null;
+            string? newFile = current is { IsTree: false } ? current.Hash : null;
+            if (oldFile != newFile)
+            {
+                yield return (prefix + name, oldFile, newFile);
+            }
+
+            string? oldTree = old is { IsTree: true } ? old.Hash : null;
+            string? newTree = current is { IsTree: true } ? current.Hash : null;
+            foreach (var change in Diff(oldTree, newTree, prefix + name + "/"))
+            {
+                yield return change;
+            }
+        }
+    }
+}
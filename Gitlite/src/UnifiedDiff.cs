@@ -0,0 +1,154 @@
+using System.Text;
+
+namespace Gitlite;
+
+/// <summary>
+/// Prints the differences between two versions of a file in unified diff format, with
+/// CONTEXT unchanged lines around each change.
+///
+/// Both versions are read as streams and every distinct line is kept once, as the diff
+/// itself only works on line ids; the output is written hunk by hunk as it is produced
+/// rather than built up in memory. A version with a NUL byte in its first
+/// BINARY_PROBE_SIZE bytes is binary and only reported as differing.
+/// </summary>
+public static class UnifiedDiff
+{
+    public const int CONTEXT = 3;
+    private const int BINARY_PROBE_SIZE = 8000;
+    private const string NO_FILE = "/dev/null";
+
+    /// <summary>
+    /// Prints the diff between two versions of a file.
+    /// </summary>
+    /// <param name="path">File name relative to the working directory.</param>
+    /// <param name="openOld">Opens the old version, or null if the file was added.</param>
+    /// <param name="openNew">Opens the new version, or null if the file was deleted.</param>
+    public static void Print(string path, Func<Stream>? openOld, Func<Stream>? openNew)
+    {
+        TextWriter output = Console.Out;
+        string oldLabel = openOld == null ? NO_FILE : $"a/{path}";
+        string newLabel = openNew == null ? NO_FILE : $"b/{path}";
+
+        output.WriteLine($"diff --gitlite a/{path} b/{path}");
+        if (openOld == null) output.WriteLine("new file");
+        if (openNew == null) output.WriteLine("deleted file");
+
+        if ((openOld != null && IsBinary(openOld)) || (openNew != null && IsBinary(openNew)))
+        {
+            output.WriteLine($"Binary files {oldLabel} and {newLabel} differ");
+            return;
+        }
+
+        Dictionary<string, int> ids = new Dictionary<string, int>();
+        List<string> texts = new List<string>();
+        int[] oldLines = openOld == null ? Array.Empty<int>() : ReadLines(openOld, ids, texts);
+        int[] newLines = openNew == null ? Array.Empty<int>() : ReadLines(openNew, ids, texts);
+        List<Hunk> hunks = LineDiff.Diff(oldLines, newLines);
+        if (hunks.Count == 0)
+        {
+            return;
+        }
+
+        output.WriteLine($"--- {oldLabel}");
+        output.WriteLine($"+++ {newLabel}");
+        for (int first = 0; first < hunks.Count;)
+        {
+            // Hunks whose contexts would touch or overlap are printed as one block.
+            int last = first;
+            while (last + 1 < hunks.Count && hunks[last + 1].OldStart - hunks[last].OldEnd <= 2 * CONTEXT)
+            {
+                last++;
+            }
+
+            int oldStart = Math.Max(0, hunks[first].OldStart - CONTEXT);
+            int oldEnd = Math.Min(oldLines.Length, hunks[last].OldEnd + CONTEXT);
+            int newStart = hunks[first].NewStart - (hunks[first].OldStart - oldStart);
+            int newEnd = hunks[last].NewEnd + (oldEnd - hunks[last].OldEnd);
+            output.WriteLine($"@@ -{FormatRange(oldStart, oldEnd)} +{FormatRange(newStart, newEnd)} @@");
+
+            int oldPos = oldStart;
+            for (int i = first; i <= last; i++)
+            {
+                Hunk hunk = hunks[i];
+                for (; oldPos < hunk.OldStart; oldPos++) WriteLine(output, ' ', texts[oldLines[oldPos]]);
+                for (int line = hunk.OldStart; line < hunk.OldEnd; line++) WriteLine(output, '-', texts[oldLines[line]]);
+                for (int line = hunk.NewStart; line < hunk.NewEnd; line++) WriteLine(output, '+', texts[newLines[line]]);
+                oldPos = hunk.OldEnd;
+            }
+            for (; oldPos < oldEnd; oldPos++) WriteLine(output, ' ', texts[oldLines[oldPos]]);
+
+            first = last + 1;
+        }
+    }
+
+    /// <summary>
+    /// Formats a range of lines for a hunk header: "start,count", 1-based, where a single
+    /// line is just "start" and an empty range starts at the line before it.
+    /// </summary>
+    private static string FormatRange(int start, int end)
+    {
+        return (end - start) switch
+        {
+            0 => $"{start},0",
+            1 => $"{start + 1}",
+            _ => $"{start + 1},{end - start}"
+        };
+    }
+
+    private static void WriteLine(TextWriter output, char prefix, string text)
+    {
+        // Only the last line of a file can lack its newline.
+        output.Write(text.EndsWith('\n') ? $"{prefix}{text}" : $"{prefix}{text}\n\\ No newline at end of file\n");
+    }
+
+    private static bool IsBinary(Func<Stream> open)
+    {
+        using Stream stream = open();
+        byte[] probe = new byte[BINARY_PROBE_SIZE];
+        int read = stream.ReadAtLeast(probe, probe.Length, false);
+        return Array.IndexOf(probe, (byte)0, 0, read) >= 0;
+    }
+
+    /// <summary>
+    /// Reads the lines of a version as ids, adding the text of lines not seen yet.
+    /// </summary>
+    private static int[] ReadLines(Func<Stream> open, Dictionary<string, int> ids, List<string> texts)
+    {
+        List<int> lines = new List<int>();
+        void Add(string text)
+        {
+            if (!ids.TryGetValue(text, out int id))
+            {
+                ids[text] = id = texts.Count;
+                texts.Add(text);
+            }
+            lines.Add(id);
+        }
+
+        using StreamReader reader = new StreamReader(open(), Encoding.UTF8, false, Utils.BUFFER_SIZE);
+        char[] buffer = new char[Utils.BUFFER_SIZE];
+        StringBuilder line = new StringBuilder();
+        int read;
+        while ((read = reader.Read(buffer, 0, buffer.Length)) > 0)
+        {
+            int start = 0;
+            for (int i = 0; i < read; i++)
+            {
+                if (buffer[i] == '\n')
+                {
+                    line.Append(buffer, start, i + 1 - start);
+                    Add(line.ToString());
+                    line.Clear();
+                    start = i + 1;
+                }
+            }
+            line.Append(buffer, start, read - start);
+        }
+
+        if (line.Length > 0)
+        {
+            Add(line.ToString());
+        }
+        return lines.ToArray();
+    }
+}
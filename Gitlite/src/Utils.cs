@@ -1,4 +1,5 @@
 using System.Security.Cryptography;
+using System.Text;
 
 namespace Gitlite;
 
@@ -14,20 +15,45 @@ public static class Utils
     /// <param name="content">Content to write into the file</param>
     public static void WriteContent(string file, string content)
     {
-        using (StreamWriter sw = new StreamWriter(file))
-        {
-            sw.Write(content);
-        }
+        WriteContent(file, new UTF8Encoding(false).GetBytes(content));
     }
 
     /// <summary>
-    /// Writes byte array content to a file.
+    /// Writes byte array content to a file. The content goes to a temporary file first,
+    /// which is flushed to disk and then renamed over FILE, so neither a crash nor a
+    /// concurrent reader can ever see a partly written file.
     /// </summary>
     /// <param name="file">File name</param>
     /// <param name="content">Content in to write represented in byte array into the file</param>
     public static void WriteContent(string file, byte[] content)
     {
-        File.WriteAllBytes(file, content);
+        WriteAtomically(file, stream => stream.Write(content));
+    }
+
+    /// <summary>
+    /// Creates or replaces a file with what WRITE writes, through a temporary file that is
+    /// flushed to disk and then renamed over FILE.
+    /// </summary>
+    /// <param name="file">File name</param>
+    /// <param name="write">Writes the content of the file.</param>
+    public static void WriteAtomically(string file, Action<Stream> write)
+    {
+        string tmpPath = $"{file}.{Guid.NewGuid():N}{TMP_SUFFIX}";
+        Trace.FileOpened();
+        try
+        {
+            using (FileStream tmp = new FileStream(tmpPath, FileMode.CreateNew, FileAccess.Write, FileShare.None, BUFFER_SIZE))
+            {
+                write(tmp);
+                tmp.Flush(true);
+            }
+            File.Move(tmpPath, file, true);
+        }
+        catch
+        {
+            File.Delete(tmpPath);
+            throw;
+        }
     }
 
     /// <summary>
@@ -44,6 +70,7 @@ public static class Utils
         }
         
         ValidateFile(path);
+        Trace.FileOpened();
         return File.ReadAllBytes(path);
     }
 
@@ -60,6 +87,7 @@ public static class Utils
             path = Path.Combine(path, name);
         }
         ValidateFile(path);
+        Trace.FileOpened();
         return File.ReadAllText(path);
     }
     
@@ -90,6 +118,19 @@ public static class Utils
         return JoinDirectory(first.ToString(), second);
     }
 
+    /// <summary>
+    /// Creates the parent directory of a file if it does not exist yet.
+    /// </summary>
+    /// <param name="path">File path</param>
+    public static void CreateParentDirectory(string path)
+    {
+        string? parent = Path.GetDirectoryName(Path.GetFullPath(path));
+        if (parent != null)
+        {
+            Directory.CreateDirectory(parent);
+        }
+    }
+
     /// <summary>
     /// Returns a sorted list of all file names in a directory. 
     /// </summary>
@@ -109,6 +150,12 @@ public static class Utils
     
     /* MESSAGES & ERROR REPORTING*/
     
+    /// <summary>
+    /// True when commands run inside a long-lived process (daemon or batch). Errors then
+    /// throw an ExitException instead of ending the process.
+    /// </summary>
+    public static bool InProcess { get; set; }
+    
     /// <summary>
     /// Exits the program and prints out MESSAGE.
     /// </summary>
@@ -120,6 +167,11 @@ public static class Utils
             Console.WriteLine(message);
         }
 
+        if (InProcess)
+        {
+            throw new ExitException(-1);
+        }
+
         Environment.Exit(-1);
     }
     
@@ -142,6 +194,20 @@ public static class Utils
         ExitWithError(message);
     }
     
+    /// <summary>
+    /// Checks if at least N arguments were provided with CMD(command).
+    /// </summary>
+    /// <param name="cmd">Command name.</param>
+    /// <param name="args">The arguments provided along with the COMMAND.</param>
+    /// <param name="n">The minimum number of arguments required.</param>
+    public static void ValidateMinArguments(string cmd, string[] args, int n)
+    {
+        if (args.Length < n)
+        {
+            ExitWithError($"Invalid number of arguments for: {cmd}");
+        }
+    }
+    
     public static void ValidateFile(string path, string? name = null, string? message = null)
     {
         if (name != null)
@@ -161,10 +227,39 @@ public static class Utils
 
 
     /* HASHING */
+    
+    /// <summary>
+    /// Size of the buffers used to stream file contents.
+    /// </summary>
+    public const int BUFFER_SIZE = 64 * 1024;
+
+    /// <summary>
+    /// Suffix of the temporary files WriteAtomically renames over their target.
+    /// </summary>
+    public const string TMP_SUFFIX = ".tmp";
+    
     public static string HashBytes(byte[] bytes)
     {
+        using Trace.TraceSpan? span = Trace.Span("Utils.HashBytes", "hash");
+        Trace.BytesHashed(bytes.Length);
         return Convert.ToHexString(SHA1.HashData(bytes)).ToLower();
     }
+
+    /// <summary>
+    /// Hashes a file incrementally with a fixed-size buffer, so memory use does not
+    /// depend on the size of the file.
+    /// </summary>
+    /// <param name="path">File path</param>
+    /// <returns>The same hash HashBytes returns for the file content.</returns>
+    public static string HashFile(string path)
+    {
+        using Trace.TraceSpan? span = Trace.Span("Utils.HashFile", "hash");
+        ValidateFile(path);
+        using FileStream file = new FileStream(path, FileMode.Open, FileAccess.Read, FileShare.Read, BUFFER_SIZE);
+        Trace.FileOpened();
+        Trace.BytesHashed(file.Length);
+        return Convert.ToHexString(SHA1.HashData(file)).ToLower();
+    }
     
     /// <summary>
     /// Splits the given HASH into two (directory, filename). This is to easily navigate
@@ -0,0 +1,214 @@
+namespace Gitlite;
+
+/// <summary>
+/// In-memory cache of repository state for the lifetime of the process: refs and the
+/// staging area along with their stat data, commits and trees. A file is reloaded as soon
+/// as its stat data changes, so edits made by other processes are always noticed, and
+/// writes made through this class update the cache directly. Commits and trees are
+/// immutable, so they are cached by hash without any check.
+///
+/// All caches are LRU caches of a fixed size. In a daemon or batch they are kept between
+/// commands. Setting GITLITE_CACHE_STATS prints their hit and miss counters to stderr.
+/// </summary>
+public static class WarmState
+{
+    public const string CACHE_STATS_ENV = "GITLITE_CACHE_STATS";
+
+    /// <summary>
+    /// When set, files written through Write are only written by Flush; until then, reads
+    /// of those files return the pending value.
+    /// </summary>
+    public static bool DeferWrites { get; set; }
+
+    private const int MAX_FILES = 256;
+    private const int MAX_COMMITS = 1024;
+    private const int MAX_TREES = 4096;
+
+    private static readonly LruCache<string, (StatEntry Stamp, object Value)> Files =
+        new LruCache<string, (StatEntry, object)>(MAX_FILES);
+    private static readonly LruCache<string, Commit> Commits = new LruCache<string, Commit>(MAX_COMMITS);
+    private static readonly LruCache<string, Tree> Trees = new LruCache<string, Tree>(MAX_TREES);
+    private static readonly Dictionary<string, (object Value, Action Write)> Pending =
+        new Dictionary<string, (object, Action)>();
+
+    /// <summary>
+    /// Returns the value loaded from a file, reusing the cached one if the file's stat
+    /// data did not change since it was loaded.
+    /// </summary>
+    /// <param name="path">File the value is loaded from.</param>
+    /// <param name="load">Loads the value from the file.</param>
+    /// <param name="copy">Copies a mutable value, so callers never modify the cached one.</param>
+    public static T ReadFile<T>(string path, Func<T> load, Func<T, T>? copy = null) where T : class
+    {
+        lock (Pending)
+        {
+            if (Pending.TryGetValue(path, out var pending))
+            {
+                return copy != null ? copy((T)pending.Value) : (T)pending.Value;
+            }
+        }
+
+        if (!File.Exists(path))
+        {
+            return load();
+        }
+
+        // Stat data is taken before loading: if the file changes meanwhile, the next
+        // lookup sees a different stamp and loads it again.
+        StatEntry stamp = StatEntry.FromFile(path, "");
+        if (Files.TryGet(path, out var cached) && cached.Stamp.HasSameStat(stamp))
+        {
+            return copy != null ? copy((T)cached.Value) : (T)cached.Value;
+        }
+
+        T value = load();
+        Files.Set(path, (stamp, copy != null ? copy(value) : value));
+        return value;
+    }
+
+    /// <summary>
+    /// Writes a value to its file, or only keeps it as pending if writes are deferred.
+    /// </summary>
+    /// <param name="path">File the value is written to.</param>
+    /// <param name="value">The value, not modified afterwards.</param>
+    /// <param name="write">Writes the value to the file.</param>
+    public static void Write(string path, object value, Action write)
+    {
+        if (DeferWrites)
+        {
+            lock (Pending)
+            {
+                Pending[path] = (value, write);
+            }
+            return;
+        }
+
+        write();
+        Remember(path, value);
+    }
+
+    /// <summary>
+    /// Checks if a file exists, or will once its pending value is written.
+    /// </summary>
+    public static bool Exists(string path)
+    {
+        lock (Pending)
+        {
+            return Pending.ContainsKey(path) || File.Exists(path);
+        }
+    }
+
+    /// <summary>
+    /// Returns the names of the files in DIR that only exist as pending values so far.
+    /// </summary>
+    public static IEnumerable<string> ListPending(string dir)
+    {
+        lock (Pending)
+        {
+            return Pending.Keys
+                .Where(path => Path.GetDirectoryName(path) == Path.TrimEndingDirectorySeparator(dir) && !File.Exists(path))
+                .Select(path => Path.GetFileName(path))
+                .ToList();
+        }
+    }
+
+    /// <summary>
+    /// Deletes a file, along with its pending value if it has one.
+    /// </summary>
+    public static void Delete(string path)
+    {
+        lock (Pending)
+        {
+            Pending.Remove(path);
+        }
+        File.Delete(path);
+    }
+
+    /// <summary>
+    /// Writes all pending values to their files, in the order they were first deferred
+    /// (e.g. the staging area of an add before the branch moved by the next commit).
+    /// </summary>
+    public static void Flush()
+    {
+        List<KeyValuePair<string, (object Value, Action Write)>> pending;
+        lock (Pending)
+        {
+            pending = Pending.ToList();
+            Pending.Clear();
+        }
+
+        foreach (var (path, (value, write)) in pending)
+        {
+            write();
+            Remember(path, value);
+        }
+    }
+
+    /// <summary>
+    /// Caches a value that was just written to a file, so the next lookup does not need to
+    /// load it back.
+    /// </summary>
+    /// <param name="path">File the value was written to.</param>
+    /// <param name="value">The written value, not modified afterwards.</param>
+    private static void Remember(string path, object value)
+    {
+        Files.Set(path, (StatEntry.FromFile(path, ""), value));
+    }
+
+    /// <summary>
+    /// Returns a commit by its full hash, reusing it if it was loaded before.
+    /// </summary>
+    /// <param name="hash">Full hash of the commit.</param>
+    /// <param name="load">Loads the commit from the object store.</param>
+    public static Commit ReadCommit(string hash, Func<Commit> load)
+    {
+        if (Commits.TryGet(hash, out Commit? cached))
+        {
+            return cached;
+        }
+
+        Commit commit = load();
+        Commits.Set(hash, commit);
+        return commit;
+    }
+
+    /// <summary>
+    /// Returns a tree by its hash, reusing it if it was loaded or written before.
+    /// </summary>
+    /// <param name="hash">Hash of the tree.</param>
+    /// <param name="load">Loads the tree from the object store.</param>
+    public static Tree ReadTree(string hash, Func<Tree> load)
+    {
+        if (Trees.TryGet(hash, out Tree? cached))
+        {
+            return cached;
+        }
+
+        Tree tree = load();
+        Trees.Set(hash, tree);
+        return tree;
+    }
+
+    /// <summary>
+    /// Caches a tree that was just written.
+    /// </summary>
+    public static void RememberTree(string hash, Tree tree)
+    {
+        Trees.Set(hash, tree);
+    }
+
+    /// <summary>
+    /// Prints the counters of every cache to stderr if GITLITE_CACHE_STATS is set.
+    /// </summary>
+    public static void ReportStats()
+    {
+        if (Environment.GetEnvironmentVariable(CACHE_STATS_ENV) == null)
+        {
+            return;
+        }
+
+        Console.Error.WriteLine($"cache files: {Files}");
+        Console.Error.WriteLine($"cache commits: {Commits}");
+        Console.Error.WriteLine($"cache trees: {Trees}");
+    }
+}
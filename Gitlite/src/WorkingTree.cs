@@ -0,0 +1,389 @@
+using System.Collections.Concurrent;
+using System.Text;
+using System.Text.RegularExpressions;
+using MessagePack;
+
+namespace Gitlite;
+
+/// <summary>
+/// Scanner of the files in the working directory. The whole tree is walked once per
+/// command, with subdirectories read in parallel, and every caller reuses that snapshot.
+/// The .gitlite directory, the Gitlite executable and files matched by .gitliteignore are
+/// left out; ignored directories are never entered.
+///
+/// While a file-system monitor runs (see FsMonitor), the file list is kept in a snapshot
+/// instead, and only the paths changed since it was taken are examined. The snapshot also
+/// lists the files a command checked against the stat cache after syncing with the
+/// monitor, until the monitor journals them again; their cached hashes can be trusted
+/// without looking at the files.
+/// </summary>
+public static class WorkingTree
+{
+    public static string IGNORE_FILE = Path.Combine(Repository.CWD.ToString(), ".gitliteignore");
+    public static string SNAPSHOT = Path.Combine(Repository.GITLITE_DIR.ToString(), "fsmonitor-snapshot");
+
+    private static List<string>? _snapshot;
+    
+    // Saved snapshot the current one was read from or written to, and its verified files,
+    // if the monitor was synced.
+    private static WorkingTreeSnapshot? _saved;
+    private static SortedSet<string>? _verified;
+    private static bool _verifiedChanged;
+    private static bool? _monitorRunning;
+
+    /// <summary>
+    /// Returns the files of the working directory, scanning it on first use.
+    /// </summary>
+    /// <returns>File names relative to the working directory, '/' separated and sorted.</returns>
+    public static IReadOnlyList<string> Scan()
+    {
+        List<string>? snapshot = _snapshot;
+        if (snapshot != null)
+        {
+            return snapshot;
+        }
+
+        using Trace.TraceSpan? span = Trace.Span("WorkingTree.Scan", "scan");
+        IgnoreRules rules = IgnoreRules.Load(IGNORE_FILE);
+        snapshot = (FsMonitor.IsRunning() ? ScanWithMonitor(rules) : null) ?? ScanAll(rules);
+        _snapshot = snapshot;
+        return snapshot;
+    }
+
+    /// <summary>
+    /// Drops the snapshot, so the next scan sees the working directory as it is now. Called
+    /// at the start of every command and after a command changed the working files.
+    /// </summary>
+    public static void Invalidate()
+    {
+        _snapshot = null;
+        _saved = null;
+        _verified = null;
+        _verifiedChanged = false;
+        _monitorRunning = null;
+    }
+
+    /// <summary>
+    /// Checks if the file-system monitor vouches that a file has not changed since a command
+    /// last checked it (see Verify), so its cached stat data and hash still hold.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    public static bool IsUnchanged(string file)
+    {
+        return IsMonitorSynced() && _verified!.Contains(file);
+    }
+
+    /// <summary>
+    /// Records that a file was just checked against the stat cache: its entry is up to date,
+    /// or it has none because the file does not exist. Only takes effect when the monitor
+    /// was synced, as changes made since are journaled after the snapshot's position.
+    /// </summary>
+    /// <param name="file">File name relative to the working directory.</param>
+    public static void Verify(string file)
+    {
+        _verifiedChanged |= IsMonitorSynced() && _verified!.Add(file);
+    }
+
+    /// <summary>
+    /// Saves the files verified by this command with the snapshot. To be called once the
+    /// stat cache entries they rely on are saved.
+    /// </summary>
+    public static void SaveVerified()
+    {
+        if (_saved != null && _verifiedChanged)
+        {
+            _saved.Verified = _verified!.ToList();
+            Utils.WriteContent(SNAPSHOT, MessagePackSerializer.Serialize(_saved));
+            _verifiedChanged = false;
+        }
+    }
+
+    /// <summary>
+    /// Syncs with the file-system monitor if one runs and this command has not scanned yet.
+    /// Without a monitor, the working directory is not scanned just for this.
+    /// </summary>
+    private static bool IsMonitorSynced()
+    {
+        if (_snapshot == null && (_monitorRunning ??= FsMonitor.IsRunning()))
+        {
+            Scan();
+        }
+        return _verified != null;
+    }
+
+    private static List<string> ScanAll(IgnoreRules rules)
+    {
+        ConcurrentBag<string> files = new ConcurrentBag<string>();
+        Walk(new DirectoryInfo(Repository.CWD.FullName), "", rules, files);
+
+        List<string> snapshot = files.ToList();
+        snapshot.Sort(StringComparer.Ordinal);
+        return snapshot;
+    }
+
+    /// <summary>
+    /// Brings the saved snapshot up to date with the changes the monitor journaled since it
+    /// was taken, or takes a new one if they can't be trusted.
+    /// </summary>
+    /// <returns>The files, or null if the monitor could not be synced.</returns>
+    private static List<string>? ScanWithMonitor(IgnoreRules rules)
+    {
+        WorkingTreeSnapshot? saved = File.Exists(SNAPSHOT)
+            ? MessagePackSerializer.Deserialize<WorkingTreeSnapshot>(Utils.ReadContentsAsBytes(SNAPSHOT))
+            : null;
+        var changes = FsMonitor.ReadChanges(saved?.Instance, saved?.Position ?? 0);
+        if (changes == null)
+        {
+            return null;
+        }
+
+        var (instance, position, paths) = changes.Value;
+        if (saved != null && saved.Instance == instance && saved.Position == position)
+        {
+            _saved = saved;
+            _verified = new SortedSet<string>(saved.Verified, StringComparer.Ordinal);
+            return saved.Files;
+        }
+
+        // The ignore rules apply to every path, so a change to them needs a full scan.
+        List<string> files = saved == null || paths == null || paths.Contains(Path.GetFileName(IGNORE_FILE))
+            ? ScanAll(rules)
+            : Update(saved.Files, paths, rules);
+        
+        // Journaled files must be checked again; after an overflow, all of them.
+        SortedSet<string> verified = new SortedSet<string>(StringComparer.Ordinal);
+        if (saved != null && paths != null)
+        {
+            verified.UnionWith(saved.Verified);
+            RemovePaths(verified, paths);
+        }
+        
+        _saved = new WorkingTreeSnapshot(instance, position, files) { Verified = verified.ToList() };
+        _verified = verified;
+        Utils.WriteContent(SNAPSHOT, MessagePackSerializer.Serialize(_saved));
+        return files;
+    }
+
+    /// <summary>
+    /// Re-examines changed paths: each one, and everything below it if it is a directory,
+    /// is dropped from the file list and added back as it is now.
+    /// </summary>
+    private static List<string> Update(List<string> files, HashSet<string> paths, IgnoreRules rules)
+    {
+        SortedSet<string> updated = new SortedSet<string>(files, StringComparer.Ordinal);
+        RemovePaths(updated, paths);
+        foreach (string path in paths)
+        {
+            if (IsInIgnoredDirectory(path, rules))
+            {
+                continue;
+            }
+
+            DirectoryInfo dir = new DirectoryInfo(Path.Combine(Repository.CWD.FullName, path));
+            if (dir.Exists)
+            {
+                if (dir.LinkTarget == null && !rules.IsIgnored(path, true))
+                {
+                    ConcurrentBag<string> below = new ConcurrentBag<string>();
+                    Walk(dir, path + "/", rules, below);
+                    updated.UnionWith(below);
+                }
+            }
+            else if (File.Exists(dir.FullName) && path != "Gitlite" && !rules.IsIgnored(path, false))
+            {
+                updated.Add(path);
+            }
+        }
+
+        return updated.ToList();
+    }
+
+    /// <summary>
+    /// Removes each path, and everything below it if it is a directory, from a set of files.
+    /// </summary>
+    private static void RemovePaths(SortedSet<string> files, IEnumerable<string> paths)
+    {
+        foreach (string path in paths)
+        {
+            // '0' follows '/', so the view holds exactly the paths below PATH.
+            files.Remove(path);
+            files.ExceptWith(files.GetViewBetween(path + "/", path + "0").ToList());
+        }
+    }
+
+    private static bool IsInIgnoredDirectory(string path, IgnoreRules rules)
+    {
+        for (int i = path.IndexOf('/'); i >= 0; i = path.IndexOf('/', i + 1))
+        {
+            if (rules.IsIgnored(path[..i], true))
+            {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    private static void Walk(DirectoryInfo dir, string prefix, IgnoreRules rules, ConcurrentBag<string> files)
+    {
+        List<(DirectoryInfo, string)> subDirs = new List<(DirectoryInfo, string)>();
+        foreach (FileSystemInfo entry in dir.EnumerateFileSystemInfos())
+        {
+            string name = prefix + entry.Name;
+            if (entry is DirectoryInfo subDir)
+            {
+                // Symbolic links to directories are not followed, as they may form cycles.
+                if (subDir.LinkTarget != null || subDir.FullName == Repository.GITLITE_DIR.FullName.TrimEnd(Path.DirectorySeparatorChar)
+                    || rules.IsIgnored(name, true))
+                {
+                    continue;
+                }
+                subDirs.Add((subDir, name + "/"));
+            }
+            else if (name != "Gitlite" && !rules.IsIgnored(name, false))
+            {
+                files.Add(name);
+            }
+        }
+
+        Parallel.ForEach(subDirs, sub => Walk(sub.Item1, sub.Item2, rules, files));
+    }
+}
+
+/// <summary>
+/// File list of the working directory, as of a position in the file-system monitor's
+/// journal, with the files whose stat cache entries were verified.
+/// </summary>
+[MessagePackObject]
+public class WorkingTreeSnapshot
+{
+    [Key(0)] public string Instance { get; set; }
+    [Key(1)] public long Position { get; set; }
+    [Key(2)] public List<string> Files { get; set; }
+    
+    /// <summary>
+    /// Files checked against the stat cache since the monitor last journaled them.
+    /// </summary>
+    [Key(3)] public List<string> Verified { get; set; } = new List<string>();
+
+    public WorkingTreeSnapshot(string instance, long position, List<string> files)
+    {
+        Instance = instance;
+        Position = position;
+        Files = files;
+    }
+}
+
+/// <summary>
+/// Glob patterns of a .gitliteignore file, one per line:
+///     - blank lines and lines starting with '#' are skipped
+///     - '*' matches anything but '/', '?' one character but '/', and [...] a character class
+///     - '**' matches across directories, e.g. "logs/**" or "**/build"
+///     - a pattern ending with '/' only matches directories
+///     - a pattern containing '/' is matched against the path from the working directory;
+///       any other pattern is matched against the name of a file or directory at any depth
+///     - a pattern starting with '!' re-includes what an earlier pattern ignored
+/// The last matching pattern decides. A file in an ignored directory is always ignored,
+/// since ignored directories are not entered.
+/// </summary>
+public class IgnoreRules
+{
+    private readonly List<(Regex Pattern, bool DirOnly, bool Anchored, bool Negated)> _rules;
+
+    private IgnoreRules(List<(Regex, bool, bool, bool)> rules)
+    {
+        _rules = rules;
+    }
+
+    /// <summary>
+    /// Loads the rules of an ignore file, or returns empty rules if it does not exist.
+    /// </summary>
+    /// <param name="path">Path of the ignore file.</param>
+    public static IgnoreRules Load(string path)
+    {
+        List<(Regex, bool, bool, bool)> rules = new List<(Regex, bool, bool, bool)>();
+        if (!File.Exists(path))
+        {
+            return new IgnoreRules(rules);
+        }
+
+        foreach (string rawLine in File.ReadAllLines(path))
+        {
+            string line = rawLine.Trim();
+            if (line.Length == 0 || line.StartsWith('#'))
+            {
+                continue;
+            }
+
+            bool negated = line.StartsWith('!');
+            if (negated) line = line[1..];
+            bool dirOnly = line.EndsWith('/');
+            line = line.TrimEnd('/');
+            bool anchored = line.Contains('/');
+            line = line.TrimStart('/');
+            if (line.Length > 0)
+            {
+                rules.Add((GlobToRegex(line), dirOnly, anchored, negated));
+            }
+        }
+
+        return new IgnoreRules(rules);
+    }
+
+    /// <summary>
+    /// Checks whether a file or directory is ignored.
+    /// </summary>
+    /// <param name="path">Path relative to the working directory, '/' separated.</param>
+    /// <param name="isDir">Whether the path is a directory.</param>
+    public bool IsIgnored(string path, bool isDir)
+    {
+        string name = path[(path.LastIndexOf('/') + 1)..];
+        bool ignored = false;
+        foreach (var (pattern, dirOnly, anchored, negated) in _rules)
+        {
+            if ((!dirOnly || isDir) && pattern.IsMatch(anchored ? path : name))
+            {
+                ignored = !negated;
+            }
+        }
+        return ignored;
+    }
+
+    private static Regex GlobToRegex(string glob)
+    {
+        StringBuilder regex = new StringBuilder("^");
+        for (int i = 0; i < glob.Length; i++)
+        {
+            char c = glob[i];
+            if (glob.AsSpan(i).StartsWith("**/"))
+            {
+                regex.Append("(.*/)?");
+                i += 2;
+            }
+            else if (glob.AsSpan(i).StartsWith("**"))
+            {
+                regex.Append(".*");
+                i += 1;
+            }
+            else if (c == '*')
+            {
+                regex.Append("[^/]*");
+            }
+            else if (c == '?')
+            {
+                regex.Append("[^/]");
+            }
+            else if (c == '[' && glob.IndexOf(']', i + 1) is int end and > 0)
+            {
+                string set = glob[(i + 1)..end];
+                regex.Append('[').Append(set.StartsWith('!') ? "^" + Regex.Escape(set[1..]) : Regex.Escape(set)).Append(']');
+                i = end;
+            }
+            else
+            {
+                regex.Append(Regex.Escape(c.ToString()));
+            }
+        }
+
+        return new Regex(regex.Append('$').ToString(), RegexOptions.CultureInvariant);
+    }
+}
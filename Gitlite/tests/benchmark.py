@@ -0,0 +1,291 @@
+"""
+Benchmarks Gitlite commands on generated repositories.
+
+Each scenario generates a repository with a given number of files, file size, history
+depth and branch count, with either text or binary files, then times add, commit,
+status, log, global-log, find, checkout, reset and merge on it. Every command records
+its wall time, peak RSS and the bytes it read and wrote, and the results are printed as
+JSON. Given a baseline saved by an earlier run, commands that got slower or bigger than
+the tolerance allows are reported and the exit code is 1.
+
+Usage (from the Gitlite directory, after `make build`):
+    python tests/benchmark.py --sizes small,medium --save-baseline baseline.json
+    python tests/benchmark.py --sizes small,medium --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = {
+    "small": {"files": 100, "file_size": 1024, "depth": 10, "branches": 2},
+    "medium": {"files": 1000, "file_size": 4096, "depth": 30, "branches": 4},
+    "large": {"files": 10000, "file_size": 4096, "depth": 50, "branches": 8},
+}
+
+# Differences below these are noise, whatever the tolerance says.
+MIN_WALL_DIFF = 0.05
+MIN_BYTES_DIFF = 64 * 1024
+METRICS = ["wall_s", "peak_rss_kb", "bytes_read", "bytes_written"]
+
+WORDS = ["alpha", "beta", "gamma", "delta", "commit", "branch", "merge", "tree", "blob", "index"]
+
+
+def run_measured(repo, cmd, stdin=None):
+    """
+    Runs a Gitlite command in REPO and measures it.
+    :param repo: Repository directory, holding the Gitlite binary.
+    :param cmd: Command to run, as a list of str.
+    :param stdin: Input for the command (str), if any.
+    :return: (stdout, measurements) where measurements has wall_s, peak_rss_kb,
+             bytes_read and bytes_written.
+    """
+    env = dict(os.environ, GITLITE_NO_DAEMON="1")
+    with tempfile.TemporaryFile() as input_file:
+        input_file.write((stdin or "").encode())
+        input_file.seek(0)
+        start = time.perf_counter()
+        process = subprocess.Popen(["./Gitlite"] + cmd, cwd=repo, env=env,
+                                   stdin=input_file, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        stdout = process.stdout.read().decode()
+        process.stdout.close()
+
+        # The process is waited for by hand, as its I/O counters are only readable
+        # until it is reaped.
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        wall = time.perf_counter() - start
+        with open(f"/proc/{process.pid}/io") as io_file:
+            io = dict(line.split(": ") for line in io_file.read().splitlines())
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed ({process.returncode}): {stdout}")
+
+    return stdout, {
+        "wall_s": round(wall, 6),
+        "peak_rss_kb": usage.ru_maxrss,
+        "bytes_read": int(io["rchar"]),
+        "bytes_written": int(io["wchar"]),
+    }
+
+
+def run_batch(repo, commands):
+    """
+    Runs several Gitlite commands in one batch, unmeasured, e.g. to build history.
+    :param repo: Repository directory.
+    :param commands: List of commands, each a list of str.
+    """
+    batch_input = "".join("\0".join(command) + "\0\0" for command in commands)
+    run_measured(repo, ["batch", "-z"], batch_input)
+
+
+class Generator:
+    """
+    Writes the files of a synthetic repository, deterministically for a given seed.
+    """
+
+    def __init__(self, repo, files, file_size, binary, seed=0):
+        self.repo = repo
+        self.file_size = file_size
+        self.binary = binary
+        self.random = random.Random(seed)
+        extension = "bin" if binary else "txt"
+        # 100 files per directory, so scans and trees see some nesting.
+        self.names = [os.path.join(f"dir{i // 100}", f"file{i}.{extension}") for i in range(files)]
+
+    def write(self, name):
+        """
+        Writes new random content to file NAME.
+        :param name: File name, relative to the repository.
+        """
+        path = os.path.join(self.repo, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.binary:
+            content = self.random.randbytes(self.file_size)
+        else:
+            lines, size = [], 0
+            while size < self.file_size:
+                line = " ".join(self.random.choices(WORDS, k=8)) + "\n"
+                lines.append(line)
+                size += len(line)
+            content = "".join(lines).encode()
+        with open(path, "wb") as file:
+            file.write(content)
+
+    def modify(self, names):
+        """
+        Writes new content to every file of NAMES.
+        :return: NAMES
+        """
+        for name in names:
+            self.write(name)
+        return names
+
+
+def generate(repo, binary_path, files, file_size, depth, branches, binary):
+    """
+    Generates a repository: DEPTH commits on master, each changing 5% of the files, and
+    BRANCHES branches off its tip with one commit each, changing files master does not.
+    """
+    os.makedirs(repo)
+    shutil.copy(binary_path, os.path.join(repo, "Gitlite"))
+    run_measured(repo, ["init"])
+
+    generator = Generator(repo, files, file_size, binary)
+    generator.modify(generator.names)
+    run_batch(repo, [["add", "."], ["commit", "initial"]])
+
+    changed_per_commit = max(1, files // 20)
+    for d in range(1, depth):
+        changed = generator.modify(generator.random.sample(generator.names[:files // 2 or 1], changed_per_commit))
+        run_batch(repo, [["add"] + changed, ["commit", f"change {d}"]])
+
+    for b in range(branches):
+        run_batch(repo, [["branch", f"feature{b}"], ["checkout", f"feature{b}"]])
+        changed = generator.modify(generator.random.sample(generator.names[files // 2:] or generator.names, changed_per_commit))
+        run_batch(repo, [["add"] + changed, ["commit", f"feature {b} work"], ["checkout", "master"]])
+
+
+def benchmark_scenario(name, params, binary_path, workdir, repeat):
+    """
+    Generates the repository of a scenario and times every command on it. Commands
+    modify the repository, so each of the REPEAT runs works on a fresh copy of it, and
+    every metric is the median over the runs.
+    :return: List of result records.
+    """
+    repo = os.path.join(workdir, name)
+    start = time.perf_counter()
+    generate(repo, binary_path, **params)
+    print(f"{name}: generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    runs = {}
+    for i in range(repeat):
+        copy = f"{repo}-run{i}"
+        shutil.copytree(repo, copy)
+        for command, measurements in run_commands(copy, params):
+            runs.setdefault(command, []).append(measurements)
+        shutil.rmtree(copy)
+
+    return [dict({"scenario": name, "params": params, "command": command},
+                 **{metric: statistics.median(run[metric] for run in measured) for metric in METRICS})
+            for command, measured in runs.items()]
+
+
+def run_commands(repo, params):
+    """
+    Runs every benchmarked command once on a generated repository.
+    :return: List of (command, measurements).
+    """
+    results = []
+
+    def measure(command, cmd):
+        results.append((command, run_measured(repo, cmd)[1]))
+
+    measure("status", ["status"])
+    measure("log", ["log"])
+    measure("global-log", ["global-log"])
+    measure("find", ["find", "change 1"])
+
+    generator = Generator(repo, params["files"], params["file_size"], params["binary"], seed=1)
+    generator.modify(generator.names[:max(1, len(generator.names) // 10)])
+    measure("status (modified)", ["status"])
+    measure("add", ["add", "."])
+    measure("commit", ["commit", "benchmark"])
+
+    if params["branches"] > 1:
+        measure("checkout branch", ["checkout", "feature1"])
+        measure("checkout master", ["checkout", "master"])
+
+    log, _ = run_measured(repo, ["log"])
+    commits = [line.split()[1] for line in log.splitlines() if line.startswith("Commit: ")]
+    if len(commits) > 1:
+        measure("reset", ["reset", commits[1]])
+        run_measured(repo, ["reset", commits[0]])
+
+    if params["branches"] > 0:
+        measure("merge", ["merge", "feature0"])
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results to a baseline.
+    :return: Descriptions of the metrics that regressed.
+    """
+    base = {(entry["scenario"], entry["command"]): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        old = base.get((entry["scenario"], entry["command"]))
+        if old is None:
+            continue
+        for metric in METRICS:
+            limit = old[metric] * (1 + tolerance)
+            min_diff = MIN_WALL_DIFF if metric == "wall_s" else MIN_BYTES_DIFF if metric.startswith("bytes") else 0
+            if entry[metric] > limit and entry[metric] - old[metric] > min_diff:
+                regressions.append(f"{entry['scenario']} {entry['command']}: {metric} {old[metric]} -> {entry[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Gitlite commands on generated repositories.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma separated presets: {', '.join(SIZES)}.")
+    parser.add_argument("--kinds", default="text,binary", help="Comma separated file kinds: text, binary.")
+    parser.add_argument("--files", type=int, help="Number of files, overriding the presets.")
+    parser.add_argument("--file-size", type=int, help="File size in bytes, overriding the presets.")
+    parser.add_argument("--depth", type=int, help="Commits on master, overriding the presets.")
+    parser.add_argument("--branches", type=int, help="Number of branches, overriding the presets.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of every command, on fresh copies.")
+    parser.add_argument("--binary", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Gitlite"),
+                        help="Gitlite binary to benchmark.")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    parser.add_argument("--baseline", help="Compare the results to a baseline saved earlier.")
+    parser.add_argument("--save-baseline", help="Also save the results as a baseline to this file.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression (0.25 = 25%%).")
+    args = parser.parse_args()
+
+    overrides = {"files": args.files, "file_size": args.file_size, "depth": args.depth, "branches": args.branches}
+    workdir = tempfile.mkdtemp(prefix="gitlite-bench-")
+    results = []
+    try:
+        for size in args.sizes.split(","):
+            for kind in args.kinds.split(","):
+                params = dict(SIZES[size], binary=kind == "binary")
+                params.update({k: v for k, v in overrides.items() if v is not None})
+                results += benchmark_scenario(f"{size}-{kind}", params, args.binary, workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir)
+
+    output = {
+        "environment": {"platform": platform.platform(), "cpus": os.cpu_count(), "python": platform.python_version()},
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            file.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
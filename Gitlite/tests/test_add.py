@@ -1,3 +1,6 @@
+import hashlib
+import os
+import random
 import subprocess
 import utils
 
@@ -21,3 +24,91 @@ def test_add_on_non_existent_file(setup_and_cleanup):
     
     assert "File does not exist." in stdout
     assert return_code != 0
+
+
+def test_add_many_paths(setup_and_cleanup):
+    """
+    Tests add on several files and on a directory in one call.
+    """
+    utils.create_file("a.txt", "a")
+    utils.create_file("b.txt", "b")
+    os.makedirs(os.path.join("src", "lib"))
+    utils.create_file(os.path.join("src", "main.c"), "int main;")
+    utils.create_file(os.path.join("src", "lib", "util.c"), "int util;")
+
+    _, return_code = utils.run_gitlite_cmd("add a.txt b.txt src")
+    assert return_code == 0
+
+    stdout, _ = utils.run_gitlite_cmd("read staging staging")
+    for name in ["a.txt", "b.txt", "src/main.c", "src/lib/util.c"]:
+        assert name in stdout
+
+    # A missing path fails the whole add.
+    stdout, return_code = utils.run_gitlite_cmd("add a.txt missing.txt")
+    assert return_code != 0
+    assert "File does not exist." in stdout
+
+
+def test_add_all_verbose(setup_and_cleanup):
+    """
+    Tests "add ." with the verbose flag. Files identical to the current commit are not
+    staged again.
+    """
+    utils.create_file("a.txt", "a")
+    utils.add_and_commit(["a.txt"], "first commit")
+    utils.create_file("b.txt", "b")
+
+    stdout, return_code = utils.run_gitlite_cmd("add . -v")
+    assert return_code == 0
+    assert "Added 2 files" in stdout
+    assert "MB/s" in stdout and "files/s" in stdout
+
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "=== Staged Files ===\nb.txt\n\n" in stdout
+
+def test_add_chunked_large_file(setup_and_cleanup, monkeypatch):
+    """
+    Tests that with GITLITE_CHUNK_THRESHOLD set, large files are stored as shared chunks,
+    so a new version of a file only stores the chunks around the edit, and that chunked
+    blobs read back byte for byte.
+    """
+    monkeypatch.setenv("GITLITE_CHUNK_THRESHOLD", "100000")
+    rng = random.Random(7)
+    content = rng.randbytes(4 * 1024 * 1024)
+    with open("data.bin", "wb") as file:
+        file.write(content)
+    with open("small.txt", "w") as file:
+        file.write("small")
+    utils.add_and_commit(["data.bin", "small.txt"], "first")
+    
+    def count_chunks():
+        return sum(len(files) for _, _, files in os.walk(os.path.join(".gitlite", "chunks")))
+    
+    first_chunks = count_chunks()
+    assert first_chunks >= 16
+    
+    # The blob is still named after the hash of the whole content.
+    blob = hashlib.sha1(content).hexdigest()
+    assert os.path.exists(os.path.join(".gitlite", "blobs", blob[:2], blob[2:]))
+    assert "data.bin" not in utils.run_gitlite_cmd("status")[0].split("=== Modifications Not Staged For Commit ===")[1]
+    
+    # Inserting bytes in the middle only adds the chunks around them.
+    edited = content[:2000000] + b"inserted line\n" + content[2000000:]
+    with open("data.bin", "wb") as file:
+        file.write(edited)
+    utils.add_and_commit(["data.bin"], "second")
+    assert first_chunks < count_chunks() <= first_chunks + 3
+    
+    os.remove("data.bin")
+    assert utils.run_gitlite_cmd("checkout -- data.bin")[1] == 0
+    with open("data.bin", "rb") as file:
+        assert file.read() == edited
+    
+    # Both versions survive gc, and read back after repacking.
+    utils.run_gitlite_cmd("gc --grace 0")
+    utils.run_gitlite_cmd("repack")
+    stdout, _ = utils.run_gitlite_cmd("log")
+    first = [line.split()[1] for line in stdout.splitlines() if line.startswith("Commit: ")][1]
+    assert utils.run_gitlite_cmd(f"checkout {first} -- data.bin")[1] == 0
+    with open("data.bin", "rb") as file:
+        assert file.read() == content
@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import utils
+
+def test_batch_runs_commands(setup_and_cleanup):
+    """
+    Tests running several commands in one batch, with one result record per command.
+    """
+    utils.create_file("a.txt", "a")
+    utils.create_file("b.txt", "b")
+    results, return_code = utils.run_gitlite_batch([
+        ["add", "a.txt"],
+        ["add", "b.txt"],
+        ["commit", "two files\nin one commit"],
+        ["log"],
+    ])
+    assert return_code == 0
+    assert [record["exit_code"] for record in results] == [0, 0, 0, 0]
+    assert results[3]["command"] == ["log"]
+    assert "two files\nin one commit" in results[3]["stdout"]
+    
+    # The staging area written at the end of the batch is clean.
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "=== Staged Files ===\n\n" in stdout
+
+def test_batch_failures_and_checkpoints(setup_and_cleanup):
+    """
+    Tests that a failing command stops the batch unless --keep-going is given, and that
+    state is written at checkpoints and when the batch stops.
+    """
+    utils.create_file("a.txt", "a")
+    utils.create_file("b.txt", "b")
+    results, return_code = utils.run_gitlite_batch([
+        ["add", "a.txt"],
+        ["add", "missing.txt"],
+        ["add", "b.txt"],
+    ])
+    assert return_code != 0
+    assert len(results) == 2
+    assert results[1]["exit_code"] == 255
+    assert "File does not exist." in results[1]["stdout"]
+    stdout, _ = utils.run_gitlite_cmd("status")
+    staged = stdout.split("=== Staged Files ===")[1].split("===")[0]
+    assert "a.txt" in staged and "b.txt" not in staged
+    
+    results, return_code = utils.run_gitlite_batch([
+        ["add", "missing.txt"],
+        ["add", "b.txt"],
+        ["checkpoint"],
+        ["commit", "first"],
+    ], keep_going=True)
+    assert return_code != 0
+    assert [record["exit_code"] for record in results] == [255, 0, 0, 0]
+    stdout, _ = utils.run_gitlite_cmd("log")
+    assert "first" in stdout
+    
+    # Commands that never return or start their own batch can't run in one.
+    for command in ["fsmonitor", "daemon", "batch"]:
+        results, return_code = utils.run_gitlite_batch([[command]])
+        assert return_code != 0
+        assert f"Cannot run {command} in a batch." in results[0]["stdout"]
+
+def test_batch_newline_delimited(setup_and_cleanup):
+    """
+    Tests newline delimited input, where quotes group arguments.
+    """
+    utils.create_file("a.txt", "a")
+    batch_input = 'add a.txt\ncommit "a message with spaces"\n\nfind \'with spaces\'\n'
+    result = subprocess.run(["./Gitlite", "batch"], input=batch_input, capture_output=True, text=True)
+    assert result.returncode == 0
+    lines = result.stdout.splitlines()
+    assert len(lines) == 3
+    assert '"command":["commit","a message with spaces"]' in lines[1]
+    assert '"exit_code":0' in lines[2]
+
+def test_batch_defers_refs(setup_and_cleanup):
+    """
+    Tests that HEAD and branch writes are deferred along with the staging area, so a
+    batch that is killed never leaves a branch moved past the staging area on disk.
+    """
+    master = os.path.join(".gitlite", "branches", "master")
+    initial = utils.read_file(master)
+    utils.create_file("a.txt", "a")
+    batch = subprocess.Popen(["./Gitlite", "batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    
+    def run(command):
+        batch.stdin.write(command + "\n")
+        batch.stdin.flush()
+        return json.loads(batch.stdout.readline())
+    
+    assert run("add a.txt")["exit_code"] == 0
+    assert run("commit first")["exit_code"] == 0
+    assert run("branch other")["exit_code"] == 0
+    assert run("branch gone")["exit_code"] == 0
+    assert run("rm-branch gone")["exit_code"] == 0
+    assert "*master\nother\n" in run("status")["stdout"]
+    assert utils.read_file(master) == initial
+    assert sorted(os.listdir(os.path.join(".gitlite", "branches"))) == ["master"]
+    
+    assert run("checkpoint")["exit_code"] == 0
+    assert utils.read_file(master) != initial
+    assert utils.read_file(os.path.join(".gitlite", "branches", "other")) == utils.read_file(master)
+    assert sorted(os.listdir(os.path.join(".gitlite", "branches"))) == ["master", "other"]
+    
+    batch.stdin.close()
+    assert batch.wait() == 0
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "=== Staged Files ===\n\n" in stdout
+
+def test_batch_reports_unexpected_errors(setup_and_cleanup):
+    """
+    Tests that an unexpected error, e.g. from a corrupt object, fails only its command,
+    with a result record, and the batch goes on with --keep-going.
+    """
+    utils.create_file("a.txt", "a")
+    utils.add_and_commit(["a.txt"], "first")
+    head = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    utils.write_file(os.path.join(".gitlite", "commits", head[:2], head[2:]), b"\xc1 not a commit")
+    
+    results, return_code = utils.run_gitlite_batch([["log"], ["find", "first"]], keep_going=True)
+    assert return_code != 0
+    assert [record["exit_code"] for record in results] == [1, 0]
+    assert "Exception" in results[0]["stderr"]
+    assert head in results[1]["stdout"]
+    
+    results, _ = utils.run_gitlite_batch([["log"], ["find", "first"]])
+    assert [record["exit_code"] for record in results] == [1]
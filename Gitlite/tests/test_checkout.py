@@ -1,3 +1,4 @@
+import os
 import os.path
 import subprocess
 import utils
@@ -153,6 +154,125 @@ def test_branch_checkout_untracked_files(setup_and_cleanup):
     assert "There is an untracked file in the way; delete it, or add and commit it first." in stdout
     assert return_code != 0
     
+def test_checkout_binary_file(setup_and_cleanup):
+    """
+    Tests that binary content, including invalid UTF-8, survives add, commit and checkout
+    byte for byte, also after the blob is packed.
+    """
+    content = bytes(range(256)) * 1000 + b"\xff\xfe\x00\r\n"
+    with open("data.bin", "wb") as binary_file:
+        binary_file.write(content)
+    utils.run_gitlite_cmd("add data.bin")
+    utils.run_gitlite_cmd("commit binary")
+    
+    with open("data.bin", "wb") as binary_file:
+        binary_file.write(b"changed")
+    _, return_code = utils.run_gitlite_cmd("checkout -- data.bin")
+    assert return_code == 0
+    with open("data.bin", "rb") as binary_file:
+        assert binary_file.read() == content
+    
+    utils.run_gitlite_cmd("repack")
+    os.remove("data.bin")
+    _, return_code = utils.run_gitlite_cmd("checkout -- data.bin")
+    assert return_code == 0
+    with open("data.bin", "rb") as binary_file:
+        assert binary_file.read() == content
+        
+def test_branch_checkout_only_writes_changed_files(setup_and_cleanup):
+    """
+    Tests that switching branches only rewrites the files that differ between them, deletes
+    files (and directories) only tracked on the old branch, and keeps untracked files.
+    """
+    os.makedirs("dir")
+    files = [f"file{i}.txt" for i in range(20)] + ["dir/nested.txt"]
+    for file in files:
+        utils.create_file(file, f"content of {file}")
+    utils.run_gitlite_cmd(["add"] + files)
+    utils.run_gitlite_cmd("commit base")
+    utils.run_gitlite_cmd("branch other")
+    
+    utils.run_gitlite_cmd("checkout other")
+    utils.create_file("file0.txt", "changed on other")
+    os.makedirs("only-other")
+    utils.create_file("only-other/new.txt", "new on other")
+    utils.run_gitlite_cmd("add file0.txt only-other")
+    utils.run_gitlite_cmd("commit other")
+    utils.create_file("untracked.txt", "untracked")
+    
+    # Backdate every file, so a rewrite would show as a new modification time.
+    old_time = 1_000_000_000
+    for file in files + ["only-other/new.txt"]:
+        os.utime(file, (old_time, old_time))
+    
+    _, return_code = utils.run_gitlite_cmd("checkout master")
+    assert return_code == 0
+    assert utils.read_file("file0.txt") == "content of file0.txt"
+    assert not os.path.exists("only-other")
+    assert os.path.exists("untracked.txt")
+    for file in files[1:]:
+        assert os.stat(file).st_mtime == old_time, f"{file} must not be rewritten"
+    assert os.stat("file0.txt").st_mtime != old_time
+        
+def test_parallel_branch_checkout(setup_and_cleanup):
+    """
+    Tests that checkout with several workers gives the same working directory as a
+    sequential one, and still refuses to overwrite untracked files before writing anything.
+    """
+    files = [f"dir{i % 7}/file{i}.txt" for i in range(100)]
+    for i in range(7):
+        os.makedirs(f"dir{i}")
+    for file in files:
+        utils.create_file(file, f"master {file}")
+    utils.run_gitlite_cmd(["add"] + [f"dir{i}" for i in range(7)])
+    utils.run_gitlite_cmd("commit master")
+    utils.run_gitlite_cmd("branch other")
+    utils.run_gitlite_cmd("checkout other")
+    for file in files:
+        with open(file, "w") as test_file:
+            test_file.write(f"other {file}")
+    utils.run_gitlite_cmd(["add"] + files)
+    utils.run_gitlite_cmd("commit other")
+    utils.run_gitlite_cmd("checkout master")
+    
+    def snapshot():
+        return {file: utils.read_file(file) for file in files}
+    
+    try:
+        os.environ["GITLITE_CHECKOUT_WORKERS"] = "1"
+        utils.run_gitlite_cmd("checkout other")
+        sequential = snapshot()
+        utils.run_gitlite_cmd("checkout master")
+        
+        os.environ["GITLITE_CHECKOUT_WORKERS"] = "4"
+        _, return_code = utils.run_gitlite_cmd("checkout other")
+        assert return_code == 0
+        assert snapshot() == sequential
+        assert all(content.startswith("other") for content in sequential.values())
+        
+        utils.run_gitlite_cmd("checkout master")
+        utils.run_gitlite_cmd("rm dir0/file0.txt")
+        utils.run_gitlite_cmd("commit removed")
+        utils.create_file("dir0/file0.txt", "untracked")
+        stdout, return_code = utils.run_gitlite_cmd("checkout other")
+        assert return_code != 0
+        assert "There is an untracked file in the way" in stdout
+        assert utils.read_file("dir1/file1.txt") == "master dir1/file1.txt"
+        
+        os.remove("dir0/file0.txt")
+        utils.create_file("master_only.txt", "master only")
+        utils.add_and_commit(["master_only.txt"], "master only")
+        os.environ["GITLITE_CHECKOUT_WORKERS"] = "zero"
+        stdout, return_code = utils.run_gitlite_cmd("checkout other")
+        assert return_code != 0
+        assert "GITLITE_CHECKOUT_WORKERS must be a positive number." in stdout
+        # The setting is rejected before any working file is touched.
+        assert utils.read_file("master_only.txt") == "master only"
+        assert utils.read_file("dir1/file1.txt") == "master dir1/file1.txt"
+        assert utils.read_file(os.path.join(".gitlite", "HEAD")) == "ref: master"
+    finally:
+        del os.environ["GITLITE_CHECKOUT_WORKERS"]
+        
 def get_commit_ids_from_log():
     """
     Calls the log command of gitlite and takes all the commit id's.
@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import utils
+
+def run_in(directory, cmd):
+    """
+    Runs a Gitlite command in another repository, e.g. a clone.
+    :return: stdout (output), return_code
+    """
+    result = subprocess.run(["./Gitlite"] + cmd.split(), capture_output=True, text=True, cwd=directory)
+    return result.stdout.strip(), result.returncode
+
+def make_clone(name):
+    os.makedirs(name)
+    shutil.copy("Gitlite", name)
+    return run_in(name, "clone ..")
+
+def test_clone_links_objects(setup_and_cleanup):
+    """
+    Tests that clone checks out the files of HEAD and shares the loose objects of the
+    source through hard links.
+    """
+    utils.create_file("a.txt", "a")
+    os.makedirs("dir")
+    utils.create_file(os.path.join("dir", "b.txt"), "b")
+    utils.add_and_commit(["a.txt", os.path.join("dir", "b.txt")], "first")
+    utils.run_gitlite_cmd("branch other")
+
+    stdout, return_code = make_clone("copy")
+    assert return_code == 0
+    assert "hard-linked" in stdout
+    assert utils.read_file(os.path.join("copy", "a.txt")) == "a"
+    assert utils.read_file(os.path.join("copy", "dir", "b.txt")) == "b"
+    assert run_in("copy", "log")[0] == utils.run_gitlite_cmd("log")[0]
+    assert "other" in run_in("copy", "status")[0]
+    assert "first" in run_in("copy", "find first")[0]
+
+    for objects_dir in ["blobs", "commits"]:
+        for root, _, files in os.walk(os.path.join(".gitlite", objects_dir)):
+            for file in files:
+                path = os.path.join(root, file)
+                assert os.stat(path).st_ino == os.stat(os.path.join("copy", path)).st_ino
+
+    assert run_in("copy", "clone ..")[1] != 0
+    os.makedirs("empty")
+    shutil.copy("Gitlite", "empty")
+    stdout, return_code = run_in("empty", "clone ../missing")
+    assert return_code != 0
+    assert "Not a GitLite repository" in stdout
+
+def test_push_and_fetch_transfer_missing_objects(setup_and_cleanup):
+    """
+    Tests that push and fetch only transfer the objects the other side lacks, and only
+    fast-forward branches.
+    """
+    utils.create_file("a.txt", "a")
+    utils.add_and_commit(["a.txt"], "first")
+    utils.run_gitlite_cmd("branch feature")
+    make_clone("copy")
+
+    # One new commit, with its root tree and one new blob.
+    run_in("copy", "checkout feature")
+    utils.create_file(os.path.join("copy", "b.txt"), "b")
+    run_in("copy", "add b.txt")
+    run_in("copy", "commit second")
+    stdout, return_code = run_in("copy", "push .. feature")
+    assert return_code == 0
+    assert "Transferred 3 objects" in stdout
+    assert "Updated branch feature" in stdout
+    assert run_in("copy", "push .. feature")[0].startswith("Transferred 0 objects")
+
+    # The branch checked out in the other repository is never updated.
+    assert run_in("copy", "push .. master")[1] != 0
+
+    utils.run_gitlite_cmd("checkout feature")
+    assert utils.read_file("b.txt") == "b"
+    assert "second" in utils.run_gitlite_cmd("global-log")[0]
+
+    utils.create_file("c.txt", "c")
+    utils.add_and_commit(["c.txt"], "third")
+    utils.run_gitlite_cmd("branch topic")
+    run_in("copy", "checkout master")
+    stdout, return_code = run_in("copy", "fetch .. feature")
+    assert return_code == 0
+    assert "Transferred 3 objects" in stdout
+    stdout, return_code = run_in("copy", "fetch .. topic")
+    assert return_code == 0
+    assert "Transferred 0 objects" in stdout
+    assert "Created branch topic" in stdout
+    run_in("copy", "checkout topic")
+    assert utils.read_file(os.path.join("copy", "c.txt")) == "c"
+    assert "third" in run_in("copy", "find third")[0]
+    assert run_in("copy", "fetch .. topic")[1] != 0
+
+    # Diverged branches are not fast-forwards either way.
+    utils.create_file(os.path.join("copy", "e.txt"), "e")
+    run_in("copy", "add e.txt")
+    run_in("copy", "commit diverged")
+    run_in("copy", "checkout master")
+    utils.run_gitlite_cmd("checkout topic")
+    utils.create_file("d.txt", "d")
+    utils.add_and_commit(["d.txt"], "fourth")
+    utils.run_gitlite_cmd("checkout master")
+    stdout, return_code = run_in("copy", "fetch .. topic")
+    assert return_code != 0
+    assert "not a fast-forward" in stdout
+    stdout, return_code = run_in("copy", "push .. topic")
+    assert return_code != 0
+    assert "not a fast-forward" in stdout
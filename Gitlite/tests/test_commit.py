@@ -1,3 +1,5 @@
+import fcntl
+import json
 import os
 import subprocess
 import utils
@@ -89,6 +91,38 @@ def test_two_files_same_content(setup_and_cleanup):
     assert a[1].strip() == b[1].strip()
     
 
+def test_unchanged_directories_share_trees(setup_and_cleanup):
+    """
+    A commit only writes new trees for the directories that changed; the trees of all
+    other directories are shared with its parent.
+    """
+    os.makedirs("docs")
+    os.makedirs("src")
+    utils.create_file(os.path.join("docs", "a.txt"), "docs")
+    utils.create_file(os.path.join("src", "b.txt"), "source")
+    utils.add_and_commit([os.path.join("docs", "a.txt"), os.path.join("src", "b.txt")], "first")
+    first = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    
+    utils.create_file(os.path.join("src", "b.txt"), "more source")
+    utils.add_and_commit([os.path.join("src", "b.txt")], "second")
+    second = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    
+    def root_entries(commit_hash):
+        stdout, _ = utils.run_gitlite_cmd(f"read {commit_hash} commit")
+        root_tree = json.loads(stdout)["RootTree"]
+        stdout, return_code = utils.run_gitlite_cmd(f"read {root_tree} tree")
+        assert return_code == 0
+        return {entry["Name"]: entry["Hash"] for entry in json.loads(stdout)["Entries"]}
+    
+    first_entries, second_entries = root_entries(first), root_entries(second)
+    assert first_entries["docs"] == second_entries["docs"]
+    assert first_entries["src"] != second_entries["src"]
+    
+    # The flat file mapping is still available when reading a commit.
+    stdout, _ = utils.run_gitlite_cmd(f"read {second} commit")
+    assert json.loads(stdout)["FileMapping"].keys() == {"docs/a.txt", "src/b.txt"}
+    
+
 def find_blob_from_commit(commit_json_serialied, file_name):
     """
     Helper function that finds the blob map for a file
@@ -104,3 +138,48 @@ def find_blob_from_commit(commit_json_serialied, file_name):
             return [i.strip().replace('"', "").replace(",", "") for i in line.split(":")]
         
         
+
+def test_writers_wait_for_repository_lock(setup_and_cleanup, monkeypatch):
+    """
+    Tests that commands modifying the repository wait for the lock held by another
+    process, while commands only reading it run right away.
+    """
+    utils.create_file("a.txt", "first")
+    utils.add_and_commit(["a.txt"], "first")
+    utils.create_file("b.txt", "second")
+    monkeypatch.setenv("GITLITE_LOCK_TIMEOUT", "0.2")
+    
+    with open(os.path.join(".gitlite", "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        stdout, return_code = utils.run_gitlite_cmd("add b.txt")
+        assert return_code != 0
+        assert stdout == "Another Gitlite command is modifying the repository; try again later."
+        
+        assert utils.run_gitlite_cmd("status")[1] == 0
+        stdout, return_code = utils.run_gitlite_cmd("log")
+        assert return_code == 0
+        assert "first" in stdout
+    
+    assert utils.run_gitlite_cmd("add b.txt")[1] == 0
+    assert utils.run_gitlite_cmd("commit second")[1] == 0
+    assert "second" in utils.run_gitlite_cmd("log")[0]
+    
+    # Every file was replaced through a renamed temporary file, none of which is left.
+    leftovers = [name for _, _, files in os.walk(".gitlite") for name in files if name.endswith(".tmp")]
+    assert leftovers == []
+
+def test_temporary_ref_files_are_not_branches(setup_and_cleanup):
+    """
+    Tests that a temporary file left next to the branches, e.g. by a crash in the middle
+    of a branch update, is neither listed as a branch nor followed by gc.
+    """
+    utils.create_file("a.txt", "first")
+    utils.add_and_commit(["a.txt"], "first")
+    with open(os.path.join(".gitlite", "branches", "master.0123abcd.tmp"), "w") as leftover:
+        leftover.write("01234")
+    
+    stdout, return_code = utils.run_gitlite_cmd("status")
+    assert return_code == 0
+    assert stdout.startswith("=== Branches ===\n*master\n\n")
+    assert utils.run_gitlite_cmd("gc")[1] == 0
+    assert utils.run_gitlite_cmd("branch other.tmp")[1] != 0
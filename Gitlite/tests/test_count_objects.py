@@ -0,0 +1,76 @@
+import os
+import hashlib
+import utils
+
+def parse_count_objects(stdout):
+    """
+    Parses the output of count-objects into {kind: (count, raw size, stored size)}.
+    """
+    result = {}
+    lines = stdout.splitlines()
+    for i in range(0, len(lines), 3):
+        kind, count = lines[i].split(":")[0], int(lines[i].split()[1])
+        raw = int(lines[i + 1].split()[2])
+        stored = int(lines[i + 2].split()[2])
+        result[kind] = (count, raw, stored)
+    return result
+
+def test_count_objects_compressed(setup_and_cleanup):
+    """
+    Tests that blobs are compressed on write, and that count-objects reports their raw
+    and stored size, before and after repacking.
+    """
+    content = "All work and no play makes Jack a dull boy.\n" * 2000
+    utils.write_file("a.txt", content)
+    utils.run_gitlite_cmd("add a.txt")
+    utils.run_gitlite_cmd("commit first")
+    
+    stdout, return_code = utils.run_gitlite_cmd("count-objects")
+    assert return_code == 0
+    counts = parse_count_objects(stdout)
+    assert counts["blobs"][0] == 1
+    assert counts["blobs"][1] == len(content)
+    assert counts["blobs"][2] < len(content) / 4
+    assert "1 loose, 0 packed" in stdout
+    
+    utils.run_gitlite_cmd("repack")
+    stdout, _ = utils.run_gitlite_cmd("count-objects")
+    assert parse_count_objects(stdout) == counts
+    
+    os.remove("a.txt")
+    utils.run_gitlite_cmd("checkout -- a.txt")
+    with open("a.txt", "r") as test_file:
+        assert test_file.read() == content
+
+def test_compression_codecs_and_raw_objects(setup_and_cleanup):
+    """
+    Tests the fast and disabled compression settings, and that uncompressed objects
+    written before compression existed stay readable.
+    """
+    content = "abcdefgh" * 4000
+    utils.write_file("a.txt", content)
+    os.environ["GITLITE_COMPRESSION"] = "deflate-fast"
+    try:
+        utils.run_gitlite_cmd("add a.txt")
+        os.environ["GITLITE_COMPRESSION"] = "none"
+        utils.write_file("b.txt", content + "!")
+        utils.run_gitlite_cmd("add b.txt")
+        os.environ["GITLITE_COMPRESSION"] = "zstd"
+        stdout, return_code = utils.run_gitlite_cmd("commit first")
+        assert "Unknown compression codec: zstd" in stdout
+    finally:
+        del os.environ["GITLITE_COMPRESSION"]
+    utils.run_gitlite_cmd("commit first")
+    
+    counts = parse_count_objects(utils.run_gitlite_cmd("count-objects")[0])
+    assert counts["blobs"][1] == 2 * len(content) + 1
+    assert len(content) + 1 < counts["blobs"][2] < 2 * len(content)
+    
+    # Replace the blob of a.txt with its raw content, as older versions stored it.
+    blob_hash = hashlib.sha1(content.encode()).hexdigest()
+    with open(os.path.join(".gitlite", "blobs", blob_hash[:2], blob_hash[2:]), "w") as blob:
+        blob.write(content)
+    os.remove("a.txt")
+    utils.run_gitlite_cmd("checkout -- a.txt")
+    with open("a.txt", "r") as test_file:
+        assert test_file.read() == content
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import utils
+
+def start_daemon():
+    daemon = subprocess.Popen(["./Gitlite", "daemon"], stdout=subprocess.PIPE, text=True)
+    assert "Serving commands on" in daemon.stdout.readline()
+    return daemon
+
+def stop_daemon(daemon):
+    if daemon.poll() is None:
+        daemon.kill()
+        daemon.wait()
+
+def test_daemon_serves_commands(setup_and_cleanup):
+    """
+    Tests running commands through the daemon, both with the Python client and with the
+    Gitlite executable forwarding to it, including error output and exit codes.
+    """
+    daemon = start_daemon()
+    try:
+        utils.create_file("a.txt", "a")
+        stdout, _, return_code = utils.run_gitlite_daemon_cmd("add a.txt")
+        assert return_code == 0
+        utils.run_gitlite_daemon_cmd(["commit", "first commit"])
+        stdout, _, return_code = utils.run_gitlite_daemon_cmd("log")
+        assert return_code == 0
+        assert "first commit" in stdout
+        
+        # The executable forwards to the daemon while it is running.
+        stdout, return_code = utils.run_gitlite_cmd("checkout not-a-branch")
+        assert return_code != 0
+        assert "No such branch exists." in stdout
+        stdout, return_code = utils.run_gitlite_cmd("status")
+        assert return_code == 0
+        assert "*master" in stdout
+        
+        _, return_code = utils.run_gitlite_cmd("daemon")
+        assert return_code != 0
+        
+        _, _, return_code = utils.run_gitlite_daemon_cmd("daemon stop")
+        assert return_code == 0
+        daemon.wait(timeout=10)
+        assert not os.path.exists(os.path.join(".gitlite", "daemon.sock"))
+        
+        stdout, return_code = utils.run_gitlite_cmd("daemon stop")
+        assert "No daemon is running." in stdout
+    finally:
+        stop_daemon(daemon)
+
+def test_daemon_notices_outside_changes(setup_and_cleanup):
+    """
+    Tests that the daemon reloads the staging area, HEAD and branches changed by another
+    process, and objects repacked by another process.
+    """
+    daemon = start_daemon()
+    os.environ["GITLITE_NO_DAEMON"] = "1"
+    try:
+        utils.create_file("a.txt", "a")
+        utils.run_gitlite_daemon_cmd("add a.txt")
+        utils.run_gitlite_daemon_cmd("commit first")
+        
+        # Changed outside of the daemon.
+        utils.create_file("b.txt", "b")
+        utils.run_gitlite_cmd("add b.txt")
+        stdout, _, _ = utils.run_gitlite_daemon_cmd("status")
+        assert "b.txt" in stdout.split("=== Staged Files ===")[1].split("===")[0]
+        
+        utils.run_gitlite_cmd("commit second")
+        utils.run_gitlite_cmd("branch other")
+        utils.run_gitlite_cmd("checkout other")
+        utils.run_gitlite_cmd("repack")
+        stdout, _, return_code = utils.run_gitlite_daemon_cmd("log")
+        assert return_code == 0
+        assert "second" in stdout
+        stdout, _, _ = utils.run_gitlite_daemon_cmd("status")
+        assert "*other" in stdout
+        
+        os.remove("a.txt")
+        _, _, return_code = utils.run_gitlite_daemon_cmd("checkout -- a.txt")
+        assert return_code == 0
+        assert utils.read_file("a.txt") == "a"
+    finally:
+        del os.environ["GITLITE_NO_DAEMON"]
+        stop_daemon(daemon)
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import utils
+
+def test_diff_working_tree_and_staged(setup_and_cleanup):
+    """
+    Tests diff of the working directory against the staging area, and of the staging
+    area against HEAD.
+    """
+    utils.write_file("a.txt", "".join(f"line {i}\n" for i in range(1, 21)))
+    utils.write_file("same.txt", "unchanged\n")
+    utils.add_and_commit(["a.txt", "same.txt"], "first")
+    
+    stdout, return_code = utils.run_gitlite_cmd("diff")
+    assert return_code == 0
+    assert stdout == ""
+    
+    utils.write_file("a.txt", "".join(f"line {i}\n" if i != 10 else "line ten\n" for i in range(1, 21)))
+    stdout, return_code = utils.run_gitlite_cmd("diff")
+    assert return_code == 0
+    assert stdout == "\n".join([
+        "diff --gitlite a/a.txt b/a.txt",
+        "--- a/a.txt",
+        "+++ b/a.txt",
+        "@@ -7,7 +7,7 @@",
+        " line 7",
+        " line 8",
+        " line 9",
+        "-line 10",
+        "+line ten",
+        " line 11",
+        " line 12",
+        " line 13",
+    ])
+    
+    # Once staged, the change moves from diff to diff --staged.
+    utils.run_gitlite_cmd("add a.txt")
+    utils.write_file("new.txt", "new")
+    utils.run_gitlite_cmd("add new.txt")
+    assert utils.run_gitlite_cmd("diff")[0] == ""
+    stdout, _ = utils.run_gitlite_cmd("diff --staged")
+    assert "-line 10\n+line ten" in stdout
+    assert "diff --gitlite a/new.txt b/new.txt\nnew file\n--- /dev/null\n+++ b/new.txt\n@@ -0,0 +1 @@\n+new\n\\ No newline at end of file" in stdout
+    assert "same.txt" not in stdout
+    
+    os.remove("same.txt")
+    stdout, _ = utils.run_gitlite_cmd("diff")
+    assert stdout == "diff --gitlite a/same.txt b/same.txt\ndeleted file\n--- a/same.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-unchanged"
+
+def test_diff_commits_and_binary(setup_and_cleanup):
+    """
+    Tests diff between two commits, by branch name or commit id, and that binary files
+    are reported instead of diffed.
+    """
+    utils.write_file("text.txt", "a\nb\nc\n")
+    utils.write_file("image.bin", b"\x89PNG\x00\x01")
+    utils.add_and_commit(["text.txt", "image.bin"], "first")
+    first = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    utils.run_gitlite_cmd("branch old")
+    
+    utils.write_file("text.txt", "a\nc\nd\n")
+    utils.write_file("image.bin", b"\x89PNG\x00\x02")
+    utils.add_and_commit(["text.txt", "image.bin"], "second")
+    
+    stdout, return_code = utils.run_gitlite_cmd(f"diff {first[:8]} master")
+    assert return_code == 0
+    assert "diff --gitlite a/image.bin b/image.bin\nBinary files a/image.bin and b/image.bin differ" in stdout
+    assert "@@ -1,3 +1,3 @@\n a\n-b\n c\n+d" in stdout
+    assert stdout == utils.run_gitlite_cmd("diff old master")[0]
+    
+    stdout, return_code = utils.run_gitlite_cmd("diff old nonexistent")
+    assert return_code != 0
+    assert stdout == "No commit with that id exists."
+
+def write_legacy_commit(message, file_mapping, parent):
+    """
+    Writes a commit as made before trees existed: a flat file mapping and no root tree.
+    :return: Hash of the commit
+    """
+    def pack_str(text):
+        data = text.encode()
+        return (bytes([0xa0 | len(data)]) if len(data) < 32 else bytes([0xd9, len(data)])) + data
+    
+    commit_hash = hashlib.sha1(message.encode()).hexdigest()
+    body = bytes([0x97]) + pack_str(message) + b"\xd6\xff" + (1).to_bytes(4, "big")
+    body += bytes([0x80 | len(file_mapping)])
+    body += b"".join(pack_str(name) + pack_str(blob) for name, blob in file_mapping.items())
+    body += pack_str(parent) + pack_str(commit_hash) + b"\xc0\xc0"
+    fanout = os.path.join(".gitlite", "commits", commit_hash[:2])
+    os.makedirs(fanout, exist_ok=True)
+    utils.write_file(os.path.join(fanout, commit_hash[2:]), body)
+    return commit_hash
+
+def test_diff_legacy_commits(setup_and_cleanup):
+    """
+    Tests that diff compares commits made before trees existed by their flat mappings,
+    without writing tree objects.
+    """
+    blobs = {}
+    for name, content in [("a1", "a\n"), ("a2", "a changed\n"), ("b", "b\n")]:
+        utils.write_file(name, content)
+        utils.run_gitlite_cmd(f"add {name}")
+        blobs[name] = hashlib.sha1(content.encode()).hexdigest()
+    initial = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    first = write_legacy_commit("legacy first", {"dir/a.txt": blobs["a1"], "b.txt": blobs["b"]}, initial)
+    second = write_legacy_commit("legacy second", {"dir/a.txt": blobs["a2"], "b.txt": blobs["b"]}, first)
+    
+    trees = sum(len(files) for _, _, files in os.walk(os.path.join(".gitlite", "trees")))
+    stdout, return_code = utils.run_gitlite_cmd(f"diff {first} {second}")
+    assert return_code == 0
+    assert "-a\n+a changed" in stdout
+    assert "b.txt" not in stdout
+    stdout, return_code = utils.run_gitlite_cmd(f"diff {initial} {second}")
+    assert return_code == 0
+    assert "dir/a.txt" in stdout and "b.txt" in stdout
+    assert sum(len(files) for _, _, files in os.walk(os.path.join(".gitlite", "trees"))) == trees
@@ -37,4 +37,83 @@ def test_find(setup_and_cleanup):
     stdout, return_code = utils.run_gitlite_cmd(["find", "testing"])
     assert return_code == 0
     assert hashes[0] in stdout
-    assert hashes[1] not in stdout
\ No newline at end of file
+    assert hashes[1] not in stdout
+
+def test_find_and_short_hash_from_catalog(setup_and_cleanup):
+    """
+    find, global-log and short hashes are served from the commit catalog. Removing the
+    catalog rebuilds it from the commit objects.
+    """
+    utils.create_add_commit("a.txt", "a", "Fix the parser, again!")
+    head = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    assert os.path.exists(os.path.join(".gitlite", "catalog"))
+
+    stdout, _ = utils.run_gitlite_cmd(["find", "PARSER, ag"])
+    assert head in stdout
+
+    stdout, _ = utils.run_gitlite_cmd(["find", "parser again"])
+    assert "Found no commit with that message." in stdout
+
+    os.remove(os.path.join(".gitlite", "catalog"))
+    os.remove(os.path.join(".gitlite", "catalog.idx"))
+
+    stdout, _ = utils.run_gitlite_cmd("global-log")
+    assert head in stdout
+    assert "initial commit" in stdout
+
+    _, return_code = utils.run_gitlite_cmd(f"checkout {head[:6]} -- a.txt")
+    assert return_code == 0
+
+def test_find_uses_token_index(setup_and_cleanup):
+    """
+    Tests that find gives the same results for commits in the token index as for those
+    appended since it was built, for whole and partial words.
+    """
+    def commit_batch(numbers):
+        commands = []
+        for i in numbers:
+            utils.create_file(f"file{i}.txt", str(i))
+            commands += [["add", f"file{i}.txt"], ["commit", f"Commit number {i} touches the {'parser' if i % 2 else 'lexer'}"]]
+        utils.run_gitlite_batch(commands)
+
+    # Rebuilding the catalog indexes every commit so far; the next ones are appended.
+    commit_batch(range(40))
+    os.remove(os.path.join(".gitlite", "catalog"))
+    utils.run_gitlite_cmd("global-log")
+    assert os.path.exists(os.path.join(".gitlite", "catalog.tokens"))
+    commit_batch(range(40, 50))
+
+    expected = {"PARSER": 25, "ber 12 touches the le": 1, "es the lex": 25, "umber 2": 11, "pars lexer": 0}
+    for query, count in expected.items():
+        stdout, _ = utils.run_gitlite_cmd(["find", query])
+        assert stdout.count("===") == count
+
+    os.remove(os.path.join(".gitlite", "catalog.tokens"))
+    stdout, _ = utils.run_gitlite_cmd(["find", "umber 2"])
+    assert stdout.count("===") == 11
+
+def test_catalog_overwrites_torn_record(setup_and_cleanup):
+    """
+    A catalog record cut short by a crash is overwritten by the next commit instead of
+    hiding it, and a short hash shared with a commit the catalog misses is ambiguous.
+    """
+    utils.create_add_commit("a.txt", "a", "before the crash")
+    catalog = os.path.join(".gitlite", "catalog")
+    with open(catalog, "ab") as file:
+        file.write((100).to_bytes(4, "big") + b"\x94torn")
+    
+    utils.create_add_commit("b.txt", "b", "after the crash")
+    head = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+    stdout, return_code = utils.run_gitlite_cmd(["find", "crash"])
+    assert return_code == 0
+    assert "before the crash" in stdout and "after the crash" in stdout
+    assert "after the crash" in utils.run_gitlite_cmd("global-log")[0]
+    assert utils.run_gitlite_cmd(f"checkout {head[:8]} -- a.txt")[1] == 0
+    
+    # A copy of the head commit under another hash with the same prefix, unknown to the
+    # catalog, e.g. written by a command that crashed before cataloging it.
+    fanout = os.path.join(".gitlite", "commits", head[:2])
+    os.link(os.path.join(fanout, head[2:]), os.path.join(fanout, head[2:8] + "0" * 32))
+    stdout, return_code = utils.run_gitlite_cmd(f"checkout {head[:8]} -- a.txt")
+    assert return_code != 0
+    assert "not unique enough" in stdout
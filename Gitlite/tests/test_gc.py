@@ -0,0 +1,85 @@
+import os
+import utils
+
+def count_loose(objects_dir):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(".gitlite", objects_dir)))
+
+def test_gc_prunes_unreachable_objects(setup_and_cleanup):
+    """
+    Tests that gc removes a replaced staged blob and the objects of a removed branch,
+    but only once they are older than the grace period, and keeps everything reachable.
+    """
+    utils.write_file("a.txt", "kept")
+    utils.add_and_commit(["a.txt"], "first")
+    
+    utils.run_gitlite_cmd("branch other")
+    utils.run_gitlite_cmd("checkout other")
+    utils.write_file("c.txt", "only on other")
+    utils.add_and_commit(["c.txt"], "other work")
+    utils.run_gitlite_cmd("checkout master")
+    utils.run_gitlite_cmd("rm-branch other")
+    
+    utils.write_file("b.txt", "first version")
+    utils.run_gitlite_cmd("add b.txt")
+    utils.write_file("b.txt", "second version")
+    utils.run_gitlite_cmd("add b.txt")
+    
+    # Everything was just written, so the default grace period keeps it.
+    stdout, return_code = utils.run_gitlite_cmd("gc")
+    assert return_code == 0
+    assert "Removed 0 unreachable objects (0 bytes)" in stdout
+    assert "Kept 4 unreachable objects newer than the grace period." in stdout
+    
+    blobs, commits = count_loose("blobs"), count_loose("commits")
+    stdout, return_code = utils.run_gitlite_cmd("gc --grace 0")
+    assert return_code == 0
+    assert "Removed 4 unreachable objects" in stdout
+    assert "Kept" not in stdout
+    assert count_loose("blobs") == blobs - 2
+    assert count_loose("commits") == commits - 1
+    
+    stdout, _ = utils.run_gitlite_cmd("global-log")
+    assert "first" in stdout
+    assert "other work" not in stdout
+    
+    assert utils.run_gitlite_cmd("commit second")[1] == 0
+    os.remove("a.txt")
+    os.remove("b.txt")
+    utils.run_gitlite_cmd("checkout -- a.txt")
+    utils.run_gitlite_cmd("checkout -- b.txt")
+    assert utils.read_file("a.txt") == "kept"
+    assert utils.read_file("b.txt") == "second version"
+    
+    assert utils.run_gitlite_cmd("gc --grace")[1] != 0
+
+def test_gc_prunes_side_files(setup_and_cleanup):
+    """
+    Tests that gc drops deleted commits from the commit-graph and changed-paths files.
+    """
+    utils.write_file("a.txt", "kept")
+    utils.add_and_commit(["a.txt"], "first")
+    
+    utils.run_gitlite_cmd("branch other")
+    utils.run_gitlite_cmd("checkout other")
+    utils.write_file("c.txt", "only on other")
+    utils.add_and_commit(["c.txt"], "other work")
+    deleted = utils.run_gitlite_cmd("log")[0].split("Commit: ")[1].split()[0]
+    utils.run_gitlite_cmd("checkout master")
+    utils.run_gitlite_cmd("rm-branch other")
+    
+    for side_file in ("commit-graph", "changed-paths"):
+        with open(os.path.join(".gitlite", side_file), "rb") as f:
+            assert bytes.fromhex(deleted) in f.read()
+    
+    assert "Removed 3 unreachable objects" in utils.run_gitlite_cmd("gc --grace 0")[0]
+    for side_file in ("commit-graph", "changed-paths"):
+        with open(os.path.join(".gitlite", side_file), "rb") as f:
+            assert bytes.fromhex(deleted) not in f.read()
+    
+    assert "for 0 commits" in utils.run_gitlite_cmd("write-changed-paths")[0]
+    utils.write_file("b.txt", "second")
+    utils.add_and_commit(["b.txt"], "second")
+    stdout, return_code = utils.run_gitlite_cmd("log -- b.txt")
+    assert return_code == 0
+    assert "second" in stdout
+    assert "first" not in stdout
@@ -1,3 +1,4 @@
+import os
 import utils
 import subprocess
 
@@ -30,4 +31,55 @@ def test_global_log(setup_and_cleanup):
     assert returncode == 0
 
     for i in range(len(messages)):
-        assert messages[i] in stdout
\ No newline at end of file
+        assert messages[i] in stdout
+
+def logged_messages(cmd):
+    stdout, _ = utils.run_gitlite_cmd(cmd)
+    return [block.strip().splitlines()[-1] for block in stdout.split("===") if block.strip()]
+
+def test_log_path(setup_and_cleanup):
+    """
+    Tests that log -- [path] lists only the commits that changed a file or a directory,
+    with or without changed-path filters.
+    """
+    utils.create_file("a.txt", "a")
+    utils.add_and_commit(["a.txt"], "add a")
+    os.makedirs("dir")
+    utils.create_file(os.path.join("dir", "b.txt"), "b")
+    utils.add_and_commit([os.path.join("dir", "b.txt")], "add b")
+    utils.create_file("a.txt", "a2")
+    utils.add_and_commit(["a.txt"], "change a")
+    utils.create_file("c.txt", "c")
+    utils.add_and_commit(["c.txt"], "add c")
+    utils.run_gitlite_cmd("rm dir/b.txt")
+    utils.run_gitlite_cmd("commit remove-b")
+
+    expected = {
+        "a.txt": ["change a", "add a"],
+        "dir": ["remove-b", "add b"],
+        "dir/b.txt": ["remove-b", "add b"],
+        "missing.txt": [],
+    }
+    for path, messages in expected.items():
+        assert logged_messages(f"log -- {path}") == messages
+
+    # Without filters, every commit is diffed; the backfill writes them all again.
+    os.remove(os.path.join(".gitlite", "changed-paths"))
+    assert logged_messages("log -- a.txt") == expected["a.txt"]
+    stdout, return_code = utils.run_gitlite_cmd("write-changed-paths")
+    assert return_code == 0
+    assert "for 6 commits" in stdout
+    assert "for 0 commits" in utils.run_gitlite_cmd("write-changed-paths")[0]
+    for path, messages in expected.items():
+        assert logged_messages(f"log -- {path}") == messages
+
+    # A record cut short by a crash is overwritten by the next commit, and backfilled.
+    changed_paths = os.path.join(".gitlite", "changed-paths")
+    os.truncate(changed_paths, os.path.getsize(changed_paths) - 3)
+    utils.create_file("a.txt", "a3")
+    utils.add_and_commit(["a.txt"], "change a again")
+    assert "for 1 commits" in utils.run_gitlite_cmd("write-changed-paths")[0]
+    assert logged_messages("log -- a.txt") == ["change a again"] + expected["a.txt"]
+    assert logged_messages("log -- c.txt") == ["add c"]
+
+    assert utils.run_gitlite_cmd("log a.txt")[1] != 0
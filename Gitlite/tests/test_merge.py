@@ -1,3 +1,5 @@
+import hashlib
+import os
 from os import remove
 
 import utils, subprocess
@@ -25,6 +27,126 @@ def simulate_diverging_branches(setup):
     utils.subprocess.run("echo 'bar' > foo.txt", shell=True)
     utils.add_and_commit(["foo.txt"], "add bar")
     
+def test_merge_disjoint_changes(setup_and_cleanup):
+    """
+    Merging branches that changed different files takes each side's changes and creates
+    a merge commit, without reading the blobs of the split point or the current branch.
+    """
+    utils.write_file("a.txt", "a\n")
+    utils.write_file("b.txt", "b\n")
+    utils.add_and_commit(["a.txt", "b.txt"], "split point")
+    utils.run_gitlite_cmd("branch feature")
+    
+    utils.write_file("a.txt", "a on master\n")
+    utils.add_and_commit(["a.txt"], "change a")
+    utils.run_gitlite_cmd("checkout feature")
+    utils.write_file("b.txt", "b on feature\n")
+    utils.write_file("c.txt", "c\n")
+    utils.add_and_commit(["b.txt", "c.txt"], "change b, add c")
+    utils.run_gitlite_cmd("checkout master")
+    
+    # The merge must succeed without the blobs it has no reason to read.
+    for content in ["a\n", "b\n", "a on master\n"]:
+        blob_hash = hashlib.sha1(content.encode()).hexdigest()
+        os.remove(os.path.join(".gitlite", "blobs", blob_hash[:2], blob_hash[2:]))
+    
+    stdout, return_code = utils.run_gitlite_cmd("merge feature")
+    assert return_code == 0
+    assert stdout == ""
+    assert utils.read_file("b.txt") == "b on feature"
+    assert utils.read_file("c.txt") == "c"
+    
+    stdout, _ = utils.run_gitlite_cmd("log")
+    first = stdout.split("===")[1]
+    assert "Merged feature into master." in first
+    assert "Merge: " in first
+    assert "change a" in stdout and "change b, add c" not in stdout
+    
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "=== Modifications Not Staged For Commit ===\n\n=== Untracked Files ===" in stdout
+
+
+def test_merge_line_level_and_conflicts(setup_and_cleanup):
+    """
+    Files changed on both sides are merged line by line; only overlapping changes
+    conflict, and are committed with conflict markers.
+    """
+    utils.write_file("lines.txt", "one\ntwo\nthree\nfour\nfive\n")
+    utils.write_file("conflict.txt", "same\n")
+    utils.add_and_commit(["lines.txt", "conflict.txt"], "split point")
+    utils.run_gitlite_cmd("branch feature")
+    
+    utils.write_file("lines.txt", "ONE\ntwo\nthree\nfour\nfive\n")
+    utils.write_file("conflict.txt", "master\n")
+    utils.add_and_commit(["lines.txt", "conflict.txt"], "master changes")
+    utils.run_gitlite_cmd("checkout feature")
+    utils.write_file("lines.txt", "one\ntwo\nthree\nfour\nFIVE\nsix\n")
+    utils.write_file("conflict.txt", "feature\n")
+    utils.add_and_commit(["lines.txt", "conflict.txt"], "feature changes")
+    utils.run_gitlite_cmd("checkout master")
+    
+    stdout, return_code = utils.run_gitlite_cmd("merge feature")
+    assert return_code == 0
+    assert stdout == "Encountered a merge conflict."
+    with open("lines.txt") as merged:
+        assert merged.read() == "ONE\ntwo\nthree\nfour\nFIVE\nsix\n"
+    with open("conflict.txt") as merged:
+        assert merged.read() == "<<<<<<< HEAD\nmaster\n=======\nfeature\n>>>>>>> feature\n"
+    
+    # Merging again finds the given branch is already an ancestor.
+    stdout, _ = utils.run_gitlite_cmd("merge feature")
+    assert stdout == "Given branch is an ancestor of the current branch."
+
+
+def test_merge_fast_forward(setup_and_cleanup):
+    """
+    If the current branch is the split point, merge just moves it to the given branch.
+    """
+    utils.run_gitlite_cmd("branch feature")
+    utils.run_gitlite_cmd("checkout feature")
+    utils.write_file("a.txt", "a\n")
+    utils.add_and_commit(["a.txt"], "add a")
+    utils.run_gitlite_cmd("checkout master")
+    assert not os.path.exists("a.txt")
+    
+    stdout, return_code = utils.run_gitlite_cmd("merge feature")
+    assert return_code == 0
+    assert stdout == "Current branch fast-forwarded."
+    assert utils.read_file("a.txt") == "a"
+    assert utils.read_file(os.path.join(".gitlite", "branches", "master")) == \
+        utils.read_file(os.path.join(".gitlite", "branches", "feature"))
+
+
+def test_merge_keeps_non_utf8_bytes(setup_and_cleanup):
+    """
+    Files that are not valid UTF-8 are merged line by line on their raw bytes, and binary
+    files changed on both sides conflict as a whole with their bytes intact.
+    """
+    def read_bytes(name):
+        with open(name, "rb") as test_file:
+            return test_file.read()
+
+    utils.write_file("latin.txt", b"caf\xe9\nmiddle\nna\xefve\n")
+    utils.write_file("data.bin", b"\x00\xff\x01")
+    utils.add_and_commit(["latin.txt", "data.bin"], "split point")
+    utils.run_gitlite_cmd("branch feature")
+
+    utils.write_file("latin.txt", b"CAF\xc9\nmiddle\nna\xefve\n")
+    utils.write_file("data.bin", b"\x00\xfe\x02")
+    utils.add_and_commit(["latin.txt", "data.bin"], "master changes")
+    utils.run_gitlite_cmd("checkout feature")
+    utils.write_file("latin.txt", b"caf\xe9\nmiddle\nNA\xcfVE\n")
+    utils.write_file("data.bin", b"\x00\xfd\x03")
+    utils.add_and_commit(["latin.txt", "data.bin"], "feature changes")
+    utils.run_gitlite_cmd("checkout master")
+
+    stdout, return_code = utils.run_gitlite_cmd("merge feature")
+    assert return_code == 0
+    assert stdout == "Encountered a merge conflict."
+    assert read_bytes("latin.txt") == b"CAF\xc9\nmiddle\nNA\xcfVE\n"
+    assert read_bytes("data.bin") == b"<<<<<<< HEAD\n\x00\xfe\x02\n=======\n\x00\xfd\x03\n>>>>>>> feature\n"
+
+
 def test_untracked_file_conflict(setup):
     """
     A merge would cause a delete conflict with an untracked file if:
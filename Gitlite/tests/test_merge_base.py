@@ -0,0 +1,89 @@
+import os
+import subprocess
+import utils
+
+
+def branch_head(branch):
+    return utils.read_file(os.path.join(".gitlite", "branches", branch))
+
+
+def test_merge_base(setup_and_cleanup):
+    """
+    Tests merge-base and is-ancestor on diverging branches.
+    """
+    utils.create_add_commit("a.txt", "a", "split")
+    split = branch_head("master")
+    utils.run_gitlite_cmd("branch feature")
+
+    subprocess.run("echo 'master' > a.txt", shell=True)
+    utils.add_and_commit(["a.txt"], "on master")
+
+    utils.run_gitlite_cmd("checkout feature")
+    subprocess.run("echo 'feature' > a.txt", shell=True)
+    utils.add_and_commit(["a.txt"], "on feature")
+
+    assert os.path.exists(os.path.join(".gitlite", "commit-graph"))
+
+    stdout, return_code = utils.run_gitlite_cmd("merge-base master feature")
+    assert return_code == 0
+    assert stdout == split
+
+    _, return_code = utils.run_gitlite_cmd(f"is-ancestor {split[:8]} master")
+    assert return_code == 0
+
+    _, return_code = utils.run_gitlite_cmd("is-ancestor master feature")
+    assert return_code != 0
+
+    stdout, return_code = utils.run_gitlite_cmd("merge-base master not-a-branch")
+    assert return_code != 0
+    assert "No commit with that id exists." in stdout
+
+
+def test_merge_base_without_graph(setup_and_cleanup):
+    """
+    Commits missing from the commit graph (e.g. created before it existed) are added
+    back from the commit objects when they are looked up.
+    """
+    utils.create_add_commit("a.txt", "a", "split")
+    split = branch_head("master")
+    utils.run_gitlite_cmd("branch feature")
+    utils.create_add_commit("b.txt", "b", "on master")
+
+    os.remove(os.path.join(".gitlite", "commit-graph"))
+
+    stdout, return_code = utils.run_gitlite_cmd("merge-base feature master")
+    assert return_code == 0
+    assert stdout == split
+    assert os.path.exists(os.path.join(".gitlite", "commit-graph"))
+
+
+def test_merge_base_with_graph_index(setup_and_cleanup):
+    """
+    gc rewrites the commit graph along with its sorted index. Commits added afterwards
+    are found past the part the index covers, and an index left behind by a removed
+    graph is ignored.
+    """
+    utils.create_add_commit("a.txt", "a", "split")
+    split = branch_head("master")
+    utils.run_gitlite_cmd("branch feature")
+    utils.run_gitlite_cmd("branch doomed")
+    utils.run_gitlite_cmd("checkout doomed")
+    utils.create_add_commit("d.txt", "d", "unreachable")
+    utils.run_gitlite_cmd("checkout master")
+    utils.run_gitlite_cmd("rm-branch doomed")
+    for i in range(5):
+        utils.create_add_commit(f"m{i}.txt", "m", f"master {i}")
+
+    assert utils.run_gitlite_cmd("gc --grace 0")[1] == 0
+    assert os.path.exists(os.path.join(".gitlite", "commit-graph.idx"))
+    assert utils.run_gitlite_cmd("merge-base master feature")[0] == split
+
+    utils.run_gitlite_cmd("checkout feature")
+    utils.create_add_commit("f.txt", "f", "on feature")
+    assert utils.run_gitlite_cmd("merge-base feature master")[0] == split
+    assert utils.run_gitlite_cmd(f"is-ancestor {split} feature")[1] == 0
+    assert utils.run_gitlite_cmd("is-ancestor master feature")[1] != 0
+
+    os.remove(os.path.join(".gitlite", "commit-graph"))
+    assert utils.run_gitlite_cmd("merge-base master feature")[0] == split
+    assert utils.run_gitlite_cmd("is-ancestor master feature")[1] != 0
@@ -0,0 +1,82 @@
+import os
+import sys
+import utils
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+from gitlite_reader import Repository, NotARepositoryError
+
+def log_hashes():
+    stdout, _ = utils.run_gitlite_cmd("log")
+    return [line.split()[1] for line in stdout.splitlines() if line.startswith("Commit: ")]
+
+def test_reader_matches_cli(setup_and_cleanup):
+    """
+    Tests that the Python reader sees the same history, files, branches and staging area
+    as the CLI, for loose and packed objects alike.
+    """
+    utils.create_file("a.txt", "a")
+    os.makedirs("dir")
+    utils.create_file(os.path.join("dir", "b.txt"), "b")
+    utils.add_and_commit(["a.txt", os.path.join("dir", "b.txt")], "first")
+    utils.run_gitlite_cmd("branch other")
+    utils.run_gitlite_cmd("checkout other")
+    utils.create_file("c.txt", "c")
+    utils.add_and_commit(["c.txt"], "on other")
+    utils.run_gitlite_cmd("checkout master")
+    utils.create_file("a.txt", "a2")
+    utils.add_and_commit(["a.txt"], "second")
+    utils.run_gitlite_cmd("merge other")
+    utils.create_file("d.txt", "d")
+    utils.run_gitlite_cmd("add d.txt")
+    utils.run_gitlite_cmd("rm dir/b.txt")
+
+    for packed in [False, True]:
+        if packed:
+            utils.run_gitlite_cmd("repack")
+        with Repository(".") as repo:
+            assert repo.current_branch == "master"
+            assert sorted(repo.branches()) == ["master", "other"]
+            assert [commit.hash for commit in repo.log()] == log_hashes()
+
+            merge = next(repo.log())
+            assert merge.second_parent == repo.branches()["other"]
+            messages = [commit.message for commit in repo.history()]
+            assert sorted(messages) == sorted(["initial commit", "first", "on other", "second", merge.message])
+            assert messages[0] == merge.message and messages[-1] == "initial commit"
+
+            files = repo.files()
+            assert sorted(files) == ["a.txt", "c.txt", "dir/b.txt"]
+            with open("a.txt", "rb") as file:
+                assert repo.blob(files["a.txt"]) == file.read()
+            assert dict(repo.read_blobs(files.values())) == {hash: repo.blob(hash) for hash in files.values()}
+            assert repo.files("other")["a.txt"] != files["a.txt"]
+            assert repo.commit(repo.resolve(merge.hash[:8])) is merge
+
+            staging = repo.staging_area()
+            assert repo.blob(staging.additions["d.txt"]) == b"d\n"
+            assert staging.removals == ["dir/b.txt"]
+
+    try:
+        Repository("..")
+        assert False
+    except NotARepositoryError:
+        pass
+
+def test_reader_chunked_and_uncompressed_blobs(setup_and_cleanup, monkeypatch):
+    """
+    Tests that the reader reassembles chunked blobs and reads objects stored without
+    compression.
+    """
+    content = os.urandom(300 * 1024)
+    with open("big.bin", "wb") as file:
+        file.write(content)
+    monkeypatch.setenv("GITLITE_CHUNK_THRESHOLD", "100000")
+    monkeypatch.setenv("GITLITE_COMPRESSION", "none")
+    utils.create_file("small.txt", "small")
+    utils.add_and_commit(["big.bin", "small.txt"], "blobs")
+
+    with Repository(".") as repo:
+        files = repo.files()
+        assert repo.blob(files["big.bin"]) == content
+        assert repo.blob(files["small.txt"]) == b"small\n"
+        assert len(list(repo.chunks.hashes())) > 1
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import utils
+
+
+def test_repack(setup_and_cleanup):
+    """
+    Tests repack. Loose objects must be folded into the packs and every command that
+    reads objects must keep working on packed objects.
+    """
+    utils.create_file("a.txt", "first version")
+    utils.add_and_commit(["a.txt"], "first commit")
+    first_commit = utils.read_file(os.path.join(".gitlite", "branches", "master"))
+
+    subprocess.run(["echo 'second version' > a.txt"], shell=True)
+    utils.add_and_commit(["a.txt"], "second commit")
+
+    stdout, return_code = utils.run_gitlite_cmd("repack")
+    assert return_code == 0
+    assert "Packed 2 blobs" in stdout
+
+    for objects_dir in ["blobs", "commits"]:
+        path = os.path.join(".gitlite", objects_dir)
+        assert os.path.exists(os.path.join(path, "pack"))
+        assert os.path.exists(os.path.join(path, "pack.idx"))
+        assert not any(os.path.isdir(os.path.join(path, d)) for d in os.listdir(path)), \
+            "No loose objects should be left after repack."
+
+    stdout, return_code = utils.run_gitlite_cmd("log")
+    assert return_code == 0
+    assert "first commit" in stdout and "second commit" in stdout
+
+    stdout, _ = utils.run_gitlite_cmd("global-log")
+    assert "initial commit" in stdout and "first commit" in stdout
+
+    # Short hashes must resolve against packed commits too.
+    _, return_code = utils.run_gitlite_cmd(f"checkout {first_commit[:8]} -- a.txt")
+    assert return_code == 0
+    assert utils.read_file("a.txt") == "first version"
+
+
+def test_repack_twice(setup_and_cleanup):
+    """
+    Objects created after a repack are loose again and a second repack appends them to
+    the existing pack.
+    """
+    utils.create_add_commit("a.txt", "a", "first commit")
+    utils.run_gitlite_cmd("repack")
+
+    utils.create_add_commit("b.txt", "b", "second commit")
+    stdout, return_code = utils.run_gitlite_cmd("repack")
+    assert return_code == 0
+    assert "Packed 1 blobs" in stdout
+
+    stdout, _ = utils.run_gitlite_cmd(["find", "commit"])
+    assert "first commit" in stdout and "second commit" in stdout
+
+    utils.run_gitlite_cmd("rm b.txt")
+    _, return_code = utils.run_gitlite_cmd("checkout -- b.txt")
+    assert return_code == 0
+    assert utils.read_file("b.txt") == "b"
+
+
+def test_repack_skips_temporary_files(setup_and_cleanup):
+    """
+    Temporary files next to the loose objects, e.g. left behind by a crash, are not
+    objects: repack, count-objects and write-changed-paths ignore them and keep them.
+    """
+    utils.create_add_commit("a.txt", "a", "first commit")
+    tmp_files = []
+    for objects_dir in ["blobs", "commits"]:
+        fanout = os.path.join(".gitlite", objects_dir, "ab")
+        os.makedirs(fanout, exist_ok=True)
+        tmp_files.append(os.path.join(fanout, "c" * 38 + ".0123456789abcdef0123456789abcdef.tmp"))
+        utils.write_file(tmp_files[-1], "half written")
+
+    stdout, return_code = utils.run_gitlite_cmd("count-objects")
+    assert return_code == 0
+    assert "blobs: 1 " in stdout
+
+    stdout, return_code = utils.run_gitlite_cmd("write-changed-paths")
+    assert return_code == 0
+    assert "for 0 commits" in stdout
+
+    stdout, return_code = utils.run_gitlite_cmd("repack")
+    assert return_code == 0
+    assert "Packed 1 blobs" in stdout
+    assert all(os.path.exists(tmp_file) for tmp_file in tmp_files)
+
+    _, return_code = utils.run_gitlite_cmd("checkout -- a.txt")
+    assert return_code == 0
@@ -1,8 +1,13 @@
+import json
 import os.path
+import sys
 
 import utils
 import subprocess
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python"))
+from gitlite_reader import _msgpack
+
 def test_status(setup_and_cleanup):
     """
     Tests status.
@@ -58,4 +63,209 @@ def test_status(setup_and_cleanup):
     stdout, stderr, return_code = utils.run_gitlite_cmd("status", stderr=True)
     assert return_code == 0
     assert not os.path.exists("remove_me.txt") # we used 'Gitlite rm' on this file
-    assert "=== Modifications Not Staged For Commit ===\na.txt (modified)\nb.txt (deleted)\nc.txt (modified)\nd.txt (deleted)"
\ No newline at end of file
+    assert "=== Modifications Not Staged For Commit ===\na.txt (modified)\nb.txt (deleted)\nc.txt (modified)\nd.txt (deleted)"
+
+def test_status_stat_cache(setup_and_cleanup):
+    """
+    Status caches file hashes by stat data. A modification that keeps the size and the
+    modification time of a file must still be reported.
+    """
+    utils.create_file("a.txt", "aaaa")
+    utils.add_and_commit(["a.txt"], "first commit")
+
+    stdout, return_code = utils.run_gitlite_cmd("status")
+    assert return_code == 0
+    assert "=== Modifications Not Staged For Commit ===\n\n" in stdout
+    assert os.path.exists(os.path.join(".gitlite", "statcache"))
+
+    # Same size, and the modification time is put back to what it was.
+    stat = os.stat("a.txt")
+    with open("a.txt", "w") as file:
+        file.write("bbbb\n")
+    os.utime("a.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    stdout, return_code = utils.run_gitlite_cmd("status")
+    assert return_code == 0
+    assert "=== Modifications Not Staged For Commit ===\na.txt (modified)" in stdout
+
+    _, return_code = utils.run_gitlite_cmd("checkout -- a.txt")
+    assert return_code == 0
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "=== Modifications Not Staged For Commit ===\n\n" in stdout
+
+def test_status_subdirectories_and_ignore(setup_and_cleanup):
+    """
+    Untracked files are found in subdirectories, and files and directories matched by
+    .gitliteignore are left out of status and of adding a directory.
+    """
+    os.makedirs(os.path.join("src", "nested"))
+    os.makedirs(os.path.join("build", "out"))
+    with open(".gitliteignore", "w") as ignore_file:
+        ignore_file.write("# build output\nbuild/\n*.log\n!keep.log\n/src/nested/*.tmp\n")
+    for name in ["main.txt", os.path.join("src", "a.txt"), os.path.join("src", "nested", "b.txt"),
+                 os.path.join("src", "nested", "c.tmp"), os.path.join("src", "debug.log"),
+                 os.path.join("src", "keep.log"), os.path.join("build", "out", "app.bin"), "c.tmp"]:
+        with open(name, "w") as test_file:
+            test_file.write(name)
+    
+    stdout, return_code = utils.run_gitlite_cmd("status")
+    assert return_code == 0
+    untracked = stdout.split("=== Untracked Files ===\n")[1].splitlines()
+    assert untracked == [".gitliteignore", "c.tmp", "main.txt", "src/a.txt", "src/keep.log", "src/nested/b.txt"]
+    
+    utils.run_gitlite_cmd("add .")
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert stdout.endswith("=== Untracked Files ===")
+    assert "src/nested/b.txt" in stdout.split("=== Staged Files ===")[1]
+    assert "build/out/app.bin" not in stdout
+    assert "src/debug.log" not in stdout
+    
+    # A tracked file that becomes ignored is still reported as modified.
+    utils.run_gitlite_cmd(["commit", "first"])
+    with open(".gitliteignore", "a") as ignore_file:
+        ignore_file.write("src/\n")
+    with open(os.path.join("src", "a.txt"), "w") as test_file:
+        test_file.write("changed")
+    stdout, _ = utils.run_gitlite_cmd("status")
+    assert "src/a.txt (modified)" in stdout.split("=== Modifications Not Staged For Commit ===")[1]
+
+def test_status_cache_stats(setup_and_cleanup):
+    """
+    Refs read repeatedly by one command come from the cache, and its counters are
+    printed to stderr when GITLITE_CACHE_STATS is set.
+    """
+    for branch in ["one", "two", "three"]:
+        utils.run_gitlite_cmd(f"branch {branch}")
+    
+    os.environ["GITLITE_CACHE_STATS"] = "1"
+    try:
+        stdout, stderr, return_code = utils.run_gitlite_cmd("status", stderr=True)
+    finally:
+        del os.environ["GITLITE_CACHE_STATS"]
+    
+    assert return_code == 0
+    assert "=== Branches ===\n*master\none\nthree\ntwo" in stdout
+    stats = {line.split(":")[0]: line for line in stderr.splitlines()}
+    assert stats.keys() == {"cache files", "cache commits", "cache trees"}
+    # HEAD is read once per branch, but only loaded the first time.
+    hits = int(stats["cache files"].split(", ")[1].split()[0])
+    assert hits >= 3
+    
+    _, stderr, _ = utils.run_gitlite_cmd("status", stderr=True)
+    assert "cache" not in stderr
+
+def test_status_trace(setup_and_cleanup):
+    """
+    With GITLITE_TRACE set, every command appends the spans of its phases to the trace
+    file as Chrome trace events, one JSON object per line.
+    """
+    with open("a.txt", "w") as file:
+        file.write("hello")
+    trace_path = os.path.join("..", "trace.jsonl")
+    
+    os.environ["GITLITE_TRACE"] = trace_path
+    try:
+        assert utils.run_gitlite_cmd("add a.txt")[1] == 0
+        assert utils.run_gitlite_cmd("status")[1] == 0
+    finally:
+        del os.environ["GITLITE_TRACE"]
+    
+    with open(trace_path) as file:
+        events = [json.loads(line) for line in file]
+    os.remove(trace_path)
+    
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert all(event["args"].keys() == {"files_opened", "bytes_hashed"} for event in events)
+    names = [event["name"] for event in events]
+    for name in ["add", "status", "WorkingTree.Scan", "StagingArea.Load", "StagingArea.Save", "Commit.Deserialize"]:
+        assert name in names
+    
+    # The command span covers its phases, including hashing the added file.
+    add = next(event for event in events if event["name"] == "add")
+    assert add["args"]["bytes_hashed"] == len("hello")
+    assert add["args"]["files_opened"] > 0
+    
+    assert utils.run_gitlite_cmd("status")[1] == 0
+    assert not os.path.exists(trace_path)
+
+def untracked_files():
+    stdout, _ = utils.run_gitlite_cmd("status")
+    return stdout.split("=== Untracked Files ===")[1].split()
+
+def test_status_fsmonitor(setup_and_cleanup):
+    """
+    Tests that status sees files created, deleted and renamed while a file-system monitor
+    runs, including whole directories and ignore rule changes, and that it scans the
+    working directory in full once the monitor is gone.
+    """
+    monitor = subprocess.Popen(["./Gitlite", "fsmonitor"], stdout=subprocess.PIPE, text=True)
+    try:
+        assert monitor.stdout.readline().startswith("Watching")
+        utils.create_file("a.txt")
+        assert untracked_files() == ["a.txt"]
+        assert os.path.exists(os.path.join(".gitlite", "fsmonitor-snapshot"))
+        
+        os.makedirs(os.path.join("dir", "sub"))
+        utils.create_file(os.path.join("dir", "sub", "b.txt"))
+        os.rename("a.txt", "c.txt")
+        assert untracked_files() == ["c.txt", "dir/sub/b.txt"]
+        
+        os.rename("dir", "moved")
+        assert untracked_files() == ["c.txt", "moved/sub/b.txt"]
+        
+        utils.create_file(".gitliteignore", "moved/")
+        assert untracked_files() == [".gitliteignore", "c.txt"]
+        
+        utils.add_and_commit(["c.txt"], "first")
+        os.remove(".gitliteignore")
+        assert untracked_files() == ["moved/sub/b.txt"]
+        
+        assert utils.run_gitlite_cmd("fsmonitor")[1] != 0
+    finally:
+        monitor.kill()
+        monitor.wait()
+    
+    utils.create_file("d.txt")
+    assert untracked_files() == ["d.txt", "moved/sub/b.txt"]
+
+def verified_files():
+    with open(os.path.join(".gitlite", "fsmonitor-snapshot"), "rb") as snapshot:
+        return _msgpack.unpackb(snapshot.read())[3]
+
+def test_status_fsmonitor_content_changes(setup_and_cleanup):
+    """
+    Tests that while a file-system monitor runs, status and add trust the stat cache for
+    files not written since they were last checked, and see writes to the others.
+    """
+    monitor = subprocess.Popen(["./Gitlite", "fsmonitor"], stdout=subprocess.PIPE, text=True)
+    try:
+        assert monitor.stdout.readline().startswith("Watching")
+        utils.create_file("a.txt", "a")
+        utils.create_file("b.txt", "b")
+        utils.add_and_commit(["a.txt", "b.txt"], "first")
+        assert "a.txt" in verified_files()
+        
+        stdout, _ = utils.run_gitlite_cmd("status")
+        assert "=== Modifications Not Staged For Commit ===\n\n" in stdout
+        assert sorted(verified_files()) == ["a.txt", "b.txt"]
+        
+        # Same size and modification time, so only the monitor tells it was written.
+        stat = os.stat("a.txt")
+        with open("a.txt", "w") as file:
+            file.write("A\n")
+        os.utime("a.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        stdout, _ = utils.run_gitlite_cmd("status")
+        assert "a.txt (modified)" in stdout
+        
+        os.remove("b.txt")
+        stdout, _ = utils.run_gitlite_cmd("status")
+        assert "b.txt (deleted)" in stdout
+        assert sorted(verified_files()) == ["a.txt", "b.txt"]
+        
+        utils.run_gitlite_cmd("add .")
+        stdout, _ = utils.run_gitlite_cmd("status")
+        assert "=== Staged Files ===\na.txt\n" in stdout
+        assert "=== Modifications Not Staged For Commit ===\nb.txt (deleted)\n" in stdout
+    finally:
+        monitor.kill()
+        monitor.wait()
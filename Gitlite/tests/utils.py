@@ -1,4 +1,7 @@
+import json
 import os
+import socket
+import struct
 import subprocess
 import shutil
 
@@ -39,6 +42,36 @@ def run_gitlite_cmd(cmd, stderr=False):
     
     return result.stdout.strip(), result.returncode
 
+def run_gitlite_daemon_cmd(cmd, socket_path=os.path.join(".gitlite", "daemon.sock")):
+    """
+    Runs a Gitlite command through a running `Gitlite daemon`, without starting a process.
+    :param cmd: (str or a list of str) Command to run on Gitlite
+    :param socket_path: Path of the daemon socket.
+    :return: stdout (output), stderr, return_code
+    """
+    args = cmd.split() if isinstance(cmd, str) else cmd
+    environment = [f"{k}={v}" for k, v in os.environ.items() if k.startswith("GITLITE_")]
+    
+    def pack_string(value):
+        data = value.encode()
+        return struct.pack(">I", len(data)) + data
+    
+    def pack_list(values):
+        return struct.pack(">I", len(values)) + b"".join(pack_string(v) for v in values)
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(pack_string(os.getcwd()) + pack_list(args) + pack_list(environment))
+        reader = client.makefile("rb")
+        output = {1: b"", 2: b""}
+        while True:
+            frame_type, length = struct.unpack(">BI", reader.read(5))
+            payload = reader.read(length)
+            if frame_type == 3:
+                return_code = struct.unpack(">i", payload)[0] & 0xFF
+                return output[1].decode().strip(), output[2].decode().strip(), return_code
+            output[frame_type] += payload
+
 def clean_up():
     """
     Cleans up the testing directory.
@@ -66,6 +99,17 @@ def create_file(name, content=""):
         for i in range(len(name)):
             subprocess.run(["touch", name[i]])
             subprocess.run([f"echo '{content[i]}' >> {name[i]}"])
+
+def write_file(name, content):
+    """
+    Writes CONTENT to file NAME exactly as given, replacing any previous content.
+    :param name: File name
+    :param content: File content, str or bytes
+    :return: None
+    """
+    
+    with open(name, "wb" if isinstance(content, bytes) else "w") as test_file:
+        test_file.write(content)
         
 def split_hash(hash_ref):
     """
@@ -76,25 +120,32 @@ def split_hash(hash_ref):
     
     return hash_ref[:2], hash_ref[2:]
 
+def run_gitlite_batch(commands, keep_going=False):
+    """
+    Runs several Gitlite commands in one `Gitlite batch` process.
+    :param commands: List of commands, each a list of str
+    :param keep_going: Run the remaining commands after one fails.
+    :return: List of result records (dicts with command, exit_code, stdout and stderr), return_code
+    """
+    batch_input = "".join("\0".join(command) + "\0\0" for command in commands)
+    cmd = ["./Gitlite", "batch", "-z"] + (["--keep-going"] if keep_going else [])
+    result = subprocess.run(cmd, input=batch_input, capture_output=True, text=True)
+    return [json.loads(line) for line in result.stdout.splitlines()], result.returncode
+
 def add_and_commit(files_to_add: list, commit_msg: str) -> None:
     """
-    Adds the given files and make a commit with the given message.
+    Adds the given files and make a commit with the given message, all in one batch.
     :param files_to_add: Files to add.
     :param commit_msg: Commit message
     :return: None
     """
     assert isinstance(files_to_add, list), "files_to_add must be a list."
     
-    for file in files_to_add:
-        
-        stdout, stderr, return_code = run_gitlite_cmd("add " + file, stderr=True)
-        if return_code != 0:
-            print(stdout, stderr)
-
-    stdout, stderr, return_code = run_gitlite_cmd(["commit", commit_msg], stderr=True)
-    if return_code != 0:
-        print("commit part")
-        print(stdout, stderr, return_code)
+    commands = [["add", file] for file in files_to_add] + [["commit", commit_msg]]
+    results, _ = run_gitlite_batch(commands, keep_going=True)
+    for record in results:
+        if record["exit_code"] != 0:
+            print(record["command"], record["stdout"], record["stderr"], record["exit_code"])
         
 def create_add_commit(filename: str, content: str, commit_msg: str) -> None:
     """